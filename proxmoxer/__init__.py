@@ -3,4 +3,35 @@ __copyright__ = "(c) Oleg Butovich 2013-2024"
 __version__ = "2.2.0"
 __license__ = "MIT"
 
-from .core import *  # noqa
+import importlib
+
+# the API is imported from .core on first use, so that `import proxmoxer` stays cheap
+__all__ = [
+    "ANYEVENT_HTTP_STATUS_CODES",
+    "SERVICES",
+    "PATH_TEMPLATE_PARAMS",
+    "REDACTED",
+    "redact_data",
+    "redact_content",
+    "path_template",
+    "RequestEvent",
+    "config_failure",
+    "ResourceException",
+    "AuthenticationError",
+    "resource_exception",
+    "ProxmoxResource",
+    "ProxmoxAPI",
+    "connect_many",
+]
+
+
+def __getattr__(name):
+    if name not in __all__:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(".core", __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
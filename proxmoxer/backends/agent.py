@@ -0,0 +1,154 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+import itertools
+import json
+import logging
+import threading
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+logger.setLevel(level=logging.WARNING)
+
+# pvedaemon's plain HTTP listener, only reachable from the node itself
+AGENT_API_URL = "http://127.0.0.1:85/api2/json"
+
+
+def agent_command():
+    """Return the command which starts the helper agent on a Proxmox node"""
+    source = (Path(__file__).parent / "agent_helper.py").read_text(encoding="utf-8")
+    return ["python3", "-u", "-c", source]
+
+
+class RemoteAgent:
+    """
+    Client side of a persistent helper agent running on a Proxmox node.
+
+    Requests from any number of threads are multiplexed over the agent's stdin/stdout
+    and answered out of order as the agent completes them.
+    """
+
+    def __init__(
+        self,
+        stdin,
+        stdout,
+        close=None,
+        token=None,
+        api_url=AGENT_API_URL,
+        workers=4,
+        timeout=None,
+    ):
+        """
+        Start talking to an agent which was started with `agent_command`
+
+        :param stdin: binary file object writing to the agent's stdin
+        :param stdout: binary file object reading from the agent's stdout
+        :param close: called to stop the underlying channel/process, defaults to None
+        :type close: Callable[[], None], optional
+        :param token: full API token ("USER@REALM!TOKENID=SECRET") used by the agent
+        :type token: str, optional
+        :param api_url: the node-local API the agent sends requests to
+        :type api_url: str, optional
+        :param workers: number of requests the agent processes concurrently, defaults to 4
+        :type workers: int, optional
+        :param timeout: seconds to wait for each response (also used by the agent for its
+            connections to the API), defaults to no limit
+        :type timeout: Optional[float], optional
+        """
+        self._stdin = stdin
+        self._stdout = stdout
+        self._close = close
+        self._ids = itertools.count()
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._closed = False
+        self.timeout = timeout
+
+        self._send({"api_url": api_url, "token": token, "workers": workers, "timeout": timeout})
+
+        self._reader = threading.Thread(target=self._read_responses, daemon=True)
+        self._reader.start()
+
+    def _send(self, obj):
+        line = json.dumps(obj).encode("utf-8") + b"\n"
+        with self._lock:
+            if self._closed:
+                raise ConnectionError("Remote agent is not running")
+            self._stdin.write(line)
+            self._stdin.flush()
+
+    def _read_responses(self):
+        try:
+            for line in self._stdout:
+                response = json.loads(line)
+                with self._lock:
+                    waiter = self._pending.pop(response["id"], None)
+                if waiter is not None:
+                    waiter["response"] = response
+                    waiter["event"].set()
+        except (ValueError, KeyError, TypeError) as e:
+            # the output cannot be followed any more, e.g. something else wrote to stdout
+            logger.error(f"Unreadable output from the remote agent: {e}")
+        except OSError as e:
+            logger.debug(f"Remote agent output closed: {e}")
+
+        # agent exited, wake up anyone still waiting so they can fail
+        with self._lock:
+            self._closed = True
+            waiters = list(self._pending.values())
+            self._pending.clear()
+        for waiter in waiters:
+            waiter["event"].set()
+
+    def request(self, method, path, data=None, params=None):
+        """
+        Send an API request through the agent and wait for its response
+
+        :return: the HTTP status code and the content (JSON of the response's data on success)
+        :rtype: Tuple[int, str]
+        """
+        request_id = next(self._ids)
+        waiter = {"event": threading.Event(), "response": None}
+        with self._lock:
+            self._pending[request_id] = waiter
+
+        try:
+            self._send(
+                {
+                    "id": request_id,
+                    "method": method,
+                    "path": path,
+                    "data": data,
+                    "params": params,
+                }
+            )
+        except (ConnectionError, OSError):
+            with self._lock:
+                self._pending.pop(request_id, None)
+            raise
+
+        if not waiter["event"].wait(self.timeout):
+            # a late response is dropped by the reader
+            with self._lock:
+                self._pending.pop(request_id, None)
+            raise TimeoutError(f"Remote agent did not respond within {self.timeout}s")
+        if waiter["response"] is None:
+            raise ConnectionError("Remote agent exited before responding")
+        return waiter["response"]["status"], waiter["response"]["content"]
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def close(self):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        try:
+            self._stdin.close()
+        except OSError:
+            pass
+        if self._close is not None:
+            self._close()
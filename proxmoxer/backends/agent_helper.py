@@ -0,0 +1,121 @@
+"""
+Persistent helper run on a Proxmox node by the command backends' agent mode.
+
+The first line on stdin is a JSON configuration object, every following line is a JSON
+request. Each request is answered with one JSON line on stdout by calling the node-local API
+over keep-alive connections, with several requests in flight at once. Responses are written
+as they complete and are matched to their request by "id".
+
+This file is sent to the node as source, so it must only use the standard library.
+"""
+
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+import http.client
+import json
+import queue
+import ssl
+import sys
+import threading
+from urllib.parse import urlencode, urlsplit
+
+
+def _connect(url, timeout):
+    if url.scheme == "https":
+        # the API is only reached over loopback, where the node's self-signed cert is expected
+        context = ssl._create_unverified_context()  # nosec
+        return http.client.HTTPSConnection(url.hostname, url.port, timeout=timeout, context=context)
+    return http.client.HTTPConnection(url.hostname, url.port, timeout=timeout)
+
+
+def _send(conn, url, headers, req):
+    path = url.path + req["path"]
+    if req.get("params"):
+        path += "?" + urlencode(req["params"], doseq=True)
+
+    body = None
+    req_headers = dict(headers)
+    if req.get("data"):
+        body = urlencode(req["data"], doseq=True)
+        req_headers["Content-Type"] = "application/x-www-form-urlencoded"
+
+    conn.request(req["method"], path, body=body, headers=req_headers)
+    resp = conn.getresponse()
+    return resp.status, resp.reason, resp.read()
+
+
+def _handle(conn, url, headers, timeout, req):
+    try:
+        status, reason, raw = _send(conn, url, headers, req)
+    except (http.client.HTTPException, OSError):
+        if req["method"] != "GET":
+            raise
+        # an idle keep-alive connection was closed by the server, retry on a new one
+        conn.close()
+        conn = _connect(url, timeout)
+        status, reason, raw = _send(conn, url, headers, req)
+
+    if 200 <= status <= 299:
+        content = json.dumps(json.loads(raw.decode("utf-8")).get("data"))
+    else:
+        # match the "<status> <message>" text pvesh writes to stderr
+        content = f"{status} {reason}"
+        try:
+            errors = json.loads(raw.decode("utf-8")).get("errors")
+        except (UnicodeDecodeError, ValueError, AttributeError):
+            errors = None
+        if errors:
+            content += "\n" + json.dumps(errors)
+    return conn, status, content
+
+
+def main():
+    config = json.loads(sys.stdin.readline())
+    url = urlsplit(config["api_url"])
+    timeout = config.get("timeout")
+    headers = {"Connection": "keep-alive"}
+    if config.get("token"):
+        headers["Authorization"] = "PVEAPIToken=" + config["token"]
+
+    pending = queue.Queue()
+    write_lock = threading.Lock()
+
+    def worker():
+        conn = _connect(url, timeout)
+        while True:
+            req = pending.get()
+            if req is None:
+                conn.close()
+                return
+
+            try:
+                conn, status, content = _handle(conn, url, headers, timeout, req)
+            except Exception as e:  # pylint: disable=broad-except
+                # report the failure for this request and keep serving the others
+                conn.close()
+                conn = _connect(url, timeout)
+                status, content = 500, f"500 {e}"
+
+            line = json.dumps({"id": req["id"], "status": status, "content": content})
+            with write_lock:
+                sys.stdout.write(line + "\n")
+                sys.stdout.flush()
+
+    workers = [threading.Thread(target=worker, daemon=True) for _ in range(config["workers"])]
+    for thread in workers:
+        thread.start()
+
+    for line in sys.stdin:
+        if line.strip():
+            pending.put(json.loads(line))
+
+    for _ in workers:
+        pending.put(None)
+    for thread in workers:
+        thread.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -3,14 +3,23 @@ __copyright__ = "(c) Oleg Butovich 2013-2017"
 __license__ = "MIT"
 
 
+import codecs
 import json
 import logging
 import platform
 import re
+import subprocess  # nosec B404
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
 from itertools import chain
+from shlex import quote
 from shlex import split as shell_split
 
-from proxmoxer.core import SERVICES
+from proxmoxer import tracing
+from proxmoxer.backends.agent import AGENT_API_URL, RemoteAgent
+from proxmoxer.core import SERVICES, reset_on_fork, resource_exception
 
 logger = logging.getLogger(__name__)
 logger.setLevel(level=logging.WARNING)
@@ -23,18 +32,153 @@ try:
         return join(args)
 
 except ImportError:
-    from shlex import quote
 
     def shell_join(args):
         return " ".join([quote(arg) for arg in args])
 
 
+# placeholder in a command for the temporary file an upload is written to on the target host
+UPLOAD_TMPFILE = "PROXMOXER_UPLOAD_TMPFILE"
+
+
+def upload_shell_command(cmd):
+    """Build a shell command which writes stdin to a temporary file, runs `cmd` with
+    `UPLOAD_TMPFILE` replaced by that file, and removes the file afterwards
+
+    :param cmd: the command to run once the upload is complete
+    :type cmd: list[str]
+    :return: a shell command string for the remote host
+    :rtype: str
+    """
+    quoted_cmd = " ".join('"$tmpfile"' if arg == UPLOAD_TMPFILE else quote(arg) for arg in cmd)
+    return (
+        'tmpfile=$(mktemp) && trap \'rm -f "$tmpfile"\' EXIT && cat > "$tmpfile" && ' + quoted_cmd
+    )
+
+
+STREAM_CHUNK_SIZE = 2**16  # read streamed command output 64 KiB at a time
+NUMBER_CHARS = frozenset("0123456789.eE+-")  # characters which may continue a JSON number
+
+
+def iter_json(stream, chunk_size=STREAM_CHUNK_SIZE):
+    """Incrementally decode JSON from a binary stream. If the top-level value is a list, its
+    items are yielded as soon as each is read, otherwise the single value is yielded.
+
+    :param stream: binary file object containing a JSON document
+    :param chunk_size: bytes to read from the stream at a time
+    :type chunk_size: int, optional
+    :raises ValueError: if the stream does not contain valid JSON
+    """
+    decoder = json.JSONDecoder()
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    buf = ""
+    pos = 0
+    eof = False
+
+    def read_more(size=chunk_size):
+        nonlocal buf, pos, eof
+        chunk = stream.read(size)
+        eof = not chunk
+        # drop everything already decoded so only the current item is buffered
+        buf = buf[pos:] + text_decoder.decode(chunk, final=eof)
+        pos = 0
+
+    def peek():
+        """Skip whitespace and return the next character, or "" at the end of the stream"""
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos].isspace():
+                pos += 1
+            if pos < len(buf):
+                return buf[pos]
+            if eof:
+                return ""
+            read_more()
+
+    first = peek()
+    if first == "":
+        return
+    if first != "[":
+        while not eof:
+            read_more()
+        yield json.loads(buf[pos:])
+        return
+
+    pos += 1
+    if peek() == "]":
+        return
+
+    while True:
+        while True:
+            try:
+                value, end = decoder.raw_decode(buf, pos)
+            except ValueError:
+                if eof:
+                    raise
+            else:
+                # a number at the end of the buffer may continue in the next chunk (e.g. "2."
+                # is read as 2)
+                if eof or not (
+                    isinstance(value, (int, float))
+                    and not isinstance(value, bool)
+                    and (end == len(buf) or buf[end] in NUMBER_CHARS)
+                ):
+                    break
+            # at least double what is buffered of an incomplete item, so a large one is decoded
+            # a few times rather than once per chunk
+            read_more(max(chunk_size, len(buf) - pos))
+        pos = end
+        yield value
+
+        separator = peek()
+        if separator == "]":
+            return
+        if separator != ",":
+            raise ValueError(f"Expecting ',' delimiter in JSON array, found {separator!r}")
+        pos += 1
+        peek()
+
+
+@contextmanager
+def popen_stream(args, timeout=None, **kwargs):
+    """Run a subprocess for `CommandBaseSession._exec_stream`, yielding its stdout stream and
+    a function which waits for it to exit and returns its stderr. The process is killed if
+    it is still running when the context exits.
+    """
+    # stderr is spooled to a file so it cannot fill a pipe while stdout is being consumed
+    with tempfile.TemporaryFile() as stderr_file:
+        # an argument list built by the session, never run through a shell
+        proc = subprocess.Popen(  # nosec B603
+            args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=stderr_file, **kwargs
+        )
+
+        def wait():
+            proc.wait(timeout=timeout)
+            stderr_file.seek(0)
+            return stderr_file.read()
+
+        try:
+            yield proc.stdout, wait
+        finally:
+            if proc.poll() is None:
+                proc.kill()
+                proc.wait()
+            proc.stdout.close()
+
+
 class Response:
     def __init__(self, content, status_code):
         self.status_code = status_code
         self.content = content
-        self.text = str(content)
         self.headers = {"content-type": "application/json"}
+        # filled in by the session for request hooks
+        self.timings = {}
+        self.bytes_sent = None
+
+    @property
+    def text(self):
+        # only made when needed so a large output is not copied for every response
+        return str(self.content)
 
     def __str__(self):
         return f"Response ({self.status_code}) {self.content}"
@@ -46,14 +190,83 @@ class CommandBaseSession:
         service="PVE",
         timeout=5,
         sudo=False,
+        agent_token=None,
+        agent_api_url=AGENT_API_URL,
+        agent_workers=4,
+        upload_timeout=None,
     ):
         self.service = service.lower()
         self.timeout = timeout
         self.sudo = sudo
+        # sending a file (and storing it) takes much longer than a command, no limit by default
+        self.upload_timeout = upload_timeout
+
+        # agent mode is used when a token for the node-local API is given
+        self.agent_token = agent_token
+        self.agent_api_url = agent_api_url
+        self.agent_workers = agent_workers
+        self._agent = None
+        self._agent_lock = threading.Lock()
+        reset_on_fork(self)
+
+    def __getstate__(self):
+        # connections and locks stay in this process, they are reopened where unpickled
+        state = self.__dict__.copy()
+        state["_agent"] = None
+        del state["_agent_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._agent_lock = threading.Lock()
+        reset_on_fork(self)
+
+    def _after_fork(self):
+        # the agent's channel belongs to the parent, a lock may have been held by one of its
+        # threads when the process forked
+        self._agent = None
+        self._agent_lock = threading.Lock()
 
     def _exec(self, cmd):
         raise NotImplementedError()
 
+    def _open_agent_channel(self):
+        """Start `agent_command()` on the target and return (stdin, stdout, close function)"""
+        raise NotImplementedError()
+
+    def _get_agent(self):
+        with self._agent_lock:
+            if self._agent is None or self._agent.closed:
+                stdin, stdout, close = self._open_agent_channel()
+                self._agent = RemoteAgent(
+                    stdin,
+                    stdout,
+                    close,
+                    token=self.agent_token,
+                    api_url=self.agent_api_url,
+                    workers=self.agent_workers,
+                    timeout=self.timeout,
+                )
+            return self._agent
+
+    def _agent_request(self, method, url, data, params):
+        # match the value formatting used when building pvesh arguments
+        def to_str(v):
+            if isinstance(v, list):
+                return [to_str(i) for i in v]
+            try:
+                return str(v, "utf-8")
+            except TypeError:
+                return str(v)
+
+        status_code, content = self._get_agent().request(
+            method.upper(),
+            url,
+            data={k: to_str(v) for k, v in data.items()},
+            params={k: to_str(v) for k, v in params.items()},
+        )
+        return Response(content, status_code)
+
     # noinspection PyUnusedLocal
     def request(self, method, url, data=None, params=None, headers=None):
         method = method.lower()
@@ -61,6 +274,82 @@ class CommandBaseSession:
         params = params or {}
         url = url.strip()
 
+        # uploads still go through pvesh since they need the file on the target
+        if self.agent_token is not None and not url.endswith("upload"):
+            if "/agent/exec" in url and isinstance(data.get("command"), str):
+                if "Windows" not in platform.platform():
+                    data["command"] = shell_split(data["command"])
+            start = time.monotonic()
+            with tracing.span("proxmoxer.command.agent_request", **{"url.path": url}):
+                resp = self._agent_request(method, url, data, params)
+            resp.timings = {"server": time.monotonic() - start}
+            return resp
+
+        full_cmd, upload_file = self._build_command(method, url, data, params)
+
+        start = time.monotonic()
+        if upload_file is not None:
+            with self._command_span("proxmoxer.command.upload", full_cmd, url):
+                stdout, stderr = self._exec_upload(full_cmd, upload_file)
+        else:
+            with self._command_span("proxmoxer.command.exec", full_cmd, url):
+                stdout, stderr = self._exec(full_cmd)
+        server_time = time.monotonic() - start
+
+        resp = self._build_response(stdout, stderr)
+        # the connection is made when the session is created, so "connect" is left unmeasured
+        resp.timings = {"server": server_time}
+        resp.bytes_sent = sum(len(arg) + 1 for arg in full_cmd)
+        return resp
+
+    def _command_span(self, name, cmd, url):
+        # only the command name is recorded, the arguments may contain secrets
+        command = cmd[1] if self.sudo else cmd[0]
+        return tracing.span(name, **{"proxmoxer.command": command, "url.path": url})
+
+    def _exec_stream(self, cmd):
+        """Context manager running `cmd` which yields (binary stdout stream, wait function).
+        The wait function blocks until the command exits and returns its stderr.
+        """
+        raise NotImplementedError()
+
+    def iter_request(self, method, url, data=None, params=None):
+        """Run a request and iterate over the items of its JSON output as they are read,
+        without holding the whole output in memory
+
+        :raises ResourceException: if the command fails
+        """
+        serializer = JsonSimpleSerializer()
+        if url.strip().endswith("upload") or self.agent_token is not None:
+            # output is not from a local command stream, decode it whole
+            resp = self.request(method, url, data=data, params=params)
+            if resp.status_code >= 400:
+                raise resource_exception(resp, serializer)
+            data = serializer.loads(resp)
+            yield from data if isinstance(data, list) else [data]
+            return
+
+        full_cmd, _ = self._build_command(method.lower(), url.strip(), data or {}, params or {})
+        decode_error = None
+        with self._exec_stream(full_cmd) as (stdout, wait):
+            try:
+                yield from iter_json(stdout)
+            except ValueError as e:
+                decode_error = e
+            stderr = wait()
+
+        resp = self._build_response(None, stderr)
+        if resp.status_code >= 400:
+            raise resource_exception(resp, serializer)
+        if decode_error is not None:
+            raise decode_error
+
+    def _build_command(self, method, url, data, params):
+        """Convert a request into the CLI command for the service
+
+        :return: the full command and the file object to upload (None if not an upload)
+        :rtype: Tuple[List[str], Optional[file object]]
+        """
         cmd = {"post": "create", "put": "set"}.get(method, method)
 
         # separate out qemu exec commands to split into multiple argument pairs (issue#89)
@@ -71,20 +360,12 @@ class CommandBaseSession:
                 del data["command"]
 
         # for 'upload' call some workaround
-        tmp_filename = ""
+        upload_file = None
         if url.endswith("upload"):
-            # copy file to temporary location on proxmox host
-            tmp_filename, _ = self._exec(
-                [
-                    "python3",
-                    "-c",
-                    "import tempfile; import sys; tf = tempfile.NamedTemporaryFile(); sys.stdout.write(tf.name)",
-                ]
-            )
-            tmp_filename = str(tmp_filename, "utf-8")
-            self.upload_file_obj(data["filename"], tmp_filename)
-            data["filename"] = data["filename"].name
-            data["tmpfilename"] = tmp_filename
+            # file is copied to a temporary location on proxmox host when the command is run
+            upload_file = data["filename"]
+            data["filename"] = upload_file.name
+            data["tmpfilename"] = UPLOAD_TMPFILE
 
         command = [f"{self.service}sh", cmd, url]
         # convert the options dict into a 2-tuple with the key formatted as a flag
@@ -110,7 +391,11 @@ class CommandBaseSession:
         if self.sudo:
             full_cmd = ["sudo"] + full_cmd
 
-        stdout, stderr = self._exec(full_cmd)
+        return full_cmd, upload_file
+
+    @staticmethod
+    def _build_response(stdout, stderr):
+        """Create a Response from a command's output, faking the HTTP status code"""
 
         def is_http_status_string(s):
             return re.match(r"\d\d\d [a-zA-Z]", str(s))
@@ -138,9 +423,33 @@ class CommandBaseSession:
             return Response(stdout, status_code)
         return Response(stderr, status_code)
 
+    def _exec_upload(self, cmd, file_obj):
+        """Upload `file_obj` to a temporary file and run `cmd` with `UPLOAD_TMPFILE` replaced
+        by its path. Backends which can stream stdin should override this to do it in a single
+        remote operation.
+        """
+        tmp_filename, _ = self._exec(
+            [
+                "python3",
+                "-c",
+                "import tempfile; import sys; tf = tempfile.NamedTemporaryFile(); sys.stdout.write(tf.name)",
+            ]
+        )
+        if isinstance(tmp_filename, bytes):
+            tmp_filename = str(tmp_filename, "utf-8")
+        self.upload_file_obj(file_obj, tmp_filename)
+        return self._exec([tmp_filename if arg == UPLOAD_TMPFILE else arg for arg in cmd])
+
     def upload_file_obj(self, file_obj, remote_path):
         raise NotImplementedError()
 
+    def close(self):
+        """Release any persistent resources (connections, sockets) held by the session"""
+        with self._agent_lock:
+            if self._agent is not None:
+                self._agent.close()
+                self._agent = None
+
 
 class JsonSimpleSerializer:
     def loads(self, response):
@@ -9,10 +9,12 @@ import logging
 import os
 import platform
 import sys
+import threading
 import time
 from shlex import split as shell_split
 
-from proxmoxer.core import SERVICES, AuthenticationError, config_failure
+from proxmoxer import tracing
+from proxmoxer.core import SERVICES, AuthenticationError, config_failure, reset_on_fork
 
 logger = logging.getLogger(__name__)
 logger.setLevel(level=logging.WARNING)
@@ -54,14 +56,30 @@ class ProxmoxHTTPAuth(ProxmoxHTTPAuthBase):
     # if calls are made less frequently than 2 hrs, using the API token auth is recommended
     renew_age = 3600
 
-    def __init__(self, username, password, otp=None, base_url="", **kwargs):
+    def __init__(self, username, password, otp=None, base_url="", lazy=False, **kwargs):
         super().__init__(**kwargs)
         self.base_url = base_url
         self.username = username
         self.pve_auth_ticket = ""
-
-        self._get_new_tokens(password=password, otp=otp)
-
+        self.csrf_prevention_token = ""
+        self.birth_time = None
+
+        # with `lazy`, the login happens when the ticket is first needed
+        self._pending_login = {"password": password, "otp": otp}
+        self._login_lock = threading.Lock()
+        if not lazy:
+            self._login()
+
+    def _login(self):
+        if self._pending_login is None:
+            return
+        with self._login_lock:
+            if self._pending_login is not None:
+                self._get_new_tokens(**self._pending_login)
+                # the password is not kept once there is a ticket
+                self._pending_login = None
+
+    @tracing.traced("proxmoxer.auth.get_tokens")
     def _get_new_tokens(self, password=None, otp=None):
         if password is None:
             # refresh from existing (unexpired) ticket
@@ -93,13 +111,34 @@ class ProxmoxHTTPAuth(ProxmoxHTTPAuthBase):
         self.pve_auth_ticket = response_data["ticket"]
         self.csrf_prevention_token = response_data["CSRFPreventionToken"]
 
+    def __getstate__(self):
+        # a pending login holds the password, which must never be pickled, so log in first and
+        # send the ticket instead
+        self._login()
+        # the monotonic clock is not comparable between hosts, send the ticket's age instead
+        state = self.__dict__.copy()
+        del state["_login_lock"]
+        state["_pending_login"] = None
+        if self.birth_time is not None:
+            state["birth_time"] = time.monotonic() - self.birth_time
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._login_lock = threading.Lock()
+        if state["birth_time"] is not None:
+            self.birth_time = time.monotonic() - state["birth_time"]
+
     def get_cookies(self):
+        self._login()
         return cookiejar_from_dict({self.service + "AuthCookie": self.pve_auth_ticket})
 
     def get_tokens(self):
+        self._login()
         return self.pve_auth_ticket, self.csrf_prevention_token
 
     def __call__(self, req):
+        self._login()
         # refresh ticket if older than `renew_age`
         time_diff = time.monotonic() - self.birth_time
         if time_diff >= self.renew_age:
@@ -158,6 +197,18 @@ class JsonSerializer:
 
 # pylint:disable=arguments-renamed
 class ProxmoxHttpSession(requests.Session):
+    def __init__(self):
+        super().__init__()
+        reset_on_fork(self)
+
+    def _after_fork(self):
+        # new pools for the child, the parent keeps using (and eventually closes) the old ones
+        for adapter in self.adapters.values():
+            adapter.init_poolmanager(
+                adapter._pool_connections, adapter._pool_maxsize, block=adapter._pool_block
+            )
+            adapter.proxy_manager = {}
+
     def request(
         self,
         method,
@@ -232,7 +283,7 @@ class ProxmoxHttpSession(requests.Session):
                         "Installing 'requests_toolbelt' will decrease memory used during upload"
                     )
 
-        return super().request(
+        resp = super().request(
             method,
             url,
             params,
@@ -250,6 +301,21 @@ class ProxmoxHttpSession(requests.Session):
             cert,
         )
 
+        # for request hooks; requests does not separate connecting from waiting on the server
+        resp.timings = {
+            "auth": getattr(resp.request, "auth_time", None),
+            "server": resp.elapsed.total_seconds(),
+        }
+        resp.bytes_sent = get_body_size(resp.request)
+        return resp
+
+    def prepare_request(self, request):
+        # the auth is applied (and a ticket renewed if needed) while preparing the request
+        start = time.monotonic()
+        prepared = super().prepare_request(request)
+        prepared.auth_time = time.monotonic() - start
+        return prepared
+
 
 class Backend:
     def __init__(
@@ -267,6 +333,7 @@ class Backend:
         path_prefix=None,
         service="PVE",
         cert=None,
+        lazy=False,
     ):
         self.cert = cert
         host_port = ""
@@ -316,18 +383,31 @@ class Backend:
                 timeout=timeout,
                 service=service,
                 cert=self.cert,
+                lazy=lazy,
             )
         else:
             config_failure("No valid authentication credentials were supplied")
 
+        self._session = None
+
+    def __getstate__(self):
+        # only the connection parameters and the auth (with its ticket or token) are sent,
+        # the unpickled backend opens its own connections when first used
+        state = self.__dict__.copy()
+        state["_session"] = None
+        return state
+
     def get_session(self):
-        session = ProxmoxHttpSession()
-        session.cert = self.cert
-        session.auth = self.auth
-        # cookies are taken from the auth
-        session.headers["Connection"] = "keep-alive"
-        session.headers["accept"] = self.get_serializer().get_accept_types()
-        return session
+        # one session (and connection pool) shared by everything made from this backend
+        if self._session is None:
+            session = ProxmoxHttpSession()
+            session.cert = self.cert
+            session.auth = self.auth
+            # cookies are taken from the auth
+            session.headers["Connection"] = "keep-alive"
+            session.headers["accept"] = self.get_serializer().get_accept_types()
+            self._session = session
+        return self._session
 
     def get_base_url(self):
         return self.base_url
@@ -341,6 +421,26 @@ class Backend:
         return self.auth.get_tokens()
 
 
+def get_body_size(prepared):
+    """Returns the number of bytes in the body of a prepared request
+
+    :param prepared: the request sent
+    :type prepared: requests.PreparedRequest
+    :return: body size in bytes, None if it could not be determined
+    :rtype: Optional[int]
+    """
+    body = prepared.body
+    if body is None:
+        return 0
+    if isinstance(body, (bytes, str)):
+        return len(body)
+    # streamed bodies (e.g. large uploads) are not held in memory, use the declared length
+    try:
+        return int(prepared.headers.get("Content-Length"))
+    except (TypeError, ValueError):
+        return None
+
+
 def get_file_size(file_obj):
     """Returns the number of bytes in the given file object in total
     file cursor remains at the same location as when passed in
@@ -2,10 +2,55 @@ __author__ = "Markus Reiter"
 __copyright__ = "(c) Markus Reiter 2022"
 __license__ = "MIT"
 
+import functools
+import io
+import os
 import shutil
-from subprocess import PIPE, Popen
+import tempfile
+import time
+import weakref
+from contextlib import contextmanager
+from subprocess import DEVNULL, PIPE, Popen, TimeoutExpired
 
-from proxmoxer.backends.command_base import CommandBaseBackend, CommandBaseSession
+from proxmoxer import tracing
+from proxmoxer.backends.agent import agent_command
+from proxmoxer.backends.command_base import (
+    UPLOAD_TMPFILE,
+    CommandBaseBackend,
+    CommandBaseSession,
+    popen_stream,
+)
+
+COPY_CHUNK_SIZE = 2**30  # max bytes the kernel is asked to copy at once (1 GiB)
+READ_CHUNK_SIZE = 2**16  # read command output 64 KiB at a time
+
+
+def _copy_file_range(src_fd, dest_fd, offset):
+    """Copy everything after `offset` in `src_fd` to `dest_fd` without passing the data
+    through userspace, using copy_file_range (reflinks on supporting filesystems)
+    or falling back to sendfile
+
+    :return: the number of bytes copied
+    :rtype: int
+    """
+    copy_file_range = getattr(os, "copy_file_range", None)
+    copied = 0
+    while True:
+        if copy_file_range is not None:
+            try:
+                count = copy_file_range(src_fd, dest_fd, COPY_CHUNK_SIZE, offset + copied)
+            except OSError:
+                if copied:
+                    raise
+                # unsupported between these files/filesystems, try sendfile instead
+                copy_file_range = None
+                continue
+        else:
+            count = os.sendfile(dest_fd, src_fd, offset + copied, COPY_CHUNK_SIZE)
+
+        if count == 0:
+            return copied
+        copied += count
 
 
 class LocalSession(CommandBaseSession):
@@ -14,12 +59,157 @@ class LocalSession(CommandBaseSession):
         stdout, stderr = proc.communicate(timeout=self.timeout)
         return stdout.decode(), stderr.decode()
 
+    def _open_agent_channel(self):
+        proc = Popen(agent_command(), stdin=PIPE, stdout=PIPE, stderr=DEVNULL)
+        return proc.stdin, proc.stdout, proc.wait
+
+    @contextmanager
+    def _exec_stream(self, cmd):
+        with popen_stream(cmd, timeout=self.timeout) as (stdout, wait):
+            yield stdout, lambda: wait().decode()
+
+    def _exec_upload(self, cmd, file_obj):
+        # the "remote" host is this one, so no interpreter is needed to make the temporary file
+        fd, tmp_filename = tempfile.mkstemp(prefix="proxmoxer-upload-")
+        os.close(fd)
+        try:
+            self.upload_file_obj(file_obj, tmp_filename)
+            return self._exec([tmp_filename if arg == UPLOAD_TMPFILE else arg for arg in cmd])
+        finally:
+            # pvesh normally moves the file into the storage
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+
     def upload_file_obj(self, file_obj, remote_path):
         with open(remote_path, "wb") as dest_fp:
-            shutil.copyfileobj(file_obj, dest_fp)
+            try:
+                src_fd = file_obj.fileno()
+                # make sure anything buffered is visible to the kernel copy
+                file_obj.flush()
+            except (AttributeError, OSError, io.UnsupportedOperation):
+                shutil.copyfileobj(file_obj, dest_fp)
+                return
+
+            offset = file_obj.tell()
+            try:
+                copied = _copy_file_range(src_fd, dest_fp.fileno(), offset)
+            except OSError:
+                # not a regular file or sendfile is unavailable
+                dest_fp.seek(0)
+                dest_fp.truncate()
+                file_obj.seek(offset)
+                shutil.copyfileobj(file_obj, dest_fp)
+                return
+
+            # leave the cursor at the end as if the file had been read
+            file_obj.seek(offset + copied)
+
+
+class AsyncLocalSession(LocalSession):
+    """
+    A local session which can also run requests as asyncio subprocesses, so many pvesh
+    commands can run in parallel from one event loop. It is the session of a local backend
+    created with `max_concurrency`, e.g. ``ProxmoxAPI(backend="local", max_concurrency=8)``.
+
+    .. code-block:: python
+
+        prox = ProxmoxAPI(backend="local", max_concurrency=8)
+        statuses = await asyncio.gather(
+            *(prox.nodes("pve1").qemu(vmid).status.current.get_async() for vmid in vmids)
+        )
+    """
+
+    def __init__(self, *args, max_concurrency=8, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.max_concurrency = max_concurrency
+        # one per event loop, as a semaphore can only be used from the loop it is bound to
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        del state["_semaphores"]
+        return state
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    async def _read_stream(self, stream):
+        chunks = []
+        while True:
+            chunk = await stream.read(READ_CHUNK_SIZE)
+            if not chunk:
+                return b"".join(chunks)
+            chunks.append(chunk)
+
+    async def _exec_async(self, cmd):
+        # asyncio is slow to import, and is already loaded whenever these coroutines run
+        import asyncio  # pylint:disable=import-outside-toplevel
+
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = self._semaphores[loop] = asyncio.Semaphore(self.max_concurrency)
+
+        async with semaphore:
+            proc = await asyncio.create_subprocess_exec(*cmd, stdout=PIPE, stderr=PIPE)
+            try:
+                stdout, stderr, _ = await asyncio.wait_for(
+                    asyncio.gather(
+                        self._read_stream(proc.stdout),
+                        self._read_stream(proc.stderr),
+                        proc.wait(),
+                    ),
+                    timeout=self.timeout,
+                )
+            except BaseException as e:
+                # also when cancelled, e.g. by a failed gather, so no command is left running
+                if proc.returncode is None:
+                    proc.kill()
+                    await proc.wait()
+                if isinstance(e, asyncio.TimeoutError):
+                    raise TimeoutExpired(cmd, self.timeout)
+                raise
+
+        return stdout.decode(), stderr.decode()
+
+    async def request_async(self, method, url, data=None, params=None):
+        """
+        Run a request as an asyncio subprocess, building the command and parsing the output
+        the same way as `request`
+
+        :return: the response of the command
+        :rtype: Response
+        """
+        import asyncio  # pylint:disable=import-outside-toplevel
+
+        if self.agent_token is not None or url.strip().endswith("upload"):
+            # agent requests and uploads are blocking, keep them off the event loop
+            # run_in_executor does not carry the context, bind it so spans stay nested
+            return await asyncio.get_running_loop().run_in_executor(
+                None,
+                tracing.wrap(
+                    functools.partial(self.request, method, url, data=data, params=params)
+                ),
+            )
+
+        full_cmd, _ = self._build_command(method.lower(), url.strip(), data or {}, params or {})
+        start = time.monotonic()
+        with self._command_span("proxmoxer.command.exec", full_cmd, url):
+            stdout, stderr = await self._exec_async(full_cmd)
+        resp = self._build_response(stdout, stderr)
+        resp.timings = {"server": time.monotonic() - start}
+        resp.bytes_sent = sum(len(arg) + 1 for arg in full_cmd)
+        return resp
 
 
 class Backend(CommandBaseBackend):
-    def __init__(self, *args, **kwargs):
-        self.session = LocalSession(*args, **kwargs)
+    def __init__(self, *args, lazy=False, max_concurrency=None, **kwargs):
+        # there is no connection to make, `lazy` is accepted so the same options work with
+        # every backend (e.g. in connect_many)
+        if max_concurrency is not None:
+            # requests can also be made with `request_async`, see AsyncLocalSession
+            self.session = AsyncLocalSession(*args, max_concurrency=max_concurrency, **kwargs)
+        else:
+            self.session = LocalSession(*args, **kwargs)
         self.target = "localhost"
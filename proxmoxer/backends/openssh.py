@@ -3,11 +3,20 @@ __copyright__ = "(c) Oleg Butovich 2013-2017"
 __license__ = "MIT"
 
 import logging
+import os
+import shutil
+import subprocess  # nosec B404
+import tempfile
+import threading
+from contextlib import contextmanager
 
+from proxmoxer.backends.agent import agent_command
 from proxmoxer.backends.command_base import (
     CommandBaseBackend,
     CommandBaseSession,
+    popen_stream,
     shell_join,
+    upload_shell_command,
 )
 
 logger = logging.getLogger(__name__)
@@ -21,6 +30,53 @@ except ImportError:
     logger.error("Chosen backend requires 'openssh_wrapper' module\n")
     sys.exit(1)
 
+# where openssh_wrapper runs ssh (and scp) from
+SSH_BINARY = "/usr/bin/ssh"
+
+
+class SSHConnection(openssh_wrapper.SSHConnection):
+    """
+    An openssh_wrapper connection which passes additional options to every ssh and scp call
+    """
+
+    def __init__(self, *args, ssh_options=None, ssh_binary=SSH_BINARY, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.ssh_options = ssh_options or []
+        self.ssh_binary = ssh_binary
+
+    def ssh_command(self, interpreter, forward_ssh_agent):
+        # openssh_wrapper's run() pipes its command to `interpreter` on the server
+        return self.remote_command(interpreter, forward_ssh_agent)
+
+    def remote_command(self, command, forward_ssh_agent=False):
+        """
+        The ssh arguments which run `command` on the server
+
+        :param command: a shell command line for the server
+        :type command: str
+        :param forward_ssh_agent: forward the local ssh agent, defaults to False
+        :type forward_ssh_agent: bool, optional
+        :return: the arguments to run locally
+        :rtype: list[bytes]
+        """
+        cmd = [self.ssh_binary, *self.ssh_options]
+        if self.login:
+            cmd += ["-l", self.login]
+        if self.configfile:
+            cmd += ["-F", self.configfile]
+        if self.identity_file:
+            cmd += ["-i", self.identity_file]
+        if forward_ssh_agent:
+            cmd.append("-A")
+        if self.port:
+            cmd += ["-p", str(self.port)]
+        cmd += [self.server, command]
+        return openssh_wrapper.b_list(cmd)
+
+    def scp_command(self, files, target):
+        cmd = super().scp_command(files, target)
+        return cmd[:1] + openssh_wrapper.b_list(self.ssh_options) + cmd[1:]
+
 
 class OpenSSHSession(CommandBaseSession):
     def __init__(
@@ -31,6 +87,10 @@ class OpenSSHSession(CommandBaseSession):
         port=22,
         identity_file=None,
         forward_ssh_agent=False,
+        control_master=False,
+        control_persist=60,
+        lazy=False,
+        ssh_binary=SSH_BINARY,
         **kwargs,
     ):
         super().__init__(**kwargs)
@@ -40,26 +100,168 @@ class OpenSSHSession(CommandBaseSession):
         self.port = port
         self.forward_ssh_agent = forward_ssh_agent
         self.identity_file = identity_file
+        self.control_master = control_master
+        self.control_persist = control_persist
+        self.ssh_binary = ssh_binary
+        self.control_dir = None
+        self._connect_lock = threading.Lock()
+
+        # with `lazy`, the connection is made by the first command
+        self._ssh_client = None if lazy else self._connect()
+
+    @property
+    def ssh_client(self):
+        """The SSH connection settings, set up again if the session was pickled or forked"""
+        if self._ssh_client is None:
+            with self._connect_lock:
+                if self._ssh_client is None:
+                    self._ssh_client = self._connect()
+        return self._ssh_client
+
+    @ssh_client.setter
+    def ssh_client(self, ssh_client):
+        self._ssh_client = ssh_client
+
+    def __getstate__(self):
+        # the control master (and its directory) is owned by this process
+        state = super().__getstate__()
+        state["_ssh_client"] = state["control_dir"] = None
+        del state["_connect_lock"]
+        return state
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self._connect_lock = threading.Lock()
 
-        self.ssh_client = self._connect()
+    def _after_fork(self):
+        # a child with its own control master cannot stop the parent's when closed
+        super()._after_fork()
+        self._ssh_client = self.control_dir = None
+        self._connect_lock = threading.Lock()
+
+    @property
+    def control_path(self):
+        if self.control_dir is None:
+            return None
+        return os.path.join(self.control_dir, "control")
+
+    def _control_options(self):
+        return [
+            "-o",
+            "ControlMaster=auto",
+            "-o",
+            f"ControlPath={self.control_path}",
+            "-o",
+            f"ControlPersist={self.control_persist}",
+        ]
 
     def _connect(self):
-        return openssh_wrapper.SSHConnection(
+        ssh_options = []
+        if self.control_master:
+            # keep the socket in a private directory so other local users cannot reuse it
+            self.control_dir = tempfile.mkdtemp(prefix="proxmoxer-ssh-")
+            ssh_options = self._control_options()
+
+        ssh_client = SSHConnection(
             self.host,
             login=self.user,
             port=str(self.port),  # openssh_wrapper complains if this is an int
             configfile=self.config_file,
             identity_file=self.identity_file,
             timeout=self.timeout,
+            ssh_options=ssh_options,
+            ssh_binary=self.ssh_binary,
         )
 
+        if self.control_master:
+            # the first connection becomes the master and stays in the background
+            # for `control_persist` seconds after the last use
+            ssh_client.run("true")
+
+        return ssh_client
+
     def _exec(self, cmd):
         ret = self.ssh_client.run(shell_join(cmd), forward_ssh_agent=self.forward_ssh_agent)
         return ret.stdout, ret.stderr
 
+    @contextmanager
+    def _exec_stream(self, cmd):
+        with popen_stream(
+            self.ssh_client.remote_command(shell_join(cmd), self.forward_ssh_agent),
+            env=self.ssh_client.get_env(),
+        ) as (stdout, wait):
+            yield stdout, lambda: wait().strip()
+
+    def _exec_upload(self, cmd, file_obj):
+        # the file is sent over the ssh process' stdin rather than a separate scp call (the
+        # command is an argument list, not run through a local shell)
+        proc = subprocess.Popen(  # nosec B603
+            self.ssh_client.remote_command(upload_shell_command(cmd), self.forward_ssh_agent),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            env=self.ssh_client.get_env(),
+        )
+        finished = False
+        try:
+            try:
+                shutil.copyfileobj(file_obj, proc.stdin)
+            except BrokenPipeError:
+                # the remote command exited early, its stderr explains why
+                logger.debug(f"upload stream to {self.host} closed early")
+            # pvesh still has to store the file, which can take long for a large one
+            stdout, stderr = proc.communicate(timeout=self.upload_timeout)
+            finished = True
+        finally:
+            if not finished:
+                # do not leave an ssh process behind for every failed upload
+                proc.kill()
+                proc.communicate()
+        return stdout.strip(), stderr.strip()
+
+    def _open_agent_channel(self):
+        # the agent script is quoted into one argument list, never run through a local shell
+        proc = subprocess.Popen(  # nosec B603
+            self.ssh_client.remote_command(shell_join(agent_command()), self.forward_ssh_agent),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            env=self.ssh_client.get_env(),
+        )
+        return proc.stdin, proc.stdout, proc.wait
+
     def upload_file_obj(self, file_obj, remote_path):
         self.ssh_client.scp((file_obj,), target=remote_path)
 
+    def close(self):
+        super().close()
+        if self.control_dir is None:
+            return
+
+        if os.path.exists(self.control_path):
+            try:
+                # an argument list with the configured ssh binary, never run through a shell
+                subprocess.run(  # nosec B603
+                    [
+                        self.ssh_binary,
+                        "-o",
+                        f"ControlPath={self.control_path}",
+                        "-O",
+                        "exit",
+                        self.host,
+                    ],
+                    stdin=subprocess.DEVNULL,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                    timeout=self.timeout,
+                    check=False,
+                )
+            except (OSError, subprocess.TimeoutExpired) as e:
+                logger.warning(f"Unable to stop SSH control master for {self.host}: {e}")
+
+        shutil.rmtree(self.control_dir, ignore_errors=True)
+        self.control_dir = None
+
 
 class Backend(CommandBaseBackend):
     def __init__(self, *args, **kwargs):
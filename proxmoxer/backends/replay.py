@@ -0,0 +1,296 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+import gzip
+import json
+import logging
+import threading
+import time
+from collections import deque
+
+from proxmoxer.core import redact_content, redact_data
+
+logger = logging.getLogger(__name__)
+logger.setLevel(level=logging.WARNING)
+
+FORMAT_NAME = "proxmoxer-replay"
+FORMAT_VERSION = 1
+
+# Recordings are JSON lines, gzip compressed if the file name ends in ".gz". The first line is a
+# header describing the recorded backend, each following line is one request with short keys:
+#   t: start time in seconds since the recording started    d: duration in seconds
+#   m: HTTP method    p: path below the base URL    q: query parameters    b: request data
+#   s: status code    r: reason (https only)    c: response content
+
+
+class ReplayError(Exception):
+    """A request was made which is not in the recording (or whose responses were used up)"""
+
+
+def _open(path, mode):
+    if str(path).endswith(".gz"):
+        return gzip.open(path, mode + "t", encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+def _match_key(method, path, params):
+    # parameters are compared independent of order, as they are sent in a query string
+    return method.upper(), path, json.dumps(params or {}, sort_keys=True, default=str)
+
+
+def _describe_value(value):
+    # file objects (uploads) and other non-JSON values are recorded as a description only
+    name = getattr(value, "name", None)
+    return f"<{type(value).__name__} {name}>" if name else f"<{type(value).__name__}>"
+
+
+def _content_text(content):
+    if isinstance(content, bytes):
+        return content.decode("utf-8", errors="replace")
+    return content if isinstance(content, str) else str(content)
+
+
+class RecordingSession:
+    """
+    Wraps the session of a backend, writing every request and response (with its duration) to
+    a recording which the replay backend can serve back later.
+
+    Use `record` to add it to an existing ProxmoxAPI.
+    """
+
+    def __init__(self, session, path, base_url="", backend="https", redact=True):
+        """
+        :param session: the session of the recorded backend
+        :param path: the file to write, gzip compressed if it ends with ".gz"
+        :type path: str
+        :param base_url: the base URL of the recorded backend, removed from recorded paths
+        :type base_url: str, optional
+        :param backend: the name of the recorded backend, defaults to "https"
+        :type backend: str, optional
+        :param redact: hide passwords, tickets and tokens in the recording, defaults to True
+        :type redact: bool, optional
+        """
+        self.session = session
+        self.path = path
+        self.base_url = base_url
+        self.redact = redact
+        self._lock = threading.Lock()
+        self._start = time.monotonic()
+        self._file = _open(path, "w")
+        self._write(
+            {
+                "format": FORMAT_NAME,
+                "version": FORMAT_VERSION,
+                "backend": backend,
+                "base_url": base_url,
+                # the https backend wraps responses in {"data": ...}, command backends do not
+                "wrapped": backend == "https",
+            }
+        )
+
+    def _write(self, entry):
+        line = json.dumps(entry, separators=(",", ":"), default=_describe_value) + "\n"
+        with self._lock:
+            if self._file is not None:
+                self._file.write(line)
+
+    def request(self, method, url, data=None, params=None, **kwargs):
+        start = time.monotonic()
+        resp = self.session.request(method, url, data=data, params=params, **kwargs)
+        duration = time.monotonic() - start
+
+        content = _content_text(resp.content)
+        entry = {
+            "t": round(start - self._start, 6),
+            "d": round(duration, 6),
+            "m": method.upper(),
+            "p": url[len(self.base_url) :] if url.startswith(self.base_url) else url,
+            "s": resp.status_code,
+            "c": redact_content(content) if self.redact else content,
+        }
+        if params:
+            entry["q"] = params
+        if data:
+            entry["b"] = redact_data(data) if self.redact else data
+        if getattr(resp, "reason", None) is not None:
+            entry["r"] = resp.reason
+        self._write(entry)
+        return resp
+
+    def stop(self):
+        """Finish the recording, the wrapped session can still be used"""
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def close(self):
+        self.stop()
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def record(prox, path, redact=True):
+    """
+    Record all requests made through `prox` from now on. This must be called before any
+    resources are created from `prox`, as they keep using the session they were created with.
+
+    .. code-block:: python
+
+        prox = ProxmoxAPI("pve.example.com", user="root@pam", password="secret")
+        with record(prox, "session.jsonl.gz"):
+            prox.cluster.resources.get()
+
+    :param prox: the API to record
+    :type prox: ProxmoxAPI
+    :param path: the file to write, gzip compressed if it ends with ".gz"
+    :type path: str
+    :param redact: hide passwords, tickets and tokens in the recording, defaults to True
+    :type redact: bool, optional
+    :return: the recording session, stopped when used as a context manager
+    :rtype: RecordingSession
+    """
+    recorder = RecordingSession(
+        prox._store["session"],
+        path,
+        base_url=prox._store["base_url"],
+        backend=prox._backend_name,
+        redact=redact,
+    )
+    prox._store["session"] = recorder
+    return recorder
+
+
+class Response:
+    def __init__(self, entry, wrapped):
+        self.status_code = entry["s"]
+        # the https backend returns bytes, the command backends return text
+        self.content = entry["c"].encode("utf-8") if wrapped else entry["c"]
+        self.headers = {"content-type": "application/json"}
+        if "r" in entry:
+            self.reason = entry["r"]
+        self.timings = {"server": entry["d"]}
+        self.bytes_sent = None
+
+    @property
+    def text(self):
+        return _content_text(self.content)
+
+    def __str__(self):
+        return f"Response ({self.status_code}) {self.content}"
+
+
+class ReplaySession:
+    def __init__(self, path, speed=None, loop=False):
+        """
+        :param path: the recording to serve, gzip compressed if it ends with ".gz"
+        :type path: str
+        :param speed: replay recorded durations divided by this factor (1 for the recorded
+            latency), None to respond immediately
+        :type speed: float, optional
+        :param loop: start again from the first matching response once they are all used,
+            otherwise ReplayError is raised
+        :type loop: bool, optional
+        """
+        self.speed = speed
+        self.loop = loop
+        self._lock = threading.Lock()
+
+        with _open(path, "r") as f_obj:
+            self.header = json.loads(f_obj.readline())
+            if self.header.get("format") != FORMAT_NAME:
+                raise ReplayError(f"{path} is not a proxmoxer recording")
+            if self.header.get("version", 0) > FORMAT_VERSION:
+                raise ReplayError(
+                    f"{path} uses recording format version {self.header['version']}, "
+                    f"only up to version {FORMAT_VERSION} is supported"
+                )
+            self.base_url = self.header.get("base_url", "")
+            self.wrapped = self.header.get("wrapped", False)
+
+            self._recorded = {}
+            for line in f_obj:
+                if line.strip():
+                    entry = json.loads(line)
+                    key = _match_key(entry["m"], entry["p"], entry.get("q"))
+                    self._recorded.setdefault(key, []).append(Response(entry, self.wrapped))
+        self._queues = {key: deque(responses) for key, responses in self._recorded.items()}
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def request(self, method, url, data=None, params=None, **kwargs):
+        path = url[len(self.base_url) :] if url.startswith(self.base_url) else url
+        key = _match_key(method, path, params)
+
+        with self._lock:
+            queue = self._queues.get(key)
+            if not queue and self.loop and key in self._recorded:
+                queue = self._queues[key] = deque(self._recorded[key])
+            if not queue:
+                raise ReplayError(f"{method} {path} {params or ''} is not in the recording")
+            resp = queue.popleft()
+
+        if self.speed:
+            time.sleep(resp.timings["server"] / self.speed)
+        return resp
+
+    def close(self):
+        pass
+
+
+class ReplaySerializer:
+    def __init__(self, wrapped):
+        self.wrapped = wrapped
+
+    def loads(self, response):
+        try:
+            data = json.loads(response.content)
+        except (UnicodeDecodeError, ValueError):
+            return {"errors": response.content}
+        # an error recorded from the HTTPS API has no "data"
+        return data.get("data") if self.wrapped else data
+
+    def loads_errors(self, response):
+        try:
+            return json.loads(response.text).get("errors")
+        except (UnicodeDecodeError, ValueError):
+            return {"errors": response.content}
+
+
+class Backend:
+    """
+    Serves the responses of a recording made with `record`, for tests and benchmarks of
+    client code which must not depend on a live cluster
+
+    .. code-block:: python
+
+        prox = ProxmoxAPI(backend="replay", recording="session.jsonl.gz", speed=1)
+    """
+
+    def __init__(self, recording, speed=None, loop=False, host=None, service="PVE", lazy=False):
+        # there is no connection to make, `lazy` is accepted so the same options work with
+        # every backend (e.g. in connect_many)
+        self.session = ReplaySession(recording, speed=speed, loop=loop)
+        self.target = host or recording
+
+    def get_session(self):
+        return self.session
+
+    def get_base_url(self):
+        return self.session.base_url
+
+    def get_serializer(self):
+        return ReplaySerializer(self.session.wrapped)
@@ -6,11 +6,19 @@ __license__ = "MIT"
 
 import logging
 import os
+import queue
+import socket
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 
+from proxmoxer import tracing
+from proxmoxer.backends.agent import agent_command
 from proxmoxer.backends.command_base import (
     CommandBaseBackend,
     CommandBaseSession,
     shell_join,
+    upload_shell_command,
 )
 
 logger = logging.getLogger(__name__)
@@ -24,17 +32,71 @@ except ImportError:
     logger.error("Chosen backend requires 'paramiko' module\n")
     sys.exit(1)
 
+# SFTP and upload channels are opened with a large window so writes are not throttled
+# waiting for window adjustments on high bandwidth-delay links
+SFTP_WINDOW_SIZE = 2**27  # 128 MiB
+SFTP_MAX_PACKET_SIZE = 2**15  # 32 KiB, the largest packet sftp-server accepts by default
+UPLOAD_CHUNK_SIZE = 2**20  # read 1 MiB at a time while streaming an upload over stdin
+
 
 class SshParamikoSession(CommandBaseSession):
-    def __init__(self, host, user, password=None, private_key_file=None, port=22, **kwargs):
+    def __init__(
+        self,
+        host,
+        user,
+        password=None,
+        private_key_file=None,
+        port=22,
+        upload_callback=None,
+        lazy=False,
+        **kwargs,
+    ):
         super().__init__(**kwargs)
         self.host = host
         self.user = user
         self.password = password
         self.private_key_file = private_key_file
         self.port = port
+        self.upload_callback = upload_callback
+
+        self._sftp = None
+        self._sftp_lock = threading.Lock()
+        self._connect_lock = threading.Lock()
+
+        # with `lazy`, the connection is made by the first command
+        self._ssh_client = None if lazy else self._connect()
+
+    @property
+    def ssh_client(self):
+        """The SSH connection, opened again if the session was pickled or forked"""
+        if self._ssh_client is None:
+            with self._connect_lock:
+                if self._ssh_client is None:
+                    self._ssh_client = self._connect()
+        return self._ssh_client
+
+    @ssh_client.setter
+    def ssh_client(self, ssh_client):
+        self._ssh_client = ssh_client
+
+    def __getstate__(self):
+        state = super().__getstate__()
+        state["_ssh_client"] = state["_sftp"] = None
+        del state["_sftp_lock"], state["_connect_lock"]
+        return state
+
+    def __setstate__(self, state):
+        super().__setstate__(state)
+        self._sftp_lock = threading.Lock()
+        self._connect_lock = threading.Lock()
 
-        self.ssh_client = self._connect()
+    def _after_fork(self):
+        # the transport's thread did not survive the fork, and closing the connection would
+        # send messages on the parent's socket, so it is only forgotten
+        super()._after_fork()
+        self._ssh_client = self._sftp = None
+        self._sftp_lock = threading.Lock()
+        self._connect_lock = threading.Lock()
 
     def _connect(self):
         ssh_client = paramiko.SSHClient()
@@ -55,6 +117,9 @@ class SshParamikoSession(CommandBaseSession):
             timeout=self.timeout,
             port=self.port,
         )
+        # a channel close followed by the next channel open would otherwise be held back by
+        # Nagle's algorithm until the server's delayed ACK, adding ~40ms to every command
+        ssh_client.get_transport().sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
 
         return ssh_client
 
@@ -65,10 +130,140 @@ class SshParamikoSession(CommandBaseSession):
         stderr = session.makefile_stderr("rb", -1).read().decode()
         return stdout, stderr
 
-    def upload_file_obj(self, file_obj, remote_path):
-        sftp = self.ssh_client.open_sftp()
-        sftp.putfo(file_obj, remote_path)
-        sftp.close()
+    @contextmanager
+    def _exec_stream(self, cmd):
+        session = self.ssh_client.get_transport().open_session()
+        session.exec_command(shell_join(cmd))
+        try:
+            yield session.makefile("rb", -1), lambda: session.makefile_stderr(
+                "rb", -1
+            ).read().decode()
+        finally:
+            session.close()
+
+    def _exec_upload(self, cmd, file_obj):
+        # the file is streamed over the command's stdin, with the same window as SFTP
+        session = self.ssh_client.get_transport().open_session(
+            window_size=SFTP_WINDOW_SIZE, max_packet_size=SFTP_MAX_PACKET_SIZE
+        )
+        # a stalled send or read raises socket.timeout instead of blocking forever
+        session.settimeout(self.upload_timeout)
+        callback = self.upload_callback
+        total = self._upload_size(file_obj) if callback is not None else 0
+        try:
+            session.exec_command(upload_shell_command(cmd))
+            sent = 0
+            try:
+                for chunk in iter(lambda: file_obj.read(UPLOAD_CHUNK_SIZE), b""):
+                    session.sendall(chunk)
+                    sent += len(chunk)
+                    if callback is not None:
+                        callback(sent, total)
+            except OSError as e:
+                # the remote command exited early, its stderr explains why
+                logger.debug(f"upload stream to {self.host} closed early: {e}")
+            session.shutdown_write()
+            stdout = session.makefile("rb", -1).read().decode()
+            stderr = session.makefile_stderr("rb", -1).read().decode()
+            return stdout, stderr
+        finally:
+            session.close()
+
+    def _open_agent_channel(self):
+        channel = self.ssh_client.get_transport().open_session()
+        channel.exec_command(shell_join(agent_command()))
+        return channel.makefile_stdin("wb"), channel.makefile("rb"), channel.close
+
+    def _open_sftp(self):
+        return paramiko.SFTPClient.from_transport(
+            self.ssh_client.get_transport(),
+            window_size=SFTP_WINDOW_SIZE,
+            max_packet_size=SFTP_MAX_PACKET_SIZE,
+        )
+
+    def _get_sftp(self):
+        """Return the session's SFTP client, (re)opening it if needed"""
+        with self._sftp_lock:
+            if self._sftp is None or self._sftp.get_channel().closed:
+                self._sftp = self._open_sftp()
+            return self._sftp
+
+    @staticmethod
+    def _upload_size(file_obj):
+        """Bytes left to read from `file_obj`, for progress callbacks"""
+        start = file_obj.tell()
+        size = file_obj.seek(0, os.SEEK_END) - start
+        file_obj.seek(start)
+        return size
+
+    def _putfo(self, sftp, file_obj, remote_path, callback=None):
+        callback = callback or self.upload_callback
+        # only needed to report progress, avoid the seeks otherwise
+        file_size = self._upload_size(file_obj) if callback is not None else 0
+
+        # putfo uses pipelined writes, so the transfer is not bound by round trips
+        return sftp.putfo(file_obj, remote_path, file_size=file_size, callback=callback)
+
+    def upload_file_obj(self, file_obj, remote_path, callback=None):
+        """
+        Upload a file object to the remote host over the session's persistent SFTP channel
+
+        :param file_obj: the file object to upload (read from its current position)
+        :type file_obj: file object
+        :param remote_path: the destination path on the remote host
+        :type remote_path: str
+        :param callback: called with (bytes transferred, total bytes) as the upload progresses,
+            defaults to the session's ``upload_callback``
+        :type callback: Callable[[int, int], None], optional
+        """
+        with tracing.span("proxmoxer.sftp.upload", **{"file.path": remote_path}):
+            self._putfo(self._get_sftp(), file_obj, remote_path, callback)
+
+    def upload_file_objs(self, uploads, max_workers=4, callback=None):
+        """
+        Upload several file objects concurrently, each worker using its own SFTP channel
+        over the session's single SSH connection
+
+        :param uploads: pairs of (file object, remote path) to upload
+        :type uploads: Iterable[Tuple[file object, str]]
+        :param max_workers: the maximum number of concurrent uploads, defaults to 4
+        :type max_workers: int, optional
+        :param callback: called with (bytes transferred, total bytes) for each file as it
+            progresses, defaults to the session's ``upload_callback``
+        :type callback: Callable[[int, int], None], optional
+        """
+        pending = queue.SimpleQueue()
+        for upload in uploads:
+            pending.put(upload)
+
+        def worker():
+            sftp = self._open_sftp()
+            try:
+                while True:
+                    try:
+                        file_obj, remote_path = pending.get_nowait()
+                    except queue.Empty:
+                        return
+                    with tracing.span("proxmoxer.sftp.upload", **{"file.path": remote_path}):
+                        self._putfo(sftp, file_obj, remote_path, callback)
+            finally:
+                sftp.close()
+
+        num_workers = min(max_workers, pending.qsize())
+        with ThreadPoolExecutor(max_workers=max(num_workers, 1)) as executor:
+            futures = [executor.submit(tracing.wrap(worker)) for _ in range(num_workers)]
+        for future in futures:
+            # raise the first error encountered by any of the workers
+            future.result()
+
+    def close(self):
+        super().close()
+        with self._sftp_lock:
+            if self._sftp is not None:
+                self._sftp.close()
+                self._sftp = None
+        if self._ssh_client is not None:
+            self._ssh_client.close()
 
 
 class Backend(CommandBaseBackend):
@@ -0,0 +1,187 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+import argparse
+import json
+
+from proxmoxer.bench.runner import (
+    CONCURRENCY_MODES,
+    InventoryWorkload,
+    TaskWorkload,
+    UploadWorkload,
+    discover_nodes,
+    run_benchmark,
+)
+from proxmoxer.cli.arguments import add_connection_arguments, api_kwargs_from_args
+from proxmoxer.core import ProxmoxAPI
+
+WORKLOAD_NAMES = ("inventory", "task", "upload")
+
+
+def parse_mix(value):
+    """Parse a workload mix such as "inventory=8,task=1" into {name: weight}"""
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in WORKLOAD_NAMES:
+            raise argparse.ArgumentTypeError(
+                f"unknown workload '{name}', choose from {', '.join(WORKLOAD_NAMES)}"
+            )
+        try:
+            mix[name] = float(weight) if weight else 1.0
+        except ValueError as e:
+            raise argparse.ArgumentTypeError(f"invalid weight for {name}: '{weight}'") from e
+    return mix
+
+
+def parse_pair(value):
+    """Parse NODE:NAME arguments"""
+    node, sep, name = value.partition(":")
+    if not sep or not node or not name:
+        raise argparse.ArgumentTypeError(f"expected NODE:NAME, got '{value}'")
+    return node, name
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m proxmoxer.bench",
+        description="Measure client-side throughput and latency of workloads against a cluster",
+    )
+    parser.add_argument("host", nargs="?", help="the host to connect to (not needed with --fake)")
+
+    connection = parser.add_argument_group("connection")
+    add_connection_arguments(connection)
+    connection.add_argument(
+        "--fake", action="store_true", help="benchmark a local fake PVE API server instead"
+    )
+    connection.add_argument(
+        "--fake-latency", type=float, default=0.0, help="seconds the fake server adds per request"
+    )
+
+    run = parser.add_argument_group("run")
+    run.add_argument(
+        "--mix",
+        type=parse_mix,
+        default={"inventory": 1.0},
+        help="workloads and their weights, e.g. inventory=8,task=1,upload=1 (default inventory)",
+    )
+    run.add_argument("--concurrency", choices=CONCURRENCY_MODES, default="thread")
+    run.add_argument("--workers", type=int, default=4, help="concurrent workers (default 4)")
+    limit = run.add_mutually_exclusive_group()
+    limit.add_argument("--duration", type=float, help="seconds to run for")
+    limit.add_argument("--operations", type=int, help="operations to run (default 100)")
+    run.add_argument(
+        "--client-per-worker",
+        action="store_true",
+        help="give each thread/asyncio worker its own client instead of sharing one",
+    )
+    run.add_argument("--seed", type=int, help="seed for the choice of operations")
+    run.add_argument("--json", action="store_true", help="print the summary as JSON")
+
+    workloads = parser.add_argument_group("workloads")
+    workloads.add_argument(
+        "--task-vm",
+        type=parse_pair,
+        action="append",
+        default=[],
+        metavar="NODE:VMID",
+        help="VM the task workload may start and stop, may be repeated",
+    )
+    workloads.add_argument(
+        "--upload-storage",
+        type=parse_pair,
+        metavar="NODE:STORAGE",
+        help="storage the upload workload writes to",
+    )
+    workloads.add_argument(
+        "--upload-size", type=int, default=2**20, help="bytes per upload (default 1 MiB)"
+    )
+    workloads.add_argument(
+        "--polling-interval",
+        type=float,
+        default=0.1,
+        help="seconds between task status checks (default 0.1)",
+    )
+
+    args = parser.parse_args(argv)
+    if args.host is None and not args.fake:
+        parser.error("a host is needed unless --fake is used")
+    if not args.fake:
+        if "task" in args.mix and not args.task_vm:
+            parser.error("the task workload needs --task-vm")
+        if "upload" in args.mix and args.upload_storage is None:
+            parser.error("the upload workload needs --upload-storage")
+    return args
+
+
+def build_workloads(args, prox):
+    workloads = []
+    weights = []
+    for name, weight in args.mix.items():
+        if name == "inventory":
+            workloads.append(InventoryWorkload(discover_nodes(prox)))
+        elif name == "task":
+            vms = [(node, int(vmid)) for node, vmid in args.task_vm]
+            workloads.append(TaskWorkload(vms, polling_interval=args.polling_interval))
+        else:
+            node, storage = args.upload_storage
+            workloads.append(
+                UploadWorkload(
+                    node, storage, size=args.upload_size, polling_interval=args.polling_interval
+                )
+            )
+        weights.append(weight)
+    return workloads, weights
+
+
+def main(argv=None):
+    args = parse_args(argv)
+
+    server = None
+    if args.fake:
+        # imported here so the benchmark does not depend on the testing package otherwise
+        from proxmoxer.testing import FakePVEServer
+
+        server = FakePVEServer(latency=args.fake_latency, task_duration=0.1).start()
+        args.host = server.address
+        args.user = args.user or server.api.username
+        args.password = args.password or server.api.password
+        args.no_verify_ssl = True
+        if not args.task_vm:
+            args.task_vm = [(vm["node"], vm["vmid"]) for vm in server.cluster.vms.values()]
+        if args.upload_storage is None:
+            args.upload_storage = (server.cluster.nodes[0], server.cluster.storages[0])
+
+    try:
+        api_kwargs = api_kwargs_from_args(args)
+        prox = ProxmoxAPI(**api_kwargs)
+        try:
+            workloads, weights = build_workloads(args, prox)
+        finally:
+            prox.close()
+
+        result = run_benchmark(
+            api_kwargs,
+            workloads,
+            weights,
+            concurrency=args.concurrency,
+            workers=args.workers,
+            duration=args.duration,
+            operations=args.operations,
+            client_per_worker=args.client_per_worker,
+            seed=args.seed,
+        )
+    finally:
+        if server is not None:
+            server.stop()
+
+    if args.json:
+        print(json.dumps(result.summary(), indent=2))
+    else:
+        print(result.format_table())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,423 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+import asyncio
+import io
+import itertools
+import math
+import os
+import random
+import time
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from proxmoxer.core import ProxmoxAPI, ResourceException
+from proxmoxer.tools.tasks import Tasks
+
+CONCURRENCY_MODES = ("thread", "process", "asyncio")
+
+# one timed operation: its start relative to the run, wall seconds, seconds of CPU used by the
+# thread running it, and a short description of the error (None if it succeeded)
+Sample = namedtuple("Sample", ["workload", "start", "latency", "cpu", "error"])
+
+
+class InventoryWorkload:
+    """Read-only requests as made by inventory and monitoring tools, one GET per operation"""
+
+    name = "inventory"
+
+    def __init__(self, nodes):
+        """
+        :param nodes: the nodes to query, e.g. from `discover_nodes`
+        :type nodes: List[str]
+        """
+        self.nodes = list(nodes)
+
+    def run(self, prox, rng):
+        choice = rng.randrange(4)
+        if choice == 0 or not self.nodes:
+            return prox.cluster.resources.get(type="vm")
+        node = rng.choice(self.nodes)
+        if choice == 1:
+            return prox.nodes.get()
+        if choice == 2:
+            return prox.nodes(node).status.get()
+        return prox.nodes(node).qemu.get()
+
+
+class TaskWorkload:
+    """
+    Starts or stops one of the given VMs, whichever changes its state, and waits for the task
+
+    Only pass VMs which may be started and stopped at will.
+    """
+
+    name = "task"
+
+    def __init__(self, vms, polling_interval=0.1, timeout=300):
+        """
+        :param vms: the (node, vmid) pairs to use
+        :type vms: List[Tuple[str, int]]
+        :param polling_interval: seconds between task status checks, defaults to 0.1
+        :type polling_interval: float, optional
+        :param timeout: seconds to wait for a task, defaults to 300
+        :type timeout: float, optional
+        """
+        if not vms:
+            raise ValueError("the task workload needs at least one VM")
+        self.vms = list(vms)
+        self.polling_interval = polling_interval
+        self.timeout = timeout
+
+    def run(self, prox, rng):
+        node, vmid = rng.choice(self.vms)
+        vm = prox.nodes(node).qemu(vmid)
+        action = "stop" if vm.status.current.get()["status"] == "running" else "start"
+        upid = vm.status(action).post()
+        status = Tasks.blocking_status(
+            prox, upid, timeout=self.timeout, polling_interval=self.polling_interval
+        )
+        if status is None:
+            raise TimeoutError(f"task {upid} did not finish in {self.timeout} seconds")
+        if status.get("exitstatus") != "OK":
+            raise RuntimeError(f"task {upid} failed: {status.get('exitstatus')}")
+        return status
+
+
+class UploadWorkload:
+    """Uploads a generated file to a storage and waits for the upload task"""
+
+    name = "upload"
+
+    def __init__(self, node, storage, size=2**20, content="iso", polling_interval=0.1):
+        """
+        :param node: the node to upload to
+        :type node: str
+        :param storage: the storage to upload to
+        :type storage: str
+        :param size: the size of each upload in bytes, defaults to 1 MiB
+        :type size: int, optional
+        :param content: the storage content type, defaults to "iso"
+        :type content: str, optional
+        :param polling_interval: seconds between task status checks, defaults to 0.1
+        :type polling_interval: float, optional
+        """
+        self.node = node
+        self.storage = storage
+        self.size = size
+        self.content = content
+        self.polling_interval = polling_interval
+        self._payload = None
+
+    def run(self, prox, rng):
+        if self._payload is None:
+            # not taken from rng, so seeded runs pick the same operations in every mode
+            self._payload = os.urandom(min(self.size, 2**16))
+        repeats = math.ceil(self.size / len(self._payload))
+        file_obj = io.BytesIO((self._payload * repeats)[: self.size])
+        file_obj.name = f"proxmoxer-bench-{rng.getrandbits(32):08x}.iso"
+
+        upid = (
+            prox.nodes(self.node)
+            .storage(self.storage)
+            .upload.post(content=self.content, filename=file_obj)
+        )
+        return Tasks.blocking_status(prox, upid, polling_interval=self.polling_interval)
+
+
+def discover_nodes(prox):
+    """Return the names of the online nodes, to build an InventoryWorkload"""
+    return [node["node"] for node in prox.nodes.get() if node.get("status", "online") == "online"]
+
+
+def _describe_error(error):
+    if isinstance(error, ResourceException):
+        return f"HTTP {error.status_code}"
+    return type(error).__name__
+
+
+def _measure(prox, workload, rng, run_start):
+    start = time.monotonic()
+    cpu_start = time.thread_time()
+    error = None
+    try:
+        workload.run(prox, rng)
+    except Exception as e:  # pylint: disable=broad-except
+        error = _describe_error(e)
+    return Sample(
+        workload.name,
+        start - run_start,
+        time.monotonic() - start,
+        time.thread_time() - cpu_start,
+        error,
+    )
+
+
+class _Plan:
+    """Decides which workload runs next and when a worker stops"""
+
+    def __init__(self, workloads, weights, duration, operations):
+        self.workloads = list(workloads)
+        self.weights = list(weights)
+        self.duration = duration
+        self.operations = operations
+
+    def pick(self, rng):
+        return rng.choices(self.workloads, self.weights)[0]
+
+    def iterations(self, start, share):
+        """Yield once for each operation a worker should run"""
+        counter = itertools.count() if share is None else range(share)
+        for _ in counter:
+            if self.duration is not None and time.monotonic() - start >= self.duration:
+                return
+            yield
+
+
+def _shares(operations, workers):
+    if operations is None:
+        return [None] * workers
+    return [operations // workers + (i < operations % workers) for i in range(workers)]
+
+
+def _run_worker(prox, plan, share, seed, run_start):
+    rng = random.Random(seed)
+    return [
+        _measure(prox, plan.pick(rng), rng, run_start) for _ in plan.iterations(run_start, share)
+    ]
+
+
+def _run_process_worker(api_kwargs, plan, share, seed, run_start):
+    # each process needs its own client, the monotonic clock is shared by all processes
+    prox = ProxmoxAPI(**api_kwargs)
+    try:
+        return _run_worker(prox, plan, share, seed, run_start)
+    finally:
+        prox.close()
+
+
+async def _run_asyncio(clients, plan, shares, seeds, run_start):
+    loop = asyncio.get_running_loop()
+
+    async def worker(prox, share, seed):
+        rng = random.Random(seed)
+        samples = []
+        for _ in plan.iterations(run_start, share):
+            # proxmoxer is synchronous, so requests run in the executor as an asyncio
+            # application would call it
+            sample = await loop.run_in_executor(
+                executor, _measure, prox, plan.pick(rng), rng, run_start
+            )
+            samples.append(sample)
+        return samples
+
+    with ThreadPoolExecutor(max_workers=len(shares)) as executor:
+        results = await asyncio.gather(
+            *(
+                worker(clients[i % len(clients)], share, seed)
+                for i, (share, seed) in enumerate(zip(shares, seeds))
+            )
+        )
+    return list(itertools.chain.from_iterable(results))
+
+
+def run_benchmark(
+    api_kwargs,
+    workloads,
+    weights=None,
+    concurrency="thread",
+    workers=4,
+    duration=None,
+    operations=None,
+    client_per_worker=False,
+    seed=None,
+):
+    """
+    Run workloads against a cluster from several workers and time every operation
+
+    :param api_kwargs: arguments for ProxmoxAPI, each process (or worker, with
+        `client_per_worker`) creates its own client from them
+    :type api_kwargs: dict
+    :param workloads: the workloads to pick operations from
+    :type workloads: List[InventoryWorkload | TaskWorkload | UploadWorkload]
+    :param weights: relative frequency of each workload, defaults to equal weights
+    :type weights: List[float], optional
+    :param concurrency: "thread", "process" or "asyncio", defaults to "thread"
+    :type concurrency: str, optional
+    :param workers: the number of concurrent workers, defaults to 4
+    :type workers: int, optional
+    :param duration: stop after this many seconds
+    :type duration: float, optional
+    :param operations: stop after this many operations in total, defaults to 100 if
+        `duration` is not given either
+    :type operations: int, optional
+    :param client_per_worker: give each thread or asyncio worker its own client instead of
+        sharing one, defaults to False
+    :type client_per_worker: bool, optional
+    :param seed: seed for the choice of operations, to make runs repeatable
+    :type seed: int, optional
+    :return: the timed operations
+    :rtype: BenchmarkResult
+    """
+    if concurrency not in CONCURRENCY_MODES:
+        raise ValueError(f"concurrency must be one of {', '.join(CONCURRENCY_MODES)}")
+    if duration is None and operations is None:
+        operations = 100
+    plan = _Plan(workloads, weights or [1] * len(workloads), duration, operations)
+    shares = _shares(operations, workers)
+    seeds = [random.Random(seed).getrandbits(64) + i for i in range(workers)]
+
+    clients = []
+    if concurrency != "process":
+        num_clients = workers if client_per_worker else 1
+        clients = [ProxmoxAPI(**api_kwargs) for _ in range(num_clients)]
+
+    run_start = time.monotonic()
+    try:
+        if concurrency == "thread":
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(
+                        _run_worker, clients[i % len(clients)], plan, share, s, run_start
+                    )
+                    for i, (share, s) in enumerate(zip(shares, seeds))
+                ]
+                samples = list(itertools.chain.from_iterable(f.result() for f in futures))
+        elif concurrency == "asyncio":
+            samples = asyncio.run(_run_asyncio(clients, plan, shares, seeds, run_start))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                futures = [
+                    executor.submit(_run_process_worker, api_kwargs, plan, share, s, run_start)
+                    for share, s in zip(shares, seeds)
+                ]
+                samples = list(itertools.chain.from_iterable(f.result() for f in futures))
+    finally:
+        for client in clients:
+            client.close()
+
+    return BenchmarkResult(
+        samples,
+        wall_time=time.monotonic() - run_start,
+        concurrency=concurrency,
+        workers=workers,
+    )
+
+
+def percentile(sorted_values, fraction):
+    """
+    Nearest-rank percentile of already sorted values
+
+    :param sorted_values: the values, in ascending order
+    :type sorted_values: List[float]
+    :param fraction: the percentile as a fraction, e.g. 0.99
+    :type fraction: float
+    :rtype: float
+    """
+    if not sorted_values:
+        return None
+    rank = max(math.ceil(fraction * len(sorted_values)), 1)
+    return sorted_values[rank - 1]
+
+
+class BenchmarkResult:
+    """The timed operations of a benchmark run"""
+
+    def __init__(self, samples, wall_time, concurrency="thread", workers=1):
+        self.samples = samples
+        self.wall_time = wall_time
+        self.concurrency = concurrency
+        self.workers = workers
+
+    def _summarize(self, samples):
+        latencies = sorted(s.latency for s in samples)
+        errors = Counter(s.error for s in samples if s.error is not None)
+        count = len(samples)
+        return {
+            "operations": count,
+            "errors": sum(errors.values()),
+            "error_rate": sum(errors.values()) / count if count else 0.0,
+            "error_types": dict(errors),
+            "throughput": count / self.wall_time if self.wall_time else 0.0,
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "max": latencies[-1] if latencies else None,
+            "cpu_per_operation": sum(s.cpu for s in samples) / count if count else None,
+        }
+
+    def summary(self):
+        """
+        Aggregate the samples for each workload and in total
+
+        Latencies are in seconds, throughput in operations per second. CPU is the time used by
+        the threads running the operations, so it includes the client's own work (encoding,
+        TLS, parsing) but not that of the server when it runs in the same process.
+
+        :return: {"total": {...}, "workloads": {name: {...}}}
+        :rtype: dict
+        """
+        by_workload = {}
+        for sample in self.samples:
+            by_workload.setdefault(sample.workload, []).append(sample)
+        return {
+            "concurrency": self.concurrency,
+            "workers": self.workers,
+            "wall_time": self.wall_time,
+            "total": self._summarize(self.samples),
+            "workloads": {name: self._summarize(s) for name, s in sorted(by_workload.items())},
+        }
+
+    def format_table(self):
+        """Return the summary as a text table"""
+
+        def ms(value):
+            return "-" if value is None else f"{value * 1000:.1f}"
+
+        summary = self.summary()
+        header = (
+            "workload",
+            "ops",
+            "ops/s",
+            "errors",
+            "p50 ms",
+            "p95 ms",
+            "p99 ms",
+            "max ms",
+            "cpu ms/op",
+        )
+        rows = []
+        for name, data in list(summary["workloads"].items()) + [("total", summary["total"])]:
+            rows.append(
+                (
+                    name,
+                    str(data["operations"]),
+                    f"{data['throughput']:.1f}",
+                    f"{data['errors']} ({data['error_rate']:.1%})",
+                    ms(data["p50"]),
+                    ms(data["p95"]),
+                    ms(data["p99"]),
+                    ms(data["max"]),
+                    ms(data["cpu_per_operation"]),
+                )
+            )
+        widths = [max(len(row[i]) for row in [header] + rows) for i in range(len(header))]
+        lines = [
+            f"{summary['workers']} {summary['concurrency']} workers, "
+            f"{summary['wall_time']:.2f}s",
+            "  ".join(
+                h.ljust(w) if i == 0 else h.rjust(w) for i, (h, w) in enumerate(zip(header, widths))
+            ),
+        ]
+        for row in rows:
+            lines.append(
+                "  ".join(
+                    v.ljust(w) if i == 0 else v.rjust(w)
+                    for i, (v, w) in enumerate(zip(row, widths))
+                )
+            )
+        errors = summary["total"]["error_types"]
+        if errors:
+            lines.append("errors: " + ", ".join(f"{k}: {v}" for k, v in sorted(errors.items())))
+        return "\n".join(lines)
@@ -0,0 +1,199 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+import argparse
+import json
+import logging
+import os
+import signal
+import subprocess  # nosec B404
+import sys
+import time
+
+from proxmoxer.cli.arguments import add_connection_arguments, api_kwargs_from_args
+from proxmoxer.cli.daemon import (
+    Daemon,
+    DaemonClient,
+    DaemonError,
+    DaemonNotRunning,
+    default_socket_path,
+)
+
+# the pvesh names are accepted too
+METHODS = {
+    "get": "GET",
+    "post": "POST",
+    "create": "POST",
+    "put": "PUT",
+    "set": "PUT",
+    "delete": "DELETE",
+}
+
+DAEMON_START_TIMEOUT = 10
+
+
+def parse_params(pairs):
+    """Parse KEY=VALUE request parameters, a repeated KEY gives a list"""
+    params = {}
+    for pair in pairs:
+        key, sep, value = pair.partition("=")
+        if not sep or not key:
+            raise ValueError(f"expected KEY=VALUE, got '{pair}'")
+        if key in params:
+            if not isinstance(params[key], list):
+                params[key] = [params[key]]
+            params[key].append(value)
+        else:
+            params[key] = value
+    return params
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="proxmoxer",
+        description=(
+            "Make Proxmox API requests and print the JSON response. Requests go through the "
+            "daemon when one is running, reusing its authenticated connections."
+        ),
+    )
+    parser.add_argument(
+        "--socket",
+        default=default_socket_path(),
+        help="unix socket of the daemon (default $PROXMOXER_SOCKET or one per user)",
+    )
+
+    connection = parser.add_argument_group("connection")
+    connection.add_argument(
+        "--host",
+        default=os.environ.get("PROXMOXER_HOST"),
+        help="the host to connect to (default $PROXMOXER_HOST)",
+    )
+    add_connection_arguments(connection)
+
+    commands = parser.add_subparsers(dest="command", metavar="COMMAND", required=True)
+    for name in METHODS:
+        command = commands.add_parser(name, help=f"make a {METHODS[name]} request")
+        command.add_argument("path", help="API path, e.g. /nodes/pve1/qemu")
+        command.add_argument("params", nargs="*", metavar="KEY=VALUE")
+        command.add_argument("--pretty", action="store_true", help="indent the JSON output")
+        command.add_argument(
+            "--no-daemon", action="store_true", help="make the request from this process"
+        )
+
+    daemon = commands.add_parser("daemon", help="start, stop or check the daemon")
+    daemon.add_argument("action", choices=("start", "stop", "status"))
+    daemon.add_argument(
+        "--idle-timeout",
+        type=float,
+        default=900,
+        help="stop after this many seconds without requests, 0 for never (default 900)",
+    )
+    daemon.add_argument(
+        "--detach", action="store_true", help="run in the background and return once it is ready"
+    )
+    daemon.add_argument("-v", "--verbose", action="store_true", help="log connections")
+
+    args = parser.parse_args(argv)
+    if args.command != "daemon":
+        try:
+            args.params = parse_params(args.params)
+        except ValueError as e:
+            parser.error(str(e))
+    return args
+
+
+def request(args):
+    method = METHODS[args.command]
+    api_kwargs = api_kwargs_from_args(args)
+    data = None
+    sent = False
+    if not args.no_daemon:
+        try:
+            with DaemonClient(args.socket) as client:
+                data = client.request(api_kwargs, method, args.path, args.params)
+            sent = True
+        except DaemonNotRunning:
+            pass
+
+    if not sent:
+        # pylint:disable=import-outside-toplevel
+        from proxmoxer.core import ProxmoxAPI
+
+        prox = ProxmoxAPI(**api_kwargs)
+        try:
+            data = getattr(prox(args.path.strip("/")), method.lower())(**args.params)
+        finally:
+            prox.close()
+
+    print(json.dumps(data, indent=2 if args.pretty else None))
+
+
+def start_daemon(args):
+    idle_timeout = args.idle_timeout or None
+    if args.detach:
+        command = [sys.executable, "-m", "proxmoxer.cli", "--socket", args.socket, "daemon"]
+        command += ["start", "--idle-timeout", str(args.idle_timeout)]
+        # re-runs this CLI with the current interpreter, never through a shell
+        process = subprocess.Popen(  # pylint: disable=consider-using-with  # nosec B603
+            command,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            start_new_session=True,
+        )
+        client = DaemonClient(args.socket)
+        deadline = time.monotonic() + DAEMON_START_TIMEOUT
+        while not client.is_running():
+            if process.poll() is not None or time.monotonic() > deadline:
+                raise DaemonError(f"the daemon did not start listening on {args.socket}")
+            time.sleep(0.05)
+        client.close()
+        print(f"Daemon {process.pid} listening on {args.socket}")
+        return
+
+    logging.basicConfig(format="%(asctime)s %(message)s")
+    if args.verbose:
+        logging.getLogger("proxmoxer.cli.daemon").setLevel(logging.INFO)
+    daemon = Daemon(args.socket, idle_timeout=idle_timeout)
+    signal.signal(signal.SIGTERM, lambda *_: daemon.stop())
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        daemon.stop()
+
+
+def daemon_command(args):
+    if args.action == "start":
+        start_daemon(args)
+        return
+
+    with DaemonClient(args.socket) as client:
+        if args.action == "stop":
+            client.shutdown()
+        else:
+            print(json.dumps(client.ping()))
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        if args.command == "daemon":
+            daemon_command(args)
+        else:
+            request(args)
+    except DaemonError as e:
+        print(f"proxmoxer: {e}", file=sys.stderr)
+        sys.exit(1)
+    except Exception as e:
+        # pylint:disable=import-outside-toplevel
+        from proxmoxer.core import ResourceException
+
+        if not isinstance(e, ResourceException):
+            raise
+        print(f"proxmoxer: {e}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
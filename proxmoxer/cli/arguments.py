@@ -0,0 +1,76 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+import os
+
+
+def parse_value(value):
+    """Convert a --option value to the type a backend expects"""
+    if value.lower() in ("true", "false"):
+        return value.lower() == "true"
+    for convert in (int, float):
+        try:
+            return convert(value)
+        except ValueError:
+            pass
+    return value
+
+
+def add_connection_arguments(group):
+    """Add the options describing how to connect to a cluster, read by `api_kwargs_from_args`
+
+    Secrets (and the other options) default to $PROXMOXER_* environment variables, so they do
+    not need to be passed on the command line.
+    """
+    group.add_argument(
+        "--backend",
+        default=os.environ.get("PROXMOXER_BACKEND", "https"),
+        help="backend to use (default $PROXMOXER_BACKEND or https)",
+    )
+    group.add_argument("--service", default=os.environ.get("PROXMOXER_SERVICE", "PVE"))
+    group.add_argument("--port", type=int, default=os.environ.get("PROXMOXER_PORT"))
+    group.add_argument(
+        "--user", default=os.environ.get("PROXMOXER_USER"), help="defaults to $PROXMOXER_USER"
+    )
+    group.add_argument(
+        "--password",
+        default=os.environ.get("PROXMOXER_PASSWORD"),
+        help="defaults to $PROXMOXER_PASSWORD",
+    )
+    group.add_argument(
+        "--token-name",
+        default=os.environ.get("PROXMOXER_TOKEN_NAME"),
+        help="defaults to $PROXMOXER_TOKEN_NAME",
+    )
+    group.add_argument(
+        "--token-value",
+        default=os.environ.get("PROXMOXER_TOKEN_VALUE"),
+        help="defaults to $PROXMOXER_TOKEN_VALUE",
+    )
+    group.add_argument("--no-verify-ssl", action="store_true")
+    group.add_argument(
+        "--option",
+        action="append",
+        default=[],
+        metavar="KEY=VALUE",
+        help="other ProxmoxAPI/backend argument (e.g. timeout=10), may be repeated",
+    )
+
+
+def api_kwargs_from_args(args):
+    """Build the ProxmoxAPI arguments from the options added by `add_connection_arguments`"""
+    kwargs = {"host": args.host, "backend": args.backend, "service": args.service}
+    if kwargs["host"] is None:
+        del kwargs["host"]
+    for name in ("port", "user", "password", "token_name", "token_value"):
+        if getattr(args, name) is not None:
+            kwargs[name] = getattr(args, name)
+    if "port" in kwargs:
+        kwargs["port"] = int(kwargs["port"])
+    if args.no_verify_ssl:
+        kwargs["verify_ssl"] = False
+    for option in args.option:
+        key, _, value = option.partition("=")
+        kwargs[key.replace("-", "_")] = parse_value(value)
+    return kwargs
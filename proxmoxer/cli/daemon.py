@@ -0,0 +1,382 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+import json
+import logging
+import os
+import socket
+import socketserver
+import stat
+import struct
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+logger.setLevel(level=logging.WARNING)
+
+
+class DaemonError(Exception):
+    pass
+
+
+class DaemonNotRunning(DaemonError):
+    pass
+
+
+def default_socket_path():
+    """The socket used when none is given: $PROXMOXER_SOCKET, else one per user in
+    $XDG_RUNTIME_DIR (or the temporary directory)
+
+    :return: path of the unix socket
+    :rtype: str
+    """
+    if os.environ.get("PROXMOXER_SOCKET"):
+        return os.environ["PROXMOXER_SOCKET"]
+    directory = os.environ.get("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+    return os.path.join(directory, f"proxmoxer-{os.getuid()}.sock")
+
+
+def connection_key(api_kwargs):
+    """Clients are shared between requests with the same ProxmoxAPI arguments"""
+    return json.dumps(api_kwargs, sort_keys=True, default=str)
+
+
+def _jsonable(value):
+    # error contents are sometimes the raw response body
+    if isinstance(value, bytes):
+        return value.decode("utf-8", errors="replace")
+    return str(value)
+
+
+def _check_owner(path):
+    """Refuse sockets of other users, they could be used to capture credentials"""
+    try:
+        info = os.stat(path)
+    except FileNotFoundError as e:
+        raise DaemonNotRunning(f"no daemon is listening on {path}") from e
+    if not stat.S_ISSOCK(info.st_mode):
+        raise DaemonError(f"{path} is not a socket")
+    if info.st_uid != os.getuid():
+        raise DaemonError(f"{path} is owned by another user")
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        if not self.server.daemon.peer_allowed(self.request):
+            logger.warning("Refused a connection from another user")
+            return
+        for line in self.rfile:
+            try:
+                message = json.loads(line)
+            except ValueError:
+                response = {"ok": False, "error": {"type": "DaemonError", "message": "bad message"}}
+            else:
+                response = self.server.daemon.handle(message)
+            self.wfile.write(json.dumps(response, default=_jsonable).encode("utf-8") + b"\n")
+            self.wfile.flush()
+
+
+class _Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+class Daemon:
+    """
+    Keeps authenticated ProxmoxAPI clients (and their connection pools) alive behind a unix
+    socket, so short-lived processes can make requests through `DaemonClient` without paying
+    for imports, TLS handshakes and logins each time.
+
+    Clients are created on first use for each distinct set of ProxmoxAPI arguments. The socket
+    is only accessible to the user running the daemon.
+
+    .. code-block:: python
+
+        with Daemon(idle_timeout=900) as daemon:
+            daemon.serve_forever()
+    """
+
+    def __init__(self, socket_path=None, idle_timeout=None):
+        """
+        :param socket_path: unix socket to listen on, defaults to `default_socket_path()`
+        :type socket_path: Optional[str]
+        :param idle_timeout: stop after this many seconds without requests, defaults to never
+        :type idle_timeout: Optional[float]
+        """
+        self.socket_path = socket_path or default_socket_path()
+        self.idle_timeout = idle_timeout
+        self.stats = {"requests": 0, "errors": 0}
+        self._clients = {}
+        self._client_locks = {}
+        self._lock = threading.Lock()
+        self._last_activity = time.monotonic()
+        self._stopped = threading.Event()
+        self._closed = threading.Event()
+        self._server = None
+        self._threads = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def _bind(self):
+        if os.path.exists(self.socket_path):
+            _check_owner(self.socket_path)
+            try:
+                DaemonClient(self.socket_path, timeout=1).ping()
+            except (DaemonNotRunning, OSError):
+                # left behind by a daemon which did not stop cleanly
+                os.unlink(self.socket_path)
+            else:
+                raise DaemonError(f"a daemon is already listening on {self.socket_path}")
+
+        old_umask = os.umask(0o177)
+        try:
+            server = _Server(self.socket_path, _Handler)
+        finally:
+            os.umask(old_umask)
+        server.daemon = self
+        return server
+
+    def start(self):
+        """Listen on the socket and handle requests in a background thread"""
+        self._server = self._bind()
+        # the poll interval is how long stopping can take
+        serve = threading.Thread(
+            target=self._server.serve_forever, kwargs={"poll_interval": 0.1}, daemon=True
+        )
+        self._threads = [serve]
+        if self.idle_timeout is not None:
+            self._threads.append(threading.Thread(target=self._watch_idle, daemon=True))
+        for thread in self._threads:
+            thread.start()
+        logger.info("Listening on %s", self.socket_path)
+        return self
+
+    def serve_forever(self):
+        """Block until the daemon is stopped (by `stop`, a shutdown request or idling)"""
+        if self._server is None and not self._stopped.is_set():
+            self.start()
+        self._stopped.wait()
+        self.stop()
+        # stop may be running in another thread, the socket and clients are cleaned up after
+        self._closed.wait()
+
+    def stop(self):
+        """Stop listening, remove the socket and close every client"""
+        self._stopped.set()
+        with self._lock:
+            server, self._server = self._server, None
+        if server is None:
+            return
+        server.shutdown()
+        server.server_close()
+        try:
+            os.unlink(self.socket_path)
+        except FileNotFoundError:
+            pass
+        with self._lock:
+            clients, self._clients = list(self._clients.values()), {}
+        for client in clients:
+            client.close()
+        self._closed.set()
+
+    def _watch_idle(self):
+        while not self._stopped.wait(min(self.idle_timeout, 1.0)):
+            if time.monotonic() - self._last_activity > self.idle_timeout:
+                logger.info("Stopping after %ss without requests", self.idle_timeout)
+                self.stop()
+
+    def peer_allowed(self, sock):
+        """Only the user running the daemon (or root) may use it"""
+        if not hasattr(socket, "SO_PEERCRED"):
+            # the socket file permissions still apply
+            return True
+        creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+        _, uid, _ = struct.unpack("3i", creds)
+        return uid in (os.getuid(), 0)
+
+    def get_client(self, api_kwargs):
+        """The ProxmoxAPI for these arguments, created (and authenticated) on first use"""
+        key = connection_key(api_kwargs)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                return client
+            client_lock = self._client_locks.setdefault(key, threading.Lock())
+
+        # other connections are not held up while this one logs in
+        with client_lock:
+            with self._lock:
+                client = self._clients.get(key)
+            if client is None:
+                # pylint:disable=import-outside-toplevel
+                from proxmoxer.core import ProxmoxAPI
+
+                client = ProxmoxAPI(**api_kwargs)
+                with self._lock:
+                    self._clients[key] = client
+        return client
+
+    def handle(self, message):
+        """Answer one message from a `DaemonClient`
+
+        :param message: the decoded request
+        :type message: dict
+        :return: the response to send back
+        :rtype: dict
+        """
+        self._last_activity = time.monotonic()
+        operation = message.get("op")
+        if operation == "ping":
+            with self._lock:
+                clients = len(self._clients)
+            return {"ok": True, "pid": os.getpid(), "clients": clients, **self.stats}
+        if operation == "shutdown":
+            # not from this thread, the response still has to be sent
+            threading.Thread(target=self.stop, daemon=True).start()
+            return {"ok": True}
+        if operation != "request":
+            return {"ok": False, "error": {"type": "DaemonError", "message": "unknown operation"}}
+
+        self.stats["requests"] += 1
+        try:
+            resource = self.get_client(message["connection"])(message["path"].strip("/"))
+            method = getattr(resource, message["method"].lower())
+            return {"ok": True, "data": method(**message.get("params", {}))}
+        except Exception as e:  # pylint: disable=broad-except
+            self.stats["errors"] += 1
+            error = {"type": type(e).__name__, "message": str(e)}
+            for attribute in ("status_code", "status_message", "content", "errors"):
+                if hasattr(e, attribute):
+                    error[attribute] = getattr(e, attribute)
+            return {"ok": False, "error": error}
+
+
+class DaemonClient:
+    """
+    Sends requests to a running `Daemon`. A single connection is kept open and may be used
+    from several threads (requests are sent one at a time).
+
+    .. code-block:: python
+
+        client = DaemonClient()
+        vms = client.request({"host": "pve1", "user": "root@pam", "password": "..."},
+                             "GET", "/nodes/pve1/qemu")
+    """
+
+    def __init__(self, socket_path=None, timeout=None):
+        """
+        :param socket_path: unix socket of the daemon, defaults to `default_socket_path()`
+        :type socket_path: Optional[str]
+        :param timeout: seconds to wait for the daemon, defaults to no limit
+        :type timeout: Optional[float]
+        """
+        self.socket_path = socket_path or default_socket_path()
+        self.timeout = timeout
+        self._sock = None
+        self._file = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def _connect(self):
+        _check_owner(self.socket_path)
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.socket_path)
+        except OSError as e:
+            sock.close()
+            raise DaemonNotRunning(f"no daemon is listening on {self.socket_path}") from e
+        self._sock = sock
+        self._file = sock.makefile("rb")
+
+    def _call(self, message):
+        with self._lock:
+            if self._sock is None:
+                self._connect()
+            try:
+                self._sock.sendall(json.dumps(message).encode("utf-8") + b"\n")
+                line = self._file.readline()
+            except OSError as e:
+                self._close()
+                raise DaemonError(f"lost the connection to the daemon: {e}") from e
+            if not line:
+                self._close()
+                raise DaemonError("the daemon closed the connection")
+        return json.loads(line)
+
+    def _close(self):
+        if self._sock is not None:
+            self._file.close()
+            self._sock.close()
+            self._sock = self._file = None
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def ping(self):
+        """Check the daemon is running
+
+        :return: the daemon's pid and counters
+        :rtype: dict
+        """
+        return self._call({"op": "ping"})
+
+    def is_running(self):
+        try:
+            self.ping()
+        except DaemonError:
+            return False
+        return True
+
+    def shutdown(self):
+        """Ask the daemon to stop"""
+        self._call({"op": "shutdown"})
+        self.close()
+
+    def request(self, api_kwargs, method, path, params=None):
+        """Make a request with the daemon's client for `api_kwargs`
+
+        :param api_kwargs: the arguments a ProxmoxAPI would be created with
+        :type api_kwargs: dict
+        :param method: GET, POST, PUT or DELETE
+        :type method: str
+        :param path: API path, e.g. /nodes/pve1/qemu
+        :type path: str
+        :param params: request parameters, defaults to None
+        :type params: Optional[dict]
+        :raises ResourceException: when the API returns an error
+        :raises DaemonError: for any other failure in the daemon
+        :return: the decoded response data
+        """
+        response = self._call(
+            {
+                "op": "request",
+                "connection": api_kwargs,
+                "method": method,
+                "path": path,
+                "params": params or {},
+            }
+        )
+        if response["ok"]:
+            return response["data"]
+
+        error = response["error"]
+        if error["type"] == "ResourceException":
+            # pylint:disable=import-outside-toplevel
+            from proxmoxer.core import ResourceException
+
+            raise ResourceException(
+                error["status_code"], error["status_message"], error["content"], error["errors"]
+            )
+        raise DaemonError(f"{error['type']}: {error['message']}")
@@ -4,12 +4,20 @@ __license__ = "MIT"
 
 # spell-checker:ignore urlunsplit
 
+import functools
 import importlib
 import logging
+import os
 import posixpath
-from http import client as httplib
+import re
+import time
+import weakref
+from http import HTTPStatus
 from urllib import parse as urlparse
 
+from proxmoxer import tracing
+from proxmoxer.deadline import Deadline, DeadlineExceeded
+
 logger = logging.getLogger(__name__)
 logger.setLevel(level=logging.WARNING)
 
@@ -25,19 +33,19 @@ ANYEVENT_HTTP_STATUS_CODES = {
 
 SERVICES = {
     "PVE": {
-        "supported_backends": ["local", "https", "openssh", "ssh_paramiko"],
+        "supported_backends": ["local", "https", "openssh", "ssh_paramiko", "replay"],
         "supported_https_auths": ["password", "token"],
         "default_port": 8006,
         "token_separator": "=",
         "cli_additional_options": ["--output-format", "json"],
     },
     "PMG": {
-        "supported_backends": ["local", "https", "openssh", "ssh_paramiko"],
+        "supported_backends": ["local", "https", "openssh", "ssh_paramiko", "replay"],
         "supported_https_auths": ["password"],
         "default_port": 8006,
     },
     "PBS": {
-        "supported_backends": ["https"],
+        "supported_backends": ["https", "replay"],
         "supported_https_auths": ["password", "token"],
         "default_port": 8007,
         "token_separator": ":",
@@ -45,10 +53,176 @@ SERVICES = {
 }
 
 
+# path segments which are followed by an identifier, used to build path templates for metrics
+PATH_TEMPLATE_PARAMS = {
+    "nodes": "node",
+    "qemu": "vmid",
+    "lxc": "vmid",
+    "storage": "storage",
+    "content": "volume",
+    "tasks": "upid",
+    "snapshot": "snapname",
+    "pools": "poolid",
+    "users": "userid",
+    "token": "tokenid",
+    "groups": "groupid",
+    "roles": "roleid",
+    "domains": "realm",
+    "services": "service",
+    "network": "iface",
+    "resources": "sid",
+    "backup": "id",
+    "replication": "id",
+    "rules": "pos",
+    "datastore": "store",
+}
+
+_API_ROOT_PATTERN = re.compile(r"^.*?/api2/[^/]+")
+
+# returned by next() when a streamed response has no items
+_END_OF_STREAM = object()
+
+# names of parameters and response fields whose values are hidden in logs
+_SECRET_NAMES = r"pass(?:word|wd|phrase)|secret|ticket|\botp\b|csrf|token(?!id)"
+_SECRET_KEY_PATTERN = re.compile(_SECRET_NAMES, re.IGNORECASE)
+_SECRET_HINTS = ("pass", "secret", "ticket", "otp", "csrf", "token")
+_SECRET_HINTS_BYTES = tuple(hint.encode() for hint in _SECRET_HINTS)
+_SECRET_JSON_PATTERN = re.compile(
+    rf'("[^"]*(?:{_SECRET_NAMES})[^"]*"\s*:\s*)"(?:[^"\\]|\\.)*"', re.IGNORECASE
+)
+_SECRET_JSON_PATTERN_BYTES = re.compile(_SECRET_JSON_PATTERN.pattern.encode(), re.IGNORECASE)
+REDACTED = "<redacted>"
+
+
+def redact_data(data):
+    """
+    Copy request data for logging, hiding the values of secret fields (passwords, tickets, tokens)
+
+    :param data: the request parameters
+    :type data: dict
+    :return: the parameters with secret values replaced
+    :rtype: dict
+    """
+    return {k: REDACTED if _SECRET_KEY_PATTERN.search(str(k)) else v for k, v in data.items()}
+
+
+def redact_content(content):
+    """
+    Hide the values of secret fields in a JSON response body for logging
+
+    :param content: the response body
+    :type content: bytes | str
+    :return: the body with secret values replaced
+    :rtype: bytes | str
+    """
+    if not isinstance(content, (bytes, str)):
+        return content
+
+    # regex scans of large bodies are slow, only run them when a secret name may be present
+    lowered = content.lower()
+    hints = _SECRET_HINTS if isinstance(content, str) else _SECRET_HINTS_BYTES
+    if not any(hint in lowered for hint in hints):
+        return content
+
+    if isinstance(content, bytes):
+        return _SECRET_JSON_PATTERN_BYTES.sub(rb'\1"' + REDACTED.encode() + b'"', content)
+    return _SECRET_JSON_PATTERN.sub(r'\1"' + REDACTED + '"', content)
+
+
+def path_template(url):
+    """
+    Convert a request URL into its API path template (e.g. ``/nodes/{node}/qemu/{vmid}/status``)
+    so requests to the same endpoint can be grouped together
+
+    :param url: the full URL or API path of the request
+    :type url: str
+    :return: the API path with identifiers replaced by placeholders
+    :rtype: str
+    """
+    path = _API_ROOT_PATTERN.sub("", urlparse.urlsplit(url).path)
+    segments = [s for s in path.split("/") if s]
+    template = []
+    for i, segment in enumerate(segments):
+        param = PATH_TEMPLATE_PARAMS.get(segments[i - 1]) if i > 0 else None
+        # don't treat a collection name as an identifier (e.g. /nodes/{node}/storage)
+        if param is not None and not (template and template[-1].startswith("{")):
+            template.append(f"{{{param}}}")
+        else:
+            template.append(segment)
+    return "/" + "/".join(template)
+
+
+class RequestEvent:
+    """
+    Information about a completed API request, passed to request hooks
+
+    `timings` contains the time (in seconds) spent in each step of the request. A step is
+    None if the backend could not measure it.
+        * connect: establishing the connection to the host
+        * queue: waiting for the client-side limiter (see proxmoxer.limits)
+        * auth: authenticating the request (e.g. renewing a ticket)
+        * server: waiting for the host to respond (includes network time)
+        * decode: decoding the response data
+        * total: the whole request as seen by the caller
+    """
+
+    def __init__(
+        self,
+        method,
+        url,
+        status_code=None,
+        bytes_sent=None,
+        bytes_received=None,
+        timings=None,
+        error=None,
+    ):
+        self.method = method
+        self.url = url
+        self.path = path_template(url)
+        self.status_code = status_code
+        self.bytes_sent = bytes_sent
+        self.bytes_received = bytes_received
+        self.timings = {
+            "queue": None,
+            "connect": None,
+            "auth": None,
+            "server": None,
+            "decode": None,
+            "total": None,
+        }
+        self.timings.update(timings or {})
+        self.error = error
+
+    def __repr__(self):
+        return f"RequestEvent ({self.method} {self.path} {self.status_code} in {self.timings['total']}s)"
+
+
 def config_failure(message, *args):
     raise NotImplementedError(message.format(*args))
 
 
+# sessions holding connections which must not be shared with a forked child
+_fork_sensitive = weakref.WeakSet()
+
+
+def reset_on_fork(session):
+    """
+    Call `session._after_fork()` in the child process whenever the process forks, so the
+    connections it holds are never used from two processes. The child should forget them
+    without closing them (closing could send data on a connection still used by the parent).
+    """
+    _fork_sensitive.add(session)
+
+
+def _after_fork_in_child():
+    for session in list(_fork_sensitive):
+        session._after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+
 class ResourceException(Exception):
     """
     An Exception thrown when an Proxmox API call failed
@@ -81,6 +255,30 @@ class AuthenticationError(Exception):
     pass
 
 
+def resource_exception(resp, serializer):
+    """
+    Create the ResourceException for a failed response
+
+    :param resp: the failed response from the backend session
+    :param serializer: the backend's serializer, used to decode any errors in the response
+    :return: the exception describing the failure
+    :rtype: ResourceException
+    """
+    # HTTPStatus gives the same phrases as http.client.responses without importing http.client
+    try:
+        status_message = HTTPStatus(resp.status_code).phrase
+    except ValueError:
+        status_message = ANYEVENT_HTTP_STATUS_CODES.get(resp.status_code)
+    if hasattr(resp, "reason"):
+        return ResourceException(
+            resp.status_code,
+            status_message,
+            resp.reason,
+            errors=(serializer.loads_errors(resp)),
+        )
+    return ResourceException(resp.status_code, status_message, resp.text)
+
+
 class ProxmoxResource:
     def __init__(self, **kwargs):
         self._store = kwargs
@@ -88,6 +286,18 @@ class ProxmoxResource:
     def __repr__(self):
         return f"ProxmoxResource ({self._store.get('base_url')})"
 
+    def __getstate__(self):
+        # connections are not sent to other processes, a new session is opened by the
+        # backend where this is unpickled (request hooks are local to this process too)
+        state = self.__dict__.copy()
+        state["_store"] = {k: v for k, v in self._store.items() if k != "session"}
+        state["_store"]["request_hooks"] = []
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._store["session"] = self._store["backend"].get_session()
+
     def __getattr__(self, item):
         if item.startswith("_"):
             raise AttributeError(item)
@@ -118,12 +328,53 @@ class ProxmoxResource:
 
         return ProxmoxResource(**kwargs)
 
+    def with_priority(self, priority):
+        """
+        A handle on this resource whose requests are queued with `priority` by the limiter
+        (see proxmoxer.limits), e.g. ``prox.with_priority("bulk").cluster.resources.get()``.
+        Requests are only queued when the ProxmoxAPI was created with a limiter.
+
+        :param priority: "interactive", "default", "bulk" or a number (lower goes first)
+        :type priority: str | int
+        :return: the resource, with the priority
+        :rtype: ProxmoxResource
+        """
+        # pylint:disable=import-outside-toplevel
+        from proxmoxer.limits import priority_rank
+
+        priority_rank(priority)  # fail here rather than on the first request
+        kwargs = self._store.copy()
+        kwargs["priority"] = priority
+        return ProxmoxResource(**kwargs)
+
+    def with_deadline(self, deadline):
+        """
+        A handle on this resource whose requests must finish by `deadline`, e.g.
+        ``prox.with_deadline(30).cluster.resources.get()``. Each request (and its retries and
+        time in the limiter's queue) waits at most for the time remaining, and none is sent
+        once it has passed.
+
+        With the command backends the deadline is checked before each command, which still
+        runs with the backend's own timeout.
+
+        :param deadline: a Deadline shared with other steps, or seconds from now
+        :type deadline: Deadline | float
+        :return: the resource, with the deadline
+        :rtype: ProxmoxResource
+        """
+        kwargs = self._store.copy()
+        kwargs["deadline"] = deadline if isinstance(deadline, Deadline) else Deadline(deadline)
+        return ProxmoxResource(**kwargs)
+
     def _request(self, method, data=None, params=None):
         url = self._store["base_url"]
-        if data:
-            logger.info(f"{method} {url} {data}")
-        else:
-            logger.info(f"{method} {url}")
+        # only format (and redact) messages when they will be logged, this is called for every request
+        if logger.isEnabledFor(logging.INFO):
+            extra = {"http_method": method, "url": url}
+            if data:
+                logger.info("%s %s %s", method, url, redact_data(data), extra=extra)
+            else:
+                logger.info("%s %s", method, url, extra=extra)
 
         # passing None values to pvesh command breaks it, let's remove them just as requests library does
         # helpful when dealing with function default values higher in the chain, no need to clean up in multiple places
@@ -139,29 +390,256 @@ class ProxmoxResource:
             for key in data_none_keys:
                 del data[key]
 
-        resp = self._store["session"].request(method, url, data=data, params=params)
-        logger.debug(f"Status code: {resp.status_code}, output: {resp.content!r}")
+        def attempt():
+            hedge_policy = self._store.get("hedge_policy")
+            if hedge_policy is not None and method == "GET":
+                return hedge_policy.call(url, lambda to: self._send(method, to, data, params))
+            return self._send(method, url, data, params)
+
+        policy = self._store.get("retry_policy")
+        if policy is None:
+            return attempt()
+        return policy.call(
+            method, self._host(url), attempt, data=data, deadline=self._store.get("deadline")
+        )
+
+    def _host(self, url):
+        """The host requests go to, e.g. for circuit breakers"""
+        netloc = urlparse.urlsplit(url).netloc
+        if netloc:
+            return netloc
+        return getattr(self._store.get("backend"), "target", None) or "localhost"
+
+    def _send(self, method, url, data, params):
+        """Make a single attempt at a request"""
+        with tracing.span("proxmoxer.request", **{"http.method": method, "url.full": url}) as span:
+            start = time.monotonic()
+            slot = None
+            deadline = self._store.get("deadline")
+            try:
+                session = self._store["session"]
+                if deadline is not None:
+                    deadline.check(f"{method} {url}")
+                limiter = self._store.get("limiter")
+                if limiter is not None:
+                    slot = limiter.acquire(
+                        self._host(url),
+                        self._store.get("priority"),
+                        timeout=None if deadline is None else deadline.remaining(),
+                    )
+                kwargs = {}
+                if deadline is not None:
+                    # after the wait in the limiter, which uses up some of the time
+                    kwargs = self._deadline_kwargs(session, deadline, f"{method} {url}")
+                resp = session.request(method, url, data=data, params=params, **kwargs)
+            except Exception as e:
+                if slot is not None:
+                    slot.release(error=e)
+                self._emit_request_event(method, url, start, error=e, slot=slot)
+                if (
+                    deadline is not None
+                    and deadline.expired
+                    and not isinstance(e, DeadlineExceeded)
+                ):
+                    # e.g. requests' ReadTimeout, after the timeout was shortened to the deadline
+                    raise DeadlineExceeded(
+                        f"the {deadline.seconds}s deadline passed during {method} {url}"
+                    ) from e
+                raise
+            if slot is not None:
+                slot.release(status_code=resp.status_code)
+            return self._handle_response(method, url, start, resp, span, slot)
+
+    def _handle_response(self, method, url, start, resp, span, slot=None):
+        """Decode a response's data, or raise a ResourceException for an error status"""
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                "Status code: %s, output: %r",
+                resp.status_code,
+                redact_content(resp.content),
+                extra={"http_method": method, "url": url, "status_code": resp.status_code},
+            )
+        span.set_attribute("http.status_code", resp.status_code)
 
         if resp.status_code >= 400:
-            if hasattr(resp, "reason"):
-                raise ResourceException(
-                    resp.status_code,
-                    httplib.responses.get(
-                        resp.status_code, ANYEVENT_HTTP_STATUS_CODES.get(resp.status_code)
-                    ),
-                    resp.reason,
-                    errors=(self._store["serializer"].loads_errors(resp)),
-                )
-            else:
-                raise ResourceException(
-                    resp.status_code,
-                    httplib.responses.get(
-                        resp.status_code, ANYEVENT_HTTP_STATUS_CODES.get(resp.status_code)
-                    ),
-                    resp.text,
-                )
+            self._emit_request_event(method, url, start, resp, slot=slot)
+            raise resource_exception(resp, self._store["serializer"])
         elif 200 <= resp.status_code <= 299:
-            return self._store["serializer"].loads(resp)
+            decode_start = time.monotonic()
+            ret = self._store["serializer"].loads(resp)
+            self._emit_request_event(
+                method, url, start, resp, time.monotonic() - decode_start, slot=slot
+            )
+            return ret
+        return None
+
+    async def _request_async(self, method, data=None, params=None):
+        # asyncio is slow to import, and is already loaded whenever this coroutine runs
+        import asyncio  # pylint:disable=import-outside-toplevel
+
+        session = self._store["session"]
+        if not hasattr(session, "request_async") or any(
+            self._store.get(key) is not None for key in ("retry_policy", "limiter", "hedge_policy")
+        ):
+            # the blocking request (with its retries and limits) runs in a thread instead
+            # run_in_executor does not carry the context, bind it so spans stay nested
+            return await asyncio.get_running_loop().run_in_executor(
+                None,
+                tracing.wrap(functools.partial(self._request, method, data=data, params=params)),
+            )
+
+        url = self._store["base_url"]
+        logger.info("%s %s", method, url, extra={"http_method": method, "url": url})
+        if params:
+            params = {k: v for (k, v) in params.items() if v is not None}
+        if data:
+            data = {k: v for (k, v) in data.items() if v is not None}
+
+        with tracing.span("proxmoxer.request", **{"http.method": method, "url.full": url}) as span:
+            start = time.monotonic()
+            deadline = self._store.get("deadline")
+            try:
+                if deadline is not None:
+                    # like the blocking command sessions, only the start is bounded
+                    deadline.check(f"{method} {url}")
+                resp = await session.request_async(method, url, data=data, params=params)
+            except Exception as e:
+                self._emit_request_event(method, url, start, error=e)
+                raise
+            return self._handle_response(method, url, start, resp, span)
+
+    @staticmethod
+    def _deadline_kwargs(session, deadline, what):
+        # the https session takes a timeout for each request (its default is the auth's), the
+        # command backends run every command with the session's own timeout
+        default = getattr(getattr(session, "auth", None), "timeout", None)
+        if default is None:
+            deadline.check(what)
+            return {}
+        return {"timeout": deadline.timeout(default, what)}
+
+    def _emit_request_event(
+        self,
+        method,
+        url,
+        start,
+        resp=None,
+        decode_time=None,
+        error=None,
+        slot=None,
+        status_code=None,
+    ):
+        hooks = self._store.get("request_hooks")
+        if not hooks:
+            return
+
+        timings = dict(getattr(resp, "timings", None) or {})
+        if slot is not None:
+            timings["queue"] = slot.wait
+        timings["decode"] = decode_time
+        timings["total"] = time.monotonic() - start
+        content = getattr(resp, "content", None)
+        event = RequestEvent(
+            method,
+            url,
+            status_code=getattr(resp, "status_code", status_code),
+            bytes_sent=getattr(resp, "bytes_sent", None),
+            bytes_received=len(content) if content is not None else None,
+            timings=timings,
+            error=error,
+        )
+        for hook in hooks:
+            try:
+                hook(event)
+            except Exception as e:  # pylint: disable=broad-except
+                # instrumentation must never break the request itself
+                logger.warning("Request hook %r failed: %s", hook, e)
+
+    def _request_iter(self, method, params=None):
+        session = self._store["session"]
+        if not hasattr(session, "iter_request"):
+            # backend cannot stream its output, decode the whole response instead
+            data = self._request(method, params=params)
+            yield from data if isinstance(data, list) else [data]
+            return
+
+        url = self._store["base_url"]
+        logger.info("%s %s", method, url, extra={"http_method": method, "url": url})
+        if params:
+            params = {k: v for (k, v) in params.items() if v is not None}
+
+        def attempt():
+            return self._open_stream(session, method, url, params)
+
+        # streams are not hedged, and once items have been read they are not retried
+        policy = self._store.get("retry_policy")
+        if policy is None:
+            stream = attempt()
+        else:
+            stream = policy.call(
+                method, self._host(url), attempt, deadline=self._store.get("deadline")
+            )
+        yield from stream
+
+    def _open_stream(self, session, method, url, params):
+        """
+        Start streaming a response, like `_send` for a single attempt. The first item is read
+        before returning, so a request which fails at once raises here (and can be retried).
+        Streams are read for as long as the caller wants, so a deadline only bounds their start.
+        """
+        with tracing.span("proxmoxer.request", **{"http.method": method, "url.full": url}):
+            start = time.monotonic()
+            slot = None
+            deadline = self._store.get("deadline")
+            try:
+                if deadline is not None:
+                    deadline.check(f"{method} {url}")
+                limiter = self._store.get("limiter")
+                if limiter is not None:
+                    # the host is busy until the whole response has been read
+                    slot = limiter.acquire(
+                        self._host(url),
+                        self._store.get("priority"),
+                        timeout=None if deadline is None else deadline.remaining(),
+                    )
+                items = iter(session.iter_request(method, url, params=params))
+                first = next(items, _END_OF_STREAM)
+            except Exception as e:
+                self._end_stream(method, url, start, slot, e)
+                if (
+                    deadline is not None
+                    and deadline.expired
+                    and not isinstance(e, DeadlineExceeded)
+                ):
+                    raise DeadlineExceeded(
+                        f"the {deadline.seconds}s deadline passed during {method} {url}"
+                    ) from e
+                raise
+        return self._read_stream(method, url, start, slot, items, first)
+
+    def _read_stream(self, method, url, start, slot, items, first):
+        error = None
+        try:
+            if first is not _END_OF_STREAM:
+                yield first
+                yield from items
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            self._end_stream(method, url, start, slot, error)
+
+    def _end_stream(self, method, url, start, slot, error=None):
+        # an error response (e.g. the status of a failed command) is released like a response
+        status_code = 200 if error is None else getattr(error, "status_code", None)
+        if slot is not None:
+            if status_code is None:
+                slot.release(error=error)
+            else:
+                slot.release(status_code=status_code)
+        self._emit_request_event(
+            method, url, start, error=error, slot=slot, status_code=status_code
+        )
 
     def get(self, *args, **params):
         return self(args)._request("GET", params=params)
@@ -169,9 +647,44 @@ class ProxmoxResource:
     def post(self, *args, **data):
         return self(args)._request("POST", data=data)
 
+    def iter_get(self, *args, **params):
+        """
+        Like `get`, but returns an iterator over the items of a list response. Backends which
+        can stream their output decode it incrementally, so large listings are never held in
+        memory all at once.
+
+        Retries, request hooks, tracing and limits apply as for `get`, except that a request is
+        only retried until its first item was read, and it is not hedged.
+        """
+        return self(args)._request_iter("GET", params=params)
+
     def put(self, *args, **data):
         return self(args)._request("PUT", data=data)
 
+    async def get_async(self, *args, **params):
+        """
+        Like `get`, as a coroutine. Sessions which can run requests from an event loop (e.g.
+        the local backend created with `max_concurrency`) do so, others run the request in a
+        thread. Requests with a retry policy, limiter or hedge policy also run in a thread.
+
+        .. code-block:: python
+
+            prox = ProxmoxAPI(backend="local", max_concurrency=8)
+            statuses = await asyncio.gather(
+                *(prox.nodes("pve1").qemu(vmid).status.current.get_async() for vmid in vmids)
+            )
+        """
+        return await self(args)._request_async("GET", params=params)
+
+    async def post_async(self, *args, **data):
+        return await self(args)._request_async("POST", data=data)
+
+    async def put_async(self, *args, **data):
+        return await self(args)._request_async("PUT", data=data)
+
+    async def delete_async(self, *args, **params):
+        return await self(args)._request_async("DELETE", params=params)
+
     def delete(self, *args, **params):
         return self(args)._request("DELETE", params=params)
 
@@ -183,7 +696,16 @@ class ProxmoxResource:
 
 
 class ProxmoxAPI(ProxmoxResource):
-    def __init__(self, host=None, backend="https", service="PVE", **kwargs):
+    def __init__(
+        self,
+        host=None,
+        backend="https",
+        service="PVE",
+        retry_policy=None,
+        limiter=None,
+        hedge_policy=None,
+        **kwargs,
+    ):
         super().__init__(**kwargs)
         service = service.upper()
         backend = backend.lower()
@@ -209,17 +731,43 @@ class ProxmoxAPI(ProxmoxResource):
             **kwargs
         )
         self._backend_name = backend
+        self._service = service
 
         self._store = {
+            # kept so pickled resources can open a new session
+            "backend": self._backend,
             "base_url": self._backend.get_base_url(),
             "session": self._backend.get_session(),
             "serializer": self._backend.get_serializer(),
+            # shared by every resource made from this instance
+            "request_hooks": [],
+            # see proxmoxer.retry.RetryPolicy
+            "retry_policy": retry_policy,
+            # see proxmoxer.limits.RequestLimiter
+            "limiter": limiter,
+            # see proxmoxer.hedging.HedgePolicy
+            "hedge_policy": hedge_policy,
         }
 
     def __repr__(self):
         dest = getattr(self._backend, "target", self._store.get("base_url"))
         return f"ProxmoxAPI ({self._backend_name} backend for {dest})"
 
+    def add_request_hook(self, hook):
+        """Call `hook` with a RequestEvent after every request made through this instance.
+
+        Hooks are called synchronously in the requesting thread, so they should be fast.
+        """
+        self._store["request_hooks"].append(hook)
+
+    def remove_request_hook(self, hook):
+        """Stop calling a hook added with `add_request_hook`."""
+        self._store["request_hooks"].remove(hook)
+
+    def close(self):
+        """Close the backend session and any persistent connections it holds."""
+        self._store["session"].close()
+
     def get_tokens(self):
         """Return the auth and csrf tokens.
 
@@ -229,3 +777,63 @@ class ProxmoxAPI(ProxmoxResource):
             return None, None
 
         return self._backend.get_tokens()
+
+
+def connect_many(configs, max_workers=16, warm=True, return_exceptions=False):
+    """
+    Create a ProxmoxAPI for each set of arguments concurrently, so building clients for many
+    clusters takes about as long as the slowest one instead of the sum of their logins.
+
+    Warming makes a request to ``version``, which logs in (also for clients created with
+    ``lazy=True``), opens the connection and checks the credentials.
+
+    .. code-block:: python
+
+        clients = connect_many({name: {"host": host, "user": "root@pam", "password": "..."}
+                                for name, host in clusters.items()})
+
+    :param configs: ProxmoxAPI keyword arguments, keyed by a name for each client
+    :type configs: Mapping[Any, dict]
+    :param max_workers: clients created at the same time, defaults to 16
+    :type max_workers: int
+    :param warm: make a first request with each client, defaults to True
+    :type warm: bool
+    :param return_exceptions: return the exception for clients which failed instead of raising
+        the first one, defaults to False
+    :type return_exceptions: bool
+    :return: the clients (or exceptions) by name, in the order of `configs`
+    :rtype: dict
+    """
+    # pylint:disable=import-outside-toplevel
+    from concurrent.futures import ThreadPoolExecutor
+
+    def connect(kwargs):
+        prox = ProxmoxAPI(**kwargs)
+        if warm:
+            try:
+                prox.version.get()
+            except Exception:
+                prox.close()
+                raise
+        return prox
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(configs)))) as executor:
+        # bound to the caller's context, so logins and warming requests are traced under it
+        futures = {
+            name: executor.submit(tracing.wrap(connect), kwargs) for name, kwargs in configs.items()
+        }
+
+    clients = {}
+    errors = []
+    for name, future in futures.items():
+        error = future.exception()
+        if error is not None:
+            errors.append(error)
+        clients[name] = error or future.result()
+
+    if errors and not return_exceptions:
+        for client in clients.values():
+            if isinstance(client, ProxmoxAPI):
+                client.close()
+        raise errors[0]
+    return clients
@@ -0,0 +1,81 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+logger.setLevel(level=logging.WARNING)
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when an operation's deadline passed before it finished"""
+
+
+class Deadline:
+    """
+    A time by which a whole operation must finish, however many requests, retries and polls it
+    takes. Every step waits at most for the time remaining, and no step is started once it has
+    passed.
+
+    .. code-block:: python
+
+        deadline = Deadline(30)
+        upid = prox.with_deadline(deadline).nodes("pve1").qemu(100).status.start.post()
+        Tasks.blocking_status(prox, upid, deadline=deadline)
+    """
+
+    def __init__(self, seconds):
+        """
+        :param seconds: time allowed from now
+        :type seconds: float
+        """
+        self.seconds = seconds
+        self.expires = time.monotonic() + seconds
+
+    def __repr__(self):
+        return f"Deadline ({self.remaining():.2f}s of {self.seconds}s left)"
+
+    def __getstate__(self):
+        # monotonic clocks differ between processes, keep the time left instead
+        state = self.__dict__.copy()
+        state["expires"] = self.remaining()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.expires += time.monotonic()
+
+    def remaining(self):
+        """Seconds left, 0 once it has passed"""
+        return max(0.0, self.expires - time.monotonic())
+
+    @property
+    def expired(self):
+        return time.monotonic() >= self.expires
+
+    def check(self, what="the operation"):
+        """
+        :param what: the step about to start, for the error message
+        :type what: str
+        :raises DeadlineExceeded: if it has passed
+        """
+        if self.expired:
+            raise DeadlineExceeded(f"the {self.seconds}s deadline passed before {what}")
+
+    def timeout(self, default=None, what="the operation"):
+        """
+        The timeout of a step, shortened to the time remaining
+
+        :param default: the step's own timeout, defaults to no limit
+        :type default: Optional[float], optional
+        :param what: the step about to start, for the error message
+        :type what: str, optional
+        :raises DeadlineExceeded: if it has passed
+        :return: seconds the step may take
+        :rtype: float
+        """
+        self.check(what)
+        remaining = self.remaining()
+        return remaining if default is None else min(default, remaining)
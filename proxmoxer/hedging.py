@@ -0,0 +1,199 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+import collections
+import contextvars
+import itertools
+import logging
+import queue
+import threading
+import time
+from urllib import parse as urlparse
+
+from proxmoxer.core import path_template
+from proxmoxer.retry import RetryBudget
+
+logger = logging.getLogger(__name__)
+logger.setLevel(level=logging.WARNING)
+
+
+class HedgePolicy:
+    """
+    Sends a GET to another member of the cluster when the first has not answered within the
+    recent 95th percentile latency; the first answer is used. This cuts the tail latency of
+    cluster-wide reads (e.g. ``/cluster/resources``) when one node is slow.
+
+    Only the https backend is supported: tickets and API tokens are valid on every member,
+    so the same session is used with the member's address.
+
+    .. code-block:: python
+
+        hedging = HedgePolicy(["pve2", "pve3"], paths=["/cluster/resources", "/cluster/tasks"])
+        prox = ProxmoxAPI("pve1", ..., hedge_policy=hedging)
+
+    A request cannot be interrupted once sent, so the slower one is abandoned: it finishes in
+    the background and its answer is discarded. A hedge which has not been sent yet when the
+    first answer arrives is not sent at all.
+    """
+
+    def __init__(
+        self,
+        members,
+        paths=None,
+        percentile=95,
+        initial_delay=1.0,
+        min_delay=0.05,
+        max_delay=5.0,
+        min_samples=20,
+        window=500,
+        budget=None,
+    ):
+        """
+        :param members: other members of the cluster, as "host" or "host:port" (the port of
+            the ProxmoxAPI is used if not given)
+        :type members: Iterable[str]
+        :param paths: only hedge these API paths (as templates, e.g. "/nodes/{node}/status"),
+            defaults to every GET
+        :type paths: Optional[Iterable[str]], optional
+        :param percentile: latency percentile after which a hedge is sent, defaults to 95
+        :type percentile: float, optional
+        :param initial_delay: seconds before hedging while there are fewer than `min_samples`
+            latencies, defaults to 1
+        :type initial_delay: float, optional
+        :param min_delay: shortest hedging delay, defaults to 0.05
+        :type min_delay: float, optional
+        :param max_delay: longest hedging delay, defaults to 5
+        :type max_delay: float, optional
+        :param min_samples: latencies needed before the percentile is used, defaults to 20
+        :type min_samples: int, optional
+        :param window: number of recent latencies kept, defaults to 500
+        :type window: int, optional
+        :param budget: limits the extra requests, defaults to hedging at most 10% of requests
+        :type budget: Optional[RetryBudget], optional
+        """
+        self.members = list(members)
+        self.paths = set(paths) if paths is not None else None
+        self.percentile = percentile
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.min_samples = min_samples
+        self.budget = budget if budget is not None else RetryBudget(ratio=0.1, min_per_second=0)
+        self.stats = collections.Counter()
+        self._latencies = collections.deque(maxlen=window)
+        self._delay = initial_delay
+        self._lock = threading.Lock()
+        self._next_member = itertools.cycle(range(len(self.members)))
+
+    def __getstate__(self):
+        # the latencies only describe this process
+        state = self.__dict__.copy()
+        del state["_lock"], state["_next_member"]
+        state["_latencies"] = collections.deque(maxlen=self._latencies.maxlen)
+        state["stats"] = collections.Counter()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._next_member = itertools.cycle(range(len(self.members)))
+
+    @property
+    def delay(self):
+        """Seconds to wait for an answer before hedging"""
+        return self._delay
+
+    def record_latency(self, seconds):
+        with self._lock:
+            self._latencies.append(seconds)
+            # sorting the window for every request would cost more than it saves
+            if len(self._latencies) >= self.min_samples and len(self._latencies) % 10 == 0:
+                ordered = sorted(self._latencies)
+                index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100))
+                self._delay = min(self.max_delay, max(self.min_delay, ordered[index]))
+
+    def _count(self, key):
+        # calls come from many threads, and `+=` on a Counter is not atomic
+        with self._lock:
+            self.stats[key] += 1
+
+    def applies(self, url):
+        """Whether GETs to `url` are hedged"""
+        # the ssh and local backends only reach the node they run commands on
+        if not self.members or not urlparse.urlsplit(url).netloc:
+            return False
+        return self.paths is None or path_template(url) in self.paths
+
+    def member_url(self, url):
+        """`url` on the next member, in turn"""
+        with self._lock:
+            member = self.members[next(self._next_member)]
+        parts = urlparse.urlsplit(url)
+        # an IPv6 address has colons of its own, the port comes after its closing bracket
+        has_port = "]:" in member or (":" in member and "[" not in member)
+        if parts.port is not None and not has_port:
+            member = f"{member}:{parts.port}"
+        return urlparse.urlunsplit(parts._replace(netloc=member))
+
+    def call(self, url, send):
+        """
+        Make a GET, hedged if it is slow
+
+        :param url: the request's url
+        :type url: str
+        :param send: makes the request to a url, returning the data or raising on failure
+        :type send: Callable[[str], Any]
+        :return: the first successful answer
+        """
+        if not self.applies(url):
+            return send(url)
+
+        self.budget.record_request()
+        answers = queue.Queue()
+
+        def attempt(attempt_url, hedge):
+            start = time.monotonic()
+            try:
+                answers.put((hedge, True, send(attempt_url)))
+            except Exception as e:  # pylint: disable=broad-except
+                answers.put((hedge, False, e))
+            else:
+                self.record_latency(time.monotonic() - start)
+
+        def start_attempt(attempt_url, hedge):
+            # each thread gets a copy of the context, so the request is traced under the caller
+            context = contextvars.copy_context()
+            threading.Thread(
+                target=context.run, args=(attempt, attempt_url, hedge), daemon=True
+            ).start()
+
+        self._count("requests")
+        start_attempt(url, False)
+        pending = 1
+        try:
+            answer = answers.get(timeout=self.delay)
+        except queue.Empty:
+            if self.budget.try_retry():
+                hedge_url = self.member_url(url)
+                logger.info("No answer within %.3fs, also sending to %s", self.delay, hedge_url)
+                self._count("hedged")
+                start_attempt(hedge_url, True)
+                pending += 1
+            else:
+                self._count("over_budget")
+            answer = answers.get()
+
+        error = None
+        while True:
+            pending -= 1
+            hedge, ok, value = answer
+            if ok:
+                if hedge:
+                    self._count("hedge_won")
+                return value
+            # the other attempt may still succeed
+            error = error or value
+            if not pending:
+                raise error
+            answer = answers.get()
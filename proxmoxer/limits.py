@@ -0,0 +1,350 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+logger.setLevel(level=logging.WARNING)
+
+# responses showing the host is overloaded (pveproxy answers 596/597 when its worker or
+# pvedaemon did not respond in time)
+OVERLOAD_STATUS_CODES = (503, 596, 597, 598)
+
+# priority classes, requests of a lower rank are sent first
+PRIORITIES = {"interactive": 0, "default": 1, "bulk": 2}
+
+
+def priority_rank(priority):
+    """
+    :param priority: a name from `PRIORITIES`, a rank, or None for "default"
+    :type priority: Optional[str | int]
+    :return: the rank of the priority
+    :rtype: int
+    """
+    if priority is None:
+        return PRIORITIES["default"]
+    if isinstance(priority, str):
+        try:
+            return PRIORITIES[priority]
+        except KeyError:
+            raise ValueError(
+                f"unknown priority '{priority}', choose from {', '.join(PRIORITIES)}"
+            ) from None
+    return priority
+
+
+class QueueTimeout(TimeoutError):
+    """Raised when a request waited longer than the limiter's `queue_timeout` to be sent"""
+
+
+class TokenBucket:
+    """Allows `rate` requests per second on average, in bursts of up to `burst`"""
+
+    def __init__(self, rate, burst=None):
+        """
+        :param rate: tokens added per second
+        :type rate: float
+        :param burst: tokens the bucket holds, defaults to one second's worth (at least 1)
+        :type burst: Optional[float], optional
+        """
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self):
+        """
+        Take a token, which may only be used after the returned delay. Tokens are handed out
+        in the order they are reserved.
+
+        :return: seconds to wait
+        :rtype: float
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            return 0.0 if self._tokens >= 0 else -self._tokens / self.rate
+
+
+class Slot:
+    """Permission to send one request, to be released once the response is received"""
+
+    def __init__(self, limiter, wait):
+        self.limiter = limiter
+        # seconds spent waiting in the queue and for the rate limit
+        self.wait = wait
+        self.sent = time.monotonic()
+        self._released = False
+
+    def release(self, status_code=None, error=None):
+        """
+        :param status_code: the response's status, if there was one
+        :type status_code: Optional[int]
+        :param error: the exception raised instead of a response
+        :type error: Optional[Exception]
+        """
+        if not self._released:
+            self._released = True
+            self.limiter._release(self, status_code, error)
+
+
+class HostLimiter:
+    """
+    Limits the requests in flight to one host, and optionally their rate. Requests over the
+    limit wait in a queue ordered by priority (see `PRIORITIES`), then by arrival.
+
+    With `adaptive`, the concurrency limit follows the host's latency (AIMD): it grows by one
+    for every `limit` responses within `latency_target`, and halves after a slow response,
+    an overload status (`OVERLOAD_STATUS_CODES`) or a connection error.
+    """
+
+    def __init__(
+        self,
+        host,
+        concurrency=3,
+        rate=None,
+        burst=None,
+        adaptive=False,
+        min_concurrency=1,
+        max_concurrency=None,
+        latency_target=1.0,
+        queue_timeout=None,
+        aging=2.0,
+    ):
+        """
+        :param host: the host requests are sent to
+        :type host: str
+        :param concurrency: requests in flight at once (the starting point when adaptive),
+            defaults to 3 (the number of pveproxy workers)
+        :type concurrency: int, optional
+        :param rate: requests per second, defaults to no limit
+        :type rate: Optional[float], optional
+        :param burst: requests allowed at once by the rate limit, defaults to `rate`
+        :type burst: Optional[float], optional
+        :param adaptive: adjust the concurrency to the observed latency, defaults to False
+        :type adaptive: bool, optional
+        :param min_concurrency: lowest adaptive concurrency, defaults to 1
+        :type min_concurrency: int, optional
+        :param max_concurrency: highest adaptive concurrency, defaults to twice `concurrency`
+        :type max_concurrency: Optional[int], optional
+        :param latency_target: seconds above which a response counts as slow, defaults to 1
+        :type latency_target: float, optional
+        :param queue_timeout: seconds a request may wait before QueueTimeout is raised,
+            defaults to no limit
+        :type queue_timeout: Optional[float], optional
+        :param aging: seconds of waiting which raise a request by one priority class, None to
+            always serve higher priorities first, defaults to 2
+        :type aging: Optional[float], optional
+        """
+        self.host = host
+        self.adaptive = adaptive
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency or 2 * concurrency
+        self.latency_target = latency_target
+        self.queue_timeout = queue_timeout
+        self.aging = aging
+        self.bucket = TokenBucket(rate, burst) if rate else None
+
+        self._limit = float(concurrency)
+        self._in_flight = 0
+        # (sort key, arrival number) of each waiting request
+        self._queue = []
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._last_decrease = time.monotonic()
+
+        self._requests = 0
+        self._queued = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._timeouts = 0
+
+    def __repr__(self):
+        return (
+            f"HostLimiter ({self.host} {self._in_flight}/{self.limit}, {len(self._queue)} queued)"
+        )
+
+    @property
+    def limit(self):
+        """The current concurrency limit"""
+        return max(1, int(self._limit))
+
+    def acquire(self, priority=None, timeout=None):
+        """
+        Wait for the request's turn. Waiting requests are served by priority, then in the order
+        they arrived; every `aging` seconds of waiting raises a request by one priority class.
+
+        :param priority: a name from `PRIORITIES` or a number (lower is served first),
+            defaults to "default"
+        :type priority: Optional[str | int], optional
+        :param timeout: seconds this request may wait, if shorter than `queue_timeout` (e.g.
+            the time left before its deadline)
+        :type timeout: Optional[float], optional
+        :raises QueueTimeout: when it did not come within `queue_timeout` or `timeout`
+        :return: the slot to release once the response is received
+        :rtype: Slot
+        """
+        start = time.monotonic()
+        timeouts = [t for t in (self.queue_timeout, timeout) if t is not None]
+        deadline = start + min(timeouts) if timeouts else None
+        rank = priority_rank(priority)
+        waited = False
+
+        with self._cond:
+            self._seq += 1
+            if self.aging is None:
+                waiter = (rank, self._seq)
+            else:
+                # waiting `aging` seconds is worth one class: a request that arrived at `start`
+                # goes before one of the next class which arrived after `start + aging`
+                waiter = (start + rank * self.aging, self._seq)
+            self._queue.append(waiter)
+            try:
+                while self._in_flight >= self.limit or min(self._queue) != waiter:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        self._timed_out(start)
+                    waited = True
+                    self._cond.wait(remaining)
+            except BaseException:
+                self._queue.remove(waiter)
+                # the next request may be able to go now
+                self._cond.notify_all()
+                raise
+            self._queue.remove(waiter)
+            self._in_flight += 1
+            if self._queue:
+                self._cond.notify_all()
+
+        if self.bucket is not None:
+            # taken in the order of the queue, so the rate limit follows the priorities too
+            delay = self.bucket.reserve()
+            if deadline is not None and time.monotonic() + delay > deadline:
+                with self._cond:
+                    self._in_flight -= 1
+                    self._cond.notify_all()
+                    self._timed_out(start)
+            if delay > 0:
+                waited = True
+                time.sleep(delay)
+
+        wait = time.monotonic() - start
+        with self._cond:
+            self._requests += 1
+            if waited:
+                self._queued += 1
+            self._wait_total += wait
+            self._wait_max = max(self._wait_max, wait)
+        return Slot(self, wait)
+
+    def _timed_out(self, start):
+        # called with the lock held
+        self._timeouts += 1
+        raise QueueTimeout(
+            f"request to {self.host} waited {time.monotonic() - start:.2f}s without being sent"
+        )
+
+    def _release(self, slot, status_code, error):
+        now = time.monotonic()
+        with self._cond:
+            self._in_flight -= 1
+            if self.adaptive:
+                latency = now - slot.sent
+                overloaded = (
+                    latency > self.latency_target
+                    or status_code in OVERLOAD_STATUS_CODES
+                    or isinstance(error, OSError)
+                )
+                if overloaded:
+                    # requests sent under the old limit do not reduce it again
+                    if slot.sent >= self._last_decrease:
+                        self._limit = max(float(self.min_concurrency), self._limit / 2)
+                        self._last_decrease = now
+                        logger.info("Lowered the concurrency for %s to %s", self.host, self.limit)
+                else:
+                    self._limit = min(float(self.max_concurrency), self._limit + 1 / self._limit)
+            self._cond.notify_all()
+
+    def stats(self):
+        """
+        The limiter's state and how long requests waited
+
+        :return: the current limit, requests in flight and queued, and totals since creation
+        :rtype: dict
+        """
+        with self._cond:
+            return {
+                "limit": self.limit,
+                "in_flight": self._in_flight,
+                "queue_depth": len(self._queue),
+                "requests": self._requests,
+                "queued": self._queued,
+                "wait_seconds_total": self._wait_total,
+                "wait_seconds_max": self._wait_max,
+                "queue_timeouts": self._timeouts,
+            }
+
+
+class RequestLimiter:
+    """
+    A `HostLimiter` for each host requests are sent to. It can be shared by several
+    ProxmoxAPI instances (e.g. one per thread) so their requests to a host are limited
+    together.
+
+    .. code-block:: python
+
+        limiter = RequestLimiter(concurrency=3, rate=20, adaptive=True)
+        prox = ProxmoxAPI("pve1", ..., limiter=limiter)
+        ...
+        print(limiter.snapshot())
+    """
+
+    def __init__(self, per_host=None, **settings):
+        """
+        :param per_host: settings for specific hosts (as "host:port" for https), overriding
+            the defaults
+        :type per_host: Optional[Dict[str, dict]], optional
+        :param settings: `HostLimiter` arguments used for every host
+        """
+        self.settings = settings
+        self.per_host = per_host or {}
+        self._limiters = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # the queues only describe this process
+        state = self.__dict__.copy()
+        del state["_lock"]
+        state["_limiters"] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def for_host(self, host):
+        with self._lock:
+            limiter = self._limiters.get(host)
+            if limiter is None:
+                settings = dict(self.settings, **self.per_host.get(host, {}))
+                limiter = self._limiters[host] = HostLimiter(host, **settings)
+            return limiter
+
+    def acquire(self, host, priority=None, timeout=None):
+        """Wait for a request's turn to be sent to `host`, see `HostLimiter.acquire`"""
+        return self.for_host(host).acquire(priority, timeout)
+
+    def snapshot(self):
+        """
+        :return: the stats of each host's limiter
+        :rtype: Dict[str, dict]
+        """
+        with self._lock:
+            limiters = dict(self._limiters)
+        return {host: limiter.stats() for host, limiter in limiters.items()}
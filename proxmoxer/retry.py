@@ -0,0 +1,386 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+import collections
+import io
+import logging
+import random
+import re
+import threading
+import time
+
+from proxmoxer.deadline import DeadlineExceeded
+from proxmoxer.limits import QueueTimeout
+
+logger = logging.getLogger(__name__)
+logger.setLevel(level=logging.WARNING)
+
+# AnyEvent statuses from pveproxy when it could not get an answer from the target node
+# (599 is usually a bad request rather than a blip)
+TRANSIENT_STATUS_CODES = (595, 596, 597, 598)
+
+# a config lock held by another operation, e.g. "can't lock file '/var/lock/qemu-server/lock-100.conf'
+# - got timeout" or "trying to acquire lock... timeout" (only the lock's own line, a task which
+# got the lock may well time out later on)
+LOCK_TIMEOUT_PATTERN = re.compile(
+    r"can't lock file '[^']*' - got timeout|trying to acquire lock\.\.\.[ \t]*timeout", re.I
+)
+
+# requests and paramiko errors raised before anything was sent, found by name so that neither
+# needs to be imported here
+_NOT_SENT_ERRORS = {"ConnectTimeout", "NewConnectionError", "NoValidConnectionsError"}
+
+# limits set by the client itself, which say nothing about the host (they are TimeoutErrors, so
+# would otherwise count as connection errors)
+_CLIENT_ERRORS = (DeadlineExceeded, QueueTimeout)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of making a request to a host which keeps failing"""
+
+    def __init__(self, host, retry_in):
+        self.host = host
+        self.retry_in = retry_in
+        super().__init__(f"too many failures from {host}, not retrying for {retry_in:.1f}s")
+
+
+class RetryBudget:
+    """
+    Limits retries to a share of the requests made recently, so that an outage does not turn
+    every request into `max_attempts` requests (a retry storm)
+
+    Retries are allowed while those in the last `window` seconds are fewer than
+    ``min_per_second * window + ratio * requests``.
+    """
+
+    def __init__(self, ratio=0.2, min_per_second=1.0, window=10.0):
+        """
+        :param ratio: retries allowed per request, defaults to 0.2
+        :type ratio: float, optional
+        :param min_per_second: retries always allowed, for clients making few requests,
+            defaults to 1
+        :type min_per_second: float, optional
+        :param window: seconds over which requests and retries are counted, defaults to 10
+        :type window: float, optional
+        """
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.window = window
+        self._lock = threading.Lock()
+        self._requests = collections.deque()
+        self._retries = collections.deque()
+
+    def __getstate__(self):
+        # the counts only describe this process
+        state = self.__dict__.copy()
+        del state["_lock"]
+        state["_requests"] = collections.deque()
+        state["_retries"] = collections.deque()
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _expire(self, now):
+        for times in (self._requests, self._retries):
+            while times and times[0] <= now - self.window:
+                times.popleft()
+
+    def record_request(self):
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            self._requests.append(now)
+
+    def try_retry(self):
+        """Use up a retry if the budget allows one
+
+        :return: whether the retry may be made
+        :rtype: bool
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._expire(now)
+            allowed = self.min_per_second * self.window + self.ratio * len(self._requests)
+            if len(self._retries) >= allowed:
+                return False
+            self._retries.append(now)
+            return True
+
+
+class CircuitBreaker:
+    """
+    Stops requests to a host after `failure_threshold` transient failures in a row. After
+    `reset_timeout` seconds, one request is let through: if it succeeds requests resume,
+    otherwise the host is given another `reset_timeout`.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, host, failure_threshold=5, reset_timeout=30.0):
+        self.host = host
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self._opened_at = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"CircuitBreaker ({self.host} {self.state})"
+
+    def before_request(self):
+        """
+        :raises CircuitOpenError: when the host should not be called now
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            waited = time.monotonic() - self._opened_at
+            if self.state == self.OPEN and waited >= self.reset_timeout:
+                # this request is the trial, others are refused until it is done
+                self.state = self.HALF_OPEN
+                return
+            raise CircuitOpenError(self.host, max(0.0, self.reset_timeout - waited))
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    logger.warning(
+                        "Not sending requests to %s for %ss", self.host, self.reset_timeout
+                    )
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+
+    def record_not_sent(self):
+        """The request was stopped by the client before reaching the host"""
+        with self._lock:
+            if self.state == self.HALF_OPEN:
+                # it was the trial, let the next request be one instead
+                self.state = self.OPEN
+                self._opened_at = time.monotonic() - self.reset_timeout
+
+
+class RetryPolicy:
+    """
+    Retries requests which failed for a transient reason, with exponential backoff and full
+    jitter, a retry budget and a circuit breaker per host.
+
+    Transient failures are the AnyEvent statuses in `TRANSIENT_STATUS_CODES`, connection
+    errors and config lock timeouts. Requests with a method in `idempotent_methods` (only GET
+    by default) are retried after any of them. Other methods are only retried when the request
+    cannot have been carried out: the connection was never made or the config lock could not
+    be taken. In the Proxmox API, POST usually starts a task and PUT or DELETE may too (e.g.
+    resizing a disk or destroying a guest), so they are not retried after e.g. a reset
+    connection unless added to `idempotent_methods`.
+
+    .. code-block:: python
+
+        prox = ProxmoxAPI("pve1", ..., retry_policy=RetryPolicy(max_attempts=5))
+
+        # the config of guests and storages can safely be set again
+        RetryPolicy(idempotent_methods=("GET", "PUT"))
+    """
+
+    def __init__(
+        self,
+        max_attempts=3,
+        backoff=0.5,
+        max_backoff=30.0,
+        idempotent_methods=("GET",),
+        status_codes=TRANSIENT_STATUS_CODES,
+        retry_lock_timeouts=True,
+        budget=None,
+        failure_threshold=5,
+        reset_timeout=30.0,
+    ):
+        """
+        :param max_attempts: attempts per request, including the first, defaults to 3
+        :type max_attempts: int, optional
+        :param backoff: seconds of the first backoff, doubled for each attempt, defaults to 0.5
+        :type backoff: float, optional
+        :param max_backoff: longest backoff, in seconds, defaults to 30
+        :type max_backoff: float, optional
+        :param idempotent_methods: methods which are retried after any transient failure,
+            defaults to GET only
+        :type idempotent_methods: Iterable[str], optional
+        :param status_codes: statuses which are transient, defaults to TRANSIENT_STATUS_CODES
+        :type status_codes: Iterable[int], optional
+        :param retry_lock_timeouts: retry requests which timed out waiting for a config lock,
+            defaults to True
+        :type retry_lock_timeouts: bool, optional
+        :param budget: limits retries across all requests, defaults to a `RetryBudget()`
+        :type budget: RetryBudget, optional
+        :param failure_threshold: transient failures in a row which open a host's circuit
+            breaker, None to never open it, defaults to 5
+        :type failure_threshold: Optional[int], optional
+        :param reset_timeout: seconds an open circuit breaker refuses requests, defaults to 30
+        :type reset_timeout: float, optional
+        """
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.idempotent_methods = {m.upper() for m in idempotent_methods}
+        self.status_codes = set(status_codes)
+        self.retry_lock_timeouts = retry_lock_timeouts
+        self.budget = budget if budget is not None else RetryBudget()
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._breakers = {}
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # the circuit breakers only describe this process
+        state = self.__dict__.copy()
+        del state["_lock"]
+        state["_breakers"] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def breaker(self, host):
+        """The circuit breaker of a host, None if they are disabled"""
+        if self.failure_threshold is None:
+            return None
+        with self._lock:
+            breaker = self._breakers.get(host)
+            if breaker is None:
+                breaker = self._breakers[host] = CircuitBreaker(
+                    host, self.failure_threshold, self.reset_timeout
+                )
+            return breaker
+
+    def failure_kind(self, error):
+        """
+        How a request failed
+
+        :param error: the exception raised by the request
+        :type error: Exception
+        :return: "not_sent" if the request cannot have been carried out, "transient" for other
+            transient failures, None for failures which would happen again
+        :rtype: Optional[str]
+        """
+        if isinstance(error, _CLIENT_ERRORS):
+            # the time given to the request is up, not the host's fault
+            return None
+        status_code = getattr(error, "status_code", None)
+        if status_code is not None:
+            if self.retry_lock_timeouts and LOCK_TIMEOUT_PATTERN.search(str(error)):
+                return "not_sent"
+            if status_code == 595 and 595 in self.status_codes:
+                # pveproxy could not connect to the target node
+                return "not_sent"
+            if status_code in self.status_codes:
+                return "transient"
+            return None
+
+        causes = []
+        cause = error
+        while cause is not None and cause not in causes:
+            causes.append(cause)
+            # urllib3 keeps the underlying error as the reason of MaxRetryError
+            reason = getattr(cause, "reason", None)
+            cause = (
+                cause.__cause__
+                or cause.__context__
+                or (reason if isinstance(reason, BaseException) else None)
+            )
+        names = {type(cause).__name__ for cause in causes}
+        if "SSLCertVerificationError" in names:
+            return None
+        if names.intersection(_NOT_SENT_ERRORS) or any(
+            isinstance(cause, ConnectionRefusedError) for cause in causes
+        ):
+            return "not_sent"
+        if isinstance(error, (OSError, EOFError)):
+            # requests' ConnectionError and Timeout are OSErrors, like resets and socket errors
+            return "transient"
+        return None
+
+    def should_retry(self, method, kind, attempt):
+        if kind is None or attempt >= self.max_attempts:
+            return False
+        return kind == "not_sent" or method.upper() in self.idempotent_methods
+
+    def backoff_time(self, attempt):
+        """Seconds to wait before the next attempt, with full jitter"""
+        # jitter only spreads retries out, it is not used for anything secret
+        return random.uniform(  # nosec B311
+            0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1))
+        )
+
+    def call(self, method, host, request, data=None, deadline=None):
+        """
+        Make a request, retrying it as allowed by the policy
+
+        :param method: the HTTP method
+        :type method: str
+        :param host: the host the request is sent to, for its circuit breaker
+        :type host: str
+        :param request: makes one attempt, returning the decoded data or raising on failure
+        :type request: Callable[[], Any]
+        :param data: the request's data, requests with files are not retried
+        :type data: Optional[dict]
+        :param deadline: the request is not retried if the backoff would end after it
+        :type deadline: Optional[Deadline]
+        :return: the result of the successful attempt
+        """
+        # a partly sent upload cannot be sent again
+        replayable = not any(
+            isinstance(v, io.IOBase) or hasattr(v, "read") for v in (data or {}).values()
+        )
+        breaker = self.breaker(host)
+        self.budget.record_request()
+        attempt = 1
+        while True:
+            if breaker is not None:
+                breaker.before_request()
+            try:
+                result = request()
+            except Exception as e:
+                kind = self.failure_kind(e)
+                if breaker is not None:
+                    if isinstance(e, _CLIENT_ERRORS):
+                        breaker.record_not_sent()
+                    # an error response still shows the host is answering
+                    elif kind is None:
+                        breaker.record_success()
+                    else:
+                        breaker.record_failure()
+                if not (
+                    replayable
+                    and self.should_retry(method, kind, attempt)
+                    and self.budget.try_retry()
+                ):
+                    raise
+                delay = self.backoff_time(attempt)
+                if deadline is not None and delay >= deadline.remaining():
+                    raise
+                logger.warning(
+                    "%s to %s failed (%s), retrying in %.2fs (attempt %s of %s)",
+                    method,
+                    host,
+                    e,
+                    delay,
+                    attempt + 1,
+                    self.max_attempts,
+                )
+                time.sleep(delay)
+                attempt += 1
+            else:
+                if breaker is not None:
+                    breaker.record_success()
+                return result
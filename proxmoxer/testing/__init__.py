@@ -0,0 +1,5 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+from .server import *  # noqa: F401 F403
@@ -0,0 +1,86 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+import argparse
+import logging
+
+from proxmoxer.testing.server import FakeCluster, FakePVEServer
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        prog="python -m proxmoxer.testing",
+        description="Run a fake PVE API server for local load testing",
+    )
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on")
+    parser.add_argument("--port", type=int, default=8006, help="port to listen on")
+    parser.add_argument("--workers", type=int, default=3, help="requests handled at once")
+    parser.add_argument(
+        "--latency",
+        type=float,
+        nargs="+",
+        default=[0.0],
+        metavar="SECONDS",
+        help="delay added to each request, or a MIN MAX range",
+    )
+    parser.add_argument(
+        "--error-rate", type=float, default=0.0, help="fraction of requests failing with 595-599"
+    )
+    parser.add_argument("--task-duration", type=float, default=0.5, help="seconds tasks run for")
+    parser.add_argument("--nodes", type=int, default=1, help="number of nodes")
+    parser.add_argument("--vms-per-node", type=int, default=3, help="number of VMs on each node")
+    parser.add_argument("--username", default="root@pam")
+    parser.add_argument("--password", default="password")
+    parser.add_argument(
+        "--token",
+        action="append",
+        default=[],
+        metavar="USER!NAME=VALUE",
+        help="a valid API token, may be repeated",
+    )
+    parser.add_argument("--certfile", help="certificate to serve (self-signed if not given)")
+    parser.add_argument("--keyfile", help="private key of the certificate")
+    parser.add_argument("--no-tls", action="store_true", help="serve plain HTTP")
+    parser.add_argument("--seed", type=int, help="seed for random latency and errors")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log every request")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(format="%(asctime)s %(message)s")
+    if args.verbose:
+        logging.getLogger("proxmoxer.testing.server").setLevel(logging.DEBUG)
+
+    tokens = dict(token.split("=", 1) for token in args.token) or None
+    latency = args.latency[0] if len(args.latency) == 1 else tuple(args.latency[:2])
+    server = FakePVEServer(
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        latency=latency,
+        error_rate=args.error_rate,
+        task_duration=args.task_duration,
+        username=args.username,
+        password=args.password,
+        tokens=tokens,
+        cluster=FakeCluster(
+            nodes=[f"node{i + 1}" for i in range(args.nodes)], vms_per_node=args.vms_per_node
+        ),
+        tls=not args.no_tls,
+        certfile=args.certfile,
+        keyfile=args.keyfile,
+        seed=args.seed,
+    )
+    print(f"Serving fake PVE API on {server.url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,738 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+import json
+import logging
+import os
+import random
+import re
+import secrets
+import shutil
+import ssl
+import subprocess  # nosec B404
+import tempfile
+import threading
+import time
+from collections import Counter, deque
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+from proxmoxer.core import ANYEVENT_HTTP_STATUS_CODES
+
+logger = logging.getLogger(__name__)
+logger.setLevel(level=logging.WARNING)
+
+API_PREFIX = "/api2/json"
+BODY_CHUNK_SIZE = 2**16  # read request bodies (e.g. uploads) 64 KiB at a time
+
+
+def generate_certificate(directory):
+    """
+    Create a self-signed certificate for localhost using the openssl CLI
+
+    :param directory: where to write the certificate and key files
+    :type directory: str
+    :return: paths of the certificate and key files
+    :rtype: Tuple[str, str]
+    """
+    certfile = os.path.join(directory, "cert.pem")
+    keyfile = os.path.join(directory, "key.pem")
+    openssl = shutil.which("openssl")
+    if openssl is None:
+        raise RuntimeError("'openssl' is needed to create a certificate, pass certfile and keyfile")
+    # fixed argument list, only the paths inside our own temporary directory vary
+    subprocess.run(  # nosec B603
+        [
+            openssl,
+            "req",
+            "-x509",
+            "-newkey",
+            "ec",
+            "-pkeyopt",
+            "ec_paramgen_curve:prime256v1",
+            "-nodes",
+            "-keyout",
+            keyfile,
+            "-out",
+            certfile,
+            "-days",
+            "30",
+            "-subj",
+            "/CN=localhost",
+        ],
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return certfile, keyfile
+
+
+class ApiError(Exception):
+    def __init__(self, status_code, reason, errors=None):
+        super().__init__(f"{status_code} {reason}")
+        self.status_code = status_code
+        self.reason = reason
+        self.errors = errors
+
+
+class FakeTask:
+    """A task which runs for a fixed time, then calls `on_finish` the first time it is seen stopped"""
+
+    def __init__(self, node, task_type, task_id, user, duration, on_finish=None):
+        self.node = node
+        self.type = task_type
+        self.id = task_id
+        self.user = user
+        self.duration = duration
+        self.on_finish = on_finish
+        self.started = time.monotonic()
+        self.starttime = int(time.time())
+        # fake process ids, nothing secret about them
+        self.pid = random.randrange(1, 2**22)  # nosec B311
+        self.pstart = random.randrange(1, 2**31)  # nosec B311
+        self.upid = (
+            f"UPID:{node}:{self.pid:08X}:{self.pstart:08X}:{self.starttime:08X}:"
+            f"{task_type}:{task_id}:{user}:"
+        )
+        self.finished = False
+
+    @property
+    def running(self):
+        return time.monotonic() - self.started < self.duration
+
+    def status(self):
+        data = {
+            "upid": self.upid,
+            "node": self.node,
+            "pid": self.pid,
+            "pstart": self.pstart,
+            "starttime": self.starttime,
+            "type": self.type,
+            "id": self.id,
+            "user": self.user,
+            "status": "running" if self.running else "stopped",
+        }
+        if not self.running:
+            data["exitstatus"] = "OK"
+        return data
+
+    def log(self):
+        elapsed = min(time.monotonic() - self.started, self.duration)
+        lines = [f"starting task {self.upid}"]
+        if self.duration:
+            lines.append(f"progress {int(elapsed / self.duration * 100)}%")
+        if not self.running:
+            lines.append("TASK OK")
+        return [{"n": i + 1, "t": line} for i, line in enumerate(lines)]
+
+
+class FakeCluster:
+    """The nodes, guests and tasks served by a FakePVEServer"""
+
+    def __init__(self, nodes=("node1",), vms_per_node=3, storages=("local",)):
+        self.lock = threading.Lock()
+        self.nodes = list(nodes)
+        self.storages = list(storages)
+        self.vms = {}
+        self.tasks = {}
+        self.content = {(node, storage): [] for node in self.nodes for storage in self.storages}
+
+        vmid = 100
+        for node in self.nodes:
+            for _ in range(vms_per_node):
+                self.add_vm(node, vmid)
+                vmid += 1
+
+    def add_vm(self, node, vmid, name=None, status="stopped"):
+        self.vms[int(vmid)] = {
+            "vmid": int(vmid),
+            "node": node,
+            "name": name or f"vm{vmid}",
+            "status": status,
+            "memory": 2048,
+            "cores": 2,
+        }
+
+    def finish_tasks(self):
+        # apply the effects of completed tasks, called with the lock held
+        for task in self.tasks.values():
+            if not task.finished and not task.running:
+                task.finished = True
+                if task.on_finish is not None:
+                    task.on_finish()
+
+
+class FakeAPI:
+    """
+    The PVE API endpoints emulated by the fake servers, called with the request's method,
+    API path and parameters independent of how the request arrived (HTTPS or pvesh over SSH)
+    """
+
+    # the default credentials are those of the fake cluster, not a real one
+    def __init__(  # nosec B107
+        self, cluster=None, task_duration=0.5, username="root@pam", password="password"
+    ):
+        """
+        :param cluster: the cluster state to serve, defaults to one node with 3 VMs
+        :type cluster: FakeCluster, optional
+        :param task_duration: how long tasks run for in seconds, defaults to 0.5
+        :type task_duration: float, optional
+        :param username: the user allowed to log in with `password`, defaults to "root@pam"
+        :type username: str, optional
+        :param password: the password of `username`, defaults to "password"
+        :type password: str, optional
+        """
+        self.cluster = cluster or FakeCluster()
+        self.task_duration = task_duration
+        self.username = username
+        self.password = password
+        self._lock = threading.Lock()
+        self._tickets = {}
+
+        self._routes = [
+            ("POST", r"/access/ticket", self._create_ticket),
+            ("GET", r"/version", self._get_version),
+            ("GET", r"/nodes", self._get_nodes),
+            ("GET", r"/nodes/(?P<node>[^/]+)/status", self._get_node_status),
+            ("GET", r"/cluster/resources", self._get_cluster_resources),
+            ("GET", r"/cluster/nextid", self._get_nextid),
+            ("GET", r"/nodes/(?P<node>[^/]+)/qemu", self._get_vms),
+            ("POST", r"/nodes/(?P<node>[^/]+)/qemu", self._create_vm),
+            ("GET", r"/nodes/(?P<node>[^/]+)/qemu/(?P<vmid>\d+)/status/current", self._get_vm),
+            ("GET", r"/nodes/(?P<node>[^/]+)/qemu/(?P<vmid>\d+)/config", self._get_vm_config),
+            (
+                "POST",
+                r"/nodes/(?P<node>[^/]+)/qemu/(?P<vmid>\d+)/status/"
+                r"(?P<action>start|stop|shutdown|reboot)",
+                self._vm_action,
+            ),
+            ("DELETE", r"/nodes/(?P<node>[^/]+)/qemu/(?P<vmid>\d+)", self._delete_vm),
+            ("GET", r"/nodes/(?P<node>[^/]+)/tasks", self._get_tasks),
+            ("GET", r"/nodes/(?P<node>[^/]+)/tasks/(?P<upid>[^/]+)/status", self._get_task),
+            ("GET", r"/nodes/(?P<node>[^/]+)/tasks/(?P<upid>[^/]+)/log", self._get_task_log),
+            (
+                "POST",
+                r"/nodes/(?P<node>[^/]+)/storage/(?P<storage>[^/]+)/upload",
+                self._upload,
+            ),
+            (
+                "GET",
+                r"/nodes/(?P<node>[^/]+)/storage/(?P<storage>[^/]+)/content",
+                self._get_content,
+            ),
+        ]
+        self._routes = [(m, re.compile(p + "$"), f) for m, p, f in self._routes]
+
+    def call(self, method, path, params, authenticate=None):
+        """
+        Run an API request
+
+        :param method: the HTTP method
+        :type method: str
+        :param path: the API path below /api2/json (e.g. "/nodes")
+        :type path: str
+        :param params: the request parameters
+        :type params: dict
+        :param authenticate: called before any request other than a login, raising ApiError
+            if the request is not authenticated
+        :type authenticate: Callable[[], None], optional
+        :raises ApiError: if the request fails
+        :return: the response data
+        """
+        for route_method, pattern, func in self._routes:
+            match = pattern.match(path)
+            if match and route_method == method:
+                break
+        else:
+            raise ApiError(501, f"Method '{method} {API_PREFIX}{path}' not implemented")
+
+        if authenticate is not None and path != "/access/ticket":
+            authenticate()
+        with self.cluster.lock:
+            self.cluster.finish_tasks()
+            return func(params=params, **match.groupdict())
+
+    def ticket_session(self, ticket):
+        """Return the user and CSRF token of a ticket, None if the ticket is not valid"""
+        with self._lock:
+            return self._tickets.get(ticket)
+
+    def _new_task(self, node, task_type, task_id, on_finish=None):
+        task = FakeTask(node, task_type, task_id, self.username, self.task_duration, on_finish)
+        self.cluster.tasks[task.upid] = task
+        return task.upid
+
+    def _get_node(self, node):
+        if node not in self.cluster.nodes:
+            raise ApiError(595, f"no such cluster node '{node}'")
+        return node
+
+    def _get_vm_on_node(self, node, vmid):
+        vm = self.cluster.vms.get(int(vmid))
+        if vm is None or vm["node"] != self._get_node(node):
+            raise ApiError(
+                500, f"Configuration file 'nodes/{node}/qemu-server/{vmid}.conf' does not exist"
+            )
+        return vm
+
+    # API endpoints
+
+    def _create_ticket(self, params):
+        username = params.get("username")
+        password = params.get("password")
+        with self._lock:
+            renewing = self._tickets.get(password, {}).get("username") == username
+        if username != self.username or (password != self.password and not renewing):
+            raise ApiError(401, "authentication failure")
+
+        ticket = f"PVE:{username}:{secrets.token_hex(16).upper()}"
+        csrf = secrets.token_hex(16)
+        with self._lock:
+            self._tickets[ticket] = {"username": username, "csrf": csrf}
+        return {
+            "username": username,
+            "ticket": ticket,
+            "CSRFPreventionToken": csrf,
+            "cap": {},
+        }
+
+    def _get_version(self, params):
+        return {"version": "8.2.4", "release": "8.2", "repoid": "faa83925"}
+
+    def _get_nodes(self, params):
+        return [
+            {"node": node, "status": "online", "type": "node", "maxcpu": 16, "maxmem": 2**36}
+            for node in self.cluster.nodes
+        ]
+
+    def _get_node_status(self, params, node):
+        self._get_node(node)
+        return {"uptime": 3600, "cpu": 0.05, "memory": {"total": 2**36, "used": 2**34}}
+
+    def _get_cluster_resources(self, params):
+        resources = []
+        if params.get("type") in (None, "node"):
+            resources += [
+                {"id": f"node/{node}", "type": "node", "node": node, "status": "online"}
+                for node in self.cluster.nodes
+            ]
+        if params.get("type") in (None, "vm"):
+            resources += [
+                {"id": f"qemu/{vm['vmid']}", "type": "qemu", **vm}
+                for vm in self.cluster.vms.values()
+            ]
+        return resources
+
+    def _get_nextid(self, params):
+        return str(max(self.cluster.vms, default=99) + 1)
+
+    def _get_vms(self, params, node):
+        self._get_node(node)
+        return [dict(vm) for vm in self.cluster.vms.values() if vm["node"] == node]
+
+    def _create_vm(self, params, node):
+        self._get_node(node)
+        vmid = params.get("vmid")
+        if vmid is None or not vmid.isdigit():
+            raise ApiError(400, "Parameter verification failed.", {"vmid": "property is missing"})
+        if int(vmid) in self.cluster.vms:
+            raise ApiError(500, f"unable to create VM {vmid} - VM {vmid} already exists")
+
+        def finish():
+            self.cluster.add_vm(node, vmid, params.get("name"))
+
+        return self._new_task(node, "qmcreate", vmid, finish)
+
+    def _get_vm(self, params, node, vmid):
+        return dict(self._get_vm_on_node(node, vmid))
+
+    def _get_vm_config(self, params, node, vmid):
+        vm = self._get_vm_on_node(node, vmid)
+        return {"name": vm["name"], "memory": vm["memory"], "cores": vm["cores"]}
+
+    def _vm_action(self, params, node, vmid, action):
+        vm = self._get_vm_on_node(node, vmid)
+        status = "running" if action in ("start", "reboot") else "stopped"
+
+        def finish():
+            vm["status"] = status
+
+        return self._new_task(node, f"qm{action}", vmid, finish)
+
+    def _delete_vm(self, params, node, vmid):
+        self._get_vm_on_node(node, vmid)
+
+        def finish():
+            self.cluster.vms.pop(int(vmid), None)
+
+        return self._new_task(node, "qmdestroy", vmid, finish)
+
+    def _get_tasks(self, params, node):
+        self._get_node(node)
+        tasks = [task.status() for task in self.cluster.tasks.values() if task.node == node]
+        return tasks[-int(params.get("limit", 50)) :]
+
+    def _get_task(self, params, node, upid):
+        task = self.cluster.tasks.get(upid)
+        if task is None or task.node != self._get_node(node):
+            raise ApiError(500, f"unable to parse worker upid '{upid}'")
+        return task.status()
+
+    def _get_task_log(self, params, node, upid):
+        task = self.cluster.tasks.get(upid)
+        if task is None or task.node != self._get_node(node):
+            raise ApiError(500, f"unable to parse worker upid '{upid}'")
+        return task.log()
+
+    def _upload(self, params, node, storage):
+        self._get_node(node)
+        if (node, storage) not in self.cluster.content:
+            raise ApiError(500, f"storage '{storage}' does not exist")
+        if "_upload_size" not in params or not params.get("filename"):
+            raise ApiError(400, "Parameter verification failed.", {"filename": "missing file"})
+
+        content_type = params.get("content", "iso")
+        volid = f"{storage}:{content_type}/{params['filename']}"
+        entry = {"volid": volid, "content": content_type, "size": params["_upload_size"]}
+
+        def finish():
+            self.cluster.content[(node, storage)].append(entry)
+
+        return self._new_task(node, "imgcopy", "", finish)
+
+    def _get_content(self, params, node, storage):
+        self._get_node(node)
+        if (node, storage) not in self.cluster.content:
+            raise ApiError(500, f"storage '{storage}' does not exist")
+        return list(self.cluster.content[(node, storage)])
+
+
+class FakePVERequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "pve-api-daemon/3.0"
+    # headers and body are written separately, don't let Nagle delay the body on keep-alive
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        logger.debug("%s - " + format, self.address_string(), *args)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        self.server.fake.handle(self)
+
+    do_POST = do_PUT = do_DELETE = do_GET
+
+
+class FakePVEServer:
+    """
+    A local stand-in for pveproxy, serving part of the PVE API over real sockets (TLS and
+    keep-alive included) so client throughput, pooling and retries can be measured offline.
+
+    Emulated:
+        * ticket (``/access/ticket``) and API token authentication, including CSRF checks
+        * nodes, guests (list, status, config, create, start/stop/shutdown/reboot, delete),
+          ``/cluster/resources`` and ``/cluster/nextid``
+        * tasks which run for ``task_duration`` seconds, with status and log endpoints
+        * storage uploads (the body is read and discarded) and content listing
+
+    Requests are handled by at most ``workers`` threads at once, like pveproxy's worker
+    processes; others wait for a free worker. Every request can be delayed by ``latency``
+    and fail with one of ``error_codes`` at ``error_rate``, or errors can be queued with
+    `inject_error`.
+
+    .. code-block:: python
+
+        with FakePVEServer(latency=0.02) as server:
+            prox = ProxmoxAPI(server.address, user="root@pam", password="password", verify_ssl=False)
+            prox.nodes.get()
+    """
+
+    # the default credentials are those of the fake cluster, not a real one
+    def __init__(  # nosec B107
+        self,
+        host="127.0.0.1",
+        port=0,
+        workers=3,
+        latency=0.0,
+        error_rate=0.0,
+        error_codes=tuple(ANYEVENT_HTTP_STATUS_CODES),
+        task_duration=0.5,
+        username="root@pam",
+        password="password",
+        tokens=None,
+        cluster=None,
+        tls=True,
+        certfile=None,
+        keyfile=None,
+        seed=None,
+    ):
+        """
+        :param host: address to listen on, defaults to "127.0.0.1"
+        :type host: str, optional
+        :param port: port to listen on, defaults to 0 (any free port)
+        :type port: int, optional
+        :param workers: the number of requests handled at the same time, defaults to 3
+        :type workers: int, optional
+        :param latency: seconds added to every request, a (min, max) range or a function
+            called with (method, path) returning the seconds, defaults to 0
+        :type latency: float | Tuple[float, float] | Callable[[str, str], float], optional
+        :param error_rate: the fraction of requests which fail with a random `error_codes`
+            status, defaults to 0
+        :type error_rate: float, optional
+        :param error_codes: statuses used for random errors, defaults to 595-599
+        :type error_codes: Iterable[int], optional
+        :param task_duration: how long tasks run for in seconds, defaults to 0.5
+        :type task_duration: float, optional
+        :param username: the user allowed to log in with `password`, defaults to "root@pam"
+        :type username: str, optional
+        :param password: the password of `username`, defaults to "password"
+        :type password: str, optional
+        :param tokens: valid API tokens as {"user@realm!name": "value"}, defaults to
+            {"root@pam!token": "secret"}
+        :type tokens: dict, optional
+        :param cluster: the cluster state to serve, defaults to one node with 3 VMs
+        :type cluster: FakeCluster, optional
+        :param tls: serve HTTPS, defaults to True
+        :type tls: bool, optional
+        :param certfile: certificate to serve, a self-signed one is generated if not given
+        :type certfile: str, optional
+        :param keyfile: private key of `certfile`
+        :type keyfile: str, optional
+        :param seed: seed for the random latency and errors, to make runs repeatable
+        :type seed: int, optional
+        """
+        self.workers = workers
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_codes = list(error_codes)
+        self.tokens = tokens if tokens is not None else {"root@pam!token": "secret"}
+        self.api = FakeAPI(cluster, task_duration, username, password)
+        self.cluster = self.api.cluster
+
+        self.stats = Counter()
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._worker_slots = threading.BoundedSemaphore(workers)
+        self._random = random.Random(seed)
+        self._injected_errors = deque()
+        self._tmpdir = None
+        self._thread = None
+        self._serving = False
+
+        self._httpd = ThreadingHTTPServer((host, port), FakePVERequestHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.fake = self
+        self.tls = tls
+        if tls:
+            if certfile is None:
+                self._tmpdir = tempfile.mkdtemp(prefix="proxmoxer-testing-")
+                certfile, keyfile = generate_certificate(self._tmpdir)
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile, keyfile)
+            # handshake in the connection threads rather than the accepting one
+            self._httpd.socket = context.wrap_socket(
+                self._httpd.socket, server_side=True, do_handshake_on_connect=False
+            )
+
+    @property
+    def host(self):
+        return self._httpd.server_address[0]
+
+    @property
+    def port(self):
+        return self._httpd.server_address[1]
+
+    @property
+    def address(self):
+        """``host:port``, to be passed as the host to ProxmoxAPI"""
+        return f"{self.host}:{self.port}"
+
+    @property
+    def url(self):
+        scheme = "https" if self.tls else "http"
+        return f"{scheme}://{self.address}{API_PREFIX}"
+
+    def start(self):
+        """Serve requests from a background thread"""
+        self._serving = True
+        self._thread = threading.Thread(
+            target=self._httpd.serve_forever, args=(0.05,), name="FakePVEServer", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def serve_forever(self):
+        """Serve requests from the current thread until `stop` is called"""
+        self._serving = True
+        self._httpd.serve_forever(0.05)
+
+    def stop(self):
+        if self._serving:
+            # shutdown() waits for serve_forever, so it would block if that never ran
+            self._httpd.shutdown()
+            self._serving = False
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+        if self._tmpdir is not None:
+            shutil.rmtree(self._tmpdir, ignore_errors=True)
+            self._tmpdir = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def inject_error(self, status_code, count=1, path=None):
+        """
+        Make the next `count` requests (to `path` if given) fail with `status_code`
+
+        :param status_code: the status to respond with (e.g. 596)
+        :type status_code: int
+        :param count: the number of requests to fail, defaults to 1
+        :type count: int, optional
+        :param path: only fail requests to this API path (e.g. "/nodes"), defaults to any
+        :type path: str, optional
+        """
+        with self._lock:
+            for _ in range(count):
+                self._injected_errors.append((status_code, path))
+
+    def _next_error(self, path):
+        with self._lock:
+            for i, (status_code, error_path) in enumerate(self._injected_errors):
+                if error_path is None or error_path == path:
+                    del self._injected_errors[i]
+                    return status_code
+            if self.error_rate and self._random.random() < self.error_rate:
+                return self._random.choice(self.error_codes)
+        return None
+
+    def _latency(self, method, path):
+        if callable(self.latency):
+            return self.latency(method, path)
+        if isinstance(self.latency, (tuple, list)):
+            with self._lock:
+                return self._random.uniform(*self.latency)
+        return self.latency
+
+    def handle(self, handler):
+        url = urlsplit(handler.path)
+        method = handler.command
+        path = unquote(url.path)
+        if path.startswith(API_PREFIX):
+            path = path[len(API_PREFIX) :] or "/"
+
+        with self._worker_slots:
+            with self._lock:
+                self._in_flight += 1
+                self.max_in_flight = max(self.max_in_flight, self._in_flight)
+                self.stats["requests"] += 1
+            try:
+                status_code, reason, body = self._dispatch(handler, method, path, url.query)
+            finally:
+                with self._lock:
+                    self._in_flight -= 1
+
+        with self._lock:
+            self.stats[status_code] += 1
+        content = json.dumps(body).encode("utf-8")
+        handler.send_response(status_code, reason)
+        handler.send_header("Content-Type", "application/json;charset=UTF-8")
+        handler.send_header("Content-Length", str(len(content)))
+        handler.send_header("Cache-Control", "max-age=0")
+        handler.end_headers()
+        handler.wfile.write(content)
+
+    def _dispatch(self, handler, method, path, query):
+        delay = self._latency(method, path)
+        if delay:
+            time.sleep(delay)
+
+        try:
+            # the body is always read so the connection can be kept alive after an error
+            params = self._read_params(handler, method, path, query)
+
+            error = self._next_error(path)
+            if error is not None:
+                return (
+                    error,
+                    ANYEVENT_HTTP_STATUS_CODES.get(error, "injected error"),
+                    {"data": None},
+                )
+
+            data = self.api.call(
+                method, path, params, authenticate=lambda: self._check_auth(handler, method)
+            )
+            return 200, "OK", {"data": data}
+        except ApiError as e:
+            body = {"data": None}
+            if e.errors:
+                body["errors"] = e.errors
+            return e.status_code, e.reason, body
+
+    def _read_params(self, handler, method, path, query):
+        params = {k: v[-1] for k, v in parse_qs(query).items()}
+        if method not in ("POST", "PUT", "DELETE"):
+            return params
+
+        length = handler.headers.get("Content-Length")
+        if length is None:
+            if handler.headers.get("Transfer-Encoding"):
+                handler.close_connection = True
+                raise ApiError(411, "Length Required")
+            return params
+
+        remaining = int(length)
+        content_type = handler.headers.get("Content-Type", "")
+        if content_type.startswith("multipart/form-data"):
+            # stream uploads without holding them in memory, keep only the form fields
+            params.update(self._read_multipart(handler, remaining))
+        else:
+            body = handler.rfile.read(remaining).decode("utf-8")
+            params.update({k: v[-1] for k, v in parse_qs(body).items()})
+        return params
+
+    def _read_multipart(self, handler, remaining):
+        fields = {}
+        head = b""
+        size = 0
+        while remaining > 0:
+            chunk = handler.rfile.read(min(BODY_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            size += len(chunk)
+            if len(head) < BODY_CHUNK_SIZE:
+                head += chunk
+
+        # small form fields come before the file in requests' encoding
+        for name, value in re.findall(
+            rb'Content-Disposition: form-data; name="([^"]+)"\r\n\r\n([^\r]*)\r\n', head
+        ):
+            fields[name.decode("utf-8")] = value.decode("utf-8")
+        match = re.search(rb'name="filename"; filename="([^"]*)"', head)
+        if match:
+            fields["filename"] = match.group(1).decode("utf-8")
+        fields["_upload_size"] = size
+        return fields
+
+    def _check_auth(self, handler, method):
+        authorization = handler.headers.get("Authorization", "")
+        if authorization.startswith("PVEAPIToken="):
+            token_id, _, value = authorization[len("PVEAPIToken=") :].partition("=")
+            if self.tokens.get(token_id) != value:
+                raise ApiError(401, "invalid token value!")
+            return token_id.split("!")[0]
+
+        cookie = SimpleCookie(handler.headers.get("Cookie", ""))
+        ticket = cookie["PVEAuthCookie"].value if "PVEAuthCookie" in cookie else None
+        session = self.api.ticket_session(ticket)
+        if session is None:
+            raise ApiError(401, "No ticket")
+        if method != "GET" and handler.headers.get("CSRFPreventionToken") != session["csrf"]:
+            raise ApiError(401, "Permission denied - invalid csrf token")
+        return session["username"]
@@ -0,0 +1,521 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+import json
+import logging
+import os
+import shlex
+import shutil
+import socket
+import struct
+import tempfile
+import threading
+import time
+from collections import Counter
+
+from proxmoxer.backends.command_base import upload_shell_command
+from proxmoxer.testing.server import ApiError, FakeAPI
+
+logger = logging.getLogger(__name__)
+logger.setLevel(level=logging.WARNING)
+logging.getLogger(f"{__name__}.transport").setLevel(level=logging.CRITICAL)
+
+try:
+    import paramiko
+except ImportError:
+    import sys
+
+    logger.error("FakeSSHServer requires 'paramiko' module\n")
+    sys.exit(1)
+
+from paramiko.common import cMSG_CHANNEL_SUCCESS  # noqa: E402
+
+STDIN_CHUNK_SIZE = 2**16  # read uploads streamed over stdin 64 KiB at a time
+
+# openssh_wrapper runs commands by starting a shell and writing the command to its stdin
+SHELLS = ("/bin/bash", "/bin/sh", "bash", "sh")
+
+# commands which upload over stdin are wrapped in this, see upload_shell_command
+UPLOAD_PREFIX = upload_shell_command([])
+
+# not 255, which openssh_wrapper treats as a failure of ssh itself
+PVESH_ERROR_STATUS = 2
+
+PVESH_COMMANDS = {"get": "GET", "create": "POST", "set": "PUT", "delete": "DELETE"}
+
+
+class FakeSFTPHandle(paramiko.SFTPHandle):
+    def stat(self):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.fstat(self.readfile.fileno()))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def chattr(self, attr):
+        return paramiko.SFTP_OK
+
+
+class FakeSFTPInterface(paramiko.SFTPServerInterface):
+    """SFTP access to the fake node's file system, which is kept below the server's root directory"""
+
+    def __init__(self, server, *args, **kwargs):
+        super().__init__(server, *args, **kwargs)
+        self.fake = server.fake
+
+    def _local(self, path):
+        return self.fake.local_path(self.canonicalize(path))
+
+    def list_folder(self, path):
+        try:
+            local = self._local(path)
+            result = []
+            for name in os.listdir(local):
+                attr = paramiko.SFTPAttributes.from_stat(os.stat(os.path.join(local, name)))
+                attr.filename = name
+                result.append(attr)
+            return result
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def stat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.stat(self._local(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def lstat(self, path):
+        try:
+            return paramiko.SFTPAttributes.from_stat(os.lstat(self._local(path)))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+    def open(self, path, flags, attr):
+        local = self._local(path)
+        if flags & os.O_CREAT:
+            # like a node's /tmp, any directory written to exists
+            os.makedirs(os.path.dirname(local), exist_ok=True)
+        try:
+            fd = os.open(local, flags, 0o600)
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+
+        if flags & os.O_WRONLY:
+            mode = "ab" if flags & os.O_APPEND else "wb"
+        elif flags & os.O_RDWR:
+            mode = "a+b" if flags & os.O_APPEND else "r+b"
+        else:
+            mode = "rb"
+        f_obj = os.fdopen(fd, mode)
+
+        handle = FakeSFTPHandle(flags)
+        handle.filename = local
+        handle.readfile = f_obj
+        handle.writefile = f_obj
+        return handle
+
+    def remove(self, path):
+        try:
+            os.remove(self._local(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def rename(self, oldpath, newpath):
+        try:
+            os.rename(self._local(oldpath), self._local(newpath))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def mkdir(self, path, attr):
+        try:
+            os.mkdir(self._local(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def rmdir(self, path):
+        try:
+            os.rmdir(self._local(path))
+        except OSError as e:
+            return paramiko.SFTPServer.convert_errno(e.errno)
+        return paramiko.SFTP_OK
+
+    def chattr(self, path, attr):
+        return paramiko.SFTP_OK
+
+
+class FakeSFTPServer(paramiko.SFTPServer):
+    def finish_subsystem(self):
+        # sshd reports the exit status of sftp-server, scp fails without one
+        try:
+            self.sock.send_exit_status(0)
+        except OSError:
+            pass
+        super().finish_subsystem()
+
+
+class FakeServerInterface(paramiko.ServerInterface):
+    def __init__(self, fake):
+        self.fake = fake
+
+    def get_allowed_auths(self, username):
+        return "publickey,password"
+
+    def check_auth_password(self, username, password):
+        if username == self.fake.username and password == self.fake.password:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_auth_publickey(self, username, key):
+        if username == self.fake.username and key.asbytes() in self.fake.authorized_keys:
+            return paramiko.AUTH_SUCCESSFUL
+        return paramiko.AUTH_FAILED
+
+    def check_channel_request(self, kind, chanid):
+        if kind == "session":
+            return paramiko.OPEN_SUCCEEDED
+        return paramiko.OPEN_FAILED_ADMINISTRATIVELY_PROHIBITED
+
+    def check_channel_exec_request(self, channel, command):
+        channel.transport.pending_commands[channel.remote_chanid] = threading.Thread(
+            target=self.fake.handle_channel,
+            args=(channel, command.decode("utf-8")),
+            name="FakeSSHServer-exec",
+            daemon=True,
+        )
+        return True
+
+
+class FakeTransport(paramiko.Transport):
+    """
+    Starts a command once its exec request has been confirmed, so a quick command cannot close
+    its channel before the client knows it was started
+    """
+
+    def __init__(self, sock):
+        super().__init__(sock)
+        self.pending_commands = {}
+
+    def _send_user_message(self, data):
+        super()._send_user_message(data)
+        message = data.asbytes()
+        if message[:1] == cMSG_CHANNEL_SUCCESS:
+            (chanid,) = struct.unpack(">I", message[1:5])
+            command = self.pending_commands.pop(chanid, None)
+            if command is not None:
+                command.start()
+
+
+class FakeSSHServer:
+    """
+    A local stand-in for a Proxmox node's SSH server, so the command backends (openssh and
+    ssh_paramiko) can be measured over real SSH connections without a node.
+
+    Emulated:
+        * password and public key authentication (a client key is generated for OpenSSH)
+        * ``pvesh`` (and ``pmgsh``), answering from the same `FakeAPI` as `FakePVEServer`,
+          optionally with ``sudo``
+        * uploads streamed over stdin by the backends and SFTP (also used by ``scp``), with
+          files kept below a temporary root directory
+
+    Every command can be delayed by ``latency``, e.g. to model pvesh's start-up time. Each
+    command runs in its own thread, so concurrent channels are handled concurrently.
+
+    This module needs paramiko, so it is not imported by ``proxmoxer.testing`` itself.
+
+    .. code-block:: python
+
+        from proxmoxer.testing.ssh import FakeSSHServer
+
+        with FakeSSHServer() as server:
+            prox = ProxmoxAPI(**server.api_kwargs("ssh_paramiko"))
+            prox.nodes.get()
+    """
+
+    # the default credentials are those of the fake host, not a real one
+    def __init__(  # nosec B107
+        self,
+        host="127.0.0.1",
+        port=0,
+        username="root",
+        password="password",
+        api=None,
+        latency=0.0,
+        host_key=None,
+        root=None,
+    ):
+        """
+        :param host: address to listen on, defaults to "127.0.0.1"
+        :type host: str, optional
+        :param port: port to listen on, defaults to 0 (any free port)
+        :type port: int, optional
+        :param username: the user allowed to log in, defaults to "root"
+        :type username: str, optional
+        :param password: the password of `username`, defaults to "password"
+        :type password: str, optional
+        :param api: the API answering pvesh commands, e.g. a FakePVEServer's ``api`` to share
+            its state, defaults to a new FakeAPI
+        :type api: FakeAPI, optional
+        :param latency: seconds added to every command, defaults to 0
+        :type latency: float, optional
+        :param host_key: the server's host key, one is generated if not given
+        :type host_key: paramiko.PKey, optional
+        :param root: directory holding the fake node's files, a temporary one if not given
+        :type root: str, optional
+        """
+        self.username = username
+        self.password = password
+        self.api = api or FakeAPI()
+        self.latency = latency
+        self.host_key = host_key or paramiko.ECDSAKey.generate()
+
+        self.stats = Counter()
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self._transports = []
+        self._thread = None
+        self._running = False
+
+        self._tmpdir = tempfile.mkdtemp(prefix="proxmoxer-testing-ssh-")
+        self.root = root or os.path.join(self._tmpdir, "root")
+        # the fake host's /tmp, which lives inside our own temporary directory
+        os.makedirs(self.local_path("/tmp"), exist_ok=True)  # nosec B108
+
+        # a key pair for clients, as OpenSSH can only log in with a key non-interactively
+        self.client_key = paramiko.ECDSAKey.generate()
+        self.client_key_file = os.path.join(self._tmpdir, "id_ecdsa")
+        self.client_key.write_private_key_file(self.client_key_file)
+        self.authorized_keys = {self.client_key.asbytes()}
+        self.ssh_config_file = os.path.join(self._tmpdir, "ssh_config")
+        with open(self.ssh_config_file, "w", encoding="utf-8") as f_obj:
+            f_obj.write(
+                "Host *\n"
+                "    StrictHostKeyChecking no\n"
+                "    UserKnownHostsFile /dev/null\n"
+                "    IdentitiesOnly yes\n"
+                "    BatchMode yes\n"
+                "    LogLevel ERROR\n"
+            )
+
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((host, port))
+        self._socket.listen(32)
+
+    @property
+    def host(self):
+        return self._socket.getsockname()[0]
+
+    @property
+    def port(self):
+        return self._socket.getsockname()[1]
+
+    @property
+    def cluster(self):
+        return self.api.cluster
+
+    def api_kwargs(self, backend="ssh_paramiko"):
+        """
+        Arguments for ProxmoxAPI to connect to this server
+
+        :param backend: "ssh_paramiko" (password login) or "openssh" (key login)
+        :type backend: str, optional
+        :return: keyword arguments for ProxmoxAPI
+        :rtype: dict
+        """
+        kwargs = {"host": self.host, "backend": backend, "user": self.username, "port": self.port}
+        if backend == "openssh":
+            kwargs["config_file"] = self.ssh_config_file
+            kwargs["identity_file"] = self.client_key_file
+        else:
+            kwargs["password"] = self.password
+        return kwargs
+
+    def local_path(self, path):
+        """
+        Return where a file of the fake node is kept on the local file system
+
+        :param path: the absolute path on the fake node
+        :type path: str
+        :rtype: str
+        """
+        return os.path.join(self.root, os.path.normpath("/" + path).lstrip("/"))
+
+    def start(self):
+        """Accept connections from a background thread"""
+        self._running = True
+        self._thread = threading.Thread(target=self._accept_loop, name="FakeSSHServer", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        # unblock accept()
+        try:
+            self._socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self._socket.close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        with self._lock:
+            transports, self._transports = self._transports, []
+        for transport in transports:
+            transport.close()
+        shutil.rmtree(self._tmpdir, ignore_errors=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _accept_loop(self):
+        while self._running:
+            try:
+                sock, _ = self._socket.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            transport = FakeTransport(sock)
+            # ssh clients often disconnect without closing the session, which paramiko logs as an
+            # error, so only critical messages are shown
+            transport.set_log_channel(f"{__name__}.transport")
+            transport.add_server_key(self.host_key)
+            transport.set_subsystem_handler("sftp", FakeSFTPServer, FakeSFTPInterface)
+            with self._lock:
+                self._transports.append(transport)
+                self.stats["connections"] += 1
+            try:
+                transport.start_server(server=FakeServerInterface(self))
+            except (paramiko.SSHException, EOFError) as e:
+                logger.debug("SSH negotiation failed: %s", e)
+
+    def handle_channel(self, channel, command):
+        """Run an exec request's command, sending its output and exit status to the channel"""
+        with self._lock:
+            self._in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self._in_flight)
+            self.stats["commands"] += 1
+        try:
+            if self.latency:
+                time.sleep(self.latency)
+            status, stdout, stderr = self.run_command(command, channel)
+        except Exception as e:  # pylint: disable=broad-except
+            logger.warning("fake command %r failed: %s", command, e)
+            status, stdout, stderr = 1, b"", f"{e}\n".encode("utf-8")
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+        try:
+            if stdout:
+                channel.sendall(stdout)
+            if stderr:
+                channel.sendall_stderr(stderr)
+            channel.send_exit_status(status)
+        except OSError as e:
+            logger.debug("client went away: %s", e)
+        channel.close()
+
+    def run_command(self, command, channel):
+        """
+        Run a shell command on the fake node
+
+        :param command: the command line sent by the client
+        :type command: str
+        :param channel: the channel to read stdin from
+        :type channel: paramiko.Channel
+        :return: the exit status, stdout and stderr
+        :rtype: Tuple[int, bytes, bytes]
+        """
+        if command.strip() in SHELLS:
+            command = self._read_stdin(channel).decode("utf-8")
+
+        if command.startswith(UPLOAD_PREFIX):
+            return self._run_upload(command[len(UPLOAD_PREFIX) :], channel)
+
+        args = shlex.split(command)
+        if args and args[0] == "sudo":
+            args = args[1:]
+        if not args:
+            return 0, b"", b""
+        if args[0] == "true":
+            return 0, b"", b""
+        if args[0] in ("pvesh", "pmgsh"):
+            return self._pvesh(args[1:])
+        return 127, b"", f"bash: {args[0]}: command not found\n".encode("utf-8")
+
+    def _read_stdin(self, channel, f_obj=None):
+        data = []
+        while True:
+            chunk = channel.recv(STDIN_CHUNK_SIZE)
+            if not chunk:
+                break
+            if f_obj is not None:
+                f_obj.write(chunk)
+            else:
+                data.append(chunk)
+        return b"".join(data)
+
+    def _run_upload(self, command, channel):
+        # like `cat > "$(mktemp)"`, then run the command with the file and remove it
+        # the fake host's /tmp, which lives inside our own temporary directory
+        tmp_dir = self.local_path("/tmp")  # nosec B108
+        fd, local_file = tempfile.mkstemp(prefix="tmp.", dir=tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as f_obj:
+                self._read_stdin(channel, f_obj)
+            remote_path = "/" + os.path.relpath(local_file, self.root)
+            return self.run_command(command.replace('"$tmpfile"', shlex.quote(remote_path)), None)
+        finally:
+            os.remove(local_file)
+
+    def _pvesh(self, args):
+        if len(args) < 2 or args[0] not in PVESH_COMMANDS:
+            return PVESH_ERROR_STATUS, b"", b"400 unknown command\n"
+        method = PVESH_COMMANDS[args[0]]
+        path = args[1]
+
+        params = {}
+        options = iter(args[2:])
+        for option in options:
+            value = next(options, "")
+            if option.startswith("--"):
+                # output options such as --output-format
+                continue
+            key = option.lstrip("-")
+            if key in params:
+                # repeated options, e.g. -command of agent exec
+                if not isinstance(params[key], list):
+                    params[key] = [params[key]]
+                params[key].append(value)
+            else:
+                params[key] = value
+
+        if "tmpfilename" in params:
+            # uploads read the file pvesh is given instead of a request body
+            params["filename"] = os.path.basename(params.get("filename", ""))
+            try:
+                params["_upload_size"] = os.path.getsize(self.local_path(params["tmpfilename"]))
+            except OSError:
+                return (
+                    PVESH_ERROR_STATUS,
+                    b"",
+                    f"500 unable to open '{params['tmpfilename']}'\n".encode("utf-8"),
+                )
+
+        try:
+            data = self.api.call(method, path, params)
+        except ApiError as e:
+            lines = [f"{e.status_code} {e.reason}"]
+            lines += [f"{key}: {value}" for key, value in (e.errors or {}).items()]
+            return PVESH_ERROR_STATUS, b"", ("\n".join(lines) + "\n").encode("utf-8")
+
+        if data is None:
+            return 0, b"", b""
+        return 0, json.dumps(data).encode("utf-8"), b""
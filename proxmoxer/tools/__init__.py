@@ -2,6 +2,32 @@ __author__ = "John Hollowell"
 __copyright__ = "(c) John Hollowell 2022"
 __license__ = "MIT"
 
-from . import *  # noqa: F401 F403
-from .files import *  # noqa: F401 F403
-from .tasks import *  # noqa: F401 F403
+import importlib
+
+# the tools are imported on first use, so that only the ones needed are loaded
+# (e.g. Tasks without Files, which needs `requests`)
+_SUBMODULES = {
+    "CHECKSUM_CHUNK_SIZE": ".files",
+    "ChecksumInfo": ".files",
+    "SupportedChecksums": ".files",
+    "Files": ".files",
+    "Fleet": ".fleet",
+    "FleetResult": ".fleet",
+    "DEFAULT_BUCKETS": ".metrics",
+    "RequestMetrics": ".metrics",
+    "Tasks": ".tasks",
+}
+
+__all__ = list(_SUBMODULES)
+
+
+def __getattr__(name):
+    if name not in _SUBMODULES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_SUBMODULES[name], __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
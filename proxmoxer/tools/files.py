@@ -11,7 +11,9 @@ from pathlib import Path
 from typing import Optional
 from urllib.parse import urljoin, urlparse
 
-from proxmoxer import ProxmoxResource, ResourceException
+from proxmoxer import ProxmoxResource, ResourceException, tracing
+from proxmoxer.deadline import Deadline, DeadlineExceeded
+from proxmoxer.limits import QueueTimeout
 from proxmoxer.tools.tasks import Tasks
 
 CHECKSUM_CHUNK_SIZE = 16384  # read 16k at a time while calculating the checksum for upload
@@ -71,7 +73,9 @@ class Files:
         filename: str,
         do_checksum_check: bool = True,
         blocking_status: bool = True,
+        deadline: Optional[Deadline] = None,
     ):
+        prox = self._prox if deadline is None else self._prox.with_deadline(deadline)
         file_path = Path(filename)
 
         if not file_path.is_file():
@@ -100,8 +104,9 @@ class Files:
                         h = hashlib.new(checksum_type)
 
                         # Iterate through the file in CHECKSUM_CHUNK_SIZE size
-                        for byte_block in iter(lambda: f_obj.read(CHECKSUM_CHUNK_SIZE), b""):
-                            h.update(byte_block)
+                        with tracing.span("proxmoxer.files.checksum", **{"file.path": filename}):
+                            for byte_block in iter(lambda: f_obj.read(CHECKSUM_CHUNK_SIZE), b""):
+                                h.update(byte_block)
                         checksum = h.hexdigest()
                         logger.debug(
                             f"The {checksum_type} checksum of {file_path.absolute()} is {checksum}"
@@ -116,15 +121,19 @@ class Files:
                     "checksum": checksum,
                     "filename": f_obj,
                 }
-                upid = self._prox.nodes(self._node).storage(self._storage).upload.post(**params)
+                with tracing.span("proxmoxer.files.upload", **{"file.path": filename}):
+                    upid = prox.nodes(self._node).storage(self._storage).upload.post(**params)
+        except (DeadlineExceeded, QueueTimeout):
+            # TimeoutErrors are OSErrors too, but these must reach the caller
+            raise
         except OSError as e:
             logger.error(e)
             return None
 
         if blocking_status:
-            return Tasks.blocking_status(self._prox, upid)
+            return Tasks.blocking_status(self._prox, upid, deadline=deadline)
         else:
-            return self._prox.nodes(self._node).tasks(upid).status.get()
+            return prox.nodes(self._node).tasks(upid).status.get()
 
     def download_file_to_storage(
         self,
@@ -132,15 +141,19 @@ class Files:
         checksum: Optional[str] = None,
         checksum_type: Optional[str] = None,
         blocking_status: bool = True,
+        deadline: Optional[Deadline] = None,
     ):
-        file_info = self.get_file_info(url)
+        prox = self._prox if deadline is None else self._prox.with_deadline(deadline)
+        file_info = self.get_file_info(url, deadline)
         filename = None
 
         if file_info is not None:
             filename = file_info.get("filename")
 
         if checksum is None and checksum_type is None:
-            checksum, checksum_info = self.get_checksums_from_file_url(url, filename)
+            checksum, checksum_info = self.get_checksums_from_file_url(
+                url, filename, deadline=deadline
+            )
             checksum_type = checksum_info.name if checksum_info else None
         elif checksum is None or checksum_type is None:
             logger.error(
@@ -158,16 +171,17 @@ class Files:
             "content": "iso" if url.endswith("iso") else "vztmpl",
             "filename": filename,
         }
-        upid = self._prox.nodes(self._node).storage(self._storage)("download-url").post(**params)
+        upid = prox.nodes(self._node).storage(self._storage)("download-url").post(**params)
 
         if blocking_status:
-            return Tasks.blocking_status(self._prox, upid)
+            return Tasks.blocking_status(self._prox, upid, deadline=deadline)
         else:
-            return self._prox.nodes(self._node).tasks(upid).status.get()
+            return prox.nodes(self._node).tasks(upid).status.get()
 
-    def get_file_info(self, url: str):
+    def get_file_info(self, url: str, deadline: Optional[Deadline] = None):
+        prox = self._prox if deadline is None else self._prox.with_deadline(deadline)
         try:
-            return self._prox.nodes(self._node)("query-url-metadata").get(url=url)
+            return prox.nodes(self._node)("query-url-metadata").get(url=url)
 
         except ResourceException as e:
             logger.warning(f"Unable to get information for {url}: {e}")
@@ -175,7 +189,10 @@ class Files:
 
     @staticmethod
     def get_checksums_from_file_url(
-        url: str, filename: str = None, preferred_type=SupportedChecksums.SHA512.value
+        url: str,
+        filename: str = None,
+        preferred_type=SupportedChecksums.SHA512.value,
+        deadline: Optional[Deadline] = None,
     ):
         getters_by_quality = [
             Files._get_checksum_from_sibling_file,
@@ -187,20 +204,24 @@ class Files:
         all_types_with_priority = list(
             dict.fromkeys([preferred_type, *(map(lambda t: t.value, SupportedChecksums))])
         )
-        for c_info in all_types_with_priority:
-            for getter in getters_by_quality:
-                checksum: str = getter(url, c_info, filename)
-                if checksum is not None:
-                    logger.info(f"{getter} found {str(c_info)} checksum {checksum}")
-                    return (checksum, c_info)
-                else:
-                    logger.debug(f"{getter} found no {str(c_info)} checksum")
+        with tracing.span("proxmoxer.files.checksum_discovery", **{"url.full": url}):
+            for c_info in all_types_with_priority:
+                for getter in getters_by_quality:
+                    checksum: str = getter(url, c_info, filename, deadline)
+                    if checksum is not None:
+                        logger.info("%s found %s checksum %s", getter, c_info, checksum)
+                        return (checksum, c_info)
+                    else:
+                        logger.debug("%s found no %s checksum", getter, c_info)
 
         return (None, None)
 
     @staticmethod
     def _get_checksum_from_sibling_file(
-        url: str, checksum_info: ChecksumInfo, filename: Optional[str] = None
+        url: str,
+        checksum_info: ChecksumInfo,
+        filename: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
     ) -> Optional[str]:
         """
         Uses a checksum file in the same path as the target file to discover the checksum
@@ -211,17 +232,22 @@ class Files:
         :type checksum_info: ChecksumInfo
         :param filename: the filename to use for finding the checksum. If None, it will be discovered from the url
         :type filename: str | None
+        :param deadline: time by which the checksum must be found, the request waits at most until then
+        :type deadline: Deadline | None
         :return: a string of the checksum if found, else None
         :rtype: str | None
         """
         sumfile_url = urljoin(url, (checksum_info.name + "SUMS").upper())
         filename = filename or os.path.basename(urlparse(url).path)
 
-        return Files._get_checksum_helper(sumfile_url, filename, checksum_info)
+        return Files._get_checksum_helper(sumfile_url, filename, checksum_info, deadline)
 
     @staticmethod
     def _get_checksum_from_extension(
-        url: str, checksum_info: ChecksumInfo, filename: Optional[str] = None
+        url: str,
+        checksum_info: ChecksumInfo,
+        filename: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
     ) -> Optional[str]:
         """
         Uses a checksum file with a checksum extension added to the target file to discover the checksum
@@ -232,17 +258,22 @@ class Files:
         :type checksum_info: ChecksumInfo
         :param filename: the filename to use for finding the checksum. If None, it will be discovered from the url
         :type filename: str | None
+        :param deadline: time by which the checksum must be found, the request waits at most until then
+        :type deadline: Deadline | None
         :return: a string of the checksum if found, else None
         :rtype: str | None
         """
         sumfile_url = url + "." + checksum_info.name
         filename = filename or os.path.basename(urlparse(url).path)
 
-        return Files._get_checksum_helper(sumfile_url, filename, checksum_info)
+        return Files._get_checksum_helper(sumfile_url, filename, checksum_info, deadline)
 
     @staticmethod
     def _get_checksum_from_extension_upper(
-        url: str, checksum_info: ChecksumInfo, filename: Optional[str] = None
+        url: str,
+        checksum_info: ChecksumInfo,
+        filename: Optional[str] = None,
+        deadline: Optional[Deadline] = None,
     ) -> Optional[str]:
         """
         Uses a checksum file with a checksum extension added to the target file to discover the checksum
@@ -253,27 +284,42 @@ class Files:
         :type checksum_info: ChecksumInfo
         :param filename: the filename to use for finding the checksum. If None, it will be discovered from the url
         :type filename: str | None
+        :param deadline: time by which the checksum must be found, the request waits at most until then
+        :type deadline: Deadline | None
         :return: a string of the checksum if found, else None
         :rtype: str | None
         """
         sumfile_url = url + "." + checksum_info.name.upper()
         filename = filename or os.path.basename(urlparse(url).path)
 
-        return Files._get_checksum_helper(sumfile_url, filename, checksum_info)
+        return Files._get_checksum_helper(sumfile_url, filename, checksum_info, deadline)
 
     @staticmethod
-    def _get_checksum_helper(sumfile_url: str, filename: str, checksum_info: ChecksumInfo):
-        logger.debug(f"getting {sumfile_url}")
+    def _get_checksum_helper(
+        sumfile_url: str,
+        filename: str,
+        checksum_info: ChecksumInfo,
+        deadline: Optional[Deadline] = None,
+    ):
+        logger.debug("getting %s", sumfile_url)
+        timeout = 10 if deadline is None else deadline.timeout(10, f"GET {sumfile_url}")
         try:
-            resp = requests.get(sumfile_url, timeout=10)
+            with tracing.span(
+                "proxmoxer.files.checksum_probe", **{"url.full": sumfile_url}
+            ) as span:
+                resp = requests.get(sumfile_url, timeout=timeout)
+                span.set_attribute("http.status_code", resp.status_code)
         except (requests.exceptions.ConnectionError, requests.exceptions.ReadTimeout):
-            logger.info(f"Failed when trying to get {sumfile_url}")
+            logger.info("Failed when trying to get %s", sumfile_url)
             return None
 
         if resp.status_code == 200:
+            # checked once rather than for each of the (possibly thousands of) lines
+            debug = logger.isEnabledFor(logging.DEBUG)
             for line in resp.iter_lines():
                 line_str = line.decode("utf-8")
-                logger.debug(f"checking for '{filename}' in '{line_str}'")
+                if debug:
+                    logger.debug("checking for '%s' in '%s'", filename, line_str)
                 if filename in str(line_str):
                     return line_str[0 : checksum_info.hex_size]
         return None
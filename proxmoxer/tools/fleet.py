@@ -0,0 +1,246 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+import contextvars
+import logging
+import queue
+import threading
+import time
+
+from proxmoxer.core import connect_many
+
+logger = logging.getLogger(__name__)
+logger.setLevel(level=logging.WARNING)
+
+
+class FleetResult:
+    """
+    The outcome of a fleet call on one cluster: either the `value` returned or the `error`
+    raised (a TimeoutError if the cluster did not answer in time)
+    """
+
+    def __init__(self, cluster, value=None, error=None, elapsed=None):
+        self.cluster = cluster
+        self.value = value
+        self.error = error
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    def result(self):
+        """The value returned by the cluster, or raise its error"""
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+    def __repr__(self):
+        outcome = "ok" if self.ok else f"{type(self.error).__name__}: {self.error}"
+        return f"FleetResult ({self.cluster} {outcome})"
+
+
+class Fleet:
+    """
+    Runs the same call on many ProxmoxAPI instances (clusters, PBS or PMG hosts) concurrently,
+    returning a result per cluster. A cluster which fails or times out does not affect the
+    others.
+
+    Example::
+
+        fleet = Fleet({"pve1": prox1, "pve2": prox2, "backup": pbs}, timeout=10)
+
+        for result in fleet.imap(lambda prox: prox.cluster.resources.get(type="vm")):
+            if result.ok:
+                print(result.cluster, len(result.value))
+
+        versions = fleet.select(service="PVE").get("version")
+
+    A call which times out is reported as such, but carries on in the background until the
+    client's own request timeout; it is still counted against `max_workers` meanwhile, also by
+    later calls of the fleet, so a hung cluster cannot pile up threads.
+    """
+
+    def __init__(self, clients, max_workers=16, timeout=None):
+        """
+        :param clients: the ProxmoxAPI instances, keyed by cluster name
+        :type clients: Mapping[str, ProxmoxAPI]
+        :param max_workers: clusters called at the same time, defaults to 16
+        :type max_workers: int, optional
+        :param timeout: seconds each cluster has to answer, either for all of them or by
+            cluster name, defaults to no limit
+        :type timeout: float | Mapping[str, float], optional
+        """
+        self._clients = dict(clients)
+        self.max_workers = max_workers
+        self.timeout = timeout
+        # clusters which could not be connected to by `from_configs`, by name
+        self.errors = {}
+        # held by each call's thread until it returns, even after it timed out
+        self._workers = threading.Semaphore(max_workers)
+
+    @classmethod
+    def from_configs(cls, configs, max_workers=16, timeout=None, warm=False):
+        """
+        Create the clients (concurrently, see `connect_many`) and a fleet of them. Clusters which
+        fail to connect are left out of the fleet and their errors kept in `errors`.
+
+        :param configs: ProxmoxAPI keyword arguments, keyed by cluster name
+        :type configs: Mapping[str, dict]
+        :param warm: make a first request with each client, defaults to False
+        :type warm: bool, optional
+        :return: the fleet
+        :rtype: Fleet
+        """
+        clients = connect_many(configs, max_workers=max_workers, warm=warm, return_exceptions=True)
+        errors = {}
+        for name, client in list(clients.items()):
+            if isinstance(client, Exception):
+                logger.warning("Leaving %s out of the fleet: %s", name, client)
+                errors[name] = clients.pop(name)
+
+        fleet = cls(clients, max_workers, timeout)
+        fleet.errors = errors
+        return fleet
+
+    def __repr__(self):
+        return f"Fleet ({len(self._clients)} clusters)"
+
+    def __len__(self):
+        return len(self._clients)
+
+    def __iter__(self):
+        return iter(self._clients)
+
+    def __contains__(self, name):
+        return name in self._clients
+
+    def __getitem__(self, name):
+        return self._clients[name]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        """Close every client"""
+        for prox in self._clients.values():
+            prox.close()
+
+    def select(self, *names, service=None):
+        """
+        A fleet of some of the clusters, sharing their clients and settings
+
+        :param names: clusters to keep, defaults to all of them
+        :type names: str
+        :param service: only keep clients of this service (PVE, PBS or PMG)
+        :type service: str, optional
+        :return: the smaller fleet, sharing this one's workers
+        :rtype: Fleet
+        """
+        clients = {
+            name: prox
+            for name, prox in self._clients.items()
+            if (not names or name in names)
+            and (service is None or prox._service == service.upper())
+        }
+        fleet = Fleet(clients, self.max_workers, self.timeout)
+        fleet._workers = self._workers
+        return fleet
+
+    def _timeout_for(self, name, timeout):
+        if isinstance(timeout, dict):
+            return timeout.get(name)
+        return timeout
+
+    def imap(self, func, timeout=None):
+        """
+        Call ``func(prox)`` for every cluster, yielding the results as they complete
+
+        :param func: the call to make on each ProxmoxAPI
+        :type func: Callable[[ProxmoxAPI], Any]
+        :param timeout: overrides the fleet's timeout for this call
+        :type timeout: float | Mapping[str, float], optional
+        :return: a result for each cluster, in the order they complete
+        :rtype: Iterator[FleetResult]
+        """
+        timeout = self.timeout if timeout is None else timeout
+        completed = queue.Queue()
+
+        def run(name, prox, start):
+            try:
+                value = func(prox)
+            except Exception as e:  # pylint: disable=broad-except
+                completed.put(FleetResult(name, error=e, elapsed=time.monotonic() - start))
+            else:
+                completed.put(FleetResult(name, value=value, elapsed=time.monotonic() - start))
+            finally:
+                self._workers.release()
+
+        waiting = list(self._clients.items())
+        running = {}  # name -> (start, timeout)
+        while waiting or running:
+            # without calls of our own to wait for, wait for the timed out ones to finish
+            while waiting and self._workers.acquire(blocking=not running):
+                name, prox = waiting.pop(0)
+                start = time.monotonic()
+                running[name] = (start, self._timeout_for(name, timeout))
+                # each thread gets a copy of the context, so the call is traced under the caller
+                context = contextvars.copy_context()
+                threading.Thread(
+                    target=context.run,
+                    args=(run, name, prox, start),
+                    name=f"fleet-{name}",
+                    daemon=True,
+                ).start()
+
+            deadlines = [start + limit for start, limit in running.values() if limit is not None]
+            wait = max(0.0, min(deadlines) - time.monotonic()) if deadlines else None
+            try:
+                result = completed.get(timeout=wait)
+            except queue.Empty:
+                now = time.monotonic()
+                for name, (start, limit) in list(running.items()):
+                    if limit is not None and start + limit <= now:
+                        del running[name]
+                        logger.warning("%s did not answer within %ss", name, limit)
+                        yield FleetResult(
+                            name,
+                            error=TimeoutError(f"{name} did not answer within {limit}s"),
+                            elapsed=now - start,
+                        )
+                continue
+
+            # a call finishing after its timeout was already reported
+            if result.cluster in running:
+                del running[result.cluster]
+                yield result
+
+    def map(self, func, timeout=None):
+        """
+        Call ``func(prox)`` for every cluster and gather the results
+
+        :param func: the call to make on each ProxmoxAPI
+        :type func: Callable[[ProxmoxAPI], Any]
+        :param timeout: overrides the fleet's timeout for this call
+        :type timeout: float | Mapping[str, float], optional
+        :return: the result of each cluster, in the fleet's order
+        :rtype: Dict[str, FleetResult]
+        """
+        results = {result.cluster: result for result in self.imap(func, timeout=timeout)}
+        return {name: results[name] for name in self._clients}
+
+    def get(self, path, **params):
+        return self.map(lambda prox: prox(path.strip("/")).get(**params))
+
+    def post(self, path, **data):
+        return self.map(lambda prox: prox(path.strip("/")).post(**data))
+
+    def put(self, path, **data):
+        return self.map(lambda prox: prox(path.strip("/")).put(**data))
+
+    def delete(self, path, **params):
+        return self.map(lambda prox: prox(path.strip("/")).delete(**params))
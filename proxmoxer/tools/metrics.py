@@ -0,0 +1,170 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+import bisect
+import threading
+
+# seconds, suited to API calls from a few milliseconds up to long synchronous requests
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    return ",".join(f'{name}="{_escape_label(value)}"' for name, value in labels)
+
+
+class _Histogram:
+    def __init__(self, num_buckets):
+        self.bucket_counts = [0] * num_buckets
+        self.count = 0
+        self.sum = 0.0
+
+
+class RequestMetrics:
+    """
+    Aggregates request events into per-endpoint latency histograms and byte counters,
+    which can be exported in the Prometheus text format.
+
+    Requests are grouped by method, API path template (e.g. ``/nodes/{node}/qemu/{vmid}``)
+    and status code, so the number of series does not grow with the number of VMs or nodes.
+
+    Example::
+
+        metrics = RequestMetrics()
+        prox.add_request_hook(metrics)
+        ...
+        print(metrics.prometheus_text())
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS, prefix="proxmoxer"):
+        """
+        :param buckets: upper bounds (in seconds) of the histogram buckets, defaults to DEFAULT_BUCKETS
+        :type buckets: Iterable[float], optional
+        :param prefix: prefix for the exported metric names, defaults to "proxmoxer"
+        :type prefix: str, optional
+        """
+        self.buckets = tuple(sorted(buckets))
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._step_seconds = {}
+        self._bytes_sent = {}
+        self._bytes_received = {}
+
+    def __call__(self, event):
+        self.record(event)
+
+    def record(self, event):
+        """
+        Add a request to the metrics
+
+        :param event: the event passed to a request hook
+        :type event: RequestEvent
+        """
+        status = "error" if event.status_code is None else str(event.status_code)
+        key = (event.method, event.path, status)
+        total = event.timings.get("total") or 0.0
+
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = _Histogram(len(self.buckets))
+            # buckets are stored non-cumulatively and summed when exported
+            index = bisect.bisect_left(self.buckets, total)
+            if index < len(self.buckets):
+                histogram.bucket_counts[index] += 1
+            histogram.count += 1
+            histogram.sum += total
+
+            endpoint = (event.method, event.path)
+            for step, seconds in event.timings.items():
+                if step != "total" and seconds is not None:
+                    step_key = endpoint + (step,)
+                    self._step_seconds[step_key] = self._step_seconds.get(step_key, 0.0) + seconds
+            if event.bytes_sent is not None:
+                self._bytes_sent[endpoint] = self._bytes_sent.get(endpoint, 0) + event.bytes_sent
+            if event.bytes_received is not None:
+                self._bytes_received[endpoint] = (
+                    self._bytes_received.get(endpoint, 0) + event.bytes_received
+                )
+
+    def snapshot(self):
+        """
+        Get the current request latency histograms
+
+        :return: for each (method, path, status), the request count, total seconds and
+            cumulative bucket counts keyed by bucket upper bound
+        :rtype: dict
+        """
+        with self._lock:
+            result = {}
+            for key, histogram in self._histograms.items():
+                cumulative = 0
+                buckets = {}
+                for bound, count in zip(self.buckets, histogram.bucket_counts):
+                    cumulative += count
+                    buckets[bound] = cumulative
+                buckets[float("inf")] = histogram.count
+                result[key] = {"count": histogram.count, "sum": histogram.sum, "buckets": buckets}
+            return result
+
+    def reset(self):
+        """Discard all recorded metrics"""
+        with self._lock:
+            self._histograms.clear()
+            self._step_seconds.clear()
+            self._bytes_sent.clear()
+            self._bytes_received.clear()
+
+    def prometheus_text(self):
+        """
+        Export the metrics in the Prometheus text exposition format
+
+        :return: the metrics, ready to be served on a /metrics endpoint
+        :rtype: str
+        """
+        name = f"{self.prefix}_request_duration_seconds"
+        lines = [
+            f"# HELP {name} Time taken by Proxmox API requests.",
+            f"# TYPE {name} histogram",
+        ]
+        for (method, path, status), data in sorted(self.snapshot().items()):
+            labels = [("method", method), ("path", path), ("status", status)]
+            for bound, count in data["buckets"].items():
+                le = "+Inf" if bound == float("inf") else repr(float(bound))
+                lines.append(f"{name}_bucket{{{_format_labels(labels + [('le', le)])}}} {count}")
+            lines.append(f"{name}_sum{{{_format_labels(labels)}}} {data['sum']!r}")
+            lines.append(f"{name}_count{{{_format_labels(labels)}}} {data['count']}")
+
+        with self._lock:
+            counters = [
+                (
+                    f"{self.prefix}_request_step_seconds_total",
+                    "Time spent in each step of Proxmox API requests.",
+                    ("method", "path", "step"),
+                    dict(self._step_seconds),
+                ),
+                (
+                    f"{self.prefix}_request_sent_bytes_total",
+                    "Bytes sent in Proxmox API requests.",
+                    ("method", "path"),
+                    dict(self._bytes_sent),
+                ),
+                (
+                    f"{self.prefix}_request_received_bytes_total",
+                    "Bytes received in Proxmox API responses.",
+                    ("method", "path"),
+                    dict(self._bytes_received),
+                ),
+            ]
+        for counter_name, help_text, label_names, values in counters:
+            lines.append(f"# HELP {counter_name} {help_text}")
+            lines.append(f"# TYPE {counter_name} counter")
+            for key, value in sorted(values.items()):
+                lines.append(f"{counter_name}{{{_format_labels(zip(label_names, key))}}} {value!r}")
+
+        return "\n".join(lines) + "\n"
@@ -4,6 +4,8 @@ __license__ = "MIT"
 
 import time
 
+from proxmoxer import tracing
+
 
 class Tasks:
     """
@@ -12,11 +14,14 @@ class Tasks:
     """
 
     @staticmethod
-    def blocking_status(prox, task_id, timeout=300, polling_interval=1):
+    def blocking_status(prox, task_id, timeout=300, polling_interval=1, deadline=None):
         """
         Turns getting the status of a Proxmox task into a blocking call
         by polling the API until the task completes
 
+        Unlike `timeout`, a `deadline` bounds the whole operation the task is part of: polls
+        wait at most for the time it leaves, and DeadlineExceeded is raised once it has passed.
+
         :param prox: The Proxmox object used to query for status
         :type prox: ProxmoxAPI
         :param task_id: the UPID of the task
@@ -25,19 +30,33 @@ class Tasks:
         :type timeout: int, optional
         :param polling_interval: the time to wait between checking for status updates, defaults to 1
         :type polling_interval: float, optional
+        :param deadline: time by which the task must be done, defaults to None
+        :type deadline: Deadline, optional
+        :raises DeadlineExceeded: if the deadline passed before the task was done
         :return: the status of the task
         :rtype: dict
         """
         node: str = Tasks.decode_upid(task_id)["node"]
+        if deadline is not None:
+            prox = prox.with_deadline(deadline)
         start_time: float = time.monotonic()
         data = {"status": ""}
-        while data["status"] != "stopped":
-            data = prox.nodes(node).tasks(task_id).status.get()
-            if start_time + timeout <= time.monotonic():
-                data = None  # type: ignore
-                break
+        with tracing.span("proxmoxer.tasks.blocking_status", **{"proxmoxer.upid": task_id}) as span:
+            polls = 0
+            while data["status"] != "stopped":
+                polls += 1
+                with tracing.span("proxmoxer.tasks.poll", **{"proxmoxer.poll": polls}):
+                    data = prox.nodes(node).tasks(task_id).status.get()
+                if start_time + timeout <= time.monotonic():
+                    data = None  # type: ignore
+                    break
 
-            time.sleep(polling_interval)
+                if deadline is not None:
+                    # the next poll fails fast if the task is not done by then
+                    time.sleep(min(polling_interval, deadline.remaining()))
+                else:
+                    time.sleep(polling_interval)
+            span.set_attribute("proxmoxer.polls", polls)
         return data
 
     @staticmethod
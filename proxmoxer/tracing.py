@@ -0,0 +1,197 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+import contextvars
+import functools
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+# the span in progress in the current thread or asyncio task
+_current_span = contextvars.ContextVar("proxmoxer_current_span", default=None)
+
+
+class Span:
+    """A timed operation, nested under the span which was current when it started"""
+
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.parent = parent
+        # random ids in the W3C trace context sizes (uuid is slow to import)
+        self.trace_id = parent.trace_id if parent is not None else os.urandom(16).hex()
+        self.span_id = os.urandom(8).hex()
+        self.attributes = dict(attributes or {})
+        self.start_time = time.time()
+        self.end_time = None
+        self.exception = None
+
+    @property
+    def duration(self):
+        if self.end_time is None:
+            return None
+        return self.end_time - self.start_time
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def record_exception(self, exception):
+        self.exception = exception
+
+    def end(self):
+        self.end_time = time.time()
+
+    def __repr__(self):
+        return f"Span ({self.name} {self.span_id} in trace {self.trace_id})"
+
+
+class _NoopSpan:
+    def set_attribute(self, key, value):
+        pass
+
+    def record_exception(self, exception):
+        pass
+
+
+class NoopTracer:
+    """The default tracer, which does not record anything"""
+
+    # nullcontext is reusable, so no objects are created for each span
+    _span = nullcontext(_NoopSpan())
+
+    def start_span(self, name, attributes=None):
+        return self._span
+
+
+class Tracer:
+    """
+    Base class for tracers which create `Span` objects, nesting them using the current
+    context. Subclasses override `on_end` to export finished spans.
+    """
+
+    @contextmanager
+    def start_span(self, name, attributes=None):
+        span = Span(name, _current_span.get(), attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.record_exception(e)
+            raise
+        finally:
+            span.end()
+            _current_span.reset(token)
+            self.on_end(span)
+
+    def on_end(self, span):
+        pass
+
+
+class RecordingTracer(Tracer):
+    """A tracer keeping all finished spans in memory, e.g. to inspect a slow run"""
+
+    def __init__(self):
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def on_end(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+
+class OpenTelemetryTracer:
+    """
+    Sends spans to OpenTelemetry, which manages its own context
+
+    .. code-block:: python
+
+        from opentelemetry import trace
+
+        tracing.set_tracer(tracing.OpenTelemetryTracer(trace.get_tracer("proxmoxer")))
+    """
+
+    def __init__(self, otel_tracer):
+        """
+        :param otel_tracer: the tracer to create spans with
+        :type otel_tracer: opentelemetry.trace.Tracer
+        """
+        self.otel_tracer = otel_tracer
+
+    def start_span(self, name, attributes=None):
+        return self.otel_tracer.start_as_current_span(name, attributes=attributes)
+
+
+_tracer = NoopTracer()
+
+
+def set_tracer(tracer):
+    """
+    Set the tracer used for all proxmoxer spans
+
+    :param tracer: the tracer, None to stop tracing
+    :type tracer: Tracer | OpenTelemetryTracer | None
+    """
+    global _tracer  # pylint: disable=global-statement
+    _tracer = tracer if tracer is not None else NoopTracer()
+
+
+def get_tracer():
+    return _tracer
+
+
+def span(name, **attributes):
+    """
+    Context manager timing the enclosed code as a span of the current tracer
+
+    :param name: the name of the operation
+    :type name: str
+    :return: context manager yielding the span
+    """
+    return _tracer.start_span(name, attributes)
+
+
+def traced(name):
+    """
+    Decorator running each call of the function in a span
+
+    :param name: the name of the span
+    :type name: str
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def current_span():
+    """Return the span in progress in the current context (only for `Tracer` based tracers)"""
+    return _current_span.get()
+
+
+def wrap(func):
+    """
+    Bind `func` to the current context so spans it creates are nested under the current span,
+    even when it is run by another thread (e.g. by a ThreadPoolExecutor)
+
+    asyncio tasks already inherit the context they are created in.
+
+    :param func: the function to wrap
+    :type func: Callable
+    :return: the wrapped function
+    :rtype: Callable
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # each call gets its own copy as a context can only be entered by one thread at a time
+        return context.copy().run(func, *args, **kwargs)
+
+    return wrapper
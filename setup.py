@@ -34,7 +34,15 @@ setup(
     url="https://proxmoxer.github.io/docs/",
     download_url="http://pypi.python.org/pypi/proxmoxer",
     keywords=["proxmox", "api"],
-    packages=["proxmoxer", "proxmoxer.backends", "proxmoxer.tools"],
+    packages=[
+        "proxmoxer",
+        "proxmoxer.backends",
+        "proxmoxer.bench",
+        "proxmoxer.cli",
+        "proxmoxer.testing",
+        "proxmoxer.tools",
+    ],
+    entry_points={"console_scripts": ["proxmoxer = proxmoxer.cli.__main__:main"]},
     classifiers=[  # http://pypi.python.org/pypi?%3Aaction=list_classifiers
         "Development Status :: 5 - Production/Stable",
         "Intended Audience :: Developers",
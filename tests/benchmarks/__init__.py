@@ -0,0 +1,15 @@
+"""
+Performance benchmarks, run with pytest-benchmark installed (see test_requirements.txt):
+
+    pytest tests/benchmarks --benchmark-only --benchmark-autosave
+    pytest tests/benchmarks --benchmark-only --benchmark-compare
+
+They are skipped by other test runs unless --benchmark-enable is given. The memory budgets in
+test_memory.py are always checked.
+
+Payloads are generated with fixed seeds and sizes so saved runs are comparable across commits.
+"""
+
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
@@ -0,0 +1,21 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+from pathlib import Path
+
+import pytest
+
+BENCHMARKS_DIR = Path(__file__).parent
+
+
+def pytest_collection_modifyitems(config, items):
+    # timing runs are slow and noisy, so they are only made when asked for
+    if config.getoption("benchmark_only", False) or config.getoption("benchmark_enable", False):
+        return
+    skip = pytest.mark.skip(
+        reason="benchmarks only run with --benchmark-only or --benchmark-enable"
+    )
+    for item in items:
+        if "benchmark" in item.fixturenames and BENCHMARKS_DIR in Path(str(item.fspath)).parents:
+            item.add_marker(skip)
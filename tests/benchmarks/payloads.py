@@ -0,0 +1,155 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+import json
+import random
+
+# fixed so every run (and every commit) benchmarks the same data
+SEED = 20240601
+
+CLUSTER_RESOURCES_COUNT = 10000
+TASK_LOG_LINES = 100000
+RRD_POINTS = 50000
+
+GiB = 2**30
+
+
+def cluster_resources(count=CLUSTER_RESOURCES_COUNT, nodes=16, seed=SEED):
+    """Entries like those returned by GET /cluster/resources for a large cluster"""
+    rng = random.Random(seed)
+    node_names = [f"pve{i:02d}" for i in range(nodes)]
+    resources = []
+
+    for node in node_names:
+        resources.append(
+            {
+                "id": f"node/{node}",
+                "type": "node",
+                "node": node,
+                "status": "online",
+                "cpu": rng.random(),
+                "maxcpu": 64,
+                "mem": rng.randint(32, 480) * GiB,
+                "maxmem": 512 * GiB,
+                "disk": rng.randint(10, 90) * GiB,
+                "maxdisk": 100 * GiB,
+                "uptime": rng.randint(3600, 10**7),
+                "level": "",
+                "cgroup-mode": 2,
+            }
+        )
+        for storage in ("local", "local-lvm", "ceph"):
+            resources.append(
+                {
+                    "id": f"storage/{node}/{storage}",
+                    "type": "storage",
+                    "node": node,
+                    "storage": storage,
+                    "status": "available",
+                    "plugintype": "rbd" if storage == "ceph" else "dir",
+                    "content": "images,rootdir",
+                    "shared": int(storage == "ceph"),
+                    "disk": rng.randint(1, 900) * GiB,
+                    "maxdisk": 1000 * GiB,
+                }
+            )
+
+    vmid = 100
+    while len(resources) < count:
+        guest_type = "qemu" if rng.random() < 0.7 else "lxc"
+        running = rng.random() < 0.8
+        maxmem = rng.choice((1, 2, 4, 8, 16, 32)) * GiB
+        resources.append(
+            {
+                "id": f"{guest_type}/{vmid}",
+                "type": guest_type,
+                "vmid": vmid,
+                "name": f"{guest_type}-{vmid}.example.com",
+                "node": rng.choice(node_names),
+                "status": "running" if running else "stopped",
+                "template": 0,
+                "tags": ";".join(rng.sample(("prod", "dev", "db", "web", "k8s", "backup"), 2)),
+                "cpu": rng.random() if running else 0,
+                "maxcpu": rng.choice((1, 2, 4, 8)),
+                "mem": rng.randint(0, maxmem) if running else 0,
+                "maxmem": maxmem,
+                "disk": 0,
+                "maxdisk": rng.choice((8, 32, 64, 128)) * GiB,
+                "diskread": rng.randint(0, 10**12),
+                "diskwrite": rng.randint(0, 10**12),
+                "netin": rng.randint(0, 10**12),
+                "netout": rng.randint(0, 10**12),
+                "uptime": rng.randint(60, 10**7) if running else 0,
+            }
+        )
+        vmid += 1
+
+    return resources
+
+
+def task_log(lines=TASK_LOG_LINES, seed=SEED):
+    """Entries like those returned by GET /nodes/{node}/tasks/{upid}/log for a long backup"""
+    rng = random.Random(seed)
+    log = [{"n": 1, "t": "INFO: starting new backup job: vzdump 100 --mode snapshot"}]
+    for n in range(2, lines):
+        percent = n * 100 // lines
+        read = n * 17 * 2**20
+        log.append(
+            {
+                "n": n,
+                "t": (
+                    f"INFO: {percent}% ({read // GiB} GiB of 4.0 TiB) in {n}s, "
+                    f"read: {rng.randint(100, 900)}.{rng.randint(0, 9)} MiB/s, "
+                    f"write: {rng.randint(50, 500)}.{rng.randint(0, 9)} MiB/s"
+                ),
+            }
+        )
+    log.append({"n": lines, "t": "TASK OK"})
+    # the API does not guarantee the order of the entries
+    rng.shuffle(log)
+    return log
+
+
+def rrddata(points=RRD_POINTS, seed=SEED):
+    """Entries like those returned by GET /nodes/{node}/qemu/{vmid}/rrddata"""
+    rng = random.Random(seed)
+    start = 1700000000
+    return [
+        {
+            "time": start + i * 60,
+            "cpu": rng.random(),
+            "maxcpu": 4,
+            "mem": rng.randint(GiB, 8 * GiB),
+            "maxmem": 8 * GiB,
+            "disk": 0,
+            "maxdisk": 64 * GiB,
+            "diskread": rng.random() * 10**7,
+            "diskwrite": rng.random() * 10**7,
+            "netin": rng.random() * 10**6,
+            "netout": rng.random() * 10**6,
+        }
+        for i in range(points)
+    ]
+
+
+def upids(count=10000, seed=SEED):
+    """Task identifiers (UPIDs) of a mix of task types"""
+    rng = random.Random(seed)
+    types = ("vzdump", "qmstart", "qmstop", "vzcreate", "imgcopy", "download")
+    return [
+        "UPID:pve{:02d}:{:08X}:{:08X}:{:08X}:{}:{}:root@pam:".format(
+            rng.randrange(16),
+            rng.randrange(16**8),
+            rng.randrange(16**8),
+            rng.randrange(16**8),
+            rng.choice(types),
+            rng.randint(100, 9999),
+        )
+        for _ in range(count)
+    ]
+
+
+def api_body(data):
+    """Encode `data` as an HTTPS API response body"""
+    return json.dumps({"data": data}).encode("utf-8")
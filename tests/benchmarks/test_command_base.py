@@ -0,0 +1,89 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+from unittest import mock
+
+import pytest
+
+from proxmoxer.backends.command_base import CommandBaseSession
+
+pytest.importorskip("pytest_benchmark")
+
+# pylint: disable=redefined-outer-name
+
+# a VM create call with a typical number of options
+CREATE_DATA = {
+    "vmid": 100,
+    "name": "web01.example.com",
+    "memory": 4096,
+    "cores": 4,
+    "sockets": 1,
+    "cpu": "host",
+    "ostype": "l26",
+    "scsihw": "virtio-scsi-single",
+    "scsi0": "ceph:32,iothread=1,discard=on",
+    "net0": "virtio,bridge=vmbr0,firewall=1",
+    "ide2": "ceph:cloudinit",
+    "ciuser": "admin",
+    "sshkeys": b"ssh-ed25519%20AAAAC3NzaC1lZDI1NTE5AAAAI%20admin",
+    "ipconfig0": "ip=dhcp",
+    "agent": "enabled=1",
+    "tags": "prod;web",
+    "onboot": 1,
+    "description": "created by the benchmark suite " * 4,
+}
+
+
+class TestBuildCommand:
+    def test_get(self, benchmark, session):
+        benchmark.group = "command arguments"
+
+        benchmark(
+            session._build_command, "get", "/nodes/pve01/qemu/100/status/current", {}, {"full": 1}
+        )
+
+    def test_create(self, benchmark, session):
+        benchmark.group = "command arguments"
+
+        benchmark(
+            lambda: session._build_command("post", "/nodes/pve01/qemu", dict(CREATE_DATA), {})
+        )
+
+    def test_qemu_exec(self, benchmark, session):
+        benchmark.group = "command arguments"
+
+        benchmark(
+            lambda: session._build_command(
+                "post",
+                "/nodes/pve01/qemu/100/agent/exec",
+                {"command": "bash -c 'for i in 1 2 3; do echo \"$i\"; done'"},
+                {},
+            )
+        )
+
+
+class TestRequest:
+    def test_request(self, benchmark, session):
+        benchmark.group = "command request"
+
+        with mock.patch.object(session, "_exec", return_value=('{"status": "running"}', "")):
+            resp = benchmark(session.request, "GET", "/nodes/pve01/qemu/100/status/current")
+
+        assert resp.status_code == 200
+
+    def test_request_task(self, benchmark, session):
+        benchmark.group = "command request"
+        stderr = "UPID:pve01:003B4235:1DF4ABCA:667C1C45:qmstart:100:root@pam:"
+
+        with mock.patch.object(session, "_exec", return_value=("", stderr)):
+            resp = benchmark(
+                lambda: session.request("POST", "/nodes/pve01/qemu", data=dict(CREATE_DATA))
+            )
+
+        assert resp.status_code == 200
+
+
+@pytest.fixture
+def session():
+    return CommandBaseSession()
@@ -0,0 +1,101 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+import pytest
+
+from proxmoxer import core
+from proxmoxer.backends.command_base import JsonSimpleSerializer, Response
+from proxmoxer.backends.https import JsonSerializer
+
+from . import payloads
+
+pytest.importorskip("pytest_benchmark")
+
+# pylint: disable=redefined-outer-name
+
+BASE_URL = "https://1.2.3.4:8006/api2/json"
+
+
+class StaticSession:
+    def __init__(self, content):
+        self.content = content
+
+    def request(self, method, url, data=None, params=None):
+        return Response(self.content, 200)
+
+
+class TestResourceChaining:
+    def test_attributes(self, benchmark, resource):
+        benchmark.group = "resource chaining"
+
+        benchmark(lambda: resource.nodes("pve01").qemu(100).status.current)
+
+    def test_path_string(self, benchmark, resource):
+        benchmark.group = "resource chaining"
+
+        benchmark(lambda: resource("nodes/pve01/qemu/100/status/current"))
+
+    def test_url_join(self, benchmark):
+        benchmark.group = "resource chaining"
+
+        benchmark(core.ProxmoxResource.url_join, BASE_URL, "nodes", "pve01", "qemu", "100")
+
+
+class TestRequest:
+    def test_small_response(self, benchmark):
+        benchmark.group = "request"
+        resource = core.ProxmoxResource(
+            session=StaticSession(b'{"data": {"status": "running"}}'),
+            base_url=BASE_URL,
+            serializer=JsonSerializer(),
+        )
+
+        benchmark(resource._request, "GET", params={"full": 1, "unset": None})
+
+    def test_with_hook(self, benchmark):
+        benchmark.group = "request"
+        resource = core.ProxmoxResource(
+            session=StaticSession(b'{"data": {"status": "running"}}'),
+            base_url=BASE_URL + "/nodes/pve01/qemu/100/status/current",
+            serializer=JsonSerializer(),
+            request_hooks=[lambda event: None],
+        )
+
+        benchmark(resource._request, "GET")
+
+    def test_cluster_resources(self, benchmark, cluster_resources_body):
+        benchmark.group = "request"
+        resource = core.ProxmoxResource(
+            session=StaticSession(cluster_resources_body),
+            base_url=BASE_URL + "/cluster/resources",
+            serializer=JsonSerializer(),
+        )
+
+        result = benchmark(resource._request, "GET")
+
+        assert len(result) == payloads.CLUSTER_RESOURCES_COUNT
+
+    def test_iter_get_fallback(self, benchmark, cluster_resources_body):
+        benchmark.group = "request"
+        resource = core.ProxmoxResource(
+            session=StaticSession(cluster_resources_body),
+            base_url=BASE_URL,
+            serializer=JsonSerializer(),
+        )
+
+        assert benchmark(lambda: sum(1 for _ in resource.cluster.resources.iter_get())) == (
+            payloads.CLUSTER_RESOURCES_COUNT
+        )
+
+
+@pytest.fixture
+def resource():
+    return core.ProxmoxResource(
+        session=StaticSession(b"{}"), base_url=BASE_URL, serializer=JsonSimpleSerializer()
+    )
+
+
+@pytest.fixture(scope="module")
+def cluster_resources_body():
+    return payloads.api_body(payloads.cluster_resources())
@@ -0,0 +1,32 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+import os
+import subprocess
+import sys
+
+import pytest
+
+import proxmoxer
+
+pytest.importorskip("pytest_benchmark")
+
+
+# a new interpreter each time, so the interpreter startup is included (compare with "baseline")
+@pytest.mark.parametrize(
+    "code",
+    [
+        "pass",
+        "import proxmoxer",
+        "from proxmoxer import ProxmoxAPI; ProxmoxAPI(backend='local')",
+        "from proxmoxer.tools import Tasks",
+        "from proxmoxer import ProxmoxAPI; ProxmoxAPI('host', token_name='a', token_value='b')",
+    ],
+    ids=["baseline", "package", "local backend", "tasks", "https backend"],
+)
+def test_import(benchmark, code):
+    benchmark.group = "import"
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(proxmoxer.__file__)))
+
+    benchmark(subprocess.run, [sys.executable, "-c", code], env=env, check=True)
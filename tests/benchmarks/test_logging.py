@@ -0,0 +1,89 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+import json
+import logging
+
+import pytest
+import responses
+
+from proxmoxer import core
+from proxmoxer.backends.command_base import JsonSimpleSerializer, Response
+from proxmoxer.tools import files
+
+pytest.importorskip("pytest_benchmark")
+
+# pylint: disable=redefined-outer-name
+
+# a ~2 MB response, large enough that formatting it dominates the request overhead
+LARGE_CONTENT = json.dumps(
+    {"data": [{"vmid": i, "name": f"vm{i}", "status": "running"} for i in range(40000)]}
+).encode("utf-8")
+
+SUMS_FILE = "\n".join(f"{i:0128x}  file{i}.iso" for i in range(10000))
+
+
+class FormattingHandler(logging.Handler):
+    """Formats every record like a real handler would, then drops it"""
+
+    def emit(self, record):
+        self.format(record)
+
+
+class LargeResponseSession:
+    def request(self, method, url, data=None, params=None):
+        return Response(LARGE_CONTENT, 200)
+
+
+class NoopSerializer(JsonSimpleSerializer):
+    # leave decoding out so only the logging overhead is measured
+    def loads(self, response):
+        return None
+
+
+@pytest.mark.parametrize("level", [logging.WARNING, logging.DEBUG], ids=["disabled", "debug"])
+def test_request_logging(benchmark, level, logger_level):
+    benchmark.group = "request logging"
+    logger_level("proxmoxer.core", level)
+    resource = core.ProxmoxResource(
+        session=LargeResponseSession(), base_url="https://host/", serializer=NoopSerializer()
+    )
+
+    benchmark(resource._request, "POST", data={"password": "secret", "vmid": 100})
+
+
+@pytest.mark.parametrize("level", [logging.WARNING, logging.DEBUG], ids=["disabled", "debug"])
+def test_checksum_helper_logging(benchmark, level, logger_level):
+    benchmark.group = "checksum helper logging"
+    logger_level("proxmoxer.tools.files", level)
+    checksum_info = files.SupportedChecksums.SHA512.value
+
+    with responses.RequestsMock() as rsps:
+        rsps.add(responses.GET, "https://example.com/SHA512SUMS", body=SUMS_FILE)
+        checksum = benchmark(
+            files.Files._get_checksum_helper,
+            "https://example.com/SHA512SUMS",
+            "file9999.iso",
+            checksum_info,
+        )
+
+    assert checksum == f"{9999:0128x}"
+
+
+@pytest.fixture
+def logger_level():
+    handler = FormattingHandler()
+    changed = []
+
+    def set_level(name, level):
+        logger = logging.getLogger(name)
+        changed.append((logger, logger.level))
+        logger.setLevel(level)
+        logger.addHandler(handler)
+
+    yield set_level
+
+    for logger, level in changed:
+        logger.setLevel(level)
+        logger.removeHandler(handler)
@@ -0,0 +1,150 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+import tracemalloc
+
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+
+from proxmoxer.backends import https
+from proxmoxer.tools import Tasks
+
+from . import payloads
+
+# pylint: disable=no-self-use,redefined-outer-name
+
+# Peak memory budgets, as traced by tracemalloc while the operation runs. They are set with
+# some headroom above the measured peaks, a change that exceeds one should be looked at
+# rather than the budget raised.
+MiB = 2**20
+
+# measured at about 3.9x the body (bytes, decoded text and the parsed objects)
+LISTING_BUDGET_FACTOR = 5
+# measured at about 8.5 MiB for 100k lines
+TASK_LOG_BUDGET = 12 * MiB
+# measured at about 2x the file, requests encodes the whole multipart body in memory
+SMALL_UPLOAD_BUDGET_FACTOR = 3
+# measured at about 3 MiB (including the 1 MiB block read), independent of the file size
+STREAMING_UPLOAD_BUDGET = 8 * MiB
+
+
+def peak_memory(func, *args):
+    """Run func(*args) and return its result and the peak memory traced meanwhile"""
+    tracemalloc.start()
+    try:
+        if hasattr(tracemalloc, "reset_peak"):
+            tracemalloc.reset_peak()
+        else:
+            # Python 3.8 has no reset_peak, starting again also forgets the peak
+            tracemalloc.stop()
+            tracemalloc.start()
+        result = func(*args)
+        return result, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+class DiscardAdapter(BaseAdapter):
+    """Transport adapter that reads request bodies like a socket would, keeping only the size"""
+
+    # larger than a socket would use, tracing every allocation makes small reads slow
+    block_size = MiB
+
+    def __init__(self):
+        super().__init__()
+        self.bytes_sent = 0
+
+    def send(self, request, **kwargs):  # pylint: disable=arguments-differ
+        body = request.body
+        if hasattr(body, "read"):
+            while True:
+                block = body.read(self.block_size)
+                if not block:
+                    break
+                self.bytes_sent += len(block)
+        else:
+            self.bytes_sent += len(body)
+
+        response = requests.Response()
+        response.status_code = 200
+        response.request = request
+        response.url = request.url
+        response._content = b'{"data": "UPID:node1:00000001:00000001:00000001:imgcopy::root@pam:"}'
+        return response
+
+    def close(self):
+        pass
+
+
+class TestDecoding:
+    def test_listing(self):
+        body = payloads.api_body(payloads.cluster_resources())
+        response = requests.Response()
+        response._content = body
+
+        resources, peak = peak_memory(https.JsonSerializer().loads, response)
+
+        assert len(resources) == payloads.CLUSTER_RESOURCES_COUNT
+        assert peak < LISTING_BUDGET_FACTOR * len(body)
+
+    def test_task_log(self):
+        log_list = payloads.task_log()
+
+        log, peak = peak_memory(Tasks.decode_log, log_list)
+
+        assert log.count("\n") == payloads.TASK_LOG_LINES - 1
+        assert peak < TASK_LOG_BUDGET
+
+
+class TestUpload:
+    def test_below_streaming_threshold(self, session, sparse_file):
+        size = https.STREAMING_SIZE_THRESHOLD // 2
+
+        _, peak = peak_memory(upload, session, sparse_file(size))
+
+        assert session.adapter.bytes_sent > size
+        assert peak < SMALL_UPLOAD_BUDGET_FACTOR * size
+
+    @pytest.mark.parametrize(
+        "size",
+        [50 * 10**6, 500 * 10**6, 3 * 10**9],
+        ids=["50MB", "500MB", "3GB"],
+    )
+    def test_streaming(self, session, sparse_file, size):
+        _, peak = peak_memory(upload, session, sparse_file(size))
+
+        assert session.adapter.bytes_sent > size
+        assert peak < STREAMING_UPLOAD_BUDGET
+
+
+def upload(session, file_obj):
+    with file_obj:
+        return session.request(
+            "POST",
+            "https://1.2.3.4:8006/api2/json/nodes/node1/storage/local/upload",
+            data={"content": "iso", "filename": file_obj},
+        )
+
+
+@pytest.fixture
+def session():
+    backend = https.Backend("1.2.3.4", user="root@pam", token_name="test", token_value="secret")
+    session = backend.get_session()
+    session.adapter = DiscardAdapter()
+    session.mount("https://", session.adapter)
+    return session
+
+
+@pytest.fixture
+def sparse_file(tmp_path):
+    """Opens a file of the given size that takes (almost) no disk space"""
+
+    def open_file(size):
+        path = tmp_path / "image.iso"
+        with open(path, "wb") as f_obj:
+            f_obj.truncate(size)
+        return open(path, "rb")  # pylint: disable=consider-using-with
+
+    return open_file
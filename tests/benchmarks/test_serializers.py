@@ -0,0 +1,83 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+import io
+import json
+
+import pytest
+
+from proxmoxer.backends.command_base import JsonSimpleSerializer, Response, iter_json
+from proxmoxer.backends.https import JsonSerializer
+
+from . import payloads
+
+pytest.importorskip("pytest_benchmark")
+
+# pylint: disable=redefined-outer-name
+
+
+class TestJsonSerializer:
+    def test_cluster_resources(self, benchmark, cluster_resources):
+        benchmark.group = "decode cluster resources"
+        response = Response(payloads.api_body(cluster_resources), 200)
+
+        assert benchmark(JsonSerializer().loads, response) == cluster_resources
+
+    def test_rrddata(self, benchmark, rrddata):
+        benchmark.group = "decode rrddata"
+        response = Response(payloads.api_body(rrddata), 200)
+
+        assert len(benchmark(JsonSerializer().loads, response)) == payloads.RRD_POINTS
+
+    def test_task_log(self, benchmark, task_log):
+        benchmark.group = "decode task log"
+        response = Response(payloads.api_body(task_log), 200)
+
+        assert len(benchmark(JsonSerializer().loads, response)) == payloads.TASK_LOG_LINES
+
+
+class TestJsonSimpleSerializer:
+    def test_cluster_resources(self, benchmark, cluster_resources):
+        benchmark.group = "decode cluster resources"
+        # command backends return the decoded text of pvesh's output
+        response = Response(json.dumps(cluster_resources), 200)
+
+        assert benchmark(JsonSimpleSerializer().loads, response) == cluster_resources
+
+    def test_rrddata(self, benchmark, rrddata):
+        benchmark.group = "decode rrddata"
+        response = Response(json.dumps(rrddata), 200)
+
+        assert len(benchmark(JsonSimpleSerializer().loads, response)) == payloads.RRD_POINTS
+
+
+class TestIterJson:
+    def test_cluster_resources(self, benchmark, cluster_resources):
+        benchmark.group = "decode cluster resources"
+        content = json.dumps(cluster_resources).encode("utf-8")
+
+        assert benchmark(lambda: sum(1 for _ in iter_json(io.BytesIO(content)))) == len(
+            cluster_resources
+        )
+
+    def test_task_log(self, benchmark, task_log):
+        benchmark.group = "decode task log"
+        content = json.dumps(task_log).encode("utf-8")
+
+        assert benchmark(lambda: sum(1 for _ in iter_json(io.BytesIO(content)))) == len(task_log)
+
+
+@pytest.fixture(scope="module")
+def cluster_resources():
+    return payloads.cluster_resources()
+
+
+@pytest.fixture(scope="module")
+def rrddata():
+    return payloads.rrddata()
+
+
+@pytest.fixture(scope="module")
+def task_log():
+    return payloads.task_log()
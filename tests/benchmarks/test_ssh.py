@@ -0,0 +1,83 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from proxmoxer import ProxmoxAPI
+from proxmoxer.testing.ssh import FakeSSHServer
+
+pytest.importorskip("pytest_benchmark")
+
+# pylint: disable=redefined-outer-name
+
+UPLOAD_SIZE = 2**25  # 32 MiB
+
+BACKENDS = [
+    "ssh_paramiko",
+    pytest.param(
+        "openssh",
+        marks=pytest.mark.skipif(
+            not os.path.exists("/usr/bin/ssh"), reason="the OpenSSH client is not installed"
+        ),
+    ),
+]
+
+
+class TestCommand:
+    @pytest.mark.parametrize("backend", BACKENDS)
+    def test_latency(self, benchmark, server, backend):
+        benchmark.group = "ssh command"
+        prox = ProxmoxAPI(**server.api_kwargs(backend))
+
+        benchmark(prox.version.get)
+
+    def test_concurrent_channels(self, benchmark, server):
+        benchmark.group = "ssh concurrent channels"
+        prox = ProxmoxAPI(**server.api_kwargs("ssh_paramiko"))
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            benchmark(lambda: list(executor.map(lambda _: prox.version.get(), range(32))))
+
+
+class TestUpload:
+    @pytest.mark.parametrize("backend", BACKENDS)
+    def test_stdin(self, benchmark, server, payload, backend):
+        benchmark.group = "ssh upload"
+        prox = ProxmoxAPI(**server.api_kwargs(backend))
+        storage = prox.nodes("node1").storage("local")
+
+        def upload():
+            file_obj = io.BytesIO(payload)
+            file_obj.name = "image.iso"
+            return storage.upload.post(content="iso", filename=file_obj)
+
+        benchmark.pedantic(upload, rounds=5)
+
+    @pytest.mark.parametrize("backend", BACKENDS)
+    def test_file_transfer(self, benchmark, server, payload, backend):
+        # SFTP for ssh_paramiko, scp for openssh
+        benchmark.group = "ssh upload"
+        session = ProxmoxAPI(**server.api_kwargs(backend))._store["session"]
+
+        def upload():
+            file_obj = io.BytesIO(payload)
+            file_obj.name = "image.iso"
+            session.upload_file_obj(file_obj, "/var/tmp/image.iso")
+
+        benchmark.pedantic(upload, rounds=5)
+
+
+@pytest.fixture(scope="module")
+def server():
+    with FakeSSHServer() as fake:
+        yield fake
+
+
+@pytest.fixture(scope="module")
+def payload():
+    return os.urandom(UPLOAD_SIZE)
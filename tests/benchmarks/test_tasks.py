@@ -0,0 +1,40 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+import pytest
+
+from proxmoxer.tools import Tasks
+
+from . import payloads
+
+pytest.importorskip("pytest_benchmark")
+
+# pylint: disable=redefined-outer-name
+
+
+def test_decode_upid(benchmark, upids):
+    benchmark.group = "tasks"
+
+    decoded = benchmark(lambda: [Tasks.decode_upid(upid) for upid in upids])
+
+    assert len(decoded) == len(upids)
+
+
+def test_decode_log(benchmark, task_log):
+    benchmark.group = "tasks"
+
+    log = benchmark(Tasks.decode_log, task_log)
+
+    assert log.count("\n") == payloads.TASK_LOG_LINES - 1
+    assert log.endswith("TASK OK")
+
+
+@pytest.fixture(scope="module")
+def upids():
+    return payloads.upids()
+
+
+@pytest.fixture(scope="module")
+def task_log():
+    return payloads.task_log()
@@ -0,0 +1,216 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from proxmoxer import core
+from proxmoxer.backends import agent, local
+
+# pylint: disable=no-self-use
+
+TOKEN = "root@pam!agent=secret"
+
+
+class TestAgentCommand:
+    def test_command(self):
+        cmd = agent.agent_command()
+
+        assert cmd[:3] == ["python3", "-u", "-c"]
+        assert "def main():" in cmd[3]
+
+
+class TestRemoteAgent:
+    def test_request(self):
+        stdin = io.BytesIO()
+        read_fd, write_fd = os.pipe()
+
+        with os.fdopen(read_fd, "rb") as stdout, os.fdopen(write_fd, "wb") as agent_out:
+            remote = agent.RemoteAgent(stdin, stdout, token=TOKEN, workers=2)
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                future = executor.submit(remote.request, "GET", "/nodes", params={"a": "b"})
+                while stdin.getvalue().count(b"\n") < 2:
+                    time.sleep(0.01)
+                agent_out.write(b'{"id": 0, "status": 200, "content": "[1, 2]"}\n')
+                agent_out.flush()
+                status, content = future.result()
+
+        assert status == 200
+        assert content == "[1, 2]"
+        lines = [json.loads(line) for line in stdin.getvalue().splitlines()]
+        assert lines == [
+            {"api_url": agent.AGENT_API_URL, "token": TOKEN, "workers": 2, "timeout": None},
+            {"id": 0, "method": "GET", "path": "/nodes", "data": None, "params": {"a": "b"}},
+        ]
+
+    def test_agent_exited(self):
+        remote = agent.RemoteAgent(io.BytesIO(), io.BytesIO(b""))
+        remote._reader.join()
+
+        assert remote.closed
+        with pytest.raises(ConnectionError):
+            remote.request("GET", "/nodes")
+
+    def test_timeout(self):
+        read_fd, write_fd = os.pipe()
+
+        with os.fdopen(read_fd, "rb") as stdout, os.fdopen(write_fd, "wb") as agent_out:
+            remote = agent.RemoteAgent(io.BytesIO(), stdout, timeout=0.05)
+            with pytest.raises(TimeoutError):
+                remote.request("GET", "/nodes")
+
+            # a late response is dropped, the agent keeps serving other requests
+            agent_out.write(b'{"id": 0, "status": 200, "content": "[]"}\n')
+            agent_out.flush()
+            assert not remote._pending
+            assert not remote.closed
+
+    def test_unreadable_output(self):
+        read_fd, write_fd = os.pipe()
+
+        with os.fdopen(read_fd, "rb") as stdout, os.fdopen(write_fd, "wb") as agent_out:
+            remote = agent.RemoteAgent(io.BytesIO(), stdout)
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                future = executor.submit(remote.request, "GET", "/nodes")
+                while not remote._pending:
+                    time.sleep(0.01)
+                agent_out.write(b"not json\n")
+                agent_out.flush()
+
+                # the waiter is woken with an error rather than left hanging
+                with pytest.raises(ConnectionError):
+                    future.result(timeout=5)
+        assert remote.closed
+
+    def test_close(self):
+        stdin = io.BytesIO()
+        closer = threading.Event()
+
+        remote = agent.RemoteAgent(stdin, io.BytesIO(b""), closer.set)
+        remote._reader.join()
+        remote._closed = False
+        remote.close()
+
+        assert stdin.closed
+        assert closer.is_set()
+
+
+class TestLocalSessionAgent:
+    def test_get(self, agent_session):
+        resp = agent_session.request("GET", "/nodes", params={"type": "node"})
+
+        assert resp.status_code == 200
+        assert json.loads(resp.content) == {
+            "method": "GET",
+            "path": "/api2/json/nodes",
+            "query": {"type": ["node"]},
+            "auth": "PVEAPIToken=" + TOKEN,
+        }
+
+    def test_post(self, agent_session):
+        resp = agent_session.request("POST", "/nodes/node1/qemu", data={"vmid": 100, "b": b"v"})
+
+        assert resp.status_code == 200
+        assert json.loads(resp.content)["form"] == {"vmid": ["100"], "b": ["v"]}
+
+    def test_qemu_exec(self, agent_session):
+        resp = agent_session.request(
+            "POST", "/nodes/node1/qemu/100/agent/exec", data={"command": "echo 'hello world'"}
+        )
+
+        assert json.loads(resp.content)["form"] == {"command": ["echo", "hello world"]}
+
+    def test_error(self, agent_session):
+        resp = agent_session.request("GET", "/fail")
+
+        assert resp.status_code == 400
+        assert resp.content == '400 Parameter verification failed.\n{"vmid": "invalid"}'
+
+    def test_concurrent(self, agent_session):
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(
+                executor.map(lambda i: agent_session.request("GET", f"/nodes/node{i}"), range(32))
+            )
+
+        assert [json.loads(r.content)["path"] for r in results] == [
+            f"/api2/json/nodes/node{i}" for i in range(32)
+        ]
+
+    def test_through_api(self, agent_session, monkeypatch):
+        prox = core.ProxmoxAPI(backend="local")
+        monkeypatch.setitem(prox._store, "session", agent_session)
+
+        assert prox.nodes("node1").status.get()["path"] == "/api2/json/nodes/node1/status"
+
+    def test_close_restart(self, agent_session):
+        agent_session.request("GET", "/nodes")
+        agent_session.close()
+
+        assert agent_session._agent is None
+        # a new agent is started if the session is used again
+        assert agent_session.request("GET", "/nodes").status_code == 200
+
+
+class FakeApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):  # pylint: disable=arguments-differ
+        pass
+
+    def _respond(self, status, body, reason=None):
+        content = json.dumps(body).encode("utf-8")
+        self.send_response(status, reason)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        url = urlsplit(self.path)
+        if url.path.endswith("/fail"):
+            self._respond(
+                400, {"data": None, "errors": {"vmid": "invalid"}}, "Parameter verification failed."
+            )
+            return
+        self._respond(
+            200,
+            {
+                "data": {
+                    "method": self.command,
+                    "path": url.path,
+                    "query": parse_qs(url.query),
+                    "auth": self.headers.get("Authorization"),
+                }
+            },
+        )
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        length = int(self.headers.get("Content-Length", 0))
+        form = parse_qs(self.rfile.read(length).decode("utf-8"))
+        self._respond(200, {"data": {"method": self.command, "form": form}})
+
+
+@pytest.fixture
+def agent_session():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeApiHandler)
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+
+    session = local.LocalSession(
+        agent_token=TOKEN,
+        agent_api_url=f"http://127.0.0.1:{server.server_address[1]}/api2/json",
+    )
+    yield session
+
+    session.close()
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,212 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+import argparse
+import json
+import random
+from unittest import mock
+
+import pytest
+
+from proxmoxer import ProxmoxAPI
+from proxmoxer.bench import (
+    BenchmarkResult,
+    InventoryWorkload,
+    Sample,
+    TaskWorkload,
+    UploadWorkload,
+    discover_nodes,
+    percentile,
+    run_benchmark,
+)
+from proxmoxer.bench.__main__ import main, parse_args, parse_mix, parse_pair
+from proxmoxer.testing import FakeCluster, FakePVEServer
+
+# pylint: disable=no-self-use,redefined-outer-name
+
+# the fake server uses a self-signed certificate
+pytestmark = pytest.mark.filterwarnings("ignore::urllib3.exceptions.InsecureRequestWarning")
+
+
+class TestRunBenchmark:
+    @pytest.mark.parametrize("concurrency", ["thread", "asyncio", "process"])
+    def test_concurrency(self, server, api_kwargs, concurrency):
+        workloads = [InventoryWorkload(["node1", "node2"])]
+
+        result = run_benchmark(
+            api_kwargs, workloads, concurrency=concurrency, workers=3, operations=10
+        )
+
+        assert len(result.samples) == 10
+        assert all(s.error is None for s in result.samples)
+        assert all(s.latency > 0 for s in result.samples)
+        assert result.summary()["total"]["operations"] == 10
+
+    def test_mix(self, server, api_kwargs):
+        prox = ProxmoxAPI(**api_kwargs)
+        workloads = [
+            InventoryWorkload(discover_nodes(prox)),
+            TaskWorkload([("node1", 100)], polling_interval=0.01),
+            UploadWorkload("node1", "local", size=1000, polling_interval=0.01),
+        ]
+
+        result = run_benchmark(api_kwargs, workloads, [1, 1, 1], operations=30, seed=1)
+
+        assert set(result.summary()["workloads"]) == {"inventory", "task", "upload"}
+        assert result.summary()["total"]["errors"] == 0
+        assert server.cluster.content[("node1", "local")][0]["size"] > 1000
+
+    def test_seed(self, server, api_kwargs):
+        workloads = [InventoryWorkload(["node1"]), TaskWorkload([("node1", 100)], 0.01)]
+
+        runs = [
+            run_benchmark(api_kwargs, workloads, workers=1, operations=10, seed=5) for _ in range(2)
+        ]
+
+        assert [s.workload for s in runs[0].samples] == [s.workload for s in runs[1].samples]
+
+    def test_duration(self, server, api_kwargs):
+        result = run_benchmark(api_kwargs, [InventoryWorkload(["node1"])], duration=0.2)
+
+        assert result.samples
+        assert 0.2 <= result.wall_time < 1
+
+    def test_errors(self, server, api_kwargs):
+        server.inject_error(596, count=2)
+
+        result = run_benchmark(api_kwargs, [InventoryWorkload([])], workers=1, operations=5)
+
+        summary = result.summary()["total"]
+        assert summary["errors"] == 2
+        assert summary["error_rate"] == 0.4
+        assert summary["error_types"] == {"HTTP 596": 2}
+
+    def test_client_per_worker(self, server, api_kwargs):
+        with mock.patch("proxmoxer.bench.runner.ProxmoxAPI", wraps=ProxmoxAPI) as mock_api:
+            run_benchmark(
+                api_kwargs, [InventoryWorkload([])], workers=3, operations=3, client_per_worker=True
+            )
+
+        assert mock_api.call_count == 3
+
+    def test_bad_concurrency(self, api_kwargs):
+        with pytest.raises(ValueError, match="concurrency must be one of"):
+            run_benchmark(api_kwargs, [], concurrency="fibers")
+
+
+class TestWorkloads:
+    def test_task_failed(self):
+        prox = mock.MagicMock()
+        prox.nodes.return_value.qemu.return_value.status.current.get.return_value = {
+            "status": "running"
+        }
+        prox.nodes.return_value.qemu.return_value.status.return_value.post.return_value = (
+            "UPID:node1:00000001:00000001:00000001:qmstop:100:root@pam:"
+        )
+
+        with mock.patch(
+            "proxmoxer.bench.runner.Tasks.blocking_status", return_value={"exitstatus": "bad"}
+        ):
+            with pytest.raises(RuntimeError, match="failed: bad"):
+                TaskWorkload([("node1", 100)]).run(prox, random.Random(0))
+
+        prox.nodes.return_value.qemu.return_value.status.assert_called_with("stop")
+
+    def test_task_no_vms(self):
+        with pytest.raises(ValueError):
+            TaskWorkload([])
+
+
+class TestResult:
+    def test_percentile(self):
+        values = list(range(1, 101))
+
+        assert percentile(values, 0.5) == 50
+        assert percentile(values, 0.99) == 99
+        assert percentile(values, 1) == 100
+        assert percentile([], 0.5) is None
+
+    def test_summary(self):
+        samples = [Sample("inventory", 0, i / 1000, 0.001, None) for i in range(1, 100)]
+        samples.append(Sample("task", 0, 1.0, 0.002, "HTTP 500"))
+
+        summary = BenchmarkResult(samples, wall_time=2.0).summary()
+
+        assert summary["total"]["throughput"] == 50
+        assert summary["total"]["p99"] == 0.099
+        assert summary["total"]["max"] == 1.0
+        assert summary["workloads"]["task"]["error_rate"] == 1.0
+        assert summary["workloads"]["inventory"]["cpu_per_operation"] == pytest.approx(0.001)
+
+    def test_format_table(self):
+        samples = [Sample("inventory", 0, 0.01, 0.001, None), Sample("task", 0, 1.0, 0, "X")]
+
+        table = BenchmarkResult(samples, wall_time=1.0, workers=2).format_table()
+
+        assert table.splitlines()[0] == "2 thread workers, 1.00s"
+        assert "inventory" in table
+        assert table.splitlines()[-1] == "errors: X: 1"
+
+
+class TestCli:
+    def test_parse_mix(self):
+        assert parse_mix("inventory=8,task") == {"inventory": 8.0, "task": 1.0}
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_mix("other")
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_mix("task=x")
+
+    def test_parse_pair(self):
+        assert parse_pair("node1:100") == ("node1", "100")
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_pair("node1")
+
+    def test_host_required(self):
+        with pytest.raises(SystemExit):
+            parse_args([])
+
+    def test_task_vm_required(self):
+        with pytest.raises(SystemExit):
+            parse_args(["pve.example.com", "--mix", "task"])
+
+    def test_main_fake(self, capsys):
+        main(["--fake", "--mix", "inventory=4,task,upload", "--operations", "12", "--json"])
+
+        summary = json.loads(capsys.readouterr().out)
+        assert summary["total"]["operations"] == 12
+        assert summary["total"]["errors"] == 0
+
+    def test_main_options(self, capsys):
+        with mock.patch("proxmoxer.bench.__main__.ProxmoxAPI") as mock_api, mock.patch(
+            "proxmoxer.bench.__main__.run_benchmark"
+        ) as mock_run:
+            mock_api.return_value.nodes.get.return_value = [{"node": "node1"}]
+            main(["pve", "--backend", "ssh_paramiko", "--user", "root", "--option", "port=2222"])
+
+        api_kwargs = mock_run.call_args[0][0]
+        assert api_kwargs == {
+            "host": "pve",
+            "backend": "ssh_paramiko",
+            "service": "PVE",
+            "user": "root",
+            "port": 2222,
+        }
+
+
+@pytest.fixture
+def server():
+    cluster = FakeCluster(nodes=["node1", "node2"], vms_per_node=2)
+    with FakePVEServer(cluster=cluster, task_duration=0) as fake:
+        yield fake
+
+
+@pytest.fixture
+def api_kwargs(server):
+    return {
+        "host": server.address,
+        "user": "root@pam",
+        "token_name": "token",
+        "token_value": "secret",
+        "verify_ssl": False,
+    }
@@ -0,0 +1,262 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+import json
+import os
+import stat
+import sys
+import tempfile
+import time
+from unittest import mock
+
+import pytest
+
+from proxmoxer import ProxmoxAPI, ResourceException
+from proxmoxer.cli import Daemon, DaemonClient, DaemonError, DaemonNotRunning
+from proxmoxer.cli.__main__ import main, parse_args, parse_params
+from proxmoxer.cli.arguments import api_kwargs_from_args, parse_value
+from proxmoxer.testing import FakePVEServer
+
+# pylint: disable=no-self-use,redefined-outer-name
+
+# the fake server uses a self-signed certificate
+pytestmark = pytest.mark.filterwarnings("ignore::urllib3.exceptions.InsecureRequestWarning")
+
+
+class TestDaemon:
+    def test_request(self, daemon, api_kwargs):
+        with DaemonClient(daemon.socket_path) as client:
+            nodes = client.request(api_kwargs, "GET", "/nodes")
+            vms = client.request(api_kwargs, "GET", "/nodes/node1/qemu", {"full": 1})
+
+        assert [n["node"] for n in nodes] == ["node1"]
+        assert [vm["vmid"] for vm in vms] == [100, 101, 102]
+
+    def test_client_reused(self, daemon, api_kwargs):
+        with mock.patch("proxmoxer.core.ProxmoxAPI", wraps=ProxmoxAPI) as mock_api:
+            for _ in range(3):
+                with DaemonClient(daemon.socket_path) as client:
+                    client.request(api_kwargs, "GET", "/version")
+
+        mock_api.assert_called_once_with(**api_kwargs)
+        assert daemon.stats["requests"] == 3
+
+    def test_post(self, daemon, api_kwargs):
+        with DaemonClient(daemon.socket_path) as client:
+            upid = client.request(api_kwargs, "POST", "/nodes/node1/qemu/100/status/start")
+
+        assert upid.startswith("UPID:node1:")
+
+    def test_resource_exception(self, daemon, api_kwargs):
+        with DaemonClient(daemon.socket_path) as client:
+            with pytest.raises(ResourceException) as exc_info:
+                client.request(api_kwargs, "GET", "/nodes/missing/status")
+
+        assert exc_info.value.status_code == 595
+        assert "no such cluster node 'missing'" in str(exc_info.value)
+        assert daemon.stats["errors"] == 1
+
+    def test_connection_error(self, daemon, api_kwargs):
+        api_kwargs["password"] = "wrong"
+
+        with DaemonClient(daemon.socket_path) as client:
+            with pytest.raises(DaemonError, match="AuthenticationError"):
+                client.request(api_kwargs, "GET", "/version")
+
+        # failed logins are not kept
+        assert client.ping()["clients"] == 0
+
+    def test_ping(self, daemon):
+        with DaemonClient(daemon.socket_path) as client:
+            assert client.ping()["pid"] == os.getpid()
+            assert client.is_running()
+
+    def test_unknown_operation(self, daemon):
+        with DaemonClient(daemon.socket_path) as client:
+            assert client._call({"op": "other"})["ok"] is False
+
+    def test_socket_permissions(self, daemon):
+        assert stat.S_IMODE(os.stat(daemon.socket_path).st_mode) == 0o600
+
+    def test_shutdown(self, daemon):
+        with DaemonClient(daemon.socket_path) as client:
+            client.shutdown()
+
+        daemon.serve_forever()
+
+        assert not os.path.exists(daemon.socket_path)
+
+    def test_idle_timeout(self, socket_path):
+        daemon = Daemon(socket_path, idle_timeout=0.1).start()
+
+        daemon.serve_forever()
+
+        assert not os.path.exists(socket_path)
+
+    def test_already_running(self, daemon):
+        with pytest.raises(DaemonError, match="already listening"):
+            Daemon(daemon.socket_path).start()
+
+    def test_stale_socket(self, socket_path):
+        Daemon(socket_path)._bind().server_close()
+
+        with Daemon(socket_path):
+            assert DaemonClient(socket_path).is_running()
+
+    def test_other_user(self, daemon):
+        client = DaemonClient(daemon.socket_path)
+
+        with mock.patch("proxmoxer.cli.daemon.os.getuid", return_value=12345):
+            with pytest.raises(DaemonError, match="owned by another user"):
+                client.ping()
+
+    def test_other_peer(self, daemon):
+        client = DaemonClient(daemon.socket_path)
+
+        with mock.patch.object(daemon, "peer_allowed", return_value=False):
+            with pytest.raises(DaemonError, match="connection"):
+                client.ping()
+
+    def test_not_running(self, socket_path):
+        with pytest.raises(DaemonNotRunning):
+            DaemonClient(socket_path).ping()
+        assert not DaemonClient(socket_path).is_running()
+
+
+class TestArguments:
+    def test_parse_value(self):
+        assert parse_value("10") == 10
+        assert parse_value("0.5") == 0.5
+        assert parse_value("False") is False
+        assert parse_value("text") == "text"
+
+    def test_parse_params(self):
+        assert parse_params(["a=1", "b=x=y", "a=2"]) == {"a": ["1", "2"], "b": "x=y"}
+        with pytest.raises(ValueError):
+            parse_params(["a"])
+
+    def test_api_kwargs(self):
+        args = parse_args(
+            ["--host", "pve", "--user", "root@pam", "--port", "8007", "--no-verify-ssl", "get", "/"]
+        )
+
+        assert api_kwargs_from_args(args) == {
+            "host": "pve",
+            "backend": "https",
+            "service": "PVE",
+            "port": 8007,
+            "user": "root@pam",
+            "verify_ssl": False,
+        }
+
+    def test_environment(self, monkeypatch):
+        monkeypatch.setenv("PROXMOXER_BACKEND", "local")
+        monkeypatch.delenv("PROXMOXER_HOST", raising=False)
+
+        args = parse_args(["--option", "timeout=10", "get", "/nodes"])
+
+        assert api_kwargs_from_args(args) == {"backend": "local", "service": "PVE", "timeout": 10}
+
+    def test_bad_params(self):
+        with pytest.raises(SystemExit):
+            parse_args(["get", "/nodes", "full"])
+
+
+class TestMain:
+    def test_through_daemon(self, daemon, cli_args, capsys):
+        main(cli_args + ["get", "/nodes/node1/qemu/100/status/current"])
+
+        assert json.loads(capsys.readouterr().out)["vmid"] == 100
+        assert daemon.stats["requests"] == 1
+
+    def test_without_daemon(self, daemon, cli_args, capsys):
+        main(cli_args + ["get", "/version", "--no-daemon"])
+
+        assert json.loads(capsys.readouterr().out)["release"] == "8.2"
+        assert daemon.stats["requests"] == 0
+
+    def test_daemon_not_running(self, server, cli_args, capsys):
+        main(cli_args + ["create", "/nodes/node1/qemu/100/status/start", "--pretty"])
+
+        assert capsys.readouterr().out.startswith('"UPID:node1:')
+
+    def test_api_error(self, daemon, cli_args, capsys):
+        with pytest.raises(SystemExit) as exit_exp:
+            main(cli_args + ["get", "/nodes/missing/status"])
+
+        assert exit_exp.value.code == 1
+        assert "595" in capsys.readouterr().err
+
+    def test_status(self, daemon, cli_args, capsys):
+        main(cli_args + ["daemon", "status"])
+
+        assert json.loads(capsys.readouterr().out)["pid"] == os.getpid()
+
+    def test_status_not_running(self, socket_path, capsys):
+        with pytest.raises(SystemExit) as exit_exp:
+            main(["--socket", socket_path, "daemon", "status"])
+
+        assert exit_exp.value.code == 1
+        assert "no daemon is listening" in capsys.readouterr().err
+
+    def test_detach(self, socket_path, capsys):
+        env = {"PYTHONPATH": os.path.dirname(os.path.dirname(sys.modules["proxmoxer"].__file__))}
+        with mock.patch.dict(os.environ, env):
+            main(["--socket", socket_path, "daemon", "start", "--detach", "--idle-timeout", "30"])
+
+        assert "listening on" in capsys.readouterr().out
+        assert DaemonClient(socket_path).is_running()
+
+        main(["--socket", socket_path, "daemon", "stop"])
+        deadline = time.monotonic() + 5
+        while os.path.exists(socket_path) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert not os.path.exists(socket_path)
+
+
+@pytest.fixture
+def socket_path():
+    # unix socket paths are limited to about 100 characters, so not under tmp_path
+    with tempfile.TemporaryDirectory(prefix="proxmoxer-") as directory:
+        yield os.path.join(directory, "daemon.sock")
+
+
+@pytest.fixture
+def server():
+    with FakePVEServer() as fake:
+        yield fake
+
+
+@pytest.fixture
+def api_kwargs(server):
+    return {
+        "host": server.address,
+        "user": "root@pam",
+        "password": "password",
+        "verify_ssl": False,
+    }
+
+
+@pytest.fixture
+def daemon(server, socket_path):
+    with Daemon(socket_path) as fake_daemon:
+        yield fake_daemon
+
+
+@pytest.fixture
+def cli_args(server, socket_path):
+    host, port = server.address.rsplit(":", 1)
+    return [
+        "--socket",
+        socket_path,
+        "--host",
+        host,
+        "--port",
+        port,
+        "--user",
+        "root@pam",
+        "--password",
+        "password",
+        "--no-verify-ssl",
+    ]
@@ -2,11 +2,15 @@ __author__ = "John Hollowell"
 __copyright__ = "(c) John Hollowell 2022"
 __license__ = "MIT"
 
+import io
+import json
 import tempfile
+from contextlib import contextmanager
 from unittest import mock
 
 import pytest
 
+from proxmoxer import core
 from proxmoxer.backends import command_base
 
 from .api_mock import PVERegistry
@@ -24,17 +28,97 @@ class TestResponse:
         assert resp.headers == {"content-type": "application/json"}
         assert str(resp) == "Response (200) b'content'"
 
+    def test_text_follows_content(self):
+        resp = command_base.Response("content", 200)
+        resp.content = "other"
+
+        assert resp.text == "other"
+
+
+class TestIterJson:
+    def _iter(self, content, chunk_size=3):
+        return list(command_base.iter_json(io.BytesIO(content.encode("utf-8")), chunk_size))
+
+    def test_list(self):
+        content = json.dumps([{"vmid": i, "name": f"vm{i}", "tags": ["a", "b"]} for i in range(50)])
+
+        assert self._iter(content) == json.loads(content)
+
+    def test_list_whitespace(self):
+        assert self._iter(' \n[ 1 ,\n 22 , "three" , null , [4, 5] ]\n') == [
+            1,
+            22,
+            "three",
+            None,
+            [4, 5],
+        ]
+
+    def test_number_across_chunks(self):
+        assert self._iter("[123456789,987654321]", chunk_size=4) == [123456789, 987654321]
+
+    @pytest.mark.parametrize(
+        "content,chunk_size", [("[100, 2.5]", 2), ("[1.5e10, -2]", 3), ("[7, -0.25e-3]", 5)]
+    )
+    def test_fraction_across_chunks(self, content, chunk_size):
+        # e.g. a chunk ending in "2." must not be read as the integer 2
+        assert self._iter(content, chunk_size=chunk_size) == json.loads(content)
+
+    def test_large_item(self):
+        content = json.dumps([{"data": list(range(100000))}, 1])
+
+        with mock.patch.object(
+            json.JSONDecoder, "raw_decode", autospec=True, side_effect=json.JSONDecoder.raw_decode
+        ) as raw_decode:
+            assert self._iter(content, chunk_size=64) == json.loads(content)
+
+        # the item is decoded again each time the buffer doubles, not once per chunk
+        assert raw_decode.call_count < 20
+
+    def test_multibyte_across_chunks(self):
+        assert self._iter('["\u00e9t\u00e9", "\u2603"]', chunk_size=1) == [
+            "\u00e9t\u00e9",
+            "\u2603",
+        ]
+
+    def test_empty_list(self):
+        assert self._iter("[ ]") == []
+
+    def test_empty(self):
+        assert self._iter("") == []
+
+    def test_object(self):
+        assert self._iter('{"key": [1, 2]}') == [{"key": [1, 2]}]
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            self._iter("[1, 2")
+
+    def test_invalid_separator(self):
+        with pytest.raises(ValueError):
+            self._iter("[1 2]")
+
+    def test_streams_items(self):
+        stream = io.BytesIO(b"[1, 2, " + b" " * 1000 + b"3]")
+        items = command_base.iter_json(stream, chunk_size=8)
+
+        assert next(items) == 1
+        # the first item is available before the whole stream is read
+        assert stream.tell() < 100
+
 
 class TestCommandBaseSession:
     base_url = PVERegistry.base_url
     _session = command_base.CommandBaseSession()
 
     def test_init_all_args(self):
-        sess = command_base.CommandBaseSession(service="SERVICE", timeout=10, sudo=True)
+        sess = command_base.CommandBaseSession(
+            service="SERVICE", timeout=10, sudo=True, upload_timeout=600
+        )
 
         assert sess.service == "service"
         assert sess.timeout == 10
         assert sess.sudo is True
+        assert sess.upload_timeout == 600
 
     def test_exec(self):
         with pytest.raises(NotImplementedError):
@@ -44,6 +128,9 @@ class TestCommandBaseSession:
         with pytest.raises(NotImplementedError), tempfile.TemporaryFile("w+b") as f_obj:
             self._session.upload_file_obj(f_obj, "/tmp/file.iso")
 
+    def test_close(self):
+        assert self._session.close() is None
+
     def test_request_basic(self, mock_exec):
         resp = self._session.request("GET", self.base_url + "/fake/echo")
 
@@ -56,6 +143,13 @@ class TestCommandBaseSession:
             "json",
         ]
 
+    def test_request_metrics(self, mock_exec):
+        resp = self._session.request("GET", self.base_url + "/fake/echo")
+
+        assert resp.bytes_sent == sum(len(arg) + 1 for arg in resp.content)
+        assert "connect" not in resp.timings
+        assert resp.timings["server"] >= 0
+
     def test_request_task(self, mock_exec_task):
         resp = self._session.request("GET", self.base_url + "/stdout")
 
@@ -201,6 +295,82 @@ class TestCommandBaseSession:
                 "json",
             ]
 
+    def test_request_upload_exec_upload(self, mock_exec_upload):
+        with tempfile.NamedTemporaryFile("w+b") as f_obj:
+            resp = self._session.request(
+                "POST",
+                self.base_url + "/node/node1/storage/local/upload",
+                data={"content": "iso", "filename": f_obj},
+            )
+
+            cmd, file_obj = resp.content
+            assert file_obj is f_obj
+            assert cmd == [
+                "pvesh",
+                "create",
+                self.base_url + "/node/node1/storage/local/upload",
+                "-content",
+                "iso",
+                "-filename",
+                str(f_obj.name),
+                "-tmpfilename",
+                command_base.UPLOAD_TMPFILE,
+                "--output-format",
+                "json",
+            ]
+
+    def test_iter_request(self, mock_exec_stream):
+        items = list(self._session.iter_request("GET", self.base_url + "/cluster/resources"))
+
+        assert items == [
+            "pvesh",
+            "get",
+            self.base_url + "/cluster/resources",
+            "--output-format",
+            "json",
+        ]
+
+    def test_iter_request_error(self, mock_exec_stream):
+        with pytest.raises(core.ResourceException) as exc_info:
+            list(self._session.iter_request("GET", self.base_url + "/fail"))
+
+        assert exc_info.value.status_code == 403
+        assert exc_info.value.content == "403 Permission check failed"
+
+    def test_iter_request_invalid(self, mock_exec_stream):
+        with pytest.raises(ValueError):
+            list(self._session.iter_request("GET", self.base_url + "/invalid"))
+
+    def test_iter_request_upload(self):
+        sess = command_base.CommandBaseSession()
+        url = self.base_url + "/node/node1/storage/local/upload"
+
+        with mock.patch.object(
+            sess, "request", return_value=command_base.Response(b'"UPID:..."', 200)
+        ) as mock_request:
+            items = list(sess.iter_request("POST", url, data={"content": "iso"}))
+
+        # uploads are run as a normal request and decoded whole
+        mock_request.assert_called_once_with("POST", url, data={"content": "iso"}, params=None)
+        assert items == ["UPID:..."]
+
+
+class TestUploadShellCommand:
+    def test_basic(self):
+        cmd = ["pvesh", "create", "/upload", "-tmpfilename", command_base.UPLOAD_TMPFILE]
+
+        assert command_base.upload_shell_command(cmd) == (
+            'tmpfile=$(mktemp) && trap \'rm -f "$tmpfile"\' EXIT && cat > "$tmpfile" && '
+            'pvesh create /upload -tmpfilename "$tmpfile"'
+        )
+
+    def test_quoting(self):
+        cmd = ["pvesh", "create", "/upload", "-filename", "my file.iso"]
+
+        assert command_base.upload_shell_command(cmd).endswith(
+            "pvesh create /upload -filename 'my file.iso'"
+        )
+
 
 class TestJsonSimpleSerializer:
     _serializer = command_base.JsonSimpleSerializer()
@@ -297,6 +467,33 @@ def mock_upload_file_obj():
         yield
 
 
+@classmethod
+def _exec_upload_echo(_, cmd, file_obj):
+    return (cmd, file_obj), None
+
+
+@contextmanager
+def _exec_stream_echo(_, cmd):
+    if cmd[2].endswith("/fail"):
+        yield io.BytesIO(b""), lambda: "403 Permission check failed"
+    elif cmd[2].endswith("/invalid"):
+        yield io.BytesIO(b"[not json"), lambda: ""
+    else:
+        yield io.BytesIO(json.dumps(cmd).encode("utf-8")), lambda: ""
+
+
+@pytest.fixture
+def mock_exec_stream():
+    with mock.patch.object(command_base.CommandBaseSession, "_exec_stream", _exec_stream_echo):
+        yield
+
+
+@pytest.fixture
+def mock_exec_upload():
+    with mock.patch.object(command_base.CommandBaseSession, "_exec_upload", _exec_upload_echo):
+        yield
+
+
 @pytest.fixture
 def mock_exec():
     with mock.patch.object(command_base.CommandBaseSession, "_exec", _exec_echo):
@@ -2,14 +2,22 @@ __author__ = "John Hollowell"
 __copyright__ = "(c) John Hollowell 2022"
 __license__ = "MIT"
 
+import asyncio
 import logging
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor
 from unittest import mock
 
 import pytest
 
-from proxmoxer import core
+from proxmoxer import core, tracing
 from proxmoxer.backends import https
 from proxmoxer.backends.command_base import JsonSimpleSerializer, Response
+from proxmoxer.deadline import DeadlineExceeded
+from proxmoxer.limits import RequestLimiter
+from proxmoxer.retry import RetryPolicy
+from proxmoxer.testing import FakePVEServer
 
 from .api_mock import (  # pylint: disable=unused-import # noqa: F401
     PVERegistry,
@@ -59,6 +67,68 @@ class TestResourceException:
         )
 
 
+class TestRedaction:
+    def test_data(self):
+        data = {"password": "a", "cipassword": "b", "otp": "c", "hotplug": "1", "tokenid": "t"}
+
+        assert core.redact_data(data) == {
+            "password": "<redacted>",
+            "cipassword": "<redacted>",
+            "otp": "<redacted>",
+            "hotplug": "1",
+            "tokenid": "t",
+        }
+        # the original is not changed
+        assert data["password"] == "a"
+
+    def test_content_bytes(self):
+        content = b'{"data": {"ticket": "PVE:a\\"b", "CSRFPreventionToken": "c", "cap": {}}}'
+
+        assert (
+            core.redact_content(content)
+            == b'{"data": {"ticket": "<redacted>", "CSRFPreventionToken": "<redacted>", "cap": {}}}'
+        )
+
+    def test_content_str(self):
+        assert core.redact_content('{"password":"a","name":"b"}') == (
+            '{"password":"<redacted>","name":"b"}'
+        )
+
+    def test_content_other(self):
+        content = ["not", "json"]
+
+        assert core.redact_content(content) is content
+
+
+class TestPathTemplate:
+    def test_full_url(self):
+        url = "https://host:8006/api2/json/nodes/node1/qemu/100/status/current"
+
+        assert core.path_template(url) == "/nodes/{node}/qemu/{vmid}/status/current"
+
+    def test_path(self):
+        assert (
+            core.path_template("/nodes/node1/lxc/101/config") == "/nodes/{node}/lxc/{vmid}/config"
+        )
+
+    def test_collections(self):
+        assert core.path_template("/nodes/node1/storage") == "/nodes/{node}/storage"
+        assert core.path_template("/nodes") == "/nodes"
+        assert core.path_template("/cluster/resources") == "/cluster/resources"
+
+    def test_nested(self):
+        path = "/nodes/node1/storage/local/content/local:iso/file.iso"
+
+        assert (
+            core.path_template(path) == "/nodes/{node}/storage/{storage}/content/{volume}/file.iso"
+        )
+
+    def test_prefix(self):
+        url = "https://host/proxy/api2/json/access/users/root@pam/token/t1"
+
+        assert core.path_template(url) == "/access/users/{userid}/token/{tokenid}"
+
+
 class TestProxmoxResource:
     obj = core.ProxmoxResource()
     base_url = "http://example.com/"
@@ -210,6 +280,228 @@ class TestProxmoxResource:
         assert exc_info.value.content == "this is the reason"
         assert exc_info.value.errors == {"errors": b"this is the error"}
 
+    def test_request_iter_fallback(self, mock_resource, caplog):
+        caplog.set_level(logging.DEBUG, logger=MODULE_LOGGER_NAME)
+
+        ret = list(mock_resource._request_iter("GET"))
+
+        # MockSession cannot stream so the whole response is decoded as one item
+        assert ret == [{"data": {"key": "value"}}]
+
+    def test_request_iter_stream(self, caplog):
+        session = mock.Mock()
+        session.iter_request.return_value = iter([1, 2, 3])
+        resource = core.ProxmoxResource(
+            session=session, base_url=self.base_url, serializer=JsonSimpleSerializer()
+        )
+        caplog.set_level(logging.DEBUG, logger=MODULE_LOGGER_NAME)
+
+        ret = list(resource._request_iter("GET", params={"key": "value", "remove_me": None}))
+
+        assert ret == [1, 2, 3]
+        session.iter_request.assert_called_once_with("GET", self.base_url, params={"key": "value"})
+        assert caplog.record_tuples == [(MODULE_LOGGER_NAME, logging.INFO, "GET " + self.base_url)]
+
+    def test_request_iter_hooks(self):
+        session = mock.Mock()
+        session.iter_request.side_effect = [iter([1, 2]), failing_stream([1])]
+        resource = core.ProxmoxResource(session=session, base_url=self.base_url)
+        events = []
+        resource._store["request_hooks"] = [events.append]
+
+        assert list(resource._request_iter("GET")) == [1, 2]
+        # the event is sent once the stream has been read
+        with pytest.raises(core.ResourceException):
+            list(resource._request_iter("GET"))
+
+        assert [(event.status_code, type(event.error)) for event in events] == [
+            (200, type(None)),
+            (500, core.ResourceException),
+        ]
+        assert events[0].timings["total"] >= 0
+
+    def test_request_iter_retry(self):
+        session = mock.Mock()
+        session.iter_request.side_effect = [failing_stream([], 596), iter([1, 2])]
+        resource = core.ProxmoxResource(
+            session=session, base_url=self.base_url, retry_policy=RetryPolicy(backoff=0)
+        )
+
+        assert list(resource._request_iter("GET")) == [1, 2]
+        assert session.iter_request.call_count == 2
+
+    def test_request_iter_no_retry_after_items(self):
+        session = mock.Mock()
+        session.iter_request.side_effect = [failing_stream([1], 596), iter([1, 2])]
+        resource = core.ProxmoxResource(
+            session=session, base_url=self.base_url, retry_policy=RetryPolicy(backoff=0)
+        )
+
+        items = resource._request_iter("GET")
+        assert next(items) == 1
+        with pytest.raises(core.ResourceException):
+            next(items)
+        assert session.iter_request.call_count == 1
+
+    def test_request_iter_span(self):
+        session = mock.Mock()
+        session.iter_request.return_value = iter([1])
+        resource = core.ProxmoxResource(session=session, base_url=self.base_url)
+        tracer = tracing.RecordingTracer()
+
+        tracing.set_tracer(tracer)
+        try:
+            assert list(resource._request_iter("GET")) == [1]
+        finally:
+            tracing.set_tracer(None)
+
+        assert [span.name for span in tracer.spans] == ["proxmoxer.request"]
+        assert tracing.current_span() is None
+
+    def test_request_iter_deadline_in_queue(self):
+        session = mock.Mock()
+        limiter = RequestLimiter(concurrency=1)
+        resource = core.ProxmoxResource(session=session, base_url=self.base_url, limiter=limiter)
+        slot = limiter.acquire("example.com")
+
+        start = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            list(resource.with_deadline(0.05)._request_iter("GET"))
+        slot.release()
+
+        assert time.monotonic() - start < 1
+        session.iter_request.assert_not_called()
+
+    def test_get_async_in_thread(self, mock_resource):
+        # MockSession cannot run requests from an event loop, the blocking request is used
+        assert asyncio.run(mock_resource.nodes.get_async(full=1)) == {"data": {"key": "value"}}
+        assert mock_resource._store["session"].params == {"full": 1}
+
+        with pytest.raises(core.ResourceException):
+            asyncio.run(mock_resource("fail").delete_async())
+
+    def test_request_hooks(self, mock_resource):
+        events = []
+        mock_resource._store["request_hooks"] = [events.append]
+
+        mock_resource(["nodes", "node1"]).status._request("GET")
+
+        assert len(events) == 1
+        event = events[0]
+        assert event.method == "GET"
+        assert event.url == self.base_url + "nodes/node1/status"
+        assert event.path == "/nodes/{node}/status"
+        assert event.status_code == 200
+        assert event.bytes_received == len(b'{"data": {"key": "value"}}')
+        assert event.error is None
+        assert event.timings["total"] >= event.timings["decode"] >= 0
+        assert event.timings["connect"] is None
+
+    def test_request_hooks_fail(self, mock_resource):
+        events = []
+        mock_resource._store["request_hooks"] = [events.append]
+
+        with pytest.raises(core.ResourceException):
+            mock_resource("fail")._request("GET")
+
+        assert events[0].status_code == 500
+        assert events[0].timings["decode"] is None
+
+    def test_request_hook_error(self, mock_resource, caplog):
+        def hook(event):
+            raise ValueError("broken")
+
+        mock_resource._store["request_hooks"] = [hook]
+
+        # the request still succeeds
+        assert mock_resource.nodes._request("GET") == {"data": {"key": "value"}}
+        (record,) = [r for r in caplog.records if r.levelno == logging.WARNING]
+        assert record.getMessage() == f"Request hook {hook!r} failed: broken"
+
+    def test_request_hooks_session_error(self, mock_resource):
+        events = []
+        mock_resource._store["request_hooks"] = [events.append]
+        error = ConnectionError("refused")
+
+        with mock.patch.object(MockSession, "request", side_effect=error):
+            with pytest.raises(ConnectionError):
+                mock_resource._request("GET")
+
+        assert events[0].status_code is None
+        assert events[0].error is error
+
+    def test_request_hooks_session_timings(self, mock_resource):
+        events = []
+        mock_resource._store["request_hooks"] = [events.append]
+        resp = Response(b"[]", 200)
+        resp.timings = {"server": 0.5}
+        resp.bytes_sent = 12
+
+        with mock.patch.object(MockSession, "request", return_value=resp):
+            mock_resource._request("GET")
+
+        assert events[0].timings["server"] == 0.5
+        assert events[0].bytes_sent == 12
+
+    def test_request_hook_error(self, mock_resource, caplog):
+        def bad_hook(event):
+            raise RuntimeError("broken")
+
+        events = []
+        mock_resource._store["request_hooks"] = [bad_hook, events.append]
+
+        assert mock_resource._request("GET") == {"data": {"key": "value"}}
+        assert len(events) == 1
+        assert caplog.record_tuples[-1][:2] == (MODULE_LOGGER_NAME, logging.WARNING)
+
+    def test_request_log_redacted(self, mock_resource, caplog):
+        caplog.set_level(logging.INFO, logger=MODULE_LOGGER_NAME)
+
+        mock_resource._request("POST", data={"username": "root", "password": "secret"})
+
+        assert caplog.record_tuples == [
+            (
+                MODULE_LOGGER_NAME,
+                logging.INFO,
+                "POST " + self.base_url + " " + str({"username": "root", "password": "<redacted>"}),
+            ),
+        ]
+        assert caplog.records[0].http_method == "POST"
+        assert caplog.records[0].url == self.base_url
+
+    def test_request_log_content_redacted(self, mock_resource, caplog):
+        caplog.set_level(logging.DEBUG, logger=MODULE_LOGGER_NAME)
+        resp = Response(b'{"data": {"ticket": "PVE:root@pam:1234", "username": "root"}}', 200)
+
+        with mock.patch.object(MockSession, "request", return_value=resp):
+            mock_resource._request("GET")
+
+        assert caplog.record_tuples[-1] == (
+            MODULE_LOGGER_NAME,
+            logging.DEBUG,
+            'Status code: 200, output: b\'{"data": {"ticket": "<redacted>", "username": "root"}}\'',
+        )
+        assert caplog.records[-1].status_code == 200
+
+    def test_request_log_disabled(self, mock_resource, caplog):
+        caplog.set_level(logging.WARNING, logger=MODULE_LOGGER_NAME)
+
+        class UnformattableBytes(bytes):
+            def __repr__(self):
+                raise AssertionError("response content was formatted")
+
+        resp = Response(UnformattableBytes(b"[]"), 200)
+
+        with mock.patch.object(MockSession, "request", return_value=resp), mock.patch(
+            "proxmoxer.core.redact_data"
+        ) as mock_redact_data, mock.patch("proxmoxer.core.redact_content") as mock_redact_content:
+            mock_resource._request("POST", data={"key": "value"})
+
+        # nothing is formatted or redacted when the messages would be dropped
+        assert caplog.record_tuples == []
+        mock_redact_data.assert_not_called()
+        mock_redact_content.assert_not_called()
+
     def test_request_params_cleanup(self, mock_resource):
         mock_resource._request("GET", params={"key": "value", "remove_me": None})
 
@@ -256,6 +548,12 @@ class TestProxmoxResourceMethods:
         assert ret["params"] == {"key": "value"}
         assert ret_self._store["base_url"] == "https://example.com/nodes"
 
+    def test_iter_get(self, mock_private_request):
+        ret = self._resource.iter_get("nodes", key="value")
+
+        assert next(ret) == "GET"
+        assert next(ret)["key"] == "value"
+
     def test_create(self, mock_private_request):
         ret = self._resource.create("nodes", key="value")
         ret_self = ret["self"]
@@ -336,6 +634,25 @@ class TestProxmoxAPI:
         assert ticket is None
         assert csrf is None
 
+    def test_close(self):
+        prox = core.ProxmoxAPI("host", token_name="name", token_value="value", backend="https")
+
+        with mock.patch.object(prox._store["session"], "close") as mock_close:
+            prox.close()
+
+        mock_close.assert_called_once_with()
+
+    def test_request_hooks(self):
+        prox = core.ProxmoxAPI("host", token_name="name", token_value="value", backend="https")
+        hook = mock.Mock()
+
+        prox.add_request_hook(hook)
+        # child resources share the hooks of the API object
+        assert prox.nodes("node1")._store["request_hooks"] == [hook]
+
+        prox.remove_request_hook(hook)
+        assert prox.nodes("node1")._store["request_hooks"] == []
+
     def test_init_with_cert(self):
         prox = core.ProxmoxAPI(
             "host",
@@ -371,6 +688,129 @@ class TestProxmoxAPI:
         assert prox._store["session"].cert == ("somepem", "somekey")
 
 
+class TestPickle:
+    def test_api(self):
+        prox = core.ProxmoxAPI("host", user="root@pam", token_name="name", token_value="value")
+        prox.add_request_hook(lambda *args: None)
+
+        restored = pickle.loads(pickle.dumps(prox))
+
+        assert repr(restored) == repr(prox)
+        assert restored._store["session"] is not prox._store["session"]
+        assert isinstance(restored._store["session"], https.ProxmoxHttpSession)
+        assert restored._store["session"].auth.token_value == "value"
+        assert restored._store["request_hooks"] == []
+        # the original is unchanged
+        assert len(prox._store["request_hooks"]) == 1
+
+    def test_resource(self):
+        prox = core.ProxmoxAPI("host", user="root@pam", token_name="name", token_value="value")
+
+        restored = pickle.loads(pickle.dumps(prox.nodes("node1").qemu))
+
+        assert restored._store["base_url"] == prox.nodes("node1").qemu._store["base_url"]
+        assert restored._store["session"] is restored._store["backend"].get_session()
+
+    @pytest.mark.filterwarnings("ignore::urllib3.exceptions.InsecureRequestWarning")
+    def test_process_pool(self):
+        with FakePVEServer() as server:
+            prox = core.ProxmoxAPI(
+                server.address, user="root@pam", password="password", verify_ssl=False
+            )
+
+            with ProcessPoolExecutor(max_workers=2) as executor:
+                releases = list(executor.map(get_release, [prox] * 4))
+
+            assert releases == ["8.2"] * 4
+            # the workers used the ticket from this process instead of logging in again
+            assert len(server.api._tickets) == 1
+
+    def test_after_fork(self):
+        session = mock.Mock()
+        core.reset_on_fork(session)
+
+        core._after_fork_in_child()
+
+        session._after_fork.assert_called_once_with()
+
+
+@pytest.mark.filterwarnings("ignore::urllib3.exceptions.InsecureRequestWarning")
+class TestConnectMany:
+    def test_warm(self, server):
+        configs = {name: api_kwargs(server, lazy=True) for name in ("a", "b", "c")}
+
+        clients = core.connect_many(configs)
+
+        assert list(clients) == ["a", "b", "c"]
+        assert all(isinstance(prox, core.ProxmoxAPI) for prox in clients.values())
+        # every client logged in while being warmed
+        assert len(server.api._tickets) == 3
+
+    def test_lazy_not_warmed(self, server):
+        clients = core.connect_many({"a": api_kwargs(server, lazy=True)}, warm=False)
+
+        assert len(server.api._tickets) == 0
+        assert clients["a"].version.get()["release"] == "8.2"
+        assert len(server.api._tickets) == 1
+
+    def test_concurrent(self):
+        with FakePVEServer(workers=8, latency=0.2) as server:
+            configs = {i: api_kwargs(server) for i in range(8)}
+
+            start = time.monotonic()
+            core.connect_many(configs)
+
+            # a login and a request each, sequentially this would take 3.2s
+            assert time.monotonic() - start < 1.6
+
+    def test_error(self, server):
+        configs = {"good": api_kwargs(server), "bad": api_kwargs(server, password="wrong")}
+
+        with pytest.raises(core.AuthenticationError):
+            core.connect_many(configs)
+
+    def test_return_exceptions(self, server):
+        configs = {"good": api_kwargs(server), "bad": api_kwargs(server, password="wrong")}
+
+        clients = core.connect_many(configs, return_exceptions=True)
+
+        assert isinstance(clients["good"], core.ProxmoxAPI)
+        assert isinstance(clients["bad"], core.AuthenticationError)
+
+    def test_traced(self, server):
+        tracer = tracing.RecordingTracer()
+        tracing.set_tracer(tracer)
+        try:
+            with tracing.span("setup") as parent:
+                core.connect_many({"a": api_kwargs(server)})
+        finally:
+            tracing.set_tracer(None)
+
+        requests = [span for span in tracer.spans if span.name == "proxmoxer.request"]
+        # the warming request is traced under the caller's span
+        assert requests and all(span.trace_id == parent.trace_id for span in requests)
+
+
+def api_kwargs(server, **kwargs):
+    return {
+        "host": server.address,
+        "user": "root@pam",
+        "password": "password",
+        "verify_ssl": False,
+        **kwargs,
+    }
+
+
+def get_release(prox):
+    return prox.version.get()["release"]
+
+
+def failing_stream(items, status_code=500):
+    """A streamed response which yields `items`, then fails like a failed command"""
+    yield from items
+    raise core.ResourceException(status_code, "Internal Server Error", "command failed")
+
+
 class MockSession:
     def request(self, method, url, data=None, params=None):
         # store the arguments in the session so they can be tested after the call
@@ -393,7 +833,13 @@ def mock_private_request():
     def mock_request(self, method, data=None, params=None):
         return {"self": self, "method": method, "data": data, "params": params}
 
-    with mock.patch("proxmoxer.core.ProxmoxResource._request", mock_request):
+    def mock_request_iter(self, method, params=None):
+        yield method
+        yield params
+
+    with mock.patch("proxmoxer.core.ProxmoxResource._request", mock_request), mock.patch(
+        "proxmoxer.core.ProxmoxResource._request_iter", mock_request_iter
+    ):
         yield
 
 
@@ -402,3 +848,9 @@ def mock_resource():
     return core.ProxmoxResource(
         session=MockSession(), base_url="http://example.com/", serializer=JsonSimpleSerializer()
     )
+
+
+@pytest.fixture
+def server():
+    with FakePVEServer() as fake:
+        yield fake
@@ -0,0 +1,154 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+import pickle
+import threading
+import time
+from unittest import mock
+
+import pytest
+import requests
+
+from proxmoxer import ProxmoxAPI, ProxmoxResource, ResourceException
+from proxmoxer.deadline import Deadline, DeadlineExceeded
+from proxmoxer.limits import RequestLimiter
+from proxmoxer.retry import RetryPolicy
+from proxmoxer.testing import FakePVEServer
+
+# pylint: disable=no-self-use,redefined-outer-name,protected-access
+
+
+class TestDeadline:
+    def test_remaining(self):
+        deadline = Deadline(10)
+
+        assert 9.9 < deadline.remaining() <= 10
+        assert not deadline.expired
+        assert repr(deadline).endswith("s of 10s left)")
+
+    def test_expired(self):
+        deadline = Deadline(0.01)
+        time.sleep(0.01)
+
+        assert deadline.expired
+        assert deadline.remaining() == 0
+        with pytest.raises(DeadlineExceeded) as exc_info:
+            deadline.check("GET /nodes")
+        assert str(exc_info.value) == "the 0.01s deadline passed before GET /nodes"
+
+    def test_timeout(self):
+        deadline = Deadline(1)
+
+        assert deadline.timeout(0.5) == 0.5
+        assert 0.9 < deadline.timeout(5) <= 1
+        assert 0.9 < deadline.timeout() <= 1
+        with pytest.raises(DeadlineExceeded):
+            Deadline(0).timeout(5)
+
+    def test_pickle(self):
+        deadline = Deadline(10)
+
+        restored = pickle.loads(pickle.dumps(deadline))
+
+        assert 9.9 < restored.remaining() <= 10
+        assert restored.seconds == 10
+
+
+@pytest.mark.filterwarnings("ignore::urllib3.exceptions.InsecureRequestWarning")
+class TestProxmoxAPI:
+    def test_with_deadline(self, server):
+        prox = ProxmoxAPI(**api_kwargs(server))
+        deadline = Deadline(10)
+
+        assert prox.with_deadline(deadline).version._store["deadline"] is deadline
+        assert prox.with_deadline(5).version._store["deadline"].seconds == 5
+        assert "deadline" not in prox._store
+        assert prox.with_deadline(5).version.get()["release"] == "8.2"
+
+    def test_slow_response(self, server):
+        prox = ProxmoxAPI(**api_kwargs(server))
+        events = []
+        prox.add_request_hook(events.append)
+
+        server.latency = 0.5
+        start = time.monotonic()
+        with pytest.raises(DeadlineExceeded) as exc_info:
+            prox.with_deadline(0.1).version.get()
+
+        # the request's timeout was shortened from the backend's 5s
+        assert time.monotonic() - start < 0.4
+        assert isinstance(exc_info.value.__cause__, requests.Timeout)
+        assert str(exc_info.value).startswith("the 0.1s deadline passed during GET https://")
+        assert len(events) == 1
+
+    def test_not_sent_after_deadline(self, server):
+        prox = ProxmoxAPI(**api_kwargs(server))
+        sent = sum(server.stats.values())
+
+        with pytest.raises(DeadlineExceeded):
+            prox.with_deadline(Deadline(0)).nodes.get()
+
+        assert sum(server.stats.values()) == sent
+
+    def test_no_retry_after_deadline(self, server):
+        prox = ProxmoxAPI(**api_kwargs(server), retry_policy=RetryPolicy(backoff=1))
+
+        server.inject_error(596, count=3, path="/version")
+        with mock.patch("proxmoxer.retry.random.uniform", side_effect=lambda a, b: b):
+            with pytest.raises(ResourceException):
+                prox.with_deadline(0.5).version.get()
+
+        # the 1s backoff would end after the deadline, so the first error is raised at once
+        assert server.stats[596] == 1
+
+    def test_queue(self, server):
+        limiter = RequestLimiter(concurrency=1)
+        prox = ProxmoxAPI(**api_kwargs(server), limiter=limiter)
+        slot = limiter.acquire(server.address)
+
+        with pytest.raises(DeadlineExceeded):
+            prox.with_deadline(0.05).version.get()
+
+        slot.release()
+        assert limiter.snapshot()[server.address]["queue_timeouts"] == 1
+
+    def test_queue_wait_shortens_timeout(self, server):
+        limiter = RequestLimiter(concurrency=1)
+        prox = ProxmoxAPI(**api_kwargs(server), limiter=limiter)
+        session = prox._store["session"]
+        slot = limiter.acquire(server.address)
+        threading.Timer(0.3, slot.release).start()
+
+        with mock.patch.object(session, "request", wraps=session.request) as request:
+            prox.with_deadline(1).version.get()
+
+        # 0.3s of the deadline were spent waiting for the saturated limiter
+        assert request.call_args.kwargs["timeout"] <= 0.71
+
+    def test_command_backend(self):
+        # the command sessions have no timeout per request, only the start is checked
+        session = mock.Mock(spec=["request"])
+        session.request.return_value = mock.Mock(status_code=200)
+        resource = ProxmoxResource(session=session, base_url="/nodes", serializer=mock.Mock())
+
+        resource.with_deadline(1).get()
+        assert "timeout" not in session.request.call_args.kwargs
+        with pytest.raises(DeadlineExceeded):
+            resource.with_deadline(0).get()
+        assert session.request.call_count == 1
+
+
+def api_kwargs(server):
+    return {
+        "host": server.address,
+        "user": "root@pam",
+        "password": "password",
+        "verify_ssl": False,
+    }
+
+
+@pytest.fixture
+def server():
+    with FakePVEServer() as fake:
+        yield fake
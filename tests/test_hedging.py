@@ -0,0 +1,215 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+import pickle
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from proxmoxer import ProxmoxAPI, ResourceException
+from proxmoxer.hedging import HedgePolicy
+from proxmoxer.retry import RetryBudget
+from proxmoxer.testing import FakePVEServer
+
+# pylint: disable=no-self-use,redefined-outer-name,protected-access
+
+URL = "https://pve1:8006/api2/json/cluster/resources"
+
+
+class TestCall:
+    def test_fast(self):
+        policy = HedgePolicy(["pve2"], initial_delay=0.05)
+        sent = []
+
+        assert policy.call(URL, sender(sent)) == "pve1:8006"
+
+        assert sent == ["pve1:8006"]
+        assert policy.stats["hedged"] == 0
+
+    def test_slow(self):
+        policy = HedgePolicy(["pve2"], initial_delay=0.02)
+        sent = []
+
+        start = time.monotonic()
+        assert policy.call(URL, sender(sent, slow={"pve1:8006": 0.5})) == "pve2:8006"
+
+        # the answer of the hedge is used without waiting for the first request
+        assert time.monotonic() - start < 0.3
+        assert sent == ["pve1:8006", "pve2:8006"]
+        assert policy.stats["hedged"] == policy.stats["hedge_won"] == 1
+
+    def test_first_answer_wins(self):
+        policy = HedgePolicy(["pve2"], initial_delay=0.02)
+
+        send = sender([], slow={"pve1:8006": 0.05, "pve2:8006": 0.5})
+
+        assert policy.call(URL, send) == "pve1:8006"
+        assert policy.stats["hedge_won"] == 0
+
+    def test_error_waits_for_other(self):
+        policy = HedgePolicy(["pve2"], initial_delay=0.02)
+        send = sender([], slow={"pve1:8006": 0.05, "pve2:8006": 0.1}, fail={"pve1:8006"})
+
+        assert policy.call(URL, send) == "pve2:8006"
+
+    def test_errors(self):
+        policy = HedgePolicy(["pve2"], initial_delay=0.02)
+        send = sender([], slow={"pve1:8006": 0.05}, fail={"pve1:8006", "pve2:8006"})
+
+        with pytest.raises(ResourceException) as exc_info:
+            policy.call(URL, send)
+
+        assert exc_info.value.status_code == 596
+
+    def test_fast_error(self):
+        policy = HedgePolicy(["pve2"], initial_delay=0.05)
+        sent = []
+
+        with pytest.raises(ResourceException):
+            policy.call(URL, sender(sent, fail={"pve1:8006"}))
+
+        assert sent == ["pve1:8006"]
+
+    def test_concurrent_stats(self):
+        policy = HedgePolicy(["pve2"], initial_delay=1)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda _: policy.call(URL, sender([])), range(400)))
+
+        assert policy.stats["requests"] == 400
+
+    def test_budget(self):
+        policy = HedgePolicy(
+            ["pve2"], initial_delay=0.01, budget=RetryBudget(ratio=0.5, min_per_second=0)
+        )
+        sent = []
+
+        for _ in range(4):
+            policy.call(URL, sender(sent, slow={"pve1:8006": 0.03}))
+
+        assert sent.count("pve2:8006") == 2
+        assert policy.stats["over_budget"] == 2
+
+    def test_members_in_turn(self):
+        policy = HedgePolicy(["pve2", "pve3:8007", "[fd00::3]", "[fd00::4]:8008"])
+
+        assert [policy.member_url(URL).split("/api2")[0] for _ in range(5)] == [
+            "https://pve2:8006",
+            "https://pve3:8007",
+            "https://[fd00::3]:8006",
+            "https://[fd00::4]:8008",
+            "https://pve2:8006",
+        ]
+
+    def test_applies(self):
+        policy = HedgePolicy(["pve2"], paths=["/cluster/resources", "/nodes/{node}/status"])
+
+        assert policy.applies(URL)
+        assert policy.applies("https://pve1:8006/api2/json/nodes/pve1/status")
+        assert not policy.applies("https://pve1:8006/api2/json/nodes")
+        # commands run over ssh or locally only reach one node
+        assert not HedgePolicy(["pve2"]).applies("/cluster/resources")
+        assert not HedgePolicy([]).applies(URL)
+
+
+class TestDelay:
+    def test_initial(self):
+        policy = HedgePolicy(["pve2"], initial_delay=0.3, min_samples=20)
+
+        for _ in range(10):
+            policy.record_latency(0.01)
+
+        assert policy.delay == 0.3
+
+    def test_percentile(self):
+        policy = HedgePolicy(["pve2"], min_delay=0)
+
+        for i in range(1, 101):
+            policy.record_latency(i / 1000)
+
+        assert policy.delay == pytest.approx(0.096)
+
+    def test_bounds(self):
+        policy = HedgePolicy(["pve2"], min_delay=0.05, max_delay=2)
+
+        for _ in range(20):
+            policy.record_latency(0.001)
+        assert policy.delay == 0.05
+        for _ in range(500):
+            policy.record_latency(10)
+        assert policy.delay == 2
+
+    def test_pickle(self):
+        policy = HedgePolicy(["pve2"], min_delay=0)
+        for _ in range(20):
+            policy.record_latency(0.5)
+
+        restored = pickle.loads(pickle.dumps(policy))
+
+        assert restored.delay == 0.5
+        assert len(restored._latencies) == 0
+        assert restored.member_url(URL).startswith("https://pve2:8006/")
+
+
+@pytest.mark.filterwarnings("ignore::urllib3.exceptions.InsecureRequestWarning")
+class TestProxmoxAPI:
+    def test_hedged(self, servers):
+        slow, fast = servers
+        policy = HedgePolicy([fast.address], initial_delay=0.05)
+        prox = ProxmoxAPI(**api_kwargs(slow), hedge_policy=policy)
+        events = []
+        prox.add_request_hook(events.append)
+
+        slow.latency = 0.5
+        start = time.monotonic()
+        assert prox.version.get()["release"] == "8.2"
+
+        assert time.monotonic() - start < 0.4
+        # the ticket from the first member is accepted by the other
+        assert [event.status_code for event in events] == [200]
+        assert fast.address in events[0].url
+        assert policy.stats["hedge_won"] == 1
+
+    def test_not_get(self, servers):
+        slow, fast = servers
+        prox = ProxmoxAPI(
+            **api_kwargs(slow), hedge_policy=HedgePolicy([fast.address], initial_delay=0.01)
+        )
+
+        slow.latency = 0.05
+        prox.nodes("node1").qemu(100).status.start.post()
+
+        assert fast.stats[200] == 0
+
+
+def sender(sent, slow=None, fail=()):
+    """A `send` which answers with the host after `slow` seconds, or fails for hosts in `fail`"""
+
+    def send(url):
+        host = url.split("/")[2]
+        sent.append(host)
+        time.sleep((slow or {}).get(host, 0))
+        if host in fail:
+            raise ResourceException(596, "Broken pipe", "")
+        return host
+
+    return send
+
+
+def api_kwargs(server):
+    return {
+        "host": server.address,
+        "user": "root@pam",
+        "password": "password",
+        "verify_ssl": False,
+    }
+
+
+@pytest.fixture
+def servers():
+    """Two members of a cluster, sharing its state and tickets"""
+    with FakePVEServer() as first, FakePVEServer() as second:
+        second.api = first.api
+        yield first, second
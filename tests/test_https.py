@@ -3,9 +3,11 @@ __copyright__ = "(c) John Hollowell 2022"
 __license__ = "MIT"
 
 import logging
+import pickle
 import re
 import sys
 import tempfile
+import time
 from unittest import mock
 
 import pytest
@@ -251,6 +253,52 @@ class TestProxmoxHTTPAuth:
             "otp", "password", base_url=self.base_url, otp="123456", service="PVE"
         )
 
+    def test_lazy(self, mock_pve):
+        auth = https.ProxmoxHTTPAuth("user", "password", base_url=self.base_url, lazy=True)
+
+        assert len(mock_pve.calls) == 0
+        assert auth.get_cookies().get_dict() == {"PVEAuthCookie": "ticket"}
+        assert len(mock_pve.calls) == 1
+        # the password is forgotten after logging in
+        assert auth._pending_login is None
+
+        auth(Request("POST", self.base_url + "/version").prepare())
+
+        assert len(mock_pve.calls) == 1
+
+    def test_lazy_auth_failure(self, mock_pve):
+        auth = https.ProxmoxHTTPAuth("bad_auth", "", base_url=self.base_url, lazy=True)
+
+        with pytest.raises(core.AuthenticationError):
+            auth.get_tokens()
+        # tried again by the next request
+        with pytest.raises(core.AuthenticationError):
+            auth(Request("GET", self.base_url + "/version").prepare())
+
+    def test_lazy_pickle(self, mock_pve):
+        auth = https.ProxmoxHTTPAuth("user", "password", base_url=self.base_url, lazy=True)
+
+        data = pickle.dumps(auth)
+        restored = pickle.loads(data)
+
+        # logged in before pickling, so only the ticket is sent
+        assert b"password" not in data
+        assert len(mock_pve.calls) == 1
+        assert restored._pending_login is None
+        assert restored.get_tokens() == ("ticket", "CSRFPreventionToken")
+        assert len(mock_pve.calls) == 1
+
+    def test_pickle(self, mock_pve):
+        auth = https.ProxmoxHTTPAuth("user", "password", base_url=self.base_url)
+        auth.birth_time -= 100
+
+        restored = pickle.loads(pickle.dumps(auth))
+
+        assert restored.pve_auth_ticket == "ticket"
+        assert restored.csrf_prevention_token == "CSRFPreventionToken"
+        # the ticket keeps its age rather than its timestamp
+        assert 100 <= time.monotonic() - restored.birth_time < 110
+
     def test_auth_otp_missing(self, mock_pve):
         with pytest.raises(core.AuthenticationError) as exc_info:
             https.ProxmoxHTTPAuth("otp", "password", base_url=self.base_url, service="PVE")
@@ -292,6 +340,13 @@ class TestProxmoxHttpSession:
         assert content["body"] == "key=value"
         assert content["headers"]["Content-Type"] == "application/x-www-form-urlencoded"
 
+    def test_request_metrics(self, mock_pve):
+        resp = self._session.request("GET", self.base_url + "/fake/echo", data={"key": "value"})
+
+        assert resp.bytes_sent == len("key=value")
+        assert resp.timings["auth"] >= 0
+        assert resp.timings["server"] == resp.elapsed.total_seconds()
+
     def test_request_monitor_command_list(self, mock_pve):
         resp = self._session.request(
             "GET",
@@ -443,8 +498,51 @@ class TestProxmoxHttpSession:
         assert m is not None  # content matches multipart for the created file
         assert content["headers"]["Content-Type"] == "multipart/form-data; boundary=" + m[1]
 
+    # pylint: disable=protected-access
+    def test_after_fork(self):
+        session = https.Backend("1.2.3.4", token_name="").get_session()
+        adapter = session.adapters["https://"]
+        old_pool = adapter.poolmanager
+
+        with mock.patch.object(old_pool, "clear") as mock_clear:
+            session._after_fork()
+
+        assert adapter.poolmanager is not old_pool
+        assert adapter.proxy_manager == {}
+        # the parent's connections are not closed from the child
+        mock_clear.assert_not_called()
+
+    def test_backend_shares_session(self):
+        backend = https.Backend("1.2.3.4", token_name="")
+
+        assert backend.get_session() is backend.get_session()
+
+    def test_backend_pickle(self):
+        backend = https.Backend("1.2.3.4", token_name="name", token_value="value")
+        session = backend.get_session()
+
+        restored = pickle.loads(pickle.dumps(backend))
+
+        assert restored.get_session() is not session
+        assert restored.get_session().auth.token_value == "value"
+
+
+class TestGetBodySize:
+    def test_empty(self):
+        assert https.get_body_size(mock.Mock(body=None)) == 0
+
+    def test_bytes(self):
+        assert https.get_body_size(mock.Mock(body=b"12345")) == 5
+
+    def test_stream(self):
+        prepared = mock.Mock(body=iter([b"1"]), headers={"Content-Length": "10"})
+
+        assert https.get_body_size(prepared) == 10
+
+    def test_stream_unknown(self):
+        assert https.get_body_size(mock.Mock(body=iter([b"1"]), headers={})) is None
+
 
-# pylint: disable=protected-access
 class TestJsonSerializer:
     _serializer = https.JsonSerializer()
 
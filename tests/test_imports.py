@@ -2,12 +2,20 @@ __author__ = "John Hollowell"
 __copyright__ = "(c) John Hollowell 2022"
 __license__ = "MIT"
 
+import json
 import logging
+import os
+import subprocess
 import sys
 from importlib import reload
 
 import pytest
 
+import proxmoxer
+
+# imported when a backend or tool needing them is used, never by `import proxmoxer`
+HEAVY_MODULES = ["requests", "paramiko", "openssh_wrapper", "http.client", "ssl", "uuid"]
+
 
 def test_missing_requests(requests_off, caplog):
     with pytest.raises(SystemExit) as exit_exp:
@@ -77,6 +85,51 @@ def test_missing_paramiko_off(paramiko_off, caplog):
     ]
 
 
+class TestLazyImports:
+    def test_import_proxmoxer(self):
+        assert loaded_modules("import proxmoxer") == []
+
+    def test_import_api(self):
+        assert loaded_modules("from proxmoxer import ProxmoxAPI") == []
+
+    def test_import_tasks(self):
+        assert loaded_modules("from proxmoxer.tools import Tasks") == []
+
+    def test_local_backend(self):
+        assert loaded_modules("import proxmoxer; proxmoxer.ProxmoxAPI(backend='local')") == []
+
+    def test_https_backend(self):
+        loaded = loaded_modules("import proxmoxer; proxmoxer.ProxmoxAPI('host', token_name='a')")
+
+        assert "requests" in loaded
+
+    def test_files(self):
+        assert "requests" in loaded_modules("from proxmoxer.tools import Files")
+
+    def test_tools_without_requests(self):
+        code = "import sys; sys.modules['requests'] = None; from proxmoxer.tools import Tasks"
+
+        assert loaded_modules(code) == []
+
+    def test_attributes(self):
+        from proxmoxer import core, tools
+        from proxmoxer.tools import tasks
+
+        assert proxmoxer.ProxmoxAPI is core.ProxmoxAPI
+        assert proxmoxer.SERVICES is core.SERVICES
+        assert tools.Tasks is tasks.Tasks
+        assert "ProxmoxAPI" in dir(proxmoxer)
+        assert "Files" in dir(tools)
+
+    def test_missing_attribute(self):
+        from proxmoxer import tools
+
+        with pytest.raises(AttributeError, match="has no attribute 'Missing'"):
+            proxmoxer.Missing  # pylint: disable=pointless-statement
+        with pytest.raises(AttributeError, match="has no attribute 'Missing'"):
+            tools.Missing  # pylint: disable=pointless-statement
+
+
 class TestCommandBase:
     def test_join_empty(self, shlex_join_on_off):
         from proxmoxer.backends import command_base
@@ -143,3 +196,19 @@ def shlex_join_on_off(request, monkeypatch):
             monkeypatch.delattr(sys.modules["shlex"], "join")
         # else join already does not exist (py < 3.8)
     return request.param
+
+
+def loaded_modules(code):
+    """Run code in a new interpreter and return which of HEAVY_MODULES it imported"""
+    check = (
+        f"import json, sys; print(json.dumps([m for m in {HEAVY_MODULES!r} if sys.modules.get(m)]))"
+    )
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(proxmoxer.__file__)))
+    result = subprocess.run(
+        [sys.executable, "-c", f"{code}\n{check}"],
+        env=env,
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    return json.loads(result.stdout)
@@ -0,0 +1,363 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+import pickle
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import pytest
+
+from proxmoxer import ProxmoxAPI, ProxmoxResource, ResourceException
+from proxmoxer.limits import (
+    HostLimiter,
+    QueueTimeout,
+    RequestLimiter,
+    TokenBucket,
+    priority_rank,
+)
+from proxmoxer.testing import FakePVEServer
+
+# pylint: disable=no-self-use,redefined-outer-name,protected-access
+
+
+class TestTokenBucket:
+    def test_burst(self):
+        bucket = TokenBucket(rate=10, burst=2)
+
+        delays = [bucket.reserve() for _ in range(4)]
+
+        assert delays[:2] == [0.0, 0.0]
+        assert delays[2] == pytest.approx(0.1, abs=0.01)
+        assert delays[3] == pytest.approx(0.2, abs=0.01)
+
+    def test_refill(self):
+        bucket = TokenBucket(rate=100, burst=1)
+        bucket.reserve()
+
+        time.sleep(0.02)
+
+        assert bucket.reserve() == 0.0
+
+    def test_default_burst(self):
+        assert TokenBucket(rate=0.5).burst == 1.0
+        assert TokenBucket(rate=20).burst == 20
+
+
+class TestHostLimiter:
+    def test_concurrency(self):
+        limiter = HostLimiter("host", concurrency=2)
+        in_flight = []
+
+        def request(_):
+            slot = limiter.acquire()
+            in_flight.append(limiter.stats()["in_flight"])
+            time.sleep(0.02)
+            slot.release(status_code=200)
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(request, range(8)))
+
+        stats = limiter.stats()
+        assert max(in_flight) == 2
+        assert stats["requests"] == 8
+        assert stats["queued"] >= 6
+        assert stats["in_flight"] == 0
+        assert stats["queue_depth"] == 0
+        assert stats["wait_seconds_max"] >= 0.02
+
+    def test_fifo(self):
+        limiter = HostLimiter("host", concurrency=1)
+
+        assert queue_requests(limiter, [None] * 5) == [0, 1, 2, 3, 4]
+
+    def test_release_once(self):
+        limiter = HostLimiter("host", concurrency=1)
+        slot = limiter.acquire()
+
+        slot.release()
+        slot.release()
+
+        assert limiter.stats()["in_flight"] == 0
+
+    def test_queue_timeout(self):
+        limiter = HostLimiter("host", concurrency=1, queue_timeout=0.05)
+        slot = limiter.acquire()
+
+        with pytest.raises(QueueTimeout) as exc_info:
+            limiter.acquire()
+
+        assert str(exc_info.value).startswith("request to host waited 0.05s")
+        assert limiter.stats()["queue_depth"] == 0
+        assert limiter.stats()["queue_timeouts"] == 1
+        slot.release()
+        limiter.acquire().release()
+
+    def test_acquire_timeout(self):
+        limiter = HostLimiter("host", concurrency=1, queue_timeout=10)
+        slot = limiter.acquire()
+
+        start = time.monotonic()
+        with pytest.raises(QueueTimeout):
+            limiter.acquire(timeout=0.05)
+
+        # the shorter of the two is used
+        assert time.monotonic() - start < 1
+        slot.release()
+
+    def test_queue_timeout_rate(self):
+        limiter = HostLimiter("host", rate=1, burst=1, queue_timeout=0.1)
+        limiter.acquire().release()
+
+        with pytest.raises(QueueTimeout):
+            limiter.acquire()
+
+    def test_rate(self):
+        limiter = HostLimiter("host", concurrency=10, rate=50, burst=1)
+
+        start = time.monotonic()
+        for _ in range(6):
+            limiter.acquire().release()
+
+        assert time.monotonic() - start >= 0.1
+
+    def test_adaptive_decrease(self):
+        limiter = HostLimiter("host", concurrency=8, adaptive=True, min_concurrency=2)
+        slots = [limiter.acquire() for _ in range(4)]
+
+        slots[0].release(status_code=596)
+        # sent before the decrease, so they do not lower the limit again
+        slots[1].release(error=ConnectionResetError())
+        assert limiter.limit == 4
+        for slot in slots[2:]:
+            slot.release()
+
+        for _ in range(2):
+            limiter.acquire().release(status_code=503)
+        assert limiter.limit == 2
+
+    def test_adaptive_slow(self):
+        limiter = HostLimiter("host", concurrency=4, adaptive=True, latency_target=0.01)
+        slot = limiter.acquire()
+
+        time.sleep(0.02)
+        slot.release(status_code=200)
+
+        assert limiter.limit == 2
+
+    def test_adaptive_increase(self):
+        limiter = HostLimiter("host", concurrency=2, adaptive=True, max_concurrency=3)
+
+        for _ in range(2):
+            limiter.acquire().release(status_code=200)
+        assert limiter.limit == 2
+        limiter.acquire().release(status_code=404)
+        assert limiter.limit == 3
+
+        for _ in range(10):
+            limiter.acquire().release(status_code=200)
+        assert limiter.limit == 3
+
+    def test_not_adaptive(self):
+        limiter = HostLimiter("host", concurrency=4)
+
+        limiter.acquire().release(status_code=596)
+
+        assert limiter.limit == 4
+        assert repr(limiter) == "HostLimiter (host 0/4, 0 queued)"
+
+
+class TestPriority:
+    def test_rank(self):
+        assert priority_rank(None) == priority_rank("default") == 1
+        assert priority_rank("interactive") < priority_rank("bulk")
+        assert priority_rank(-5) == -5
+        with pytest.raises(ValueError) as exc_info:
+            priority_rank("urgent")
+        assert str(exc_info.value) == (
+            "unknown priority 'urgent', choose from interactive, default, bulk"
+        )
+
+    def test_order(self):
+        limiter = HostLimiter("host", concurrency=1, aging=None)
+
+        order = queue_requests(limiter, ["bulk", "bulk", "interactive", None, -1])
+
+        assert order == [4, 2, 3, 0, 1]
+
+    def test_aging(self):
+        limiter = HostLimiter("host", concurrency=1, aging=0.05)
+        first = limiter.acquire()
+        order = []
+
+        threads = [start_request(limiter, "bulk", order, 0)]
+        # waiting for two agings makes the bulk request as urgent as a new interactive one
+        time.sleep(0.15)
+        threads.append(start_request(limiter, "interactive", order, 1))
+        first.release()
+        for thread in threads:
+            thread.join()
+
+        assert order == [0, 1]
+
+
+class TestRequestLimiter:
+    def test_per_host(self):
+        limiter = RequestLimiter(concurrency=2, per_host={"big:8006": {"concurrency": 8}})
+
+        assert limiter.for_host("small:8006").limit == 2
+        assert limiter.for_host("big:8006").limit == 8
+        assert limiter.for_host("small:8006") is limiter.for_host("small:8006")
+
+    def test_snapshot(self):
+        limiter = RequestLimiter()
+        limiter.acquire("pve1").release()
+
+        assert limiter.snapshot() == {
+            "pve1": {
+                "limit": 3,
+                "in_flight": 0,
+                "queue_depth": 0,
+                "requests": 1,
+                "queued": 0,
+                "wait_seconds_total": pytest.approx(0, abs=0.01),
+                "wait_seconds_max": pytest.approx(0, abs=0.01),
+                "queue_timeouts": 0,
+            }
+        }
+
+    def test_pickle(self):
+        limiter = RequestLimiter(concurrency=1)
+        limiter.acquire("pve1")
+
+        restored = pickle.loads(pickle.dumps(limiter))
+
+        assert restored.snapshot() == {}
+        restored.acquire("pve1").release()
+
+
+@pytest.mark.filterwarnings("ignore::urllib3.exceptions.InsecureRequestWarning")
+class TestProxmoxAPI:
+    def test_concurrency(self):
+        with FakePVEServer(workers=8, latency=0.02) as server:
+            limiter = RequestLimiter(concurrency=2)
+            prox = ProxmoxAPI(**api_kwargs(server), limiter=limiter)
+            events = []
+            prox.add_request_hook(events.append)
+
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                list(executor.map(lambda _: prox.version.get(), range(16)))
+
+            assert server.max_in_flight == 2
+            assert limiter.snapshot()[server.address]["requests"] == 16
+            assert max(event.timings["queue"] for event in events) > 0.02
+
+    def test_errors_release(self):
+        with FakePVEServer() as server:
+            limiter = RequestLimiter(concurrency=1)
+            prox = ProxmoxAPI(**api_kwargs(server), limiter=limiter)
+
+            server.inject_error(596, count=3)
+            for _ in range(3):
+                with pytest.raises(ResourceException):
+                    prox.version.get()
+
+            assert prox.version.get()["release"] == "8.2"
+            assert limiter.snapshot()[server.address]["in_flight"] == 0
+
+    def test_with_priority(self):
+        limiter = RequestLimiter(concurrency=1)
+        order = []
+
+        def request(method, url, **kwargs):
+            order.append(url)
+            return mock.Mock(status_code=200)
+
+        session = mock.Mock()
+        session.request.side_effect = request
+        prox = ProxmoxResource(
+            session=session,
+            base_url="https://pve1:8006/api2/json",
+            serializer=mock.Mock(),
+            limiter=limiter,
+        )
+        bulk = prox.with_priority("bulk")
+
+        first = limiter.acquire("pve1:8006")
+        threads = []
+        for resource in (bulk.cluster.resources, bulk.nodes, prox.version):
+            threads.append(threading.Thread(target=resource.get))
+            threads[-1].start()
+            while limiter.snapshot()["pve1:8006"]["queue_depth"] < len(threads):
+                time.sleep(0.001)
+        first.release()
+        for thread in threads:
+            thread.join()
+
+        assert [url.rsplit("/json/", 1)[1] for url in order] == [
+            "version",
+            "cluster/resources",
+            "nodes",
+        ]
+        assert bulk._store["priority"] == "bulk"
+        assert "priority" not in prox._store
+
+    def test_with_unknown_priority(self):
+        prox = ProxmoxResource(base_url="https://pve1:8006/api2/json")
+
+        with pytest.raises(ValueError):
+            prox.with_priority("urgent")
+
+    def test_iter_get(self):
+        limiter = RequestLimiter(concurrency=1)
+        session = mock.Mock()
+        session.iter_request.side_effect = lambda *args, **kwargs: iter([1, 2])
+        resource = ProxmoxResource(
+            session=session, base_url="https://pve1:8006/api2/json/nodes", limiter=limiter
+        )
+
+        items = resource.iter_get()
+        assert next(items) == 1
+        # the slot is held until the whole response is read
+        assert limiter.snapshot()["pve1:8006"]["in_flight"] == 1
+        items.close()
+
+        assert limiter.snapshot()["pve1:8006"]["in_flight"] == 0
+        assert list(resource.iter_get()) == [1, 2]
+
+
+def start_request(limiter, priority, order, i):
+    queued = limiter.stats()["queue_depth"]
+
+    def request():
+        slot = limiter.acquire(priority)
+        order.append(i)
+        slot.release()
+
+    thread = threading.Thread(target=request)
+    thread.start()
+    while limiter.stats()["queue_depth"] == queued:
+        time.sleep(0.001)
+    return thread
+
+
+def queue_requests(limiter, priorities):
+    """Queue requests with these priorities behind a held slot, return the order they went in"""
+    first = limiter.acquire()
+    order = []
+    threads = [start_request(limiter, p, order, i) for i, p in enumerate(priorities)]
+    first.release()
+    for thread in threads:
+        thread.join()
+    return order
+
+
+def api_kwargs(server):
+    return {
+        "host": server.address,
+        "user": "root@pam",
+        "password": "password",
+        "verify_ssl": False,
+    }
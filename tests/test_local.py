@@ -2,11 +2,23 @@ __author__ = "John Hollowell"
 __copyright__ = "(c) John Hollowell 2022"
 __license__ = "MIT"
 
+import asyncio
+import io
+import json
+import os
+import stat
+import subprocess
+import sys
 import tempfile
+import time
+from unittest import mock
 
-from proxmoxer.backends import local
+import pytest
 
-# pylint: disable=no-self-use
+from proxmoxer import ProxmoxAPI, core
+from proxmoxer.backends import command_base, local
+
+# pylint: disable=no-self-use,redefined-outer-name,protected-access
 
 
 class TestLocalBackend:
@@ -16,6 +28,58 @@ class TestLocalBackend:
         assert isinstance(back.session, local.LocalSession)
         assert back.target == "localhost"
 
+    def test_lazy(self):
+        # accepted like with the other backends, there is nothing to connect to
+        prox = ProxmoxAPI(backend="local", lazy=True)
+
+        assert repr(prox) == "ProxmoxAPI (local backend for localhost)"
+
+    def test_max_concurrency(self):
+        prox = ProxmoxAPI(backend="local", timeout=10, max_concurrency=3)
+        session = prox._store["session"]
+
+        assert isinstance(session, local.AsyncLocalSession)
+        assert session.max_concurrency == 3
+        assert session.timeout == 10
+        assert type(ProxmoxAPI(backend="local")._store["session"]) is local.LocalSession
+
+    def test_get_async(self, fake_pvesh):
+        prox = ProxmoxAPI(backend="local", max_concurrency=3)
+
+        async def get_all():
+            return await asyncio.gather(
+                *(prox.nodes("node1").qemu(i).status.current.get_async() for i in range(3))
+            )
+
+        # decoded like the blocking requests
+        assert [args[1] for args in asyncio.run(get_all())] == [
+            f"/nodes/node1/qemu/{i}/status/current" for i in range(3)
+        ]
+        assert prox.nodes("node1").qemu.get() == [
+            "get",
+            "/nodes/node1/qemu",
+            "--output-format",
+            "json",
+        ]
+
+    def test_get_async_error(self, fake_pvesh):
+        prox = ProxmoxAPI(backend="local", max_concurrency=3)
+        events = []
+        prox.add_request_hook(events.append)
+
+        with pytest.raises(core.ResourceException) as exc_info:
+            asyncio.run(prox("fail").get_async())
+
+        assert exc_info.value.status_code == 403
+        assert [event.status_code for event in events] == [403]
+
+    def test_post_async(self, fake_pvesh):
+        prox = ProxmoxAPI(backend="local", max_concurrency=3)
+
+        args = asyncio.run(prox.nodes("node1").qemu(100).status.start.post_async(skiplock=1))
+
+        assert args[:4] == ["create", "/nodes/node1/qemu/100/status/start", "-skiplock", "1"]
+
 
 class TestLocalSession:
     _session = local.LocalSession()
@@ -47,6 +111,66 @@ class TestLocalSession:
 
             assert b"" == dest_obj.read()
 
+    def test_upload_file_obj_offset(self):
+        with tempfile.NamedTemporaryFile("w+b") as f_obj, tempfile.NamedTemporaryFile(
+            "rb"
+        ) as dest_obj:
+            f_obj.write(b"a" * 10 + b"b" * 90)
+            f_obj.seek(10)
+            self._session.upload_file_obj(f_obj, dest_obj.name)
+
+            assert dest_obj.read() == b"b" * 90
+            assert f_obj.tell() == 100
+
+    def test_upload_file_obj_no_fileno(self):
+        with tempfile.NamedTemporaryFile("rb") as dest_obj:
+            self._session.upload_file_obj(io.BytesIO(b"a" * 100), dest_obj.name)
+
+            assert dest_obj.read() == b"a" * 100
+
+    def test_upload_file_obj_sendfile(self):
+        with tempfile.NamedTemporaryFile("w+b") as f_obj, tempfile.NamedTemporaryFile(
+            "rb"
+        ) as dest_obj, mock.patch("os.copy_file_range", side_effect=OSError, create=True):
+            f_obj.write(b"a" * 100)
+            f_obj.seek(0)
+            self._session.upload_file_obj(f_obj, dest_obj.name)
+
+            assert dest_obj.read() == b"a" * 100
+
+    def test_upload_file_obj_fallback(self):
+        with tempfile.NamedTemporaryFile("w+b") as f_obj, tempfile.NamedTemporaryFile(
+            "rb"
+        ) as dest_obj, mock.patch(
+            "os.copy_file_range", side_effect=OSError, create=True
+        ), mock.patch(
+            "os.sendfile", side_effect=OSError
+        ):
+            f_obj.write(b"a" * 100)
+            f_obj.seek(0)
+            self._session.upload_file_obj(f_obj, dest_obj.name)
+
+            assert dest_obj.read() == b"a" * 100
+
+    def test_exec_upload(self):
+        cmd = [
+            "python3",
+            "-c",
+            "import sys; sys.stdout.write(sys.argv[1] + ' ' + open(sys.argv[1]).read())",
+            command_base.UPLOAD_TMPFILE,
+        ]
+
+        with tempfile.NamedTemporaryFile("w+b") as f_obj:
+            f_obj.write(b"file content")
+            f_obj.seek(0)
+            stdout, stderr = self._session._exec_upload(cmd, f_obj)
+
+        tmp_filename, content = stdout.split(" ", 1)
+        assert content == "file content"
+        assert stderr == ""
+        # temporary file is cleaned up after the command
+        assert not os.path.exists(tmp_filename)
+
     def test_exec(self):
         cmd = [
             "python3",
@@ -58,3 +182,155 @@ class TestLocalSession:
 
         assert stdout == "stdout content"
         assert stderr == "stderr content"
+
+
+class TestAsyncLocalSession:
+    def test_init(self):
+        sess = local.AsyncLocalSession(timeout=10, max_concurrency=3)
+
+        assert isinstance(sess, local.LocalSession)
+        assert sess.timeout == 10
+        assert sess.max_concurrency == 3
+
+    def test_request_async(self, fake_pvesh):
+        sess = local.AsyncLocalSession()
+
+        resp = asyncio.run(sess.request_async("GET", "/nodes/node1/qemu", params={"full": 1}))
+
+        assert resp.status_code == 200
+        assert json.loads(resp.content) == [
+            "get",
+            "/nodes/node1/qemu",
+            "-full",
+            "1",
+            "--output-format",
+            "json",
+        ]
+        assert "connect" not in resp.timings
+        assert resp.timings["server"] >= 0
+
+    def test_request_async_error(self, fake_pvesh):
+        sess = local.AsyncLocalSession()
+
+        resp = asyncio.run(sess.request_async("GET", "/fail"))
+
+        assert resp.status_code == 403
+        assert resp.content == "403 Permission check failed\n"
+
+    def test_request_async_parallel(self, fake_pvesh):
+        sess = local.AsyncLocalSession(max_concurrency=8)
+
+        async def run_all():
+            return await asyncio.gather(
+                *(sess.request_async("GET", f"/sleep/{i}") for i in range(8))
+            )
+
+        start = time.monotonic()
+        responses = asyncio.run(run_all())
+        elapsed = time.monotonic() - start
+
+        assert [json.loads(r.content)[1] for r in responses] == [f"/sleep/{i}" for i in range(8)]
+        # each command sleeps 0.5s, running them one at a time would take at least 4s
+        assert elapsed < 3
+
+    def test_request_async_timeout(self, fake_pvesh):
+        sess = local.AsyncLocalSession(timeout=0.2)
+
+        with pytest.raises(subprocess.TimeoutExpired):
+            asyncio.run(sess.request_async("GET", "/hang"))
+
+    def test_request_async_cancelled(self, fake_pvesh):
+        sess = local.AsyncLocalSession()
+        procs = []
+        create_subprocess_exec = asyncio.create_subprocess_exec
+
+        async def create(*args, **kwargs):
+            procs.append(await create_subprocess_exec(*args, **kwargs))
+            return procs[-1]
+
+        async def cancel():
+            task = asyncio.ensure_future(sess.request_async("GET", "/hang"))
+            await asyncio.sleep(0.2)
+            task.cancel()
+            with pytest.raises(asyncio.CancelledError):
+                await task
+
+        with mock.patch("asyncio.create_subprocess_exec", create):
+            asyncio.run(cancel())
+
+        # the command was killed and reaped, not left running
+        assert procs[0].returncode is not None
+
+    def test_request_async_loops(self, fake_pvesh):
+        sess = local.AsyncLocalSession(max_concurrency=1)
+
+        async def run_all():
+            return await asyncio.gather(*(sess.request_async("GET", "/nodes") for _ in range(2)))
+
+        # each event loop gets its own semaphore
+        for _ in range(2):
+            assert [r.status_code for r in asyncio.run(run_all())] == [200, 200]
+
+    def test_iter_request(self, fake_pvesh):
+        sess = local.LocalSession()
+
+        items = sess.iter_request("GET", "/list")
+
+        assert next(items) == {"vmid": 0}
+        assert sum(1 for _ in items) == 9999
+
+    def test_iter_request_stop_early(self, fake_pvesh):
+        sess = local.LocalSession()
+
+        items = sess.iter_request("GET", "/list")
+        assert next(items) == {"vmid": 0}
+        # the command is killed and cleaned up when the iterator is closed
+        items.close()
+
+    def test_iter_request_error(self, fake_pvesh):
+        sess = local.LocalSession()
+
+        with pytest.raises(core.ResourceException) as exc_info:
+            list(sess.iter_request("GET", "/fail"))
+
+        assert exc_info.value.status_code == 403
+
+    def test_request_async_upload(self, fake_pvesh):
+        sess = local.AsyncLocalSession()
+
+        with tempfile.NamedTemporaryFile("w+b") as f_obj:
+            resp = asyncio.run(
+                sess.request_async(
+                    "POST", "/nodes/node1/storage/local/upload", data={"filename": f_obj}
+                )
+            )
+
+            assert json.loads(resp.content)[3] == f_obj.name
+
+
+FAKE_PVESH = """#!{python}
+import json, sys, time
+if sys.argv[2] == "/fail":
+    sys.stderr.write("403 Permission check failed\\n")
+    sys.exit(1)
+if sys.argv[2].startswith("/sleep"):
+    time.sleep(0.5)
+if sys.argv[2] == "/hang":
+    time.sleep(5)
+if sys.argv[2] == "/list":
+    sys.stdout.write(json.dumps([{{"vmid": i}} for i in range(10000)]))
+    sys.exit(0)
+sys.stdout.write(json.dumps(sys.argv[1:]))
+"""
+
+
+@pytest.fixture
+def fake_pvesh(monkeypatch):
+    with tempfile.TemporaryDirectory() as bin_dir:
+        pvesh = os.path.join(bin_dir, "pvesh")
+        with open(pvesh, "w") as f_obj:
+            f_obj.write(FAKE_PVESH.format(python=sys.executable))
+        os.chmod(pvesh, os.stat(pvesh).st_mode | stat.S_IEXEC)
+
+        monkeypatch.setenv("PATH", bin_dir + os.pathsep + os.environ["PATH"])
+        yield pvesh
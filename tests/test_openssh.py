@@ -2,13 +2,17 @@ __author__ = "John Hollowell"
 __copyright__ = "(c) John Hollowell 2022"
 __license__ = "MIT"
 
+import io
+import os
+import pickle
+import subprocess
 import tempfile
 from unittest import mock
 
 import openssh_wrapper
 import pytest
 
-from proxmoxer.backends import openssh
+from proxmoxer.backends import agent, command_base, openssh
 
 # pylint: disable=no-self-use
 
@@ -45,6 +49,70 @@ class TestOpenSSHSession:
             assert sess.port == 123
             assert sess.identity_file == ident_obj.name
             assert sess.forward_ssh_agent is True
+            assert sess.control_master is False
+            assert sess.control_path is None
+
+    def test_connect_control_master(self):
+        with mock.patch.object(openssh.SSHConnection, "run") as mock_run:
+            sess = openssh.OpenSSHSession("host", "user", control_master=True, control_persist=30)
+
+            try:
+                assert os.path.isdir(sess.control_dir)
+                assert sess.control_path == os.path.join(sess.control_dir, "control")
+                assert sess.ssh_client.ssh_options == [
+                    "-o",
+                    "ControlMaster=auto",
+                    "-o",
+                    f"ControlPath={sess.control_path}",
+                    "-o",
+                    "ControlPersist=30",
+                ]
+                # master connection is started while connecting
+                mock_run.assert_called_once_with("true")
+            finally:
+                sess.close()
+
+    def test_close_control_master(self):
+        with mock.patch.object(openssh.SSHConnection, "run"):
+            sess = openssh.OpenSSHSession("host", "user", control_master=True)
+        control_dir = sess.control_dir
+        control_path = sess.control_path
+        # fake the socket created by the master process
+        open(control_path, "w").close()
+
+        with mock.patch("subprocess.run") as mock_subprocess_run:
+            sess.close()
+
+        assert mock_subprocess_run.call_args[0][0] == [
+            "/usr/bin/ssh",
+            "-o",
+            f"ControlPath={control_path}",
+            "-O",
+            "exit",
+            "host",
+        ]
+        assert not os.path.exists(control_dir)
+        assert sess.control_dir is None
+
+    def test_close_ssh_binary(self):
+        with mock.patch.object(openssh.SSHConnection, "run"):
+            sess = openssh.OpenSSHSession(
+                "host", "user", control_master=True, ssh_binary="/opt/openssh/bin/ssh"
+            )
+        open(sess.control_path, "w").close()
+
+        # the master is stopped with the ssh which started it
+        assert sess.ssh_client.ssh_binary == "/opt/openssh/bin/ssh"
+        with mock.patch("subprocess.run") as mock_subprocess_run:
+            sess.close()
+
+        assert mock_subprocess_run.call_args[0][0][0] == "/opt/openssh/bin/ssh"
+
+    def test_close_no_control_master(self, mock_session):
+        with mock.patch("subprocess.run") as mock_subprocess_run:
+            mock_session.close()
+
+        mock_subprocess_run.assert_not_called()
 
     def test_exec(self, mock_session):
         cmd = [
@@ -62,6 +130,73 @@ class TestOpenSSHSession:
             forward_ssh_agent=True,
         )
 
+    def test_exec_upload(self):
+        sess = openssh.OpenSSHSession("host", "user")
+        cmd = ["pvesh", "create", "/upload", "-tmpfilename", command_base.UPLOAD_TMPFILE]
+
+        with mock.patch("subprocess.Popen") as mock_popen, tempfile.NamedTemporaryFile(
+            "w+b"
+        ) as f_obj:
+            mock_popen.return_value.communicate.return_value = (b"stdout\n", b"stderr\n")
+            f_obj.write(b"a" * 100)
+            f_obj.seek(0)
+            stdout, stderr = sess._exec_upload(cmd, f_obj)
+
+        assert stdout == b"stdout"
+        assert stderr == b"stderr"
+        assert mock_popen.call_args[0][0] == [
+            b"/usr/bin/ssh",
+            b"-l",
+            b"user",
+            b"-p",
+            b"22",
+            b"host",
+            command_base.upload_shell_command(cmd).encode("utf-8"),
+        ]
+        mock_popen.return_value.stdin.write.assert_called_once_with(b"a" * 100)
+        # the 5s command timeout does not apply to sending and storing the file
+        mock_popen.return_value.communicate.assert_called_once_with(timeout=None)
+        mock_popen.return_value.kill.assert_not_called()
+
+    def test_exec_upload_failure(self):
+        sess = openssh.OpenSSHSession("host", "user", upload_timeout=60)
+
+        with mock.patch("subprocess.Popen") as mock_popen:
+            mock_popen.return_value.communicate.side_effect = [
+                subprocess.TimeoutExpired("ssh", 60),
+                (b"", b""),
+            ]
+            with pytest.raises(subprocess.TimeoutExpired):
+                sess._exec_upload(["pvesh"], io.BytesIO(b"a" * 100))
+
+        # the ssh process is not left running
+        mock_popen.return_value.kill.assert_called_once_with()
+
+    def test_exec_stream(self):
+        sess = openssh.OpenSSHSession("host", "user")
+
+        with mock.patch("subprocess.Popen") as mock_popen:
+            mock_popen.return_value.poll.return_value = 0
+            with sess._exec_stream(["echo", "hello"]) as (stdout, _):
+                assert stdout == mock_popen.return_value.stdout
+
+        assert mock_popen.call_args[0][0][-1] == b"echo hello"
+        mock_popen.return_value.kill.assert_not_called()
+        mock_popen.return_value.stdout.close.assert_called_once_with()
+
+    def test_open_agent_channel(self):
+        sess = openssh.OpenSSHSession("host", "user")
+
+        with mock.patch("subprocess.Popen") as mock_popen:
+            stdin, stdout, close = sess._open_agent_channel()
+
+        assert mock_popen.call_args[0][0][-1] == command_base.shell_join(
+            agent.agent_command()
+        ).encode("utf-8")
+        assert stdin == mock_popen.return_value.stdin
+        assert stdout == mock_popen.return_value.stdout
+        assert close == mock_popen.return_value.wait
+
     def test_upload_file_obj(self, mock_session):
         with tempfile.NamedTemporaryFile("r") as f_obj:
             mock_session.upload_file_obj(f_obj, "/tmp/file")
@@ -71,6 +206,95 @@ class TestOpenSSHSession:
                 target="/tmp/file",
             )
 
+    def test_pickle(self):
+        with mock.patch.object(openssh.SSHConnection, "run"):
+            sess = openssh.OpenSSHSession("host", "user", control_master=True)
+            try:
+                restored = pickle.loads(pickle.dumps(sess))
+
+                # the control master belongs to the original session
+                assert restored.control_dir is None
+                assert restored._ssh_client is None
+                assert restored.ssh_client.server == b"host"
+                assert restored.control_dir not in (None, sess.control_dir)
+                restored.close()
+                assert os.path.isdir(sess.control_dir)
+            finally:
+                sess.close()
+
+    def test_lazy(self):
+        with mock.patch.object(openssh.SSHConnection, "run") as mock_run:
+            sess = openssh.OpenSSHSession("host", "user", control_master=True, lazy=True)
+
+            # the control master is only started for the first command
+            assert sess._ssh_client is None
+            assert sess.control_dir is None
+            mock_run.assert_not_called()
+            try:
+                assert sess.ssh_client.server == b"host"
+                assert os.path.isdir(sess.control_dir)
+                mock_run.assert_called_once_with("true")
+            finally:
+                sess.close()
+
+    def test_after_fork(self, mock_session):
+        parent_client = mock_session.ssh_client
+        mock_session.control_dir = "/tmp/parent-control"
+
+        mock_session._after_fork()
+
+        assert mock_session.control_dir is None
+        assert mock_session.ssh_client is not parent_client
+
+
+class TestSSHConnection:
+    _conn = openssh.SSHConnection("host", login="user", port="22", ssh_options=["-o", "A=b"])
+
+    def test_ssh_command(self):
+        assert self._conn.ssh_command("/bin/bash", False) == [
+            b"/usr/bin/ssh",
+            b"-o",
+            b"A=b",
+            b"-l",
+            b"user",
+            b"-p",
+            b"22",
+            b"host",
+            b"/bin/bash",
+        ]
+
+    def test_remote_command(self):
+        conn = openssh.SSHConnection("host", login="user", ssh_options=["-o", "A=b"])
+
+        assert conn.remote_command("pvesh get /nodes", forward_ssh_agent=True) == [
+            b"/usr/bin/ssh",
+            b"-o",
+            b"A=b",
+            b"-l",
+            b"user",
+            b"-A",
+            b"host",
+            b"pvesh get /nodes",
+        ]
+
+    def test_remote_command_ssh_binary(self):
+        conn = openssh.SSHConnection("host", ssh_binary="/opt/openssh/bin/ssh")
+
+        assert conn.remote_command("true") == [b"/opt/openssh/bin/ssh", b"host", b"true"]
+
+    def test_scp_command(self):
+        assert self._conn.scp_command(["/tmp/file"], "/tmp/remote") == [
+            b"/usr/bin/scp",
+            b"-o",
+            b"A=b",
+            b"-q",
+            b"-r",
+            b"-P",
+            b"22",
+            b"/tmp/file",
+            b"user@host:/tmp/remote",
+        ]
+
 
 @pytest.fixture
 def mock_session():
@@ -2,13 +2,16 @@ __author__ = "John Hollowell"
 __copyright__ = "(c) John Hollowell 2022"
 __license__ = "MIT"
 
+import io
 import os.path
+import pickle
+import socket
 import tempfile
 from unittest import mock
 
 import pytest
 
-from proxmoxer.backends import ssh_paramiko
+from proxmoxer.backends import agent, command_base, ssh_paramiko
 
 # pylint: disable=no-self-use
 
@@ -36,6 +39,13 @@ class TestSshParamikoSession:
         assert sess.port == 1234
         assert sess.ssh_client == mock_connect()
 
+    def test_connect_nodelay(self, mock_ssh_client):
+        sess = ssh_paramiko.SshParamikoSession("host", "user", password="password")
+
+        sess.ssh_client.get_transport().sock.setsockopt.assert_called_once_with(
+            socket.IPPROTO_TCP, socket.TCP_NODELAY, 1
+        )
+
     def test_connect_basic(self, mock_ssh_client):
         import paramiko
 
@@ -106,6 +116,104 @@ class TestSshParamikoSession:
         assert stderr == "stderr contents"
         mock_session.exec_command.assert_called_once_with("echo hello world")
 
+    def test_exec_upload(self, mock_ssh_client):
+        mock_client, mock_session, _ = mock_ssh_client
+
+        sess = ssh_paramiko.SshParamikoSession("host", "user")
+        sess.ssh_client = mock_client
+
+        cmd = ["pvesh", "create", "/upload", "-tmpfilename", command_base.UPLOAD_TMPFILE]
+        with tempfile.NamedTemporaryFile("w+b") as f_obj:
+            f_obj.write(b"a" * 100)
+            f_obj.seek(0)
+            stdout, stderr = sess._exec_upload(cmd, f_obj)
+
+        assert stdout == "stdout contents"
+        assert stderr == "stderr contents"
+        mock_session.exec_command.assert_called_once_with(command_base.upload_shell_command(cmd))
+        mock_session.sendall.assert_called_once_with(b"a" * 100)
+        mock_session.shutdown_write.assert_called_once_with()
+        # the 5s command timeout does not apply to sending the file
+        mock_session.settimeout.assert_called_once_with(None)
+        mock_client.get_transport().open_session.assert_called_once_with(
+            window_size=ssh_paramiko.SFTP_WINDOW_SIZE,
+            max_packet_size=ssh_paramiko.SFTP_MAX_PACKET_SIZE,
+        )
+        mock_session.close.assert_called_once_with()
+
+    def test_exec_upload_callback(self, mock_ssh_client):
+        mock_client, _, _ = mock_ssh_client
+        callback = mock.Mock()
+
+        sess = ssh_paramiko.SshParamikoSession(
+            "host", "user", upload_callback=callback, upload_timeout=60
+        )
+        sess.ssh_client = mock_client
+
+        with mock.patch.object(ssh_paramiko, "UPLOAD_CHUNK_SIZE", 40):
+            sess._exec_upload(["pvesh"], io.BytesIO(b"a" * 100))
+
+        assert callback.call_args_list == [
+            mock.call(40, 100),
+            mock.call(80, 100),
+            mock.call(100, 100),
+        ]
+        mock_client.get_transport().open_session().settimeout.assert_called_once_with(60)
+
+    def test_exec_upload_failure(self, mock_ssh_client):
+        mock_client, mock_session, _ = mock_ssh_client
+        mock_session.makefile.side_effect = socket.timeout()
+
+        sess = ssh_paramiko.SshParamikoSession("host", "user")
+        sess.ssh_client = mock_client
+
+        with pytest.raises(socket.timeout):
+            sess._exec_upload(["pvesh"], io.BytesIO(b"a" * 100))
+
+        mock_session.close.assert_called_once_with()
+
+    def test_exec_upload_closed_early(self, mock_ssh_client):
+        mock_client, mock_session, _ = mock_ssh_client
+        mock_session.sendall.side_effect = OSError("Socket is closed")
+
+        sess = ssh_paramiko.SshParamikoSession("host", "user")
+        sess.ssh_client = mock_client
+
+        with tempfile.NamedTemporaryFile("w+b") as f_obj:
+            f_obj.write(b"a" * 100)
+            f_obj.seek(0)
+            stdout, stderr = sess._exec_upload(["pvesh"], f_obj)
+
+        assert stderr == "stderr contents"
+
+    def test_exec_stream(self, mock_ssh_client):
+        mock_client, mock_session, _ = mock_ssh_client
+
+        sess = ssh_paramiko.SshParamikoSession("host", "user")
+        sess.ssh_client = mock_client
+
+        with sess._exec_stream(["echo", "hello"]) as (stdout, wait):
+            assert stdout.read() == b"stdout contents"
+            assert wait() == "stderr contents"
+
+        mock_session.exec_command.assert_called_once_with("echo hello")
+        mock_session.close.assert_called_once_with()
+
+    def test_open_agent_channel(self, mock_ssh_client):
+        mock_client, mock_session, _ = mock_ssh_client
+
+        sess = ssh_paramiko.SshParamikoSession("host", "user")
+        sess.ssh_client = mock_client
+
+        stdin, stdout, close = sess._open_agent_channel()
+
+        mock_session.exec_command.assert_called_once_with(
+            command_base.shell_join(agent.agent_command())
+        )
+        assert stdin == mock_session.makefile_stdin.return_value
+        assert stdout == mock_session.makefile.return_value
+        assert close == mock_session.close
+
     def test_upload_file_obj(self, mock_ssh_client):
         mock_client, _, mock_sftp = mock_ssh_client
 
@@ -115,10 +223,146 @@ class TestSshParamikoSession:
         with tempfile.NamedTemporaryFile("r") as f_obj:
             sess.upload_file_obj(f_obj, "/tmp/file")
 
-            mock_sftp.putfo.assert_called_once_with(f_obj, "/tmp/file")
+            mock_sftp.putfo.assert_called_once_with(f_obj, "/tmp/file", file_size=0, callback=None)
+
+        # SFTP channel is kept open for later uploads
+        mock_sftp.close.assert_not_called()
+
+    def test_upload_file_obj_reuses_sftp(self, mock_ssh_client):
+        import paramiko
+
+        mock_client, _, mock_sftp = mock_ssh_client
+
+        sess = ssh_paramiko.SshParamikoSession("host", "user")
+        sess.ssh_client = mock_client
+
+        with tempfile.NamedTemporaryFile("r") as f_obj:
+            sess.upload_file_obj(f_obj, "/tmp/file1")
+            sess.upload_file_obj(f_obj, "/tmp/file2")
+
+        paramiko.SFTPClient.from_transport.assert_called_once_with(
+            mock_client.get_transport(),
+            window_size=ssh_paramiko.SFTP_WINDOW_SIZE,
+            max_packet_size=ssh_paramiko.SFTP_MAX_PACKET_SIZE,
+        )
+        assert mock_sftp.putfo.call_count == 2
+
+    def test_upload_file_obj_reopen_closed(self, mock_ssh_client):
+        import paramiko
+
+        mock_client, _, mock_sftp = mock_ssh_client
+
+        sess = ssh_paramiko.SshParamikoSession("host", "user")
+        sess.ssh_client = mock_client
+
+        with tempfile.NamedTemporaryFile("r") as f_obj:
+            sess.upload_file_obj(f_obj, "/tmp/file1")
+            mock_sftp.get_channel.return_value.closed = True
+            sess.upload_file_obj(f_obj, "/tmp/file2")
+
+        assert paramiko.SFTPClient.from_transport.call_count == 2
+
+    def test_upload_file_obj_callback(self, mock_ssh_client):
+        mock_client, _, mock_sftp = mock_ssh_client
+        callback = mock.Mock()
+
+        sess = ssh_paramiko.SshParamikoSession("host", "user", upload_callback=callback)
+        sess.ssh_client = mock_client
+
+        with tempfile.NamedTemporaryFile("w+b") as f_obj:
+            f_obj.write(b"a" * 100)
+            f_obj.seek(10)
+            sess.upload_file_obj(f_obj, "/tmp/file")
+
+            # file position is left where the upload should start from
+            assert f_obj.tell() == 10
+            mock_sftp.putfo.assert_called_once_with(
+                f_obj, "/tmp/file", file_size=90, callback=callback
+            )
+
+    def test_upload_file_objs(self, mock_ssh_client):
+        import paramiko
+
+        mock_client, _, mock_sftp = mock_ssh_client
+
+        sess = ssh_paramiko.SshParamikoSession("host", "user")
+        sess.ssh_client = mock_client
+
+        with tempfile.NamedTemporaryFile("r") as f_obj1, tempfile.NamedTemporaryFile(
+            "r"
+        ) as f_obj2, tempfile.NamedTemporaryFile("r") as f_obj3:
+            uploads = [(f_obj1, "/tmp/file1"), (f_obj2, "/tmp/file2"), (f_obj3, "/tmp/file3")]
+            sess.upload_file_objs(uploads, max_workers=2)
+
+            assert sorted(c.args[1] for c in mock_sftp.putfo.call_args_list) == [
+                "/tmp/file1",
+                "/tmp/file2",
+                "/tmp/file3",
+            ]
+
+        # one channel per worker, closed once the batch is done
+        assert paramiko.SFTPClient.from_transport.call_count == 2
+        assert mock_sftp.close.call_count == 2
+
+    def test_upload_file_objs_error(self, mock_ssh_client):
+        mock_client, _, mock_sftp = mock_ssh_client
+        mock_sftp.putfo.side_effect = IOError("size mismatch in put!")
+
+        sess = ssh_paramiko.SshParamikoSession("host", "user")
+        sess.ssh_client = mock_client
+
+        with tempfile.NamedTemporaryFile("r") as f_obj, pytest.raises(IOError):
+            sess.upload_file_objs([(f_obj, "/tmp/file")])
 
         mock_sftp.close.assert_called_once_with()
 
+    def test_close(self, mock_ssh_client):
+        mock_client, _, mock_sftp = mock_ssh_client
+
+        sess = ssh_paramiko.SshParamikoSession("host", "user")
+        sess.ssh_client = mock_client
+
+        with tempfile.NamedTemporaryFile("r") as f_obj:
+            sess.upload_file_obj(f_obj, "/tmp/file")
+        sess.close()
+
+        mock_sftp.close.assert_called_once_with()
+        mock_client.close.assert_called_once_with()
+
+    def test_pickle(self, mock_connect):
+        sess = ssh_paramiko.SshParamikoSession("host", "user", password="password", port=2222)
+
+        restored = pickle.loads(pickle.dumps(sess))
+
+        assert (restored.host, restored.password, restored.port) == ("host", "password", 2222)
+        assert restored._ssh_client is None
+        # connects again on first use
+        assert restored.ssh_client == mock_connect.return_value
+        assert mock_connect.call_count == 2
+
+    def test_lazy(self, mock_connect):
+        sess = ssh_paramiko.SshParamikoSession("host", "user", lazy=True)
+
+        mock_connect.assert_not_called()
+        assert sess.ssh_client == mock_connect.return_value
+        mock_connect.assert_called_once()
+
+    def test_after_fork(self, mock_ssh_client):
+        mock_client, _, mock_sftp = mock_ssh_client
+        sess = ssh_paramiko.SshParamikoSession("host", "user")
+        sess.ssh_client = mock_client
+        sess._get_sftp()
+
+        with mock.patch.object(ssh_paramiko.SshParamikoSession, "_connect") as mock_reconnect:
+            sess._after_fork()
+            new_client = sess.ssh_client
+
+        # the parent's connection is not closed from the child
+        mock_client.close.assert_not_called()
+        mock_sftp.close.assert_not_called()
+        assert new_client == mock_reconnect.return_value
+        assert sess._sftp is None
+
 
 @pytest.fixture
 def mock_connect():
@@ -139,6 +383,7 @@ def mock_ssh_client():
     mock_transport = mock.Mock(spec=Transport)
     mock_channel = mock.Mock(spec=channel.Channel)
     mock_sftp = mock.Mock(spec=SFTPClient)
+    mock_sftp.get_channel.return_value.closed = False
 
     # mock the return streams from the SSH connection
     mock_stdout = mock.Mock(spec=channel.ChannelFile)
@@ -152,5 +397,7 @@ def mock_ssh_client():
     mock_client.get_transport.return_value = mock_transport
     mock_client.open_sftp.return_value = mock_sftp
 
-    with mock.patch("paramiko.SSHClient", mock_client):
+    with mock.patch("paramiko.SSHClient", mock_client), mock.patch(
+        "paramiko.SFTPClient.from_transport", return_value=mock_sftp
+    ):
         yield (mock_client, mock_channel, mock_sftp)
@@ -0,0 +1,228 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+import gzip
+import io
+import json
+from unittest import mock
+
+import pytest
+
+from proxmoxer import ProxmoxAPI, ResourceException
+from proxmoxer.backends import replay
+from proxmoxer.backends.command_base import Response
+from proxmoxer.testing import FakeCluster, FakePVEServer
+
+# pylint: disable=no-self-use,redefined-outer-name
+
+# the fake server uses a self-signed certificate
+pytestmark = pytest.mark.filterwarnings("ignore::urllib3.exceptions.InsecureRequestWarning")
+
+
+class TestRecord:
+    def test_file_format(self, recording):
+        with gzip.open(recording, "rt") as f_obj:
+            header, *entries = [json.loads(line) for line in f_obj]
+
+        assert header["format"] == "proxmoxer-replay"
+        assert header["backend"] == "https"
+        assert header["wrapped"] is True
+        assert header["base_url"].endswith("/api2/json")
+        assert [(e["m"], e["p"]) for e in entries] == [
+            ("GET", "/version"),
+            ("GET", "/nodes"),
+            ("GET", "/cluster/resources"),
+            ("POST", "/nodes/node1/qemu/100/status/start"),
+            ("GET", "/nodes/missing/status"),
+        ]
+        assert entries[2]["q"] == {"type": "vm"}
+        assert all(e["d"] >= 0 for e in entries)
+
+    def test_plain_file(self, tmp_path):
+        path = tmp_path / "session.jsonl"
+        prox = ProxmoxAPI(backend="local")
+
+        with mock.patch.object(prox._store["session"], "_exec", return_value=('["a"]', "")):
+            with replay.record(prox, str(path)):
+                assert prox.nodes.get() == ["a"]
+
+        header, entry = [json.loads(line) for line in path.read_text().splitlines()]
+        assert header["wrapped"] is False
+        assert entry["c"] == '["a"]'
+
+    def test_redact(self, tmp_path):
+        session = mock.Mock()
+        session.request.return_value = Response('{"ticket": "abc"}', 200)
+        path = tmp_path / "session.jsonl"
+
+        with replay.RecordingSession(session, str(path), backend="local") as recorder:
+            recorder.request("POST", "/access/users", data={"userid": "a", "password": "b"})
+
+        entry = json.loads(path.read_text().splitlines()[1])
+        assert entry["b"] == {"userid": "a", "password": "<redacted>"}
+        assert "abc" not in entry["c"]
+
+    def test_file_data(self, tmp_path):
+        session = mock.Mock()
+        session.request.return_value = Response('"UPID"', 200)
+        path = tmp_path / "session.jsonl"
+        upload = io.BytesIO(b"data")
+        upload.name = "image.iso"
+
+        with replay.RecordingSession(session, str(path), backend="local") as recorder:
+            recorder.request("POST", "/upload", data={"filename": upload})
+
+        entry = json.loads(path.read_text().splitlines()[1])
+        assert entry["b"] == {"filename": "<BytesIO image.iso>"}
+
+    def test_stop(self, tmp_path):
+        session = mock.Mock()
+        session.request.return_value = Response("[]", 200)
+        path = tmp_path / "session.jsonl"
+
+        recorder = replay.RecordingSession(session, str(path), backend="local")
+        recorder.stop()
+        recorder.request("GET", "/nodes")
+        recorder.close()
+
+        assert len(path.read_text().splitlines()) == 1
+        session.close.assert_called_once_with()
+
+
+class TestReplay:
+    def test_responses(self, recording):
+        prox = ProxmoxAPI(backend="replay", recording=recording)
+
+        assert prox.version.get()["release"] == "8.2"
+        assert [n["node"] for n in prox.nodes.get()] == ["node1"]
+        assert [r["vmid"] for r in prox.cluster.resources.get(type="vm")] == [100, 101]
+        assert prox.nodes("node1").qemu(100).status.start.post().startswith("UPID:node1:")
+
+    def test_error(self, recording):
+        prox = ProxmoxAPI(backend="replay", recording=recording)
+
+        with pytest.raises(ResourceException) as exc_info:
+            prox.nodes("missing").status.get()
+
+        # the recorded status and reason of the fake server
+        assert exc_info.value.status_code == 595
+        assert "no such cluster node 'missing'" in str(exc_info.value)
+
+    def test_not_recorded(self, recording):
+        prox = ProxmoxAPI(backend="replay", recording=recording)
+
+        with pytest.raises(replay.ReplayError, match="GET /cluster/resources"):
+            # different parameters
+            prox.cluster.resources.get(type="storage")
+
+    def test_used_up(self, recording):
+        prox = ProxmoxAPI(backend="replay", recording=recording)
+        prox.version.get()
+
+        with pytest.raises(replay.ReplayError):
+            prox.version.get()
+
+    def test_loop(self, recording):
+        prox = ProxmoxAPI(backend="replay", recording=recording, loop=True)
+
+        assert prox.version.get() == prox.version.get()
+
+    def test_speed(self, recording):
+        prox = ProxmoxAPI(backend="replay", recording=recording, speed=2)
+
+        with mock.patch("proxmoxer.backends.replay.time.sleep") as mock_sleep:
+            prox.version.get()
+
+        (recorded,) = prox._store["session"]._recorded[("GET", "/version", "{}")]
+        mock_sleep.assert_called_once_with(recorded.timings["server"] / 2)
+
+    def test_full_speed(self, recording):
+        prox = ProxmoxAPI(backend="replay", recording=recording)
+
+        with mock.patch("proxmoxer.backends.replay.time.sleep") as mock_sleep:
+            prox.version.get()
+
+        mock_sleep.assert_not_called()
+
+    def test_request_timings(self, recording):
+        prox = ProxmoxAPI(backend="replay", recording=recording)
+        events = []
+        prox.add_request_hook(events.append)
+
+        prox.version.get()
+
+        assert events[0].timings["server"] >= 0
+        assert events[0].path == "/version"
+
+    def test_command_backend(self, tmp_path):
+        path = tmp_path / "session.jsonl"
+        prox = ProxmoxAPI(backend="local")
+        with mock.patch.object(prox._store["session"], "_exec", return_value=('["a"]', "")):
+            with replay.record(prox, str(path)):
+                prox.nodes.get()
+
+        prox = ProxmoxAPI(backend="replay", recording=str(path))
+
+        assert prox.nodes.get() == ["a"]
+
+    def test_pbs(self, recording):
+        prox = ProxmoxAPI(backend="replay", service="PBS", recording=recording)
+
+        assert prox.version.get()["release"] == "8.2"
+
+    def test_not_a_recording(self, tmp_path):
+        path = tmp_path / "other.jsonl"
+        path.write_text('{"data": []}\n')
+
+        with pytest.raises(replay.ReplayError, match="not a proxmoxer recording"):
+            ProxmoxAPI(backend="replay", recording=str(path))
+
+    def test_newer_version(self, tmp_path):
+        path = tmp_path / "newer.jsonl"
+        path.write_text('{"format": "proxmoxer-replay", "version": 99}\n')
+
+        with pytest.raises(replay.ReplayError, match="version 99"):
+            ProxmoxAPI(backend="replay", recording=str(path))
+
+    def test_repr(self, recording):
+        prox = ProxmoxAPI(backend="replay", recording=recording)
+
+        assert repr(prox) == f"ProxmoxAPI (replay backend for {recording})"
+
+    def test_lazy(self, recording):
+        prox = ProxmoxAPI(backend="replay", recording=recording, lazy=True)
+
+        assert prox.version.get()["release"] == "8.2"
+
+
+class TestReplaySerializer:
+    def test_loads(self):
+        serializer = replay.ReplaySerializer(wrapped=True)
+
+        assert serializer.loads(Response(b'{"data": [1, 2]}', 200)) == [1, 2]
+
+    def test_loads_no_data(self):
+        serializer = replay.ReplaySerializer(wrapped=True)
+
+        assert serializer.loads(Response(b'{"errors": {"vmid": "invalid"}}', 400)) is None
+
+    def test_loads_unwrapped(self):
+        serializer = replay.ReplaySerializer(wrapped=False)
+
+        assert serializer.loads(Response(b'{"errors": {}}', 200)) == {"errors": {}}
+
+
+@pytest.fixture
+def recording(tmp_path):
+    path = str(tmp_path / "session.jsonl.gz")
+    with FakePVEServer(cluster=FakeCluster(vms_per_node=2)) as server:
+        prox = ProxmoxAPI(server.address, user="root@pam", password="password", verify_ssl=False)
+        with replay.record(prox, path):
+            prox.version.get()
+            prox.nodes.get()
+            prox.cluster.resources.get(type="vm")
+            prox.nodes("node1").qemu(100).status.start.post()
+            with pytest.raises(ResourceException):
+                prox.nodes("missing").status.get()
+    return path
@@ -0,0 +1,384 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+import io
+import pickle
+import ssl
+import time
+from unittest import mock
+
+import pytest
+import requests
+
+from proxmoxer import ProxmoxAPI, ResourceException
+from proxmoxer.deadline import DeadlineExceeded
+from proxmoxer.limits import QueueTimeout, RequestLimiter
+from proxmoxer.retry import CircuitBreaker, CircuitOpenError, RetryBudget, RetryPolicy
+from proxmoxer.testing import FakePVEServer
+
+# pylint: disable=no-self-use,redefined-outer-name,protected-access
+
+
+def error(status_code, content="", errors=None):
+    return ResourceException(status_code, "", content, errors)
+
+
+class TestFailureKind:
+    policy = RetryPolicy()
+
+    @pytest.mark.parametrize(
+        "exception,kind",
+        [
+            (error(596), "transient"),
+            (error(597), "transient"),
+            (error(595), "not_sent"),
+            (error(599), None),
+            (
+                error(500, "can't lock file '/var/lock/qemu-server/lock-100.conf' - got timeout"),
+                "not_sent",
+            ),
+            (error(500, "trying to acquire lock... timeout"), "not_sent"),
+            (
+                error(
+                    500,
+                    "trying to acquire lock...\ncan't lock file '/var/lock/pve-manager/pve-storage-local'"
+                    " - got timeout",
+                ),
+                "not_sent",
+            ),
+            # the lock was taken, the request did run
+            (error(500, "trying to acquire lock...\n OK\nstart failed: got timeout"), None),
+            (error(500, "VM 100 not running"), None),
+            (error(403), None),
+            (ConnectionResetError(), "transient"),
+            (EOFError(), "transient"),
+            (ConnectionRefusedError(), "not_sent"),
+            (requests.ConnectTimeout(), "not_sent"),
+            (requests.ReadTimeout(), "transient"),
+            (ValueError(), None),
+        ],
+    )
+    def test_kind(self, exception, kind):
+        assert self.policy.failure_kind(exception) == kind
+
+    def test_cause(self):
+        try:
+            try:
+                raise ConnectionRefusedError()
+            except ConnectionRefusedError as e:
+                raise requests.ConnectionError("failed") from e
+        except requests.ConnectionError as e:
+            assert self.policy.failure_kind(e) == "not_sent"
+
+    def test_reason(self):
+        # urllib3's MaxRetryError keeps the connection error as its reason
+        max_retry = Exception("max retries exceeded")
+        max_retry.reason = ConnectionRefusedError()
+        outer = requests.ConnectionError()
+        outer.__context__ = max_retry
+
+        assert self.policy.failure_kind(outer) == "not_sent"
+
+    def test_certificate_error(self):
+        e = requests.exceptions.SSLError()
+        e.__context__ = ssl.SSLCertVerificationError()
+
+        assert self.policy.failure_kind(e) is None
+
+    def test_lock_timeouts_disabled(self):
+        policy = RetryPolicy(retry_lock_timeouts=False)
+
+        assert policy.failure_kind(error(500, "can't lock file 'x' - got timeout")) is None
+
+    def test_status_codes(self):
+        policy = RetryPolicy(status_codes=[502])
+
+        assert policy.failure_kind(error(502)) == "transient"
+        assert policy.failure_kind(error(595)) is None
+        assert policy.failure_kind(error(596)) is None
+
+
+class TestShouldRetry:
+    policy = RetryPolicy(max_attempts=3)
+
+    def test_idempotent(self):
+        assert self.policy.should_retry("get", "transient", 1)
+        assert not self.policy.should_retry("GET", "transient", 3)
+
+    def test_not_idempotent(self):
+        for method in ("POST", "PUT", "DELETE"):
+            assert not self.policy.should_retry(method, "transient", 1)
+            assert self.policy.should_retry(method, "not_sent", 1)
+
+    def test_idempotent_opt_in(self):
+        policy = RetryPolicy(idempotent_methods=("get", "put"))
+
+        assert policy.should_retry("PUT", "transient", 2)
+        assert not policy.should_retry("DELETE", "transient", 1)
+
+    def test_lock_then_timeout_not_retried(self):
+        e = error(500, "trying to acquire lock...\n OK\nstart failed: command 'kvm' got timeout")
+
+        assert not self.policy.should_retry("POST", self.policy.failure_kind(e), 1)
+
+    def test_not_transient(self):
+        assert not self.policy.should_retry("GET", None, 1)
+
+    def test_backoff(self):
+        policy = RetryPolicy(backoff=0.5, max_backoff=3)
+
+        with mock.patch("proxmoxer.retry.random.uniform", side_effect=lambda a, b: b):
+            assert [policy.backoff_time(attempt) for attempt in range(1, 6)] == [
+                0.5,
+                1.0,
+                2.0,
+                3,
+                3,
+            ]
+
+
+class TestCall:
+    def test_retries_until_success(self, no_sleep):
+        request = mock.Mock(side_effect=[error(596), ConnectionResetError(), "data"])
+
+        assert RetryPolicy().call("GET", "host", request) == "data"
+        assert request.call_count == 3
+        assert no_sleep.call_count == 2
+
+    def test_max_attempts(self, no_sleep):
+        request = mock.Mock(side_effect=error(596))
+
+        with pytest.raises(ResourceException):
+            RetryPolicy(max_attempts=4).call("GET", "host", request)
+
+        assert request.call_count == 4
+
+    def test_not_retried(self, no_sleep):
+        request = mock.Mock(side_effect=error(400))
+
+        with pytest.raises(ResourceException):
+            RetryPolicy().call("GET", "host", request)
+
+        assert request.call_count == 1
+        no_sleep.assert_not_called()
+
+    def test_post(self, no_sleep):
+        request = mock.Mock(side_effect=[error(595), error(596), "UPID"])
+
+        with pytest.raises(ResourceException) as exc_info:
+            RetryPolicy().call("POST", "host", request)
+
+        # the 596 may have been after the task was started
+        assert exc_info.value.status_code == 596
+        assert request.call_count == 2
+
+    def test_upload_not_retried(self, no_sleep):
+        request = mock.Mock(side_effect=[error(596), "data"])
+
+        with pytest.raises(ResourceException):
+            RetryPolicy(idempotent_methods=("GET", "PUT")).call(
+                "PUT", "host", request, data={"filename": io.BytesIO(b"iso")}
+            )
+
+        assert request.call_count == 1
+
+    def test_budget(self, no_sleep):
+        policy = RetryPolicy(budget=RetryBudget(ratio=0, min_per_second=0.2, window=10))
+        request = mock.Mock(side_effect=error(596))
+
+        for _ in range(3):
+            with pytest.raises(ResourceException):
+                policy.call("GET", "host", request)
+
+        # two retries allowed in the window, instead of two for each request
+        assert request.call_count == 3 + 2
+
+
+class TestRetryBudget:
+    def test_ratio(self):
+        budget = RetryBudget(ratio=0.5, min_per_second=0, window=10)
+        for _ in range(4):
+            budget.record_request()
+
+        assert [budget.try_retry() for _ in range(3)] == [True, True, False]
+
+    def test_window(self):
+        budget = RetryBudget(ratio=0, min_per_second=10, window=0.1)
+
+        assert budget.try_retry()
+        assert not budget.try_retry()
+        time.sleep(0.1)
+        assert budget.try_retry()
+
+    def test_pickle(self):
+        budget = RetryBudget(ratio=0, min_per_second=10, window=0.1)
+        budget.try_retry()
+
+        restored = pickle.loads(pickle.dumps(budget))
+
+        assert restored.try_retry()
+
+
+class TestCircuitBreaker:
+    def test_open(self, no_sleep):
+        policy = RetryPolicy(max_attempts=1, failure_threshold=3)
+        request = mock.Mock(side_effect=error(596))
+
+        for _ in range(3):
+            with pytest.raises(ResourceException):
+                policy.call("GET", "host", request)
+        with pytest.raises(CircuitOpenError) as exc_info:
+            policy.call("GET", "host", request)
+
+        assert request.call_count == 3
+        assert exc_info.value.host == "host"
+        assert str(exc_info.value).startswith("too many failures from host, not retrying for")
+        # other hosts are not affected
+        assert policy.breaker("other").state == CircuitBreaker.CLOSED
+
+    def test_error_responses_close(self, no_sleep):
+        policy = RetryPolicy(max_attempts=1, failure_threshold=2)
+        request = mock.Mock(side_effect=[error(596), error(404), error(596), "data"])
+
+        for _ in range(3):
+            with pytest.raises(ResourceException):
+                policy.call("GET", "host", request)
+
+        assert policy.call("GET", "host", request) == "data"
+
+    def test_half_open(self):
+        breaker = CircuitBreaker("host", failure_threshold=1, reset_timeout=0.05)
+        breaker.record_failure()
+
+        with pytest.raises(CircuitOpenError):
+            breaker.before_request()
+        time.sleep(0.05)
+        breaker.before_request()
+
+        # one trial request at a time
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        with pytest.raises(CircuitOpenError):
+            breaker.before_request()
+
+        breaker.record_failure()
+        assert breaker.state == CircuitBreaker.OPEN
+        time.sleep(0.05)
+        breaker.before_request()
+        breaker.record_success()
+        assert breaker.state == CircuitBreaker.CLOSED
+        assert repr(breaker) == "CircuitBreaker (host closed)"
+
+    def test_disabled(self, no_sleep):
+        policy = RetryPolicy(max_attempts=1, failure_threshold=None)
+        request = mock.Mock(side_effect=error(596))
+
+        for _ in range(10):
+            with pytest.raises(ResourceException):
+                policy.call("GET", "host", request)
+
+        assert policy.breaker("host") is None
+
+    def test_client_errors(self, no_sleep):
+        policy = RetryPolicy(failure_threshold=3)
+        request = mock.Mock(
+            side_effect=[QueueTimeout(), DeadlineExceeded(), QueueTimeout(), "data"]
+        )
+
+        for _ in range(3):
+            with pytest.raises(TimeoutError):
+                policy.call("GET", "host", request)
+
+        # never sent, so neither retried nor counted against the host
+        assert request.call_count == 3
+        assert policy.breaker("host").failures == 0
+        assert policy.call("GET", "host", request) == "data"
+
+    def test_half_open_not_sent(self):
+        policy = RetryPolicy(max_attempts=1, failure_threshold=1, reset_timeout=0.05)
+        policy.breaker("host").record_failure()
+        time.sleep(0.05)
+
+        with pytest.raises(QueueTimeout):
+            policy.call("GET", "host", mock.Mock(side_effect=QueueTimeout()))
+
+        # the trial was not sent, so the next request may be the trial
+        assert policy.call("GET", "host", mock.Mock(return_value="data")) == "data"
+
+    def test_pickle(self):
+        policy = RetryPolicy(failure_threshold=1)
+        policy.breaker("host").record_failure()
+
+        restored = pickle.loads(pickle.dumps(policy))
+
+        assert restored.breaker("host").state == CircuitBreaker.CLOSED
+
+
+@pytest.mark.filterwarnings("ignore::urllib3.exceptions.InsecureRequestWarning")
+class TestProxmoxAPI:
+    def test_transient_errors(self, server):
+        prox = ProxmoxAPI(**api_kwargs(server), retry_policy=RetryPolicy(backoff=0))
+        events = []
+        prox.add_request_hook(events.append)
+
+        server.inject_error(596, count=2, path="/version")
+
+        assert prox.version.get()["release"] == "8.2"
+        # every attempt is a request of its own
+        assert [event.status_code for event in events] == [596, 596, 200]
+
+    def test_without_policy(self, server):
+        prox = ProxmoxAPI(**api_kwargs(server))
+
+        server.inject_error(596, path="/version")
+
+        with pytest.raises(ResourceException):
+            prox.version.get()
+
+    def test_queue_timeouts(self, server):
+        limiter = RequestLimiter(concurrency=1, queue_timeout=0.05)
+        policy = RetryPolicy(failure_threshold=3)
+        prox = ProxmoxAPI(**api_kwargs(server), limiter=limiter, retry_policy=policy)
+        slot = limiter.acquire(server.address)
+
+        for _ in range(3):
+            with pytest.raises(QueueTimeout):
+                prox.version.get()
+        slot.release()
+
+        # the host was never contacted, its breaker stays closed
+        assert policy.breaker(server.address).state == CircuitBreaker.CLOSED
+        assert prox.version.get()["release"] == "8.2"
+
+    def test_breaker_per_host(self, server):
+        policy = RetryPolicy(max_attempts=1, failure_threshold=1)
+        prox = ProxmoxAPI(**api_kwargs(server), retry_policy=policy)
+
+        server.inject_error(596, path="/version")
+        with pytest.raises(ResourceException):
+            prox.version.get()
+
+        assert list(policy._breakers) == [server.address]
+        with pytest.raises(CircuitOpenError):
+            prox.nodes.get()
+
+
+def api_kwargs(server):
+    return {
+        "host": server.address,
+        "user": "root@pam",
+        "password": "password",
+        "verify_ssl": False,
+    }
+
+
+@pytest.fixture
+def no_sleep():
+    with mock.patch("proxmoxer.retry.time.sleep") as mock_sleep:
+        yield mock_sleep
+
+
+@pytest.fixture
+def server():
+    with FakePVEServer() as fake:
+        yield fake
@@ -0,0 +1,261 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import pytest
+import requests
+
+from proxmoxer import ProxmoxAPI, ResourceException
+from proxmoxer.testing import FakeCluster, FakePVEServer
+from proxmoxer.testing.__main__ import main, parse_args
+from proxmoxer.tools import Files, Tasks
+
+# pylint: disable=no-self-use,redefined-outer-name
+
+# the fake server uses a self-signed certificate
+pytestmark = pytest.mark.filterwarnings("ignore::urllib3.exceptions.InsecureRequestWarning")
+
+
+class TestAuth:
+    def test_password(self, server):
+        prox = ProxmoxAPI(server.address, user="root@pam", password="password", verify_ssl=False)
+
+        assert prox.version.get()["release"] == "8.2"
+
+    def test_password_wrong(self, server):
+        with pytest.raises(Exception, match="Couldn't authenticate user"):
+            ProxmoxAPI(server.address, user="root@pam", password="wrong", verify_ssl=False)
+
+    def test_token(self, server):
+        prox = ProxmoxAPI(
+            server.address,
+            user="root@pam",
+            token_name="token",
+            token_value="secret",
+            verify_ssl=False,
+        )
+
+        assert [n["node"] for n in prox.nodes.get()] == ["node1"]
+
+    def test_token_wrong(self, server):
+        prox = ProxmoxAPI(
+            server.address, user="root@pam", token_name="token", token_value="bad", verify_ssl=False
+        )
+
+        with pytest.raises(ResourceException) as exc_info:
+            prox.nodes.get()
+        assert exc_info.value.status_code == 401
+
+    def test_no_ticket(self, server):
+        resp = requests.get(server.url + "/nodes", verify=False, timeout=5)
+
+        assert resp.status_code == 401
+        assert resp.reason == "No ticket"
+
+    def test_csrf(self, server, prox):
+        ticket, _ = prox.get_tokens()
+
+        resp = requests.post(
+            server.url + "/nodes/node1/qemu/100/status/start",
+            cookies={"PVEAuthCookie": ticket},
+            verify=False,
+            timeout=5,
+        )
+
+        assert resp.status_code == 401
+        assert resp.reason == "Permission denied - invalid csrf token"
+
+    def test_ticket_renewal(self, server, prox):
+        old_ticket, _ = prox.get_tokens()
+
+        prox._backend.auth._get_new_tokens()
+
+        assert prox.get_tokens()[0] != old_ticket
+        assert prox.nodes.get()
+
+
+class TestApi:
+    def test_cluster_resources(self, prox):
+        resources = prox.cluster.resources.get(type="vm")
+
+        assert [r["vmid"] for r in resources] == [100, 101, 102]
+
+    def test_vm_lifecycle(self, server, prox):
+        upid = prox.nodes("node1").qemu.post(vmid=200, name="new")
+        assert Tasks.blocking_status(prox, upid, polling_interval=0.01)["exitstatus"] == "OK"
+
+        upid = prox.nodes("node1").qemu(200).status.start.post()
+        # still running until the task completes
+        assert prox.nodes("node1").qemu(200).status.current.get()["status"] == "stopped"
+        Tasks.blocking_status(prox, upid, polling_interval=0.01)
+        assert prox.nodes("node1").qemu(200).status.current.get()["status"] == "running"
+
+        log = prox.nodes("node1").tasks(upid).log.get()
+        assert Tasks.decode_log(log).endswith("TASK OK")
+
+        Tasks.blocking_status(prox, prox.nodes("node1").qemu(200).delete(), polling_interval=0.01)
+        assert 200 not in [vm["vmid"] for vm in prox.nodes("node1").qemu.get()]
+
+    def test_task_list(self, prox):
+        upid = prox.nodes("node1").qemu(100).status.stop.post()
+
+        assert [t["upid"] for t in prox.nodes("node1").tasks.get()] == [upid]
+        assert Tasks.decode_upid(upid)["type"] == "qmstop"
+
+    def test_upload(self, prox):
+        with tempfile.NamedTemporaryFile(suffix=".iso") as f_obj:
+            f_obj.write(b"a" * 100000)
+            f_obj.flush()
+
+            # don't wait for the default 1 second polling interval
+            with mock.patch("proxmoxer.tools.tasks.time.sleep"):
+                status = Files(prox, "node1", "local").upload_local_file_to_storage(f_obj.name)
+
+        assert status["exitstatus"] == "OK"
+        (content,) = prox.nodes("node1").storage("local").content.get()
+        assert content["volid"].endswith(".iso")
+        assert content["content"] == "iso"
+        # the size of the whole multipart body
+        assert content["size"] > 100000
+
+    def test_bad_parameter(self, prox):
+        with pytest.raises(ResourceException) as exc_info:
+            prox.nodes("node1").qemu.post(name="no vmid")
+
+        assert exc_info.value.status_code == 400
+        assert exc_info.value.errors == {"vmid": "property is missing"}
+
+    def test_not_implemented(self, prox):
+        with pytest.raises(ResourceException) as exc_info:
+            prox.access.acl.get()
+
+        assert exc_info.value.status_code == 501
+
+
+class TestInjection:
+    def test_inject_error(self, server, prox):
+        server.inject_error(596, count=2, path="/nodes")
+
+        for _ in range(2):
+            with pytest.raises(ResourceException) as exc_info:
+                prox.nodes.get()
+            assert exc_info.value.status_code == 596
+        # other paths are not affected and the queue is used up
+        assert prox.version.get()
+        assert prox.nodes.get()
+        assert server.stats[596] == 2
+
+    def test_error_rate(self, prox_factory):
+        server, prox = prox_factory(error_rate=1.0, error_codes=[599], seed=1)
+
+        with pytest.raises(ResourceException) as exc_info:
+            prox.nodes.get()
+
+        assert exc_info.value.status_code == 599
+
+    def test_latency(self, prox_factory):
+        _, prox = prox_factory(latency=0.1)
+
+        start = time.monotonic()
+        prox.nodes.get()
+
+        assert time.monotonic() - start >= 0.1
+
+    def test_latency_function(self, prox_factory):
+        latency = mock.Mock(return_value=0)
+        _, prox = prox_factory(latency=latency)
+
+        prox.nodes.get()
+
+        latency.assert_called_with("GET", "/nodes")
+
+    def test_worker_limit(self, prox_factory):
+        server, prox = prox_factory(workers=2, latency=0.02)
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            list(executor.map(lambda _: prox.version.get(), range(12)))
+
+        assert server.max_in_flight == 2
+        assert server.stats["requests"] == 12
+
+
+class TestServer:
+    def test_plain_http(self):
+        with FakePVEServer(tls=False) as server:
+            resp = requests.get(
+                server.url + "/version",
+                headers={"Authorization": "PVEAPIToken=root@pam!token=secret"},
+                timeout=5,
+            )
+
+        assert server.url.startswith("http://")
+        assert resp.json()["data"]["version"] == "8.2.4"
+
+    def test_keep_alive(self, server):
+        session = requests.Session()
+        session.headers["Authorization"] = "PVEAPIToken=root@pam!token=secret"
+        connections = set()
+
+        for _ in range(3):
+            resp = session.get(server.url + "/version", verify=False, timeout=5, stream=True)
+            connections.add(id(resp.raw._connection))
+            resp.content  # pylint: disable=pointless-statement
+
+        assert len(connections) == 1
+
+    def test_cluster(self):
+        cluster = FakeCluster(nodes=["a", "b"], vms_per_node=2)
+
+        assert sorted(vm["node"] for vm in cluster.vms.values()) == ["a", "a", "b", "b"]
+
+    def test_cli(self):
+        args = parse_args(["--port", "0", "--latency", "0.1", "0.2", "--token", "u@pve!t=v"])
+
+        assert args.latency == [0.1, 0.2]
+        assert args.token == ["u@pve!t=v"]
+
+    def test_cli_main(self, capsys):
+        with mock.patch.object(FakePVEServer, "serve_forever", side_effect=KeyboardInterrupt):
+            main(["--port", "0", "--nodes", "2", "--no-tls"])
+
+        assert "Serving fake PVE API on http://127.0.0.1:" in capsys.readouterr().out
+
+
+@pytest.fixture
+def server():
+    with FakePVEServer(task_duration=0.05) as fake:
+        yield fake
+
+
+@pytest.fixture
+def prox(server):
+    return ProxmoxAPI(server.address, user="root@pam", password="password", verify_ssl=False)
+
+
+@pytest.fixture
+def prox_factory():
+    servers = []
+    lock = threading.Lock()
+
+    def make(**kwargs):
+        fake = FakePVEServer(**kwargs).start()
+        with lock:
+            servers.append(fake)
+        return fake, ProxmoxAPI(
+            fake.address,
+            user="root@pam",
+            token_name="token",
+            token_value="secret",
+            verify_ssl=False,
+        )
+
+    yield make
+
+    for fake in servers:
+        fake.stop()
@@ -0,0 +1,198 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import paramiko
+import pytest
+
+from proxmoxer import ProxmoxAPI, ResourceException
+from proxmoxer.testing import FakePVEServer
+from proxmoxer.testing.ssh import FakeSSHServer
+
+# pylint: disable=no-self-use,redefined-outer-name
+
+requires_openssh = pytest.mark.skipif(
+    not os.path.exists("/usr/bin/ssh"), reason="the OpenSSH client is not installed"
+)
+
+
+class TestCommands:
+    def test_pvesh(self, server):
+        status, stdout, stderr = server.run_command("pvesh get /nodes --output-format json", None)
+
+        assert status == 0
+        assert b'"node": "node1"' in stdout
+        assert stderr == b""
+
+    def test_pvesh_options(self, server):
+        status, stdout, _ = server.run_command(
+            "sudo pvesh get /cluster/resources -type vm --output-format json", None
+        )
+
+        assert status == 0
+        assert b"qemu/100" in stdout
+        assert b"node/node1" not in stdout
+
+    def test_pvesh_error(self, server):
+        status, stdout, stderr = server.run_command(
+            "pvesh create /nodes/node1/qemu -name test", None
+        )
+
+        assert status == 2
+        assert stdout == b""
+        assert stderr == b"400 Parameter verification failed.\nvmid: property is missing\n"
+
+    def test_pvesh_task(self, server):
+        _, stdout, _ = server.run_command("pvesh create /nodes/node1/qemu/100/status/start", None)
+
+        assert stdout.startswith(b'"UPID:node1:')
+
+    def test_unknown_command(self, server):
+        status, _, stderr = server.run_command("qm list", None)
+
+        assert status == 127
+        assert stderr == b"bash: qm: command not found\n"
+
+    def test_shell_stdin(self, server):
+        channel = mock.Mock()
+        channel.recv.side_effect = [b"pvesh get /version", b""]
+
+        status, stdout, _ = server.run_command("/bin/bash", channel)
+
+        assert status == 0
+        assert b'"release": "8.2"' in stdout
+
+    def test_local_path(self, server):
+        assert server.local_path("/tmp/../etc/file") == os.path.join(server.root, "etc/file")
+
+
+class TestParamikoBackend:
+    def test_request(self, server):
+        prox = ProxmoxAPI(**server.api_kwargs("ssh_paramiko"))
+
+        assert [n["node"] for n in prox.nodes.get()] == ["node1"]
+        assert [vm["vmid"] for vm in prox.nodes("node1").qemu.get()] == [100, 101, 102]
+        assert server.stats["connections"] == 1
+
+    def test_error(self, server):
+        prox = ProxmoxAPI(**server.api_kwargs("ssh_paramiko"))
+
+        with pytest.raises(ResourceException) as exc_info:
+            prox.nodes("missing").status.get()
+
+        assert exc_info.value.status_code == 595
+
+    def test_wrong_password(self, server):
+        kwargs = dict(server.api_kwargs("ssh_paramiko"), password="wrong")
+
+        with pytest.raises(paramiko.AuthenticationException):
+            ProxmoxAPI(**kwargs)
+
+    def test_key(self, server):
+        kwargs = server.api_kwargs("ssh_paramiko")
+        del kwargs["password"]
+
+        prox = ProxmoxAPI(**kwargs, private_key_file=server.client_key_file)
+
+        assert prox.version.get()["release"] == "8.2"
+
+    def test_concurrent_channels(self):
+        with FakeSSHServer(latency=0.05) as server:
+            prox = ProxmoxAPI(**server.api_kwargs("ssh_paramiko"))
+
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                list(executor.map(lambda _: prox.version.get(), range(8)))
+
+            assert server.max_in_flight > 1
+            assert server.stats["connections"] == 1
+
+    def test_iter_request(self, server):
+        prox = ProxmoxAPI(**server.api_kwargs("ssh_paramiko"))
+        session = prox._store["session"]
+
+        assert [n["node"] for n in session.iter_request("GET", "/nodes")] == ["node1"]
+
+    def test_upload(self, server):
+        prox = ProxmoxAPI(**server.api_kwargs("ssh_paramiko"))
+        upload = io.BytesIO(b"a" * 100000)
+        upload.name = "/home/user/image.iso"
+
+        upid = prox.nodes("node1").storage("local").upload.post(content="iso", filename=upload)
+
+        assert upid.startswith("UPID:node1:")
+        with server.cluster.lock:
+            (task,) = server.cluster.tasks.values()
+            task.on_finish()
+        assert prox.nodes("node1").storage("local").content.get() == [
+            {"volid": "local:iso/image.iso", "content": "iso", "size": 100000}
+        ]
+        # the temporary file is removed afterwards
+        assert os.listdir(server.local_path("/tmp")) == []
+
+    def test_sftp(self, server):
+        prox = ProxmoxAPI(**server.api_kwargs("ssh_paramiko"))
+
+        prox._store["session"].upload_file_obj(io.BytesIO(b"data"), "/var/tmp/file")
+
+        with open(server.local_path("/var/tmp/file"), "rb") as f_obj:
+            assert f_obj.read() == b"data"
+
+    def test_sftp_concurrent(self, server):
+        prox = ProxmoxAPI(**server.api_kwargs("ssh_paramiko"))
+        uploads = [(io.BytesIO(bytes([i]) * 1000), f"/var/tmp/file{i}") for i in range(4)]
+
+        prox._store["session"].upload_file_objs(uploads, max_workers=2)
+
+        assert sorted(os.listdir(server.local_path("/var/tmp"))) == [f"file{i}" for i in range(4)]
+
+
+@requires_openssh
+class TestOpenSSHBackend:
+    def test_request(self, server):
+        prox = ProxmoxAPI(**server.api_kwargs("openssh"))
+
+        assert [n["node"] for n in prox.nodes.get()] == ["node1"]
+
+    def test_upload(self, server):
+        prox = ProxmoxAPI(**server.api_kwargs("openssh"))
+        upload = io.BytesIO(b"a" * 100000)
+        upload.name = "image.iso"
+
+        upid = prox.nodes("node1").storage("local").upload.post(content="iso", filename=upload)
+
+        assert upid.startswith("UPID:node1:")
+
+    def test_scp(self, server):
+        prox = ProxmoxAPI(**server.api_kwargs("openssh"))
+        upload = io.BytesIO(b"data")
+        upload.name = "file"
+
+        prox._store["session"].upload_file_obj(upload, "/var/tmp/file")
+
+        with open(server.local_path("/var/tmp/file"), "rb") as f_obj:
+            assert f_obj.read() == b"data"
+
+
+class TestSharedApi:
+    @pytest.mark.filterwarnings("ignore::urllib3.exceptions.InsecureRequestWarning")
+    def test_https_and_ssh(self):
+        with FakePVEServer() as https_server, FakeSSHServer(api=https_server.api) as ssh_server:
+            https = ProxmoxAPI(
+                https_server.address, user="root@pam", password="password", verify_ssl=False
+            )
+            ssh = ProxmoxAPI(**ssh_server.api_kwargs("ssh_paramiko"))
+
+            upid = ssh.nodes("node1").qemu(100).status.start.post()
+
+            assert https.nodes("node1").tasks(upid).status.get()["upid"] == upid
+
+
+@pytest.fixture
+def server():
+    with FakeSSHServer() as fake:
+        yield fake
@@ -0,0 +1,186 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+import pytest
+
+from proxmoxer import core, tracing
+from proxmoxer.backends import command_base
+from proxmoxer.tools import Tasks
+
+from .api_mock import mock_pve  # pylint: disable=unused-import # noqa: F401
+
+# pylint: disable=no-self-use,redefined-outer-name
+
+
+class TestNoopTracer:
+    def test_default(self):
+        assert isinstance(tracing.get_tracer(), tracing.NoopTracer)
+
+    def test_span(self):
+        with tracing.span("name", key="value") as span:
+            span.set_attribute("other", 1)
+            span.record_exception(ValueError())
+
+        assert tracing.current_span() is None
+
+    def test_set_none(self, tracer):
+        tracing.set_tracer(None)
+
+        assert isinstance(tracing.get_tracer(), tracing.NoopTracer)
+
+
+class TestRecordingTracer:
+    def test_nesting(self, tracer):
+        with tracing.span("outer") as outer:
+            with tracing.span("inner", key="value") as inner:
+                assert tracing.current_span() is inner
+            assert tracing.current_span() is outer
+
+        assert [s.name for s in tracer.spans] == ["inner", "outer"]
+        assert inner.parent is outer
+        assert inner.trace_id == outer.trace_id
+        assert inner.attributes == {"key": "value"}
+        assert outer.parent is None
+        assert outer.duration >= inner.duration >= 0
+
+    def test_separate_traces(self, tracer):
+        with tracing.span("first"):
+            pass
+        with tracing.span("second"):
+            pass
+
+        assert tracer.spans[0].trace_id != tracer.spans[1].trace_id
+
+    def test_exception(self, tracer):
+        error = ValueError("bad")
+
+        with pytest.raises(ValueError):
+            with tracing.span("failing"):
+                raise error
+
+        assert tracer.spans[0].exception is error
+        assert tracer.spans[0].end_time is not None
+
+    def test_traced(self, tracer):
+        @tracing.traced("decorated")
+        def func(value):
+            return value * 2
+
+        assert func(2) == 4
+        assert func.__name__ == "func"
+        assert [s.name for s in tracer.spans] == ["decorated"]
+
+
+class TestContextPropagation:
+    def test_wrap_threads(self, tracer):
+        def work(i):
+            with tracing.span(f"work{i}"):
+                pass
+
+        with tracing.span("fan-out") as parent:
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                list(executor.map(tracing.wrap(work), range(8)))
+
+        children = [s for s in tracer.spans if s.name.startswith("work")]
+        assert len(children) == 8
+        assert all(s.parent is parent for s in children)
+
+    def test_unwrapped_threads(self, tracer):
+        def work():
+            with tracing.span("orphan"):
+                pass
+
+        with tracing.span("fan-out"):
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                executor.submit(work).result()
+
+        # threads do not inherit the context unless the function is wrapped
+        assert tracer.spans[0].parent is None
+
+    def test_asyncio(self, tracer):
+        async def work(i):
+            with tracing.span(f"work{i}"):
+                await asyncio.sleep(0)
+
+        async def main():
+            with tracing.span("fan-out") as parent:
+                await asyncio.gather(*(work(i) for i in range(4)))
+            return parent
+
+        parent = asyncio.run(main())
+
+        children = [s for s in tracer.spans if s.name.startswith("work")]
+        assert len(children) == 4
+        assert all(s.parent is parent for s in children)
+
+
+class TestOpenTelemetryTracer:
+    def test_start_span(self, tracer):
+        otel_tracer = mock.MagicMock()
+        tracing.set_tracer(tracing.OpenTelemetryTracer(otel_tracer))
+
+        with tracing.span("name", key="value"):
+            pass
+
+        otel_tracer.start_as_current_span.assert_called_once_with(
+            "name", attributes={"key": "value"}
+        )
+
+
+class TestInstrumentation:
+    def test_request(self, tracer, mock_pve):
+        prox = core.ProxmoxAPI("1.2.3.4:1234", token_name="name", token_value="value")
+
+        prox.version.get()
+
+        (span,) = tracer.spans
+        assert span.name == "proxmoxer.request"
+        assert span.attributes == {
+            "http.method": "GET",
+            "url.full": "https://1.2.3.4:1234/api2/json/version",
+            "http.status_code": 200,
+        }
+
+    def test_auth(self, tracer, mock_pve):
+        core.ProxmoxAPI("1.2.3.4:1234", user="user", password="password")
+
+        assert [s.name for s in tracer.spans] == ["proxmoxer.auth.get_tokens"]
+
+    def test_blocking_status(self, tracer, mock_pve):
+        prox = core.ProxmoxAPI("1.2.3.4:1234", token_name="name", token_value="value")
+
+        Tasks.blocking_status(
+            prox,
+            "UPID:node1:000FF1FD:10F9374C:630D702C:vzdump:110:root@pam:done",
+            polling_interval=0.01,
+        )
+
+        request, poll, status = tracer.spans
+        assert status.name == "proxmoxer.tasks.blocking_status"
+        assert status.attributes["proxmoxer.polls"] == 1
+        assert poll.name == "proxmoxer.tasks.poll"
+        assert poll.parent is status
+        assert request.parent is poll
+
+    def test_command_exec(self, tracer):
+        session = command_base.CommandBaseSession(sudo=True)
+
+        with mock.patch.object(session, "_exec", return_value=("[]", "")):
+            session.request("GET", "/nodes", data={"password": "secret"})
+
+        (span,) = tracer.spans
+        assert span.name == "proxmoxer.command.exec"
+        assert span.attributes == {"proxmoxer.command": "pvesh", "url.path": "/nodes"}
+
+
+@pytest.fixture
+def tracer():
+    recording = tracing.RecordingTracer()
+    tracing.set_tracer(recording)
+    yield recording
+    tracing.set_tracer(None)
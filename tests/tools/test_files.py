@@ -7,8 +7,11 @@ import tempfile
 from unittest import mock
 
 import pytest
+import requests
 
 from proxmoxer import ProxmoxAPI, core
+from proxmoxer.deadline import Deadline, DeadlineExceeded
+from proxmoxer.limits import QueueTimeout
 from proxmoxer.tools import ChecksumInfo, Files, SupportedChecksums
 
 from ..api_mock import mock_pve  # pylint: disable=unused-import # noqa: F401
@@ -128,6 +131,24 @@ class TestGetChecksum:
         assert data[0] is None
         assert data[1] is None
 
+    def test_get_checksums_from_file_url_deadline(self, mock_files):
+        url = "https://sub.domain.tld/missing.iso"
+
+        with mock.patch("proxmoxer.tools.files.requests.get", wraps=requests.get) as get:
+            with pytest.raises(DeadlineExceeded):
+                Files.get_checksums_from_file_url(url, deadline=Deadline(0))
+
+        get.assert_not_called()
+
+    def test_checksum_timeout_shortened(self, mock_files):
+        url = "https://sub.domain.tld/sibling/file.iso"
+        info = ChecksumInfo("testing", 16)
+
+        with mock.patch("proxmoxer.tools.files.requests.get", wraps=requests.get) as get:
+            Files._get_checksum_from_sibling_file(url, info, deadline=Deadline(2))
+
+        assert get.call_args.kwargs["timeout"] <= 2
+
 
 class TestFiles:
     prox = ProxmoxAPI("1.2.3.4:1234", token_name="name", token_value="value")
@@ -358,6 +379,17 @@ class TestFilesUpload:
             assert exc_info.value.status_message == "Internal Server Error"
             # assert exc_info.value.content == "storage 'missing' does not exist"
 
+    def test_upload_deadline(self, mock_files_and_pve):
+        with tempfile.NamedTemporaryFile("rb") as f_obj:
+            with pytest.raises(DeadlineExceeded):
+                self.f.upload_local_file_to_storage(filename=f_obj.name, deadline=Deadline(0))
+
+    def test_upload_queue_timeout(self, mock_files_and_pve):
+        with tempfile.NamedTemporaryFile("rb") as f_obj:
+            with mock.patch.object(core.ProxmoxResource, "post", side_effect=QueueTimeout()):
+                with pytest.raises(QueueTimeout):
+                    self.f.upload_local_file_to_storage(filename=f_obj.name)
+
     def test_upload_io_error(self, mock_files_and_pve, caplog):
         with tempfile.NamedTemporaryFile("rb") as f_obj:
             mo = mock.mock_open()
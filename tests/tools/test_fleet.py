@@ -0,0 +1,208 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+import threading
+import time
+from unittest import mock
+
+import pytest
+
+from proxmoxer import ProxmoxAPI, ResourceException, tracing
+from proxmoxer.testing import FakeCluster, FakePVEServer
+from proxmoxer.tools import Fleet, FleetResult
+
+# pylint: disable=no-self-use,redefined-outer-name,protected-access
+
+
+class TestFleetResult:
+    def test_ok(self):
+        result = FleetResult("pve1", value=[1, 2])
+
+        assert result.ok
+        assert result.result() == [1, 2]
+        assert repr(result) == "FleetResult (pve1 ok)"
+
+    def test_error(self):
+        result = FleetResult("pve1", error=TimeoutError("too slow"))
+
+        assert not result.ok
+        with pytest.raises(TimeoutError):
+            result.result()
+        assert repr(result) == "FleetResult (pve1 TimeoutError: too slow)"
+
+
+@pytest.mark.filterwarnings("ignore::urllib3.exceptions.InsecureRequestWarning")
+class TestFleet:
+    def test_get(self, fleet):
+        results = fleet.get("/nodes")
+
+        assert list(results) == ["small", "large"]
+        assert [n["node"] for n in results["small"].value] == ["node1"]
+        assert [n["node"] for n in results["large"].value] == ["node1", "node2", "node3"]
+        assert all(result.elapsed is not None for result in results.values())
+
+    def test_error_per_cluster(self, fleet):
+        results = fleet.get("nodes/node2/status")
+
+        assert isinstance(results["small"].error, ResourceException)
+        assert results["large"].ok
+
+    def test_imap_as_completed(self):
+        fleet = Fleet({"slow": mock_client(0.2), "fast": mock_client(0)})
+
+        assert [result.cluster for result in fleet.imap(lambda prox: prox.version.get())] == [
+            "fast",
+            "slow",
+        ]
+
+    def test_timeout(self):
+        fleet = Fleet({"slow": mock_client(1), "fast": mock_client(0)}, timeout=0.1)
+
+        start = time.monotonic()
+        results = fleet.map(lambda prox: prox.version.get())
+
+        assert time.monotonic() - start < 0.5
+        assert results["fast"].value == {"release": "8.2"}
+        assert isinstance(results["slow"].error, TimeoutError)
+        assert str(results["slow"].error) == "slow did not answer within 0.1s"
+
+    def test_timeout_per_cluster(self):
+        fleet = Fleet({"a": mock_client(0.2), "b": mock_client(0.2)}, timeout={"a": 0.05})
+
+        results = fleet.map(lambda prox: prox.version.get())
+
+        assert isinstance(results["a"].error, TimeoutError)
+        assert results["b"].ok
+
+    def test_max_workers(self):
+        in_flight = []
+        lock = threading.Lock()
+        running = 0
+
+        def call(prox):
+            nonlocal running
+            with lock:
+                running += 1
+                in_flight.append(running)
+            time.sleep(0.02)
+            with lock:
+                running -= 1
+
+        fleet = Fleet({i: mock_client(0) for i in range(6)}, max_workers=2)
+        fleet.map(call)
+
+        assert max(in_flight) == 2
+
+    def test_timed_out_call_keeps_worker(self):
+        fleet = Fleet({"hung": mock_client(0.3), "next": mock_client(0)}, max_workers=1)
+
+        results = fleet.map(lambda prox: prox.version.get(), timeout={"hung": 0.05})
+
+        assert isinstance(results["hung"].error, TimeoutError)
+        # only started once the hung call returned
+        assert results["next"].ok
+        assert results["next"].elapsed < 0.1
+        assert fleet["next"].version.get.call_count == 1
+
+    def test_timed_out_call_blocks_next_call(self):
+        fleet = Fleet({"hung": mock_client(0.3)}, max_workers=1, timeout=0.05)
+
+        start = time.monotonic()
+        assert not fleet.map(lambda prox: prox.version.get())["hung"].ok
+        assert time.monotonic() - start < 0.2
+
+        # the first call still holds the only worker
+        fleet.map(lambda prox: prox.version.get())
+        assert time.monotonic() - start >= 0.3
+
+    def test_traced(self):
+        fleet = Fleet({"a": mock_client(0), "b": mock_client(0)})
+        tracer = tracing.RecordingTracer()
+
+        def call(prox):
+            with tracing.span("call"):
+                return prox.version.get()
+
+        tracing.set_tracer(tracer)
+        try:
+            with tracing.span("fan-out") as parent:
+                fleet.map(call)
+        finally:
+            tracing.set_tracer(None)
+
+        calls = [span for span in tracer.spans if span.name == "call"]
+        assert len(calls) == 2
+        assert all(span.parent is parent for span in calls)
+
+    def test_select(self, fleet):
+        pbs = mock.Mock(_service="PBS")
+        mixed = Fleet({**{name: fleet[name] for name in fleet}, "backup": pbs}, timeout=5)
+
+        assert list(mixed.select("small", "backup")) == ["small", "backup"]
+        assert list(mixed.select(service="pbs")) == ["backup"]
+        assert mixed.select(service="PVE").timeout == 5
+        assert len(mixed.select(service="PMG")) == 0
+
+    def test_from_configs(self, servers):
+        fleet = Fleet.from_configs(
+            {name: api_kwargs(server) for name, server in servers.items()}, timeout=5
+        )
+
+        assert list(fleet) == ["small", "large"]
+        assert fleet.timeout == 5
+        assert fleet.errors == {}
+        assert repr(fleet) == "Fleet (2 clusters)"
+
+    def test_from_configs_errors(self, servers):
+        configs = {name: api_kwargs(server) for name, server in servers.items()}
+        configs["small"]["password"] = "wrong"
+
+        fleet = Fleet.from_configs(configs, warm=True)
+
+        assert list(fleet) == ["large"]
+        assert list(fleet.errors) == ["small"]
+        assert isinstance(fleet.errors["small"], Exception)
+
+    def test_close(self):
+        clients = {"a": mock_client(0), "b": mock_client(0)}
+
+        with Fleet(clients):
+            pass
+
+        for prox in clients.values():
+            prox.close.assert_called_once_with()
+
+
+def api_kwargs(server):
+    return {
+        "host": server.address,
+        "user": "root@pam",
+        "password": "password",
+        "verify_ssl": False,
+    }
+
+
+def mock_client(delay):
+    prox = mock.Mock()
+
+    def get():
+        time.sleep(delay)
+        return {"release": "8.2"}
+
+    prox.version.get.side_effect = get
+    return prox
+
+
+@pytest.fixture
+def servers():
+    with FakePVEServer(cluster=FakeCluster(nodes=["node1"])) as small, FakePVEServer(
+        cluster=FakeCluster(nodes=["node1", "node2", "node3"])
+    ) as large:
+        yield {"small": small, "large": large}
+
+
+@pytest.fixture
+def fleet(servers):
+    with Fleet({name: ProxmoxAPI(**api_kwargs(server)) for name, server in servers.items()}) as f:
+        yield f
@@ -0,0 +1,107 @@
+__author__ = "John Hollowell"
+__copyright__ = "(c) John Hollowell 2024"
+__license__ = "MIT"
+
+from concurrent.futures import ThreadPoolExecutor
+
+from proxmoxer import core
+from proxmoxer.tools import RequestMetrics
+
+from ..api_mock import mock_pve  # pylint: disable=unused-import # noqa: F401
+
+# pylint: disable=no-self-use
+
+
+def _event(url="/nodes/node1/qemu/100/status", total=0.02, status_code=200, **timings):
+    return core.RequestEvent(
+        "GET",
+        url,
+        status_code=status_code,
+        bytes_sent=10,
+        bytes_received=100,
+        timings={"total": total, **timings},
+    )
+
+
+class TestRequestMetrics:
+    def test_histogram(self):
+        metrics = RequestMetrics(buckets=(0.01, 0.1, 1))
+
+        metrics(_event(total=0.005))
+        metrics(_event(url="/nodes/node2/qemu/101/status", total=0.05))
+        metrics(_event(total=5))
+
+        assert metrics.snapshot() == {
+            ("GET", "/nodes/{node}/qemu/{vmid}/status", "200"): {
+                "count": 3,
+                "sum": 5.055,
+                "buckets": {0.01: 1, 0.1: 2, 1: 2, float("inf"): 3},
+            }
+        }
+
+    def test_status_and_error(self):
+        metrics = RequestMetrics()
+
+        metrics(_event(status_code=500))
+        metrics(_event(status_code=None))
+
+        assert {key[2] for key in metrics.snapshot()} == {"500", "error"}
+
+    def test_reset(self):
+        metrics = RequestMetrics()
+        metrics(_event())
+
+        metrics.reset()
+
+        assert metrics.snapshot() == {}
+
+    def test_concurrent(self):
+        metrics = RequestMetrics()
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(lambda _: metrics(_event()), range(1000)))
+
+        assert list(metrics.snapshot().values())[0]["count"] == 1000
+
+    def test_prometheus_text(self):
+        metrics = RequestMetrics(buckets=(0.1, 1))
+        metrics(_event(total=0.5, server=0.25, decode=0.125))
+
+        labels = 'method="GET",path="/nodes/{node}/qemu/{vmid}/status"'
+        assert metrics.prometheus_text().splitlines() == [
+            "# HELP proxmoxer_request_duration_seconds Time taken by Proxmox API requests.",
+            "# TYPE proxmoxer_request_duration_seconds histogram",
+            f'proxmoxer_request_duration_seconds_bucket{{{labels},status="200",le="0.1"}} 0',
+            f'proxmoxer_request_duration_seconds_bucket{{{labels},status="200",le="1.0"}} 1',
+            f'proxmoxer_request_duration_seconds_bucket{{{labels},status="200",le="+Inf"}} 1',
+            f'proxmoxer_request_duration_seconds_sum{{{labels},status="200"}} 0.5',
+            f'proxmoxer_request_duration_seconds_count{{{labels},status="200"}} 1',
+            "# HELP proxmoxer_request_step_seconds_total "
+            "Time spent in each step of Proxmox API requests.",
+            "# TYPE proxmoxer_request_step_seconds_total counter",
+            f'proxmoxer_request_step_seconds_total{{{labels},step="decode"}} 0.125',
+            f'proxmoxer_request_step_seconds_total{{{labels},step="server"}} 0.25',
+            "# HELP proxmoxer_request_sent_bytes_total Bytes sent in Proxmox API requests.",
+            "# TYPE proxmoxer_request_sent_bytes_total counter",
+            f"proxmoxer_request_sent_bytes_total{{{labels}}} 10",
+            "# HELP proxmoxer_request_received_bytes_total Bytes received in Proxmox API responses.",
+            "# TYPE proxmoxer_request_received_bytes_total counter",
+            f"proxmoxer_request_received_bytes_total{{{labels}}} 100",
+        ]
+
+    def test_prometheus_label_escaping(self):
+        metrics = RequestMetrics()
+        metrics(_event(url='/weird/"path\\'))
+
+        assert 'path="/weird/\\"path\\\\"' in metrics.prometheus_text()
+
+    def test_with_api(self, mock_pve):
+        prox = core.ProxmoxAPI("1.2.3.4:1234", token_name="name", token_value="value")
+        metrics = RequestMetrics()
+        prox.add_request_hook(metrics)
+
+        prox.version.get()
+
+        ((key, data),) = metrics.snapshot().items()
+        assert key == ("GET", "/version", "200")
+        assert data["count"] == 1
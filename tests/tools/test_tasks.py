@@ -3,10 +3,12 @@ __copyright__ = "(c) John Hollowell 2022"
 __license__ = "MIT"
 
 import logging
+import time
 
 import pytest
 
 from proxmoxer import ProxmoxAPI
+from proxmoxer.deadline import Deadline, DeadlineExceeded
 from proxmoxer.tools import Tasks
 
 from ..api_mock import mock_pve  # pylint: disable=unused-import # noqa: F401
@@ -153,6 +155,26 @@ class TestBlockingStatus:
             ),
         ]
 
+    def test_deadline(self, mocked_prox):
+        upid = "UPID:node1:000FF1FD:10F9374C:630D702C:vzdump:110:root@pam:keep-running"
+        deadline = Deadline(0.05)
+
+        start = time.monotonic()
+        with pytest.raises(DeadlineExceeded):
+            Tasks.blocking_status(mocked_prox, upid, polling_interval=1, deadline=deadline)
+
+        # the last sleep is cut short by the deadline
+        assert time.monotonic() - start < 0.5
+
+    def test_deadline_done(self, mocked_prox):
+        status = Tasks.blocking_status(
+            mocked_prox,
+            "UPID:node1:000FF1FD:10F9374C:630D702C:vzdump:110:root@pam:done",
+            deadline=Deadline(10),
+        )
+
+        assert status["status"] == "stopped"
+
 
 class TestDecodeUpid:
     def test_basic(self):